@@ -0,0 +1,188 @@
+import collections
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LOG_QUEUE_SIZE = 1024
+RATE_PER_EVENT = 20.0      #Records per second per event name...
+BURST_PER_EVENT = 40       #...after an initial burst of this many
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+RECORD_LINE = "%s.%03d %-7s %s%s\n"
+SUPPRESSED_FIELD = "suppressed"
+THREAD_NAME = "async-logger"
+
+
+def format_fields(message, fields):
+    """
+    This function renders the free text and key=value fields of a record.
+    :param message: Optional free text.
+    :type message: str
+    :param fields: Structured fields.
+    :type fields: dict
+    :return: ' text key=value ...' (leading space when not empty).
+    :rtype: str
+    Time: O(f), where f is the number of fields.
+    """
+    parts = [message] if message else []
+    parts.extend(f"{name}={value!r}" if isinstance(value, str) else f"{name}={value}" for name, value in fields.items())
+    return " " + " ".join(parts) if parts else ""
+
+
+class AsyncLogger:
+    def __init__(self, stream=None, level=INFO, maxsize=LOG_QUEUE_SIZE, rate=RATE_PER_EVENT, burst=BURST_PER_EVENT):
+        """
+        Structured logger whose callers only append to a bounded queue; a daemon thread formats and
+        writes. Each event name has a token bucket, so a hot event (every command sent) cannot flood
+        the console: extra records are counted and the next one written says how many were dropped.
+        :param stream: Where records go, defaults to sys.stdout at write time.
+        :type stream: io.TextIOBase
+        :param level: Records below this level are discarded by the caller at once.
+        :type level: int
+        :param maxsize: Capacity of the queue; when full the oldest record is dropped.
+        :type maxsize: int
+        :param rate: Records per second per event.
+        :type rate: float
+        :param burst: Bucket size per event.
+        :type burst: int
+        Time: O(1)
+        """
+        self.stream = stream
+        self.level = level
+        self.maxsize = maxsize
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}            #event -> [tokens, last refill, suppressed]
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.busy = False
+        self.thread = None
+        self.dropped = 0
+        self.suppressed = 0
+        self.written = 0
+
+    def log(self, level, event, message=None, **fields):
+        """
+        This function queues a record; it never touches the stream.
+        :param level: One of DEBUG, INFO, WARNING, ERROR.
+        :type level: int
+        :param event: Short snake_case event name, also the rate limiting key.
+        :type event: str
+        :param message: Optional free text.
+        :type message: str
+        :param fields: Structured fields.
+        :type fields: dict
+        :return: True if the record was queued.
+        :rtype: bool
+        Time: O(1)
+        """
+        if level < self.level:
+            return False
+        now = time.monotonic()
+        with self.condition:
+            bucket = self.buckets.get(event)
+            if bucket is None:
+                bucket = self.buckets[event] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1 and level < ERROR:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                fields[SUPPRESSED_FIELD] = bucket[2]
+                bucket[2] = 0
+            if len(self.pending) >= self.maxsize:
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append((time.time(), level, event, message, fields))
+            self.condition.notify()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name=THREAD_NAME, daemon=True)
+                self.thread.start()
+        return True
+
+    def debug(self, event, message=None, **fields):
+        return self.log(DEBUG, event, message, **fields)
+
+    def info(self, event, message=None, **fields):
+        return self.log(INFO, event, message, **fields)
+
+    def warning(self, event, message=None, **fields):
+        return self.log(WARNING, event, message, **fields)
+
+    def error(self, event, message=None, **fields):
+        return self.log(ERROR, event, message, **fields)
+
+    def format(self, record):
+        """
+        This function renders one record as a single line.
+        :param record: (wall time, level, event, message, fields).
+        :type record: tuple
+        :return: The line.
+        :rtype: str
+        Time: O(f), where f is the number of fields.
+        """
+        stamp, level, event, message, fields = record
+        text = time.strftime(TIME_FORMAT, time.localtime(stamp))
+        return RECORD_LINE % (text, int(stamp * 1000) % 1000, LEVEL_NAMES.get(level, level), event,
+                              format_fields(message, fields))
+
+    def run(self):
+        """
+        Writer loop: takes every queued record and writes them with one write() and flush().
+        :return: None
+        Time: O(r), where r is the number of records.
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                records = list(self.pending)
+                self.pending.clear()
+                self.busy = True
+            try:
+                stream = self.stream or sys.stdout
+                stream.write("".join(self.format(record) for record in records))
+                stream.flush()
+                self.written += len(records)
+            except (OSError, ValueError):
+                pass  #no console (pythonw) or closed stream: logging must never break the app
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        This function waits until every queued record has been written.
+        :param timeout: Seconds to wait, None waits forever.
+        :type timeout: float
+        :return: True if the queue drained in time.
+        :rtype: bool
+        Time: O(1)
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.busy, timeout)
+
+
+default_logger = None
+default_logger_lock = threading.Lock()
+
+
+def get_logger():
+    """
+    This function returns the process wide logger.
+    :return: The shared logger.
+    :rtype: AsyncLogger
+    Time: O(1)
+    """
+    global default_logger
+    with default_logger_lock:
+        if default_logger is None:
+            default_logger = AsyncLogger()
+        return default_logger
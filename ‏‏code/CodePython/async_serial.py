@@ -0,0 +1,468 @@
+import asyncio
+import os
+import socket
+import serial
+from command_writer import CommandWriter
+from device_simulator import AsyncDeviceSimulator
+from frame_codec import FrameEncoder, ENCODING_AUTO
+from frame_protocol import encode_command, PROTOCOL_ASCII, PROTOCOL_AUTO, PROTOCOL_BINARY, HELLO_COMMAND, HELLO_REPLY
+from serial_manager import PORT, BAUDRATE, READY_TIMEOUT, SERIAL_TIMEOUT, backoff_delay
+from serial_reader import LineFramer, parse_message, KIND_READY, SUBSCRIBER_QUEUE_SIZE
+from transport import SIM_SCHEME, READ_SIZE, simulator_options
+
+NEGOTIATE_TIMEOUT = 1.0   #Old firmware never answers the handshake
+NOT_CONNECTED = "Not connected"
+LINK_CLOSED = "Link closed"
+
+
+class StreamLink:
+    def __init__(self, reader, writer):
+        """
+        Host end of a link as asyncio streams (a socket, a pipe or a POSIX serial port).
+        :param reader: Read side.
+        :type reader: asyncio.StreamReader
+        :param writer: Write side.
+        :type writer: asyncio.StreamWriter
+        Time: O(1)
+        """
+        self.reader = reader
+        self.writer = writer
+
+    async def read(self):
+        return await self.reader.read(READ_SIZE)
+
+    def write(self, data):
+        self.writer.write(data)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+
+class ExecutorLink:
+    def __init__(self, ser):
+        """
+        Fallback for ports without a pollable file descriptor (Windows COM ports): reads block in the
+        loop's default executor, so each link holds a pool worker while it waits.
+        :param ser: The open pyserial port.
+        :type ser: serial.Serial
+        Time: O(1)
+        """
+        self.ser = ser
+
+    async def read(self):
+        loop = asyncio.get_running_loop()
+        while self.ser.is_open:
+            data = await loop.run_in_executor(None, self.ser.read, 1)  #returns every SERIAL_TIMEOUT to see close()
+            if data:
+                waiting = self.ser.in_waiting
+                return data + self.ser.read(waiting) if waiting else data
+        return b''
+
+    def write(self, data):
+        self.ser.write(data)
+
+    async def drain(self):
+        pass  #write() above already blocked until the driver took the bytes
+
+    def close(self):
+        self.ser.close()
+
+
+class FdLink:
+    def __init__(self, ser):
+        """
+        Host end of a POSIX serial port driven by the event loop's selector: non-blocking os.read and
+        os.write on the port's descriptor (what pyserial-asyncio does), so no thread is needed.
+        :param ser: The open port; pyserial opens it O_NONBLOCK.
+        :type ser: serial.Serial
+        Time: O(1)
+        """
+        self.ser = ser
+        self.fd = ser.fileno()
+        self.loop = asyncio.get_running_loop()
+        self.pending = bytearray()
+        self.drained = None
+        os.set_blocking(self.fd, False)
+
+    async def wait_fd(self, add, remove):
+        future = self.loop.create_future()
+        add(self.fd, lambda: future.done() or future.set_result(None))
+        try:
+            await future
+        finally:
+            remove(self.fd)
+
+    async def read(self):
+        """
+        This coroutine returns the next received bytes, or b'' once the device hung up.
+        A tty with VMIN=0 also reads b'' while idle, so only an empty read after the selector
+        reported the port readable means the end, the same rule pyserial applies.
+        :return: The bytes.
+        :rtype: bytes
+        Time: O(k), where k is the number of bytes read.
+        """
+        readable = False
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                data = None
+            if data or (readable and data is not None):
+                return data
+            await self.wait_fd(self.loop.add_reader, self.loop.remove_reader)
+            readable = True
+
+    def write(self, data):
+        """
+        This function writes what the driver takes now and keeps the rest for on_writable().
+        :param data: The bytes.
+        :type data: bytes
+        :return: None
+        Time: O(len(data))
+        """
+        if not self.pending:
+            try:
+                data = data[os.write(self.fd, data):]
+            except BlockingIOError:
+                pass
+            if not data:
+                return
+            self.loop.add_writer(self.fd, self.on_writable)
+        self.pending += data
+
+    def on_writable(self):
+        try:
+            del self.pending[:os.write(self.fd, self.pending)]
+        except BlockingIOError:
+            return
+        except OSError as error:
+            self.pending.clear()
+            self.finish_drain(error)
+            return
+        if not self.pending:
+            self.finish_drain(None)
+
+    def finish_drain(self, error):
+        self.loop.remove_writer(self.fd)
+        if self.drained and not self.drained.done():
+            if error:
+                self.drained.set_exception(error)
+            else:
+                self.drained.set_result(None)
+        self.drained = None
+
+    async def drain(self):
+        if self.pending:
+            if self.drained is None:
+                self.drained = self.loop.create_future()
+            await asyncio.shield(self.drained)
+
+    def close(self):
+        self.loop.remove_reader(self.fd)
+        self.loop.remove_writer(self.fd)
+        self.finish_drain(ConnectionError(LINK_CLOSED))
+        self.ser.close()
+
+
+async def open_link(url, baudrate):
+    """
+    This coroutine opens a link by name. "sim://" runs an AsyncDeviceSimulator on a socket pair in
+    the same loop; POSIX ports use non-blocking fd I/O; other ports fall back to executor reads.
+    :param url: Port name or URL, as for open_transport.
+    :type url: str
+    :param baudrate: Line speed (also paces the simulator's input).
+    :type baudrate: int
+    :return: (link, simulator or None).
+    :rtype: tuple
+    :raises serial.SerialException: If the port cannot be opened.
+    Time: O(1)
+    """
+    if url.startswith(SIM_SCHEME):
+        options = simulator_options(url)
+        host_socket, device_socket = socket.socketpair()
+        host = StreamLink(*await asyncio.open_connection(sock=host_socket))
+        device_reader, device_writer = await asyncio.open_connection(sock=device_socket)
+        device = AsyncDeviceSimulator(device_reader, device_writer, baudrate, **options)
+        device.task = asyncio.ensure_future(device.serve())
+        return host, device
+    ser = serial.serial_for_url(url, baudrate, timeout=SERIAL_TIMEOUT)
+    if os.name == 'posix' and isinstance(ser, serial.Serial):
+        return FdLink(ser), None
+    return ExecutorLink(ser), None  #Windows COM ports, socket:// and loop:// URLs have no pollable descriptor
+
+
+class AsyncSerialManager:
+    def __init__(self, port=PORT, baudrate=BAUDRATE, protocol=PROTOCOL_AUTO, frame_encoding=ENCODING_AUTO):
+        """
+        asyncio client for one ring: awaitable sends, requests correlated with device replies,
+        async iteration over incoming messages and cancellation through the usual task APIs.
+        All of it runs on the event loop, so many links share one thread.
+        :param port: Port name or URL (sim:// for the simulator).
+        :type port: str
+        :param baudrate: Line speed.
+        :type baudrate: int
+        :param protocol: PROTOCOL_AUTO negotiates binary frames, PROTOCOL_ASCII/PROTOCOL_BINARY force one.
+        :type protocol: str
+        :param frame_encoding: Frame encoding for send_frame.
+        :type frame_encoding: str
+        Time: O(1)
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.protocol = protocol
+        self.active_protocol = PROTOCOL_ASCII
+        self.encoder = CommandWriter.encode_ascii
+        self.frame_encoder = FrameEncoder(frame_encoding)
+        self.link = None
+        self.device = None
+        self.read_task = None
+        self.connected = False
+        self.waiters = []
+        self.subscribers = []
+        self.lines_read = 0
+        self.bytes_written = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self, attempts=None):
+        """
+        This coroutine opens the port, waits for Ready and negotiates the protocol, retrying with
+        backoff. Wrap it in asyncio.wait_for() or cancel its task to give up.
+        :param attempts: Number of tries, None retries until cancelled.
+        :type attempts: int
+        :return: The protocol in use.
+        :rtype: str
+        :raises serial.SerialException: When the last attempt fails.
+        Time: O(n), where n is the number of attempts.
+        """
+        attempt = 0
+        while True:
+            try:
+                await self.open()
+                return self.active_protocol
+            except (serial.SerialException, OSError):
+                await self.close()
+                attempt += 1
+                if attempts is not None and attempt >= attempts:
+                    raise
+            await asyncio.sleep(backoff_delay(attempt - 1))
+
+    async def open(self):
+        """
+        This coroutine makes one connection attempt.
+        :return: None
+        :raises serial.SerialException: If the port cannot be opened.
+        Time: O(READY_TIMEOUT + NEGOTIATE_TIMEOUT) in the worst case.
+        """
+        self.link, self.device = await open_link(self.port, self.baudrate)
+        self.connected = True
+        ready = self.expect(KIND_READY)  #registered before reading, Ready may come at once
+        self.read_task = asyncio.ensure_future(self.read_loop())
+        try:
+            await asyncio.wait_for(ready, READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            ready.cancel()  #boards that do not reset on open never print Ready
+        self.frame_encoder.reset()
+        await self.negotiate_protocol()
+
+    async def negotiate_protocol(self):
+        """
+        This coroutine asks for the binary protocol, as SerialManager.negotiate_protocol does.
+        :return: The protocol in use.
+        :rtype: str
+        Time: O(NEGOTIATE_TIMEOUT) in the worst case.
+        """
+        self.active_protocol = PROTOCOL_ASCII
+        self.encoder = CommandWriter.encode_ascii
+        if self.protocol == PROTOCOL_BINARY:
+            self.active_protocol = PROTOCOL_BINARY
+        elif self.protocol == PROTOCOL_AUTO:
+            try:
+                await self.request(HELLO_COMMAND, HELLO_REPLY, NEGOTIATE_TIMEOUT)
+                self.active_protocol = PROTOCOL_BINARY
+            except asyncio.TimeoutError:
+                pass
+        if self.active_protocol == PROTOCOL_BINARY:
+            self.encoder = encode_command
+        return self.active_protocol
+
+    def expect(self, match):
+        """
+        This function registers interest in the next message that matches.
+        :param match: A message kind or whole line ("ready", "proto:bin"), or a predicate on DeviceMessage.
+        :type match: str or callable
+        :return: A future resolved with the message, or failed with ConnectionError if the link closes.
+        :rtype: asyncio.Future
+        Time: O(1)
+        """
+        if not callable(match):
+            text = match
+            match = lambda message: message.kind == text or message.raw == text
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((match, future))
+        return future
+
+    async def send(self, command):
+        """
+        This coroutine writes a command and waits until the link has room for more (backpressure).
+        :param command: The command string.
+        :type command: str
+        :return: None
+        :raises ConnectionError: If the link is not open.
+        Time: O(k), where k is the length of the command.
+        """
+        await self.write(self.encoder(command))
+
+    async def send_frame(self, frame):
+        """
+        This coroutine writes a full RGB frame (binary protocol only).
+        :param frame: A (num_leds, 3) uint8 array.
+        :type frame: np.ndarray
+        :return: None
+        :raises ConnectionError: If the link is not open or not binary.
+        Time: O(num_leds)
+        """
+        if self.active_protocol != PROTOCOL_BINARY:
+            raise ConnectionError(PROTOCOL_BINARY)
+        await self.write(self.frame_encoder.encode(frame))
+
+    async def write(self, data):
+        if not self.connected:
+            raise ConnectionError(NOT_CONNECTED)
+        self.link.write(data)
+        self.bytes_written += len(data)
+        await self.link.drain()
+
+    async def request(self, command, expect, timeout=None):
+        """
+        This coroutine sends a command and waits for the reply that matches expect.
+        :param command: The command string (written with the encoder of the active protocol).
+        :type command: str
+        :param expect: What the reply looks like, see expect().
+        :type expect: str or callable
+        :param timeout: Seconds to wait, None waits forever.
+        :type timeout: float
+        :return: The reply.
+        :rtype: DeviceMessage
+        :raises asyncio.TimeoutError: If no reply came in time.
+        :raises ConnectionError: If the link closed meanwhile.
+        Time: O(k) plus the device's reply time.
+        """
+        future = self.expect(expect)
+        try:
+            await self.send(command)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if not future.done():
+                future.cancel()
+            self.waiters = [waiter for waiter in self.waiters if waiter[1] is not future]
+
+    async def messages(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        """
+        Async iterator over incoming messages, until the link closes: `async for message in manager.messages()`.
+        A consumer that falls behind loses the oldest messages, the reader never waits for it.
+        :param maxsize: Capacity of this consumer's queue.
+        :type maxsize: int
+        :return: DeviceMessage objects.
+        :rtype: AsyncIterator[DeviceMessage]
+        Time: O(1) per message.
+        """
+        queue = asyncio.Queue(maxsize)
+        self.subscribers.append(queue)
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.subscribers.remove(queue)
+
+    def __aiter__(self):
+        return self.messages()
+
+    def dispatch(self, message):
+        """
+        This function resolves the oldest matching waiter and fans the message out to the iterators.
+        :param message: The parsed message.
+        :type message: DeviceMessage
+        :return: None
+        Time: O(w + s), where w is the number of waiters and s the number of iterators.
+        """
+        for index, (match, future) in enumerate(self.waiters):
+            if not future.done() and match(message):
+                future.set_result(message)
+                del self.waiters[index]
+                break
+        for queue in self.subscribers:
+            self.deliver(queue, message)
+
+    @staticmethod
+    def deliver(queue, message):
+        if queue.full():
+            queue.get_nowait()  #drop the oldest, like Subscription.put
+        queue.put_nowait(message)
+
+    async def read_loop(self):
+        """
+        Reader task: frames lines and dispatches them until the link closes or the task is cancelled.
+        :return: None
+        Time: O(n), where n is the number of bytes received.
+        """
+        framer = LineFramer()
+        try:
+            while True:
+                data = await self.link.read()
+                if not data:
+                    break
+                for line in framer.feed(data):
+                    self.lines_read += 1
+                    self.dispatch(parse_message(line))
+        except (OSError, serial.SerialException):
+            pass  #link went away, same outcome as EOF
+        finally:
+            self.connected = False
+            self.fail_waiters()
+
+    def fail_waiters(self):
+        """
+        This function ends every pending request and iterator after the link closed.
+        :return: None
+        Time: O(w + s)
+        """
+        waiters, self.waiters = self.waiters, []
+        for _, future in waiters:
+            if not future.done():
+                future.set_exception(ConnectionError(LINK_CLOSED))
+        for queue in self.subscribers:
+            self.deliver(queue, None)
+
+    async def close(self):
+        """
+        This coroutine stops the reader task, closes the link and the simulator, and fails what waits on them.
+        :return: None
+        Time: O(w + s)
+        """
+        self.connected = False
+        if self.read_task:
+            self.read_task.cancel()
+            try:
+                await self.read_task
+            except asyncio.CancelledError:
+                pass
+            self.read_task = None
+        if self.link:
+            self.link.close()
+            self.link = None
+        if self.device:
+            await asyncio.wait([self.device.task])  #ends on EOF once the host side is closed
+            self.device = None
+        self.fail_waiters()
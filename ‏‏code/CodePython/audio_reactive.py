@@ -0,0 +1,551 @@
+import argparse
+import mmap
+import struct
+import sys
+import threading
+import time
+import numpy as np
+from effect_engine import NUM_LEDS, CHANNELS
+from colors import HUE_LUT, VALUE_LUT, LEVELS, MAX_VALUE, apply_output
+from scheduler import TimerStats
+from async_logger import get_logger
+from serial_manager import SerialManager, BAUDRATE
+
+# Audio input: 16-bit little endian PCM, from a WAV file or a raw stream ("-" reads stdin)
+SAMPLE_DTYPE = np.dtype('<i2')
+SAMPLE_FULL_SCALE = 32768.0
+DEFAULT_RATE = 44100
+DEFAULT_CHANNELS = 2
+STDIN_SOURCE = "-"
+# WAV (RIFF) layout
+RIFF_HEADER = struct.Struct('<4sI4s')
+CHUNK_HEADER = struct.Struct('<4sI')
+FMT_FORMAT = struct.Struct('<HHIIHH')
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+SAMPLE_BITS = 16
+# Analysis: a window of WINDOW_SIZE samples every HOP_SIZE samples (50% overlap)
+WINDOW_SIZE = 1024
+HOP_SIZE = 512
+MIN_FREQUENCY = 40.0
+MAX_FREQUENCY = 16000.0
+POWER_FLOOR = 1e-12
+DYNAMIC_RANGE = 4.0       #Bels (40 dB) below the running peak that still light an LED
+PEAK_FLOOR = 0.0          #Bels; keeps the gain from chasing noise in silence
+PEAK_FALL = 0.01          #Bels the running peak drops per window
+LEVEL_FALLOFF = 0.85      #Share of the previous level an LED keeps, so beats fade instead of flicker
+HUE_SPAN = 192            #Bass red through treble blue-violet
+FRAME_POOL = 4            #Frames in flight: one being filled, one queued, one on the wire
+# Audio to wire latency budget, checked against the p99
+LATENCY_BOUND = 0.050
+THREAD_NAME = "audio"
+EVENT_AUDIO_STARTED = "audio_started"
+EVENT_AUDIO_FINISHED = "audio_finished"
+EVENT_AUDIO_LATE = "audio_latency_over_bound"
+
+
+class AudioFormatError(Exception):
+    """Raised for audio this module cannot read."""
+
+
+def find_chunk(data, chunk_id, offset=RIFF_HEADER.size):
+    """
+    This function walks the chunks of a RIFF file.
+    :param data: The whole file.
+    :type data: mmap.mmap
+    :param chunk_id: Chunk to find, e.g. b"data".
+    :type chunk_id: bytes
+    :param offset: Where the chunk list starts.
+    :type offset: int
+    :return: (offset of the chunk body, body size).
+    :rtype: tuple[int, int]
+    Time: O(c), where c is the number of chunks.
+    """
+    while offset + CHUNK_HEADER.size <= len(data):
+        found, size = CHUNK_HEADER.unpack_from(data, offset)
+        offset += CHUNK_HEADER.size
+        if found == chunk_id:
+            return offset, min(size, len(data) - offset)
+        offset += size + (size & 1)
+    raise AudioFormatError("no %s chunk" % chunk_id.decode())
+
+
+class WavSource:
+    def __init__(self, path):
+        """
+        A 16-bit PCM WAV file, memory mapped: blocks are views into the file, nothing is copied or decoded.
+        :param path: The file.
+        :type path: str
+        Time: O(c), where c is the number of chunks.
+        """
+        self.path = path
+        self.live = False
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        riff, _, wave = RIFF_HEADER.unpack_from(self.map)
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise AudioFormatError("%s is not a WAV file" % path)
+        offset, _ = find_chunk(self.map, b"fmt ")
+        audio_format, self.channels, self.rate, _, _, bits = FMT_FORMAT.unpack_from(self.map, offset)
+        if audio_format not in (WAVE_FORMAT_PCM, WAVE_FORMAT_EXTENSIBLE) or bits != SAMPLE_BITS:
+            raise AudioFormatError("only 16-bit PCM is supported, got format %d with %d bits" % (audio_format, bits))
+        offset, size = find_chunk(self.map, b"data")
+        frames = size // (SAMPLE_DTYPE.itemsize * self.channels)
+        self.samples = np.frombuffer(self.map, SAMPLE_DTYPE, frames * self.channels, offset)
+        self.samples = self.samples.reshape(frames, self.channels)
+
+    def duration(self):
+        return len(self.samples) / self.rate
+
+    def blocks(self, size):
+        """
+        This function yields the audio in blocks; a last partial block is dropped.
+        :param size: Sample frames per block.
+        :type size: int
+        :return: Generator of (size, channels) int16 views.
+        :rtype: generator
+        Time: O(1) per block.
+        """
+        for start in range(0, len(self.samples) - size + 1, size):
+            yield self.samples[start:start + size]
+
+    def close(self):
+        self.samples = None
+        self.map.close()
+
+
+class PcmSource:
+    def __init__(self, stream, rate=DEFAULT_RATE, channels=DEFAULT_CHANNELS):
+        """
+        Raw 16-bit little endian PCM from a pipe, e.g. `arecord -f S16_LE -r 44100 -c 2 | ...`.
+        Reads into one buffer allocated up front.
+        :param stream: Binary stream with readinto (sys.stdin.buffer).
+        :type stream: io.BufferedIOBase
+        :param rate: Sample rate.
+        :type rate: int
+        :param channels: Interleaved channels.
+        :type channels: int
+        Time: O(1)
+        """
+        self.stream = stream
+        self.rate = rate
+        self.channels = channels
+        self.live = True
+
+    def blocks(self, size):
+        """
+        This function yields the stream in blocks, as they arrive; the pipe closing ends it.
+        :param size: Sample frames per block.
+        :type size: int
+        :return: Generator of (size, channels) int16 arrays, the same buffer every time.
+        :rtype: generator
+        Time: O(size) per block.
+        """
+        buffer = bytearray(size * self.channels * SAMPLE_DTYPE.itemsize)
+        view = memoryview(buffer)
+        block = np.frombuffer(buffer, SAMPLE_DTYPE).reshape(size, self.channels)
+        while True:
+            filled = 0
+            while filled < len(buffer):
+                count = self.stream.readinto(view[filled:])
+                if not count:
+                    return
+                filled += count
+            yield block
+
+    def close(self):
+        pass
+
+
+class SampleRing:
+    def __init__(self, window, hop):
+        """
+        A fixed ring of mono samples. Every hop is written twice, half a buffer apart, so the last
+        window is always one contiguous view and reading it copies nothing.
+        :param window: Samples per analysis window.
+        :type window: int
+        :param hop: Samples per write; must divide window.
+        :type hop: int
+        Time: O(window)
+        """
+        if window % hop:
+            raise ValueError("hop %d does not divide window %d" % (hop, window))
+        self.window = window
+        self.hop = hop
+        self.buffer = np.zeros(2 * window, dtype=np.float32)
+        self.position = 0
+
+    def write(self, block):
+        """
+        This function adds a block, down-mixed by summing the channels (the analyzer scales it).
+        :param block: (hop, channels) int16 samples.
+        :type block: np.ndarray
+        :return: The latest window, a (window,) float32 view.
+        :rtype: np.ndarray
+        Time: O(hop * channels)
+        """
+        start = self.position
+        first = self.buffer[start:start + self.hop]
+        np.sum(block, axis=1, dtype=np.float32, out=first)
+        self.buffer[start + self.window:start + self.window + self.hop] = first
+        self.position = (start + self.hop) % self.window
+        return self.buffer[start + self.hop:start + self.hop + self.window]
+
+
+def band_edges(rate, window, bands, min_frequency=MIN_FREQUENCY, max_frequency=MAX_FREQUENCY):
+    """
+    This function splits the spectrum into log spaced bands, at least one FFT bin each.
+    :param rate: Sample rate.
+    :type rate: int
+    :param window: FFT size.
+    :type window: int
+    :param bands: Number of bands.
+    :type bands: int
+    :param min_frequency: Lower edge of the first band.
+    :type min_frequency: float
+    :param max_frequency: Upper edge of the last band (capped at Nyquist).
+    :type max_frequency: float
+    :return: (first bin of each band, bin after the last band).
+    :rtype: tuple[np.ndarray, int]
+    Time: O(bands)
+    """
+    bins = window // 2 + 1
+    stop = min(int(max_frequency * window / rate), bins - 1)
+    edges = np.geomspace(max(min_frequency * window / rate, 1), stop, bands + 1).astype(np.intp)
+    for band in range(1, bands + 1):
+        edges[band] = max(edges[band], edges[band - 1] + 1)
+    if edges[-1] > bins:
+        raise ValueError("%d bands do not fit a %d point FFT" % (bands, window))
+    return edges[:-1].copy(), int(edges[-1])
+
+
+class BandAnalyzer:
+    def __init__(self, rate, window=WINDOW_SIZE, bands=NUM_LEDS, channels=1):
+        """
+        Turns windows of samples into per band levels 0..255: Hann window, real FFT, power summed per
+        band, then an automatic gain per band in the log domain. Every array is allocated here, a
+        window only runs ufuncs with out=.
+        :param rate: Sample rate.
+        :type rate: int
+        :param window: FFT size.
+        :type window: int
+        :param bands: Number of bands.
+        :type bands: int
+        :param channels: Channels summed into each sample by SampleRing.
+        :type channels: int
+        Time: O(window)
+        """
+        self.starts, self.stop = band_edges(rate, window, bands)
+        self.taper = (np.hanning(window) / (SAMPLE_FULL_SCALE * channels)).astype(np.float32)
+        self.windowed = np.empty(window, dtype=np.float32)
+        self.spectrum = np.empty(window // 2 + 1, dtype=np.complex64)
+        self.power = np.empty(window // 2 + 1, dtype=np.float32)
+        self.levels = np.empty(bands, dtype=np.float32)
+        self.peaks = np.full(bands, PEAK_FLOOR, dtype=np.float32)
+        self.smoothed = np.zeros(bands, dtype=np.float32)
+        self.values = np.zeros(bands, dtype=np.uint8)
+
+    def analyze(self, samples):
+        """
+        This function computes the band levels of one window.
+        :param samples: (window,) float32 samples.
+        :type samples: np.ndarray
+        :return: (bands,) uint8 levels, the same array every call.
+        :rtype: np.ndarray
+        Time: O(window log window)
+        """
+        levels = self.levels
+        np.multiply(samples, self.taper, out=self.windowed)
+        np.fft.rfft(self.windowed, out=self.spectrum)
+        np.abs(self.spectrum, out=self.power)
+        np.square(self.power, out=self.power)
+        np.add.reduceat(self.power[:self.stop], self.starts, out=levels)
+        np.add(levels, POWER_FLOOR, out=levels)
+        np.log10(levels, out=levels)
+        #The running peak follows the loudest recent level; DYNAMIC_RANGE below it is dark
+        np.subtract(self.peaks, PEAK_FALL, out=self.peaks)
+        np.maximum(self.peaks, levels, out=self.peaks)
+        np.maximum(self.peaks, PEAK_FLOOR, out=self.peaks)
+        np.subtract(levels, self.peaks, out=levels)
+        np.add(levels, DYNAMIC_RANGE, out=levels)
+        np.multiply(levels, 1.0 / DYNAMIC_RANGE, out=levels)
+        np.clip(levels, 0.0, 1.0, out=levels)
+        np.multiply(self.smoothed, LEVEL_FALLOFF, out=self.smoothed)
+        np.maximum(self.smoothed, levels, out=self.smoothed)
+        np.multiply(self.smoothed, MAX_VALUE, out=levels)
+        np.copyto(self.values, levels, casting='unsafe')
+        return self.values
+
+
+class BandMapper:
+    def __init__(self, num_leds=NUM_LEDS, bands=NUM_LEDS, pool=FRAME_POOL):
+        """
+        Draws band levels on the ring: each LED shows one band, the hue from its position in the
+        spectrum and the brightness from its level (a CHSV value lookup, like FastLED).
+        Frames come from a small pool, so a frame still queued or on the wire is never overwritten.
+        :param num_leds: Number of LEDs.
+        :type num_leds: int
+        :param bands: Number of bands.
+        :type bands: int
+        :param pool: Frames in the pool.
+        :type pool: int
+        Time: O(pool * num_leds)
+        """
+        self.led_bands = np.arange(num_leds) * bands // num_leds
+        self.colors = HUE_LUT[self.led_bands * HUE_SPAN // bands].astype(np.intp)
+        self.flat_lut = VALUE_LUT.ravel()
+        self.led_values = np.empty(num_leds, dtype=np.uint8)
+        self.index = np.empty((num_leds, CHANNELS), dtype=np.intp)
+        self.pool = [np.zeros((num_leds, CHANNELS), dtype=np.uint8) for _ in range(pool)]
+        self.next_frame = 0
+
+    def frame(self, levels):
+        """
+        This function draws one frame.
+        :param levels: (bands,) uint8 band levels.
+        :type levels: np.ndarray
+        :return: (num_leds, 3) uint8 frame from the pool.
+        :rtype: np.ndarray
+        Time: O(num_leds)
+        """
+        frame = self.pool[self.next_frame]
+        self.next_frame = (self.next_frame + 1) % len(self.pool)
+        np.take(levels, self.led_bands, out=self.led_values)
+        np.multiply(self.led_values[:, None], LEVELS, out=self.index, dtype=np.intp)
+        np.add(self.index, self.colors, out=self.index)
+        np.take(self.flat_lut, self.index, out=frame)
+        return frame
+
+
+def hops(source, hop, realtime):
+    """
+    Pipeline stage: yields (block, time the block was complete). A file played in real time is
+    paced with absolute deadlines, as if it came from a sound card; a live source arrives paced.
+    :param source: WavSource or PcmSource.
+    :type source: WavSource or PcmSource
+    :param hop: Samples per block.
+    :type hop: int
+    :param realtime: Pace a file to its sample rate.
+    :type realtime: bool
+    :return: Generator of (block, perf_counter timestamp).
+    :rtype: generator
+    Time: O(1) per block.
+    """
+    started = time.perf_counter()
+    for count, block in enumerate(source.blocks(hop), 1):
+        if realtime and not source.live:
+            delay = started + count * hop / source.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield block, time.perf_counter()
+
+
+def windows(blocks, ring):
+    """Pipeline stage: yields (latest window, timestamp) for every block."""
+    for block, captured in blocks:
+        yield ring.write(block), captured
+
+
+def band_levels(windows, analyzer):
+    """Pipeline stage: yields (band levels, timestamp) for every window."""
+    for samples, captured in windows:
+        yield analyzer.analyze(samples), captured
+
+
+def frames(levels, mapper, output=None):
+    """Pipeline stage: yields (frame, timestamp), through an optional output stage (ColorPipeline or table)."""
+    for values, captured in levels:
+        frame = mapper.frame(values)
+        if output is not None:
+            frame[...] = apply_output(output, frame)  #stay in the pool, the latency samples key on it
+        yield frame, captured
+
+
+class AudioStreamer:
+    def __init__(self, serial_manager, source, num_leds=NUM_LEDS, bands=None, window=WINDOW_SIZE, hop=HOP_SIZE,
+                 realtime=True, output=None, latency_bound=LATENCY_BOUND):
+        """
+        Streams an audio reactive effect: source -> ring buffer -> FFT bands -> frames -> send_frame,
+        one generator stage each, on a thread of its own. The time from a block's last sample to its
+        frame leaving the writer thread is measured per frame.
+        :param serial_manager: The connected manager (binary protocol required), or anything with send_frame.
+        :type serial_manager: SerialManager
+        :param source: WavSource or PcmSource.
+        :type source: WavSource or PcmSource
+        :param num_leds: Number of LEDs.
+        :type num_leds: int
+        :param bands: Number of bands, defaults to one per LED.
+        :type bands: int
+        :param window: FFT size.
+        :type window: int
+        :param hop: Samples between two windows.
+        :type hop: int
+        :param realtime: Pace a file to its sample rate; False runs as fast as the host can.
+        :type realtime: bool
+        :param output: Optional output stage, a ColorPipeline or a table from colors.
+        :type output: ColorPipeline or np.ndarray
+        :param latency_bound: Audio to wire budget in seconds, checked against the p99.
+        :type latency_bound: float
+        Time: O(window + num_leds)
+        """
+        self.serial_manager = serial_manager
+        self.source = source
+        self.hop = hop
+        self.realtime = realtime
+        self.output = output
+        self.latency_bound = latency_bound
+        self.ring = SampleRing(window, hop)
+        self.analyzer = BandAnalyzer(source.rate, window, bands or num_leds, source.channels)
+        self.mapper = BandMapper(num_leds, bands or num_leds)
+        self.latency = TimerStats()
+        self.captured = {}
+        self.windows = 0
+        self.frames_sent = 0
+        self.elapsed = 0.0
+        self.stop_event = threading.Event()
+        self.finished = threading.Event()
+        self.thread = None
+        self.writer = getattr(serial_manager, "writer", None)
+        self.previous_on_sent = None
+
+    def on_sent(self, command):
+        """
+        Writer thread callback: completes the latency sample of a frame once it is on the wire.
+        :param command: What the writer just wrote.
+        :type command: str or np.ndarray
+        :return: None
+        Time: O(1)
+        """
+        captured = self.captured.pop(id(command), None)
+        if captured is not None:
+            self.latency.record(time.perf_counter() - captured)
+        if self.previous_on_sent:
+            self.previous_on_sent(command)
+
+    def pipeline(self):
+        """
+        This function chains the stages.
+        :return: Generator of (frame, timestamp).
+        :rtype: generator
+        Time: O(1)
+        """
+        blocks = hops(self.source, self.hop, self.realtime)
+        return frames(band_levels(windows(blocks, self.ring), self.analyzer), self.mapper, self.output)
+
+    def run(self):
+        """
+        This function plays the source to its end or until stop(); runs on the calling thread.
+        :return: The statistics.
+        :rtype: dict
+        Time: O(w * window log window), where w is the number of windows.
+        """
+        if self.writer:
+            self.previous_on_sent = self.writer.on_sent
+            self.writer.on_sent = self.on_sent
+        get_logger().info(EVENT_AUDIO_STARTED, rate=self.source.rate, channels=self.source.channels,
+                          realtime=self.realtime)
+        started = time.perf_counter()
+        try:
+            for frame, captured in self.pipeline():
+                if self.stop_event.is_set():
+                    break
+                self.windows += 1
+                if self.writer:
+                    self.captured[id(frame)] = captured  #a frame superseded in the queue keeps no sample
+                elif self.realtime:
+                    self.latency.record(time.perf_counter() - captured)
+                if self.serial_manager.send_frame(frame, copy=False):
+                    self.frames_sent += 1
+        finally:
+            self.elapsed = time.perf_counter() - started
+            if self.writer:
+                self.writer.on_sent = self.previous_on_sent
+            self.finished.set()
+        stats = self.stats()
+        get_logger().info(EVENT_AUDIO_FINISHED, windows=self.windows, sent=self.frames_sent,
+                          speed=round(stats["speed"], 2))
+        if stats["latency"]["p99_ms"] > self.latency_bound * 1000:
+            get_logger().warning(EVENT_AUDIO_LATE, p99_ms=round(stats["latency"]["p99_ms"], 2),
+                                 bound_ms=self.latency_bound * 1000)
+        return stats
+
+    def start(self):
+        """
+        This function plays the source on a background thread.
+        :return: None
+        Time: O(1)
+        """
+        self.stop_event.clear()
+        self.finished.clear()
+        self.thread = threading.Thread(target=self.run, name=THREAD_NAME, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        This function stops playback after the current window.
+        :param timeout: Seconds to wait for the thread.
+        :type timeout: float
+        :return: None
+        Time: O(1)
+        """
+        self.stop_event.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def stats(self):
+        """
+        This function reports windows processed, frames sent, speed against real time and the
+        audio to wire latency in milliseconds.
+        :return: The statistics.
+        :rtype: dict
+        Time: O(w log w), where w is the latency window.
+        """
+        audio_seconds = self.windows * self.hop / self.source.rate
+        latency = self.latency.snapshot()
+        return {"windows": self.windows, "sent": self.frames_sent,
+                "speed": audio_seconds / self.elapsed if self.elapsed else 0.0, "latency": latency,
+                "within_bound": latency["p99_ms"] <= self.latency_bound * 1000}
+
+
+def open_source(path, rate=DEFAULT_RATE, channels=DEFAULT_CHANNELS):
+    """
+    This function opens a WAV file, or raw PCM on stdin for "-".
+    :param path: File path or "-".
+    :type path: str
+    :param rate: Sample rate of raw PCM.
+    :type rate: int
+    :param channels: Channels of raw PCM.
+    :type channels: int
+    :return: The source.
+    :rtype: WavSource or PcmSource
+    Time: O(1)
+    """
+    if path == STDIN_SOURCE:
+        return PcmSource(sys.stdin.buffer, rate, channels)
+    return WavSource(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio reactive effect from a WAV file or raw PCM on stdin")
+    parser.add_argument("source", help="WAV file, or - for raw s16le PCM on stdin")
+    parser.add_argument("--port", required=True, help="serial port (sim:// for a simulated ring)")
+    parser.add_argument("--baud", type=int, default=BAUDRATE)
+    parser.add_argument("--leds", type=int, default=NUM_LEDS)
+    parser.add_argument("--rate", type=int, default=DEFAULT_RATE, help="sample rate of raw PCM")
+    parser.add_argument("--channels", type=int, default=DEFAULT_CHANNELS, help="channels of raw PCM")
+    args = parser.parse_args()
+    source = open_source(args.source, args.rate, args.channels)
+    link = SerialManager(port=args.port, baudrate=args.baud, discover=False)
+    link.connect()
+    streamer = AudioStreamer(link, source, args.leds)
+    try:
+        print(streamer.run())
+    except KeyboardInterrupt:
+        streamer.stop()
+    finally:
+        link.close()
+        source.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import threading
+import time
+import numpy as np
+from async_serial import AsyncSerialManager
+
+DEFAULT_LINKS = [1, 100, 500]
+DEFAULT_BAUDRATE = 115200
+DEFAULT_LEDS = 14
+DEFAULT_COMMANDS = 50
+WAIT_TIMEOUT = 5.0
+POLL_INTERVAL = 0.001
+SIM_URL = "sim://?leds=%d"
+REPORT_LINE = ("links=%-4d threads=%-3d connect=%8.1f ms  handshake p50=%6.2f p99=%6.2f ms  "
+               "commands=%9.0f /s  lost=%d")
+
+
+async def connect_timed(manager):
+    start = time.perf_counter()
+    await manager.connect(attempts=1)
+    return time.perf_counter() - start
+
+
+async def delivered(managers, counts, timeout):
+    """
+    This coroutine waits until every simulated ring handled its commands.
+    :param managers: The connected managers.
+    :type managers: list[AsyncSerialManager]
+    :param counts: Commands each ring must have handled.
+    :type counts: list[int]
+    :param timeout: Seconds to wait.
+    :type timeout: float
+    :return: Number of rings that fell short.
+    :rtype: int
+    Time: O(links) per poll.
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if all(manager.device.commands >= count for manager, count in zip(managers, counts)):
+            return 0
+        await asyncio.sleep(POLL_INTERVAL)
+    return sum(manager.device.commands < count for manager, count in zip(managers, counts))
+
+
+async def run_links(links, baudrate, num_leds, commands):
+    """
+    This coroutine opens many simulated links in one event loop, times their connect and protocol
+    handshake, and then sends commands to all of them as fast as the links take them.
+    :param links: Number of links.
+    :type links: int
+    :param baudrate: Line speed.
+    :type baudrate: int
+    :param num_leds: LEDs per ring.
+    :type num_leds: int
+    :param commands: Commands per link.
+    :type commands: int
+    :return: (threads, connect ms, handshake p50 ms, handshake p99 ms, commands per second, rings short).
+    :rtype: tuple
+    Time: O(links * commands)
+    """
+    managers = [AsyncSerialManager(SIM_URL % num_leds, baudrate) for _ in range(links)]
+    start = time.perf_counter()
+    handshakes = await asyncio.gather(*(connect_timed(manager) for manager in managers))
+    connect_time = time.perf_counter() - start
+    threads = threading.active_count()
+    targets = [manager.device.commands + commands for manager in managers]
+    start = time.perf_counter()
+    for i in range(commands):
+        command = "rgb:%d,0,0" % (i % 256)
+        await asyncio.gather(*(manager.send(command) for manager in managers))
+    lost = await delivered(managers, targets, WAIT_TIMEOUT)
+    rate = links * commands / (time.perf_counter() - start)
+    await asyncio.gather(*(manager.close() for manager in managers))
+    p50, p99 = np.percentile(handshakes, [50, 99]) * 1000
+    return threads, connect_time * 1000, p50, p99, rate, lost
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Many simulated rings on one asyncio loop")
+    parser.add_argument("--links", type=int, nargs="+", default=DEFAULT_LINKS)
+    parser.add_argument("--baud", type=int, default=DEFAULT_BAUDRATE)
+    parser.add_argument("--leds", type=int, default=DEFAULT_LEDS)
+    parser.add_argument("--commands", type=int, default=DEFAULT_COMMANDS)
+    args = parser.parse_args()
+    for links in args.links:
+        result = asyncio.run(run_links(links, args.baud, args.leds, args.commands))
+        print(REPORT_LINE % ((links,) + result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import wave
+import numpy as np
+from audio_reactive import AudioStreamer, WavSource, DEFAULT_RATE, LATENCY_BOUND
+from serial_manager import SerialManager
+
+DEFAULT_MINUTES = 30.0
+DEFAULT_LEDS = [14, 300]
+DEFAULT_BAUDS = [115200, 1000000]
+LATENCY_SECONDS = 5.0
+CHUNK_SECONDS = 60
+BEAT_SECONDS = 0.5
+TRACED_WINDOWS = 2000
+SIM_URL = "sim://?leds=%d"
+FILE_NAME = "bench-audio.wav"
+SPEED_LINE = "leds=%-4d audio=%6.1f min  processed in %6.2f s  speed=%7.1fx real time  %6.1f us/window"
+ALLOC_LINE = "leds=%-4d allocations per window: %.2f blocks, %.1f bytes"
+LATENCY_LINE = "leds=%-4d baud=%-8d latency p50=%6.2f p99=%6.2f max=%6.2f ms  bound=%.0f ms %s  sent=%d/%d"
+
+
+class NullLink:
+    def __init__(self):
+        self.frames = 0
+
+    def send_frame(self, frame, copy=True):
+        self.frames += 1
+        return True
+
+
+def write_test_wav(path, minutes, rate=DEFAULT_RATE, seed=1):
+    """
+    This function writes a stereo 16-bit WAV with something for every band: a kick each beat,
+    a wandering melody and noise, a minute at a time so long files never sit in memory.
+    :param path: Output file.
+    :type path: str
+    :param minutes: Length.
+    :type minutes: float
+    :param rate: Sample rate.
+    :type rate: int
+    :param seed: Random seed.
+    :type seed: int
+    :return: None
+    Time: O(minutes * rate)
+    """
+    rng = np.random.default_rng(seed)
+    total = int(minutes * 60 * rate)
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(2)
+        file.setsampwidth(2)
+        file.setframerate(rate)
+        for start in range(0, total, CHUNK_SECONDS * rate):
+            t = np.arange(start, min(start + CHUNK_SECONDS * rate, total)) / rate
+            beat = t % BEAT_SECONDS
+            kick = np.sin(2 * np.pi * 60 * beat) * np.exp(-beat * 20)
+            melody = 0.4 * np.sin(2 * np.pi * (440 + 300 * np.sin(t * 0.7)) * t)
+            noise = 0.1 * rng.standard_normal(len(t))
+            mono = (kick + melody + noise) * 9000
+            file.writeframes(np.stack([mono, mono * 0.8], axis=1).astype('<i2').tobytes())
+
+
+def measure_speed(path, num_leds):
+    """
+    This function runs the whole pipeline as fast as the host can into a link that only counts.
+    :return: (streamer statistics, audio seconds, wall seconds).
+    :rtype: tuple[dict, float, float]
+    Time: O(windows * window log window)
+    """
+    source = WavSource(path)
+    streamer = AudioStreamer(NullLink(), source, num_leds, realtime=False)
+    stats = streamer.run()
+    duration = source.duration()
+    source.close()
+    return stats, duration, streamer.elapsed
+
+
+def measure_allocations(path, num_leds):
+    """
+    This function counts what the steady state pipeline allocates per window, with tracemalloc.
+    :return: (blocks, bytes) per window.
+    :rtype: tuple[float, float]
+    Time: O(TRACED_WINDOWS * window log window)
+    """
+    source = WavSource(path)
+    streamer = AudioStreamer(NullLink(), source, num_leds, realtime=False)
+    pipeline = streamer.pipeline()
+    for _ in range(10):
+        next(pipeline)  #warm up: generator frames, FFT plan
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(TRACED_WINDOWS):
+        next(pipeline)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    pipeline.close()
+    source.close()
+    stats = after.compare_to(before, "lineno")
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    return blocks / TRACED_WINDOWS, size / TRACED_WINDOWS
+
+
+def measure_latency(path, num_leds, baudrate, seconds):
+    """
+    This function plays the file in real time into a simulated ring and reports the audio to wire latency.
+    :return: The streamer statistics.
+    :rtype: dict
+    Time: O(seconds * rate)
+    """
+    link = SerialManager(port=SIM_URL % num_leds, baudrate=baudrate, discover=False)
+    link.reader.on_message = None
+    link.connect()
+    source = WavSource(path)
+    streamer = AudioStreamer(link, source, num_leds)
+    link.writer.on_sent = None  #logging every frame would dominate the timings
+    streamer.start()
+    time.sleep(seconds)
+    streamer.stop()
+    link.close()
+    source.close()
+    return streamer.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio reactive pipeline speed and audio to wire latency")
+    parser.add_argument("--minutes", type=float, default=DEFAULT_MINUTES, help="length of the generated file")
+    parser.add_argument("--leds", type=int, nargs="+", default=DEFAULT_LEDS)
+    parser.add_argument("--baud", type=int, nargs="+", default=DEFAULT_BAUDS)
+    parser.add_argument("--seconds", type=float, default=LATENCY_SECONDS, help="real time playback per latency run")
+    args = parser.parse_args()
+    path = os.path.join(tempfile.gettempdir(), FILE_NAME)
+    write_test_wav(path, args.minutes)
+    for num_leds in args.leds:
+        stats, duration, elapsed = measure_speed(path, num_leds)
+        print(SPEED_LINE % (num_leds, duration / 60, elapsed, stats["speed"], elapsed / stats["windows"] * 1e6))
+        print(ALLOC_LINE % ((num_leds,) + measure_allocations(path, num_leds)))
+        for baudrate in args.baud:
+            stats = measure_latency(path, num_leds, baudrate, args.seconds)
+            latency = stats["latency"]
+            verdict = "ok" if stats["within_bound"] else "OVER"
+            print(LATENCY_LINE % (num_leds, baudrate, latency["p50_ms"], latency["p99_ms"], latency["max_ms"],
+                                  LATENCY_BOUND * 1000, verdict, latency["count"], stats["windows"]))
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
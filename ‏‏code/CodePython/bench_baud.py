@@ -0,0 +1,82 @@
+import argparse
+import time
+from effect_engine import Rainbow, FrameStreamer
+from link_speed import BaudCache, SAFE_BAUDRATE, BAUD_RATES
+from serial_manager import SerialManager
+from bench_latency import STREAM_FPS, WAIT_TIMEOUT
+
+DEFAULT_LEDS = [14, 144]
+DEFAULT_SECONDS = 2.0
+SIM_URL = "sim://?leds=%d"
+NOISY_URL = "sim://?leds=%d&noisybaud=%d"
+NOISY_BAUDRATE = 1000000
+RATE_LINE = "leds=%-4d max=%-8d negotiated=%-8d climb=%6.1f ms cached=%6.1f ms  frames=%7.1f fps %9.0f bytes/s"
+NOISY_LINE = "leds=%-4d noisy from %d: negotiated=%d in %.1f ms, cached next time: %d"
+
+
+def connect(port, max_baudrate, cache):
+    """
+    This function connects a SerialManager that negotiates up to max_baudrate and times the connect.
+    :param port: The sim:// URL.
+    :type port: str
+    :param max_baudrate: Highest rate to negotiate.
+    :type max_baudrate: int
+    :param cache: Rates per port.
+    :type cache: BaudCache
+    :return: (manager, seconds to connect).
+    :rtype: tuple[SerialManager, float]
+    Time: O(rates tried)
+    """
+    manager = SerialManager(port=port, discover=False, max_baudrate=max_baudrate, baud_cache=cache)
+    manager.writer.on_sent = None  #printing every frame would dominate the timings
+    manager.reader.on_message = None
+    start = time.perf_counter()
+    manager.connect()
+    return manager, time.perf_counter() - start
+
+
+def measure_throughput(manager, num_leds, seconds):
+    """
+    This function streams a host-rendered rainbow at whatever rate the link was negotiated to.
+    :return: (frames per second, wire bytes per second).
+    :rtype: tuple[float, float]
+    Time: O(seconds * fps * num_leds)
+    """
+    device = manager.ser.device
+    streamer = FrameStreamer(manager, Rainbow(num_leds), STREAM_FPS)
+    sent = manager.writer.bytes_written
+    start = time.perf_counter()
+    streamer.start()
+    time.sleep(seconds)
+    streamer.stop()
+    manager.writer.flush()
+    manager.ser.flush()
+    device.wait_for(lambda simulator: simulator.transport.in_waiting == 0, WAIT_TIMEOUT)
+    elapsed = time.perf_counter() - start
+    return device.frames / elapsed, (manager.writer.bytes_written - sent) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Negotiated line speed and frame throughput on the simulator")
+    parser.add_argument("--max-baud", type=int, nargs="+", default=[SAFE_BAUDRATE] + list(BAUD_RATES))
+    parser.add_argument("--leds", type=int, nargs="+", default=DEFAULT_LEDS)
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS)
+    args = parser.parse_args()
+    for num_leds in args.leds:
+        for max_baudrate in args.max_baud:
+            cache = BaudCache()
+            manager, climb = connect(SIM_URL % num_leds, max_baudrate, cache)
+            manager.close()
+            manager, cached = connect(SIM_URL % num_leds, max_baudrate, cache)
+            fps, rate = measure_throughput(manager, num_leds, args.seconds)
+            print(RATE_LINE % (num_leds, max_baudrate, manager.line_baudrate, climb * 1000, cached * 1000, fps, rate))
+            manager.close()
+        cache = BaudCache()
+        port = NOISY_URL % (num_leds, NOISY_BAUDRATE)
+        manager, climb = connect(port, max(BAUD_RATES), cache)
+        print(NOISY_LINE % (num_leds, NOISY_BAUDRATE, manager.line_baudrate, climb * 1000, cache.get(port)))
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import time
+import numpy as np
+from colors import (ColorPipeline, chsv_to_rgb, hex_to_rgb, hex_to_frame, limit_power, scale8, scale8_video,
+                    channel_scales, build_gamma_lut, TYPICAL_LED_STRIP, FIRMWARE_BRIGHTNESS, MAX_VALUE)
+from preview_renderer import frame_to_hex
+
+DEFAULT_LEDS = [14, 300]
+DEFAULT_BATCH = 100
+DEFAULT_GAMMA = 2.2
+DEFAULT_MILLIAMPS = 2000
+REPEATS = 5
+LINE = "leds=%-4d %-10s per-pixel=%9.1f us  lut=%8.1f us  batch=%8.2f us/frame  speedup=%6.1fx"
+SECTIONS = 8
+
+
+def reference_hsv(hue, sat, val):
+    """
+    This function is hsv2rgb_rainbow one color at a time, the way a straight port would run it.
+    Time: O(1)
+    """
+    offset8 = (hue & 0x1F) << 3
+    third = scale8(offset8, 256 // 3)
+    twothirds = scale8(offset8, (256 * 2) // 3)
+    r, g, b = [(255 - third, third, 0), (171, 85 + third, 0), (171 - twothirds, 170 + third, 0),
+               (0, 255 - third, third), (0, 171 - twothirds, 85 + twothirds), (third, 0, 255 - third),
+               (85 + third, 0, 171 - third), (170 + third, 0, 85 - third)][hue * SECTIONS // 256]
+    if sat != MAX_VALUE:
+        if sat == 0:
+            r = g = b = MAX_VALUE
+        else:
+            desat = scale8_video(MAX_VALUE - sat, MAX_VALUE - sat)
+            satscale = MAX_VALUE - desat
+            r, g, b = scale8(r, satscale) + desat, scale8(g, satscale) + desat, scale8(b, satscale) + desat
+    if val != MAX_VALUE:
+        val = scale8_video(val, val)
+        r, g, b = (0, 0, 0) if val == 0 else (scale8(r, val), scale8(g, val), scale8(b, val))
+    return r, g, b
+
+
+def reference_output(frame, gamma, scales, max_milliamps):
+    """
+    This function applies gamma, correction, brightness and the current limit pixel by pixel.
+    Time: O(num_leds)
+    """
+    pixels = [[scale8(round(MAX_VALUE * (value / MAX_VALUE) ** gamma), scale) for value, scale in zip(pixel, scales)]
+              for pixel in frame.tolist()]
+    draw = sum(r * 16 + g * 11 + b * 15 for r, g, b in pixels) / MAX_VALUE + len(pixels)
+    if draw > max_milliamps:
+        scale = min(max(int(256 * (max_milliamps - len(pixels)) / (draw - len(pixels))) - 1, 0), MAX_VALUE)
+        pixels = [[scale8(value, scale) for value in pixel] for pixel in pixels]
+    return np.array(pixels, dtype=np.uint8)
+
+
+def best_time(function, *args):
+    """
+    This function returns the best of REPEATS runs, in seconds.
+    Time: O(REPEATS * cost of function)
+    """
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-pixel color code against the lookup table pipeline")
+    parser.add_argument("--leds", type=int, nargs="+", default=DEFAULT_LEDS)
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="frames converted per call")
+    parser.add_argument("--gamma", type=float, default=DEFAULT_GAMMA)
+    parser.add_argument("--max-milliamps", type=float, default=DEFAULT_MILLIAMPS)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    pipeline = ColorPipeline(args.gamma, TYPICAL_LED_STRIP, FIRMWARE_BRIGHTNESS, args.max_milliamps)
+    scales = channel_scales(TYPICAL_LED_STRIP, FIRMWARE_BRIGHTNESS)
+    assert (build_gamma_lut(args.gamma) == [round(MAX_VALUE * (v / MAX_VALUE) ** args.gamma) for v in range(256)]).all()
+    for num_leds in args.leds:
+        hsv = rng.integers(0, 256, (args.batch, num_leds, 3))
+        frames = rng.integers(0, 256, (args.batch, num_leds, 3), dtype=np.uint8)
+        hexes = frame_to_hex(frames[0])
+
+        scalar, expected = best_time(lambda: [reference_hsv(*color) for color in hsv[0].tolist()])
+        table, result = best_time(chsv_to_rgb, hsv[0, :, 0], hsv[0, :, 1], hsv[0, :, 2])
+        batch, _ = best_time(chsv_to_rgb, hsv[..., 0], hsv[..., 1], hsv[..., 2])
+        assert result.tolist() == [list(color) for color in expected]
+        print(LINE % (num_leds, "hsv", scalar * 1e6, table * 1e6, batch / args.batch * 1e6, scalar / table))
+
+        scalar, expected = best_time(reference_output, frames[0], args.gamma, scales, args.max_milliamps)
+        table, result = best_time(pipeline.apply, frames[0])
+        batch, _ = best_time(pipeline.apply, frames)
+        assert (result == expected).all()
+        assert (limit_power(result, args.max_milliamps) == result).all()
+        print(LINE % (num_leds, "output", scalar * 1e6, table * 1e6, batch / args.batch * 1e6, scalar / table))
+
+        uncached = lambda: [tuple(int(color[i:i + 2], 16) for i in (1, 3, 5)) for color in hexes]
+        scalar, expected = best_time(uncached)
+        table, result = best_time(lambda: [hex_to_rgb(color) for color in hexes])
+        batch, frame = best_time(hex_to_frame, hexes)
+        assert result == expected and frame.tolist() == [list(color) for color in expected]
+        print(LINE % (num_leds, "hex", scalar * 1e6, table * 1e6, batch * 1e6, scalar / table))
+
+
+if __name__ == "__main__":
+    main()
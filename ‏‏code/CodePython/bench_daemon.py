@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import collections
+import os
+import socket
+import tempfile
+import threading
+import time
+import numpy as np
+from effect_engine import CHANNELS
+from ring_daemon import RingDaemon, parse_address, encode_frame_request
+from serial_manager import SerialManager
+
+DEFAULT_CLIENTS = 100
+DEFAULT_REQUESTS = 200
+DEFAULT_WINDOW = 8
+DEFAULT_FRAME_SHARE = 0.1
+DEFAULT_BAUDRATE = 115200
+DEFAULT_LEDS = 14
+WAIT_TIMEOUT = 5.0
+SIM_URL = "sim://?leds=%d"
+SOCKET_NAME = "rgb-ring-bench.sock"
+TCP_ADDRESS = "127.0.0.1:0"
+REPORT_LINE = ("%-5s clients=%-4d window=%-3d requests=%-7d %9.0f req/s  latency p50=%7.3f p99=%7.3f "
+               "max=%7.3f ms  errors=%d")
+
+
+class DaemonThread:
+    def __init__(self, address, num_leds, baudrate):
+        """
+        Runs a RingDaemon on its own event loop thread, driving a simulated ring, like the real
+        headless process would.
+        :param address: Unix socket path or "host:port" (port 0 picks a free one).
+        :type address: str
+        :param num_leds: LEDs of the simulated ring.
+        :type num_leds: int
+        :param baudrate: Line speed.
+        :type baudrate: int
+        Time: O(1)
+        """
+        self.link = SerialManager(port=SIM_URL % num_leds, baudrate=baudrate)
+        self.link.writer.on_sent = None  #logging every command would dominate the timings
+        self.link.reader.on_message = None
+        self.daemon = RingDaemon(self.link)
+        self.loop = asyncio.new_event_loop()
+        self.stop_event = None
+        self.server = None
+        self.address = address
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self.run(),), daemon=True)
+
+    async def run(self):
+        self.stop_event = asyncio.Event()
+        self.link.connect()
+        self.server = await self.daemon.start_server(self.address)
+        if parse_address(self.address)[0] == socket.AF_INET:
+            host, port = self.server.sockets[0].getsockname()[:2]
+            self.address = f"{host}:{port}"
+        self.ready.set()
+        await self.stop_event.wait()
+        self.server.close()
+        await self.daemon.close_clients()
+        await self.server.wait_closed()
+        self.link.close()
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait(WAIT_TIMEOUT)
+        return self.address
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stop_event.set)
+        self.thread.join(WAIT_TIMEOUT)
+
+
+async def open_client(address):
+    family, where = parse_address(address)
+    if family == socket.AF_INET:
+        return await asyncio.open_connection(*where)
+    return await asyncio.open_unix_connection(where)
+
+
+async def run_client(address, requests, window, frame_every, frame, latencies):
+    """
+    This coroutine is one client pipelining up to window requests ahead of the replies.
+    :param address: Daemon address.
+    :type address: str
+    :param requests: Requests to send.
+    :type requests: int
+    :param window: Requests in flight at most.
+    :type window: int
+    :param frame_every: Every n-th request is a frame upload, 0 for none.
+    :type frame_every: int
+    :param frame: The frame request bytes.
+    :type frame: bytes
+    :param latencies: Collects the request to reply times.
+    :type latencies: list[float]
+    :return: Number of error replies.
+    :rtype: int
+    Time: O(requests)
+    """
+    reader, writer = await open_client(address)
+    in_flight = asyncio.Semaphore(window)
+    sent_at = collections.deque()
+    errors = 0
+
+    async def read_replies():
+        nonlocal errors
+        for _ in range(requests):
+            reply = await reader.readline()
+            latencies.append(time.perf_counter() - sent_at.popleft())
+            errors += not reply.startswith(b"ok")
+            in_flight.release()
+
+    replies = asyncio.ensure_future(read_replies())
+    for i in range(requests):
+        await in_flight.acquire()
+        sent_at.append(time.perf_counter())
+        writer.write(frame if frame_every and i % frame_every == 0 else b"rgb:%d,0,0\n" % (i % 256))
+        await writer.drain()
+    await replies
+    writer.close()
+    return errors
+
+
+async def load(address, clients, requests, window, frame_every, num_leds):
+    frame = encode_frame_request(np.zeros((num_leds, CHANNELS), dtype=np.uint8))
+    latencies = []
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(run_client(address, requests, window, frame_every, frame, latencies)
+                                    for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed, sum(errors)
+
+
+def measure(address, clients, requests, window, frame_share, num_leds, baudrate):
+    """
+    This function starts a daemon and loads it with concurrent pipelining clients.
+    :param address: Where the daemon listens.
+    :type address: str
+    :param clients: Concurrent clients.
+    :type clients: int
+    :param requests: Requests per client.
+    :type requests: int
+    :param window: Pipelining depth per client.
+    :type window: int
+    :param frame_share: Share of requests that upload a frame.
+    :type frame_share: float
+    :param num_leds: LEDs of the simulated ring.
+    :type num_leds: int
+    :param baudrate: Line speed of the simulated ring.
+    :type baudrate: int
+    :return: (requests per second, p50, p99 and max latency in milliseconds, error replies).
+    :rtype: tuple
+    Time: O(clients * requests)
+    """
+    daemon = DaemonThread(address, num_leds, baudrate)
+    address = daemon.start()
+    frame_every = round(1 / frame_share) if frame_share else 0
+    latencies, elapsed, errors = asyncio.run(load(address, clients, requests, window, frame_every, num_leds))
+    daemon.stop()
+    p50, p99, worst = np.percentile(latencies, [50, 99, 100]) * 1000
+    return len(latencies) / elapsed, p50, p99, worst, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the ring daemon's control socket")
+    parser.add_argument("--clients", type=int, default=DEFAULT_CLIENTS)
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="per client")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="pipelined requests per client")
+    parser.add_argument("--frames", type=float, default=DEFAULT_FRAME_SHARE, help="share of frame uploads")
+    parser.add_argument("--leds", type=int, default=DEFAULT_LEDS)
+    parser.add_argument("--baud", type=int, default=DEFAULT_BAUDRATE)
+    args = parser.parse_args()
+    addresses = [("tcp", TCP_ADDRESS)]
+    if hasattr(socket, "AF_UNIX") and os.name == "posix":
+        addresses.insert(0, ("unix", os.path.join(tempfile.gettempdir(), SOCKET_NAME)))
+    for name, address in addresses:
+        result = measure(address, args.clients, args.requests, args.window, args.frames, args.leds, args.baud)
+        print(REPORT_LINE % ((name, args.clients, args.window, args.clients * args.requests) + result))
+
+
+if __name__ == "__main__":
+    main()
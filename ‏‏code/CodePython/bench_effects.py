@@ -0,0 +1,116 @@
+import argparse
+import threading
+import time
+from effect_engine import EFFECTS, DEFAULT_FPS, NUM_LEDS, FrameStreamer, create_effect
+from frame_protocol import PROTOCOL_BINARY
+from serial_manager import SerialManager
+
+DEFAULT_BAUDRATE = 9600
+DEFAULT_SECONDS = 2.0
+RENDER_FRAMES = 2000
+BITS_PER_BYTE = 10  # 8N1: start + 8 data + stop
+REPORT_LINE = "%-14s leds=%-6d rendered=%10.0f fps  block=%10.0f fps  delivered=%6.1f fps"
+
+
+class ThrottledPort:
+    def __init__(self, baudrate):
+        """
+        Fake serial port whose write() takes as long as the bytes need on a real UART.
+        :param baudrate: Simulated line speed.
+        :type baudrate: int
+        Time: O(1)
+        """
+        self.baudrate = baudrate
+        self.frames = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        """
+        This function "transmits" data by sleeping for its wire time.
+        :param data: Bytes to send.
+        :type data: bytes
+        :return: Number of bytes written.
+        :rtype: int
+        Time: O(1)
+        """
+        time.sleep(len(data) * BITS_PER_BYTE / self.baudrate)
+        with self.lock:
+            self.frames += 1
+            self.bytes += len(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def measure_render(effect_id, num_leds):
+    """
+    This function measures frames per second rendered one by one and in a single block.
+    :param effect_id: Firmware effect id.
+    :type effect_id: int
+    :param num_leds: Strip length.
+    :type num_leds: int
+    :return: (single frame fps, block fps).
+    :rtype: tuple[float, float]
+    Time: O(RENDER_FRAMES * num_leds)
+    """
+    effect = create_effect(effect_id, num_leds)
+    start = time.perf_counter()
+    for _ in range(RENDER_FRAMES):
+        effect.render()
+    single = RENDER_FRAMES / (time.perf_counter() - start)
+    start = time.perf_counter()
+    effect.render_block(RENDER_FRAMES)
+    block = RENDER_FRAMES / (time.perf_counter() - start)
+    return single, block
+
+
+def measure_delivery(effect_id, num_leds, fps, baudrate, seconds):
+    """
+    This function streams an effect through SerialManager into a throttled fake port.
+    :param effect_id: Firmware effect id.
+    :type effect_id: int
+    :param num_leds: Strip length.
+    :type num_leds: int
+    :param fps: Target frame rate.
+    :type fps: float
+    :param baudrate: Simulated line speed.
+    :type baudrate: int
+    :param seconds: Duration of the run.
+    :type seconds: float
+    :return: Frames per second that reached the wire.
+    :rtype: float
+    Time: O(seconds * fps * num_leds)
+    """
+    port = ThrottledPort(baudrate)
+    manager = SerialManager(protocol=PROTOCOL_BINARY)
+    manager.ser = port
+    manager.connected = True
+    manager.active_protocol = PROTOCOL_BINARY
+    manager.writer.ser = port
+    manager.writer.start()
+    streamer = FrameStreamer(manager, create_effect(effect_id, num_leds), fps)
+    streamer.start()
+    time.sleep(seconds)
+    streamer.stop()
+    manager.close()
+    return port.frames / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark host-rendered effects")
+    parser.add_argument("--leds", type=int, nargs="+", default=[NUM_LEDS, 144, 1000])
+    parser.add_argument("--fps", type=float, default=DEFAULT_FPS)
+    parser.add_argument("--baud", type=int, default=DEFAULT_BAUDRATE)
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS)
+    args = parser.parse_args()
+    for num_leds in args.leds:
+        for effect_id, effect in EFFECTS.items():
+            single, block = measure_render(effect_id, num_leds)
+            delivered = measure_delivery(effect_id, num_leds, args.fps, args.baud, args.seconds)
+            print(REPORT_LINE % (effect.__name__, num_leds, single, block, delivered))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+from effect_engine import EFFECTS, NUM_LEDS, create_effect
+from frame_codec import FrameEncoder, ENCODING_FULL, ENCODING_RLE, ENCODING_DELTA, ENCODING_AUTO
+
+DEFAULT_BAUDRATE = 9600
+DEFAULT_FRAMES = 1000
+BITS_PER_BYTE = 10  # 8N1: start + 8 data + stop
+ENCODINGS = (ENCODING_FULL, ENCODING_RLE, ENCODING_DELTA, ENCODING_AUTO)
+REPORT_LINE = "%-14s leds=%-6d %-6s %8.1f bytes/frame %8.1f fps"
+
+
+def record(effect_id, num_leds, frames):
+    """
+    This function records frames of a host-rendered effect.
+    :param effect_id: Firmware effect id.
+    :type effect_id: int
+    :param num_leds: Strip length.
+    :type num_leds: int
+    :param frames: Number of frames.
+    :type frames: int
+    :return: A (frames, num_leds, 3) uint8 array.
+    :rtype: np.ndarray
+    Time: O(frames * num_leds)
+    """
+    return create_effect(effect_id, num_leds).render_block(frames)
+
+
+def measure(recording, encoding, baudrate):
+    """
+    This function encodes a recording and computes the wire cost per frame.
+    :param recording: Frames to encode.
+    :type recording: np.ndarray
+    :param encoding: One of the ENCODING_* constants.
+    :type encoding: str
+    :param baudrate: Line speed used to turn bytes into achievable fps.
+    :type baudrate: int
+    :return: (average wire bytes per frame, frames per second the link can carry).
+    :rtype: tuple[float, float]
+    Time: O(frames * num_leds)
+    """
+    encoder = FrameEncoder(encoding)
+    total = sum(len(encoder.encode(frame)) for frame in recording)
+    per_frame = total / len(recording)
+    return per_frame, baudrate / BITS_PER_BYTE / per_frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per frame and fps for each frame encoding")
+    parser.add_argument("--leds", type=int, nargs="+", default=[NUM_LEDS, 144])
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES)
+    parser.add_argument("--baud", type=int, default=DEFAULT_BAUDRATE)
+    args = parser.parse_args()
+    for num_leds in args.leds:
+        for effect_id, effect in EFFECTS.items():
+            recording = record(effect_id, num_leds, args.frames)
+            for encoding in ENCODINGS:
+                per_frame, fps = measure(recording, encoding, args.baud)
+                print(REPORT_LINE % (effect.__name__, num_leds, encoding, per_frame, fps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import time
+import numpy as np
+from device_group import DeviceGroup
+
+DEFAULT_DEVICES = [1, 8, 64]
+DEFAULT_BAUDRATE = 115200
+DEFAULT_LEDS = 14
+DEFAULT_SAMPLES = 100
+WAIT_TIMEOUT = 5.0
+SETTLE_TIME = 0.02        #Pause between broadcasts so every ring is idle when the next one starts
+SIM_URL = "sim://?leds=%d"
+DEAD_PORT = "/dev/null-ring"  #never opens, its ring keeps retrying in the background
+RAINBOW_COMMAND = "1"
+SKEW_LINE = ("devices=%-3d sync=%-5s dead=%-5s wire skew p50=%7.3f p99=%7.3f  ring skew p50=%7.3f p99=%7.3f  "
+             "latency p50=%7.3f p99=%7.3f ms  lost=%d")
+
+
+def build_group(devices, baudrate, num_leds, synchronized, dead):
+    """
+    This function connects a group of simulated rings, plus an unreachable port when dead is set.
+    :param devices: Number of simulated rings.
+    :type devices: int
+    :param baudrate: Line speed.
+    :type baudrate: int
+    :param num_leds: LEDs per ring.
+    :type num_leds: int
+    :param synchronized: Release broadcasts on all writers together.
+    :type synchronized: bool
+    :param dead: Add a ring whose port never opens.
+    :type dead: bool
+    :return: (group, simulators of the live rings, per live ring the time its last write finished).
+    :rtype: tuple[DeviceGroup, list[DeviceSimulator], list[float]]
+    Time: O(devices)
+    """
+    ports = [SIM_URL % num_leds] * devices + ([DEAD_PORT] if dead else [])
+    group = DeviceGroup(ports, baudrate, synchronized)
+    for ring in group.rings:
+        ring.reader.on_message = None  #logging every message would dominate the timings
+    group.connect(WAIT_TIMEOUT)
+    live = [ring for ring in group.rings if ring.connected]
+    written = [0.0] * len(live)
+    for index, ring in enumerate(live):
+        ring.writer.on_sent = lambda command, index=index: written.__setitem__(index, time.perf_counter())
+    return group, [ring.ser.device for ring in live], written
+
+
+def measure_skew(devices, baudrate, num_leds, samples, synchronized, dead=False):
+    """
+    This function broadcasts effect and color commands and measures, per broadcast, the spread between
+    the first and the last write on the host (wire skew) and between the first and the last ring that
+    took the command (ring skew, which includes the firmware finishing its current effect step),
+    and the time until the last ring took it.
+    :param devices: Number of simulated rings.
+    :type devices: int
+    :param baudrate: Line speed.
+    :type baudrate: int
+    :param num_leds: LEDs per ring.
+    :type num_leds: int
+    :param samples: Number of broadcasts.
+    :type samples: int
+    :param synchronized: Release broadcasts on all writers together.
+    :type synchronized: bool
+    :param dead: Add a ring whose port never opens, to check it does not delay the others.
+    :type dead: bool
+    :return: Wire skew, ring skew and latency (p50, p99 each) in milliseconds, and the broadcasts some ring missed.
+    :rtype: tuple
+    Time: O(samples * devices)
+    """
+    group, simulators, written = build_group(devices, baudrate, num_leds, synchronized, dead)
+    wire_skews = []
+    skews = []
+    latencies = []
+    lost = 0
+    for i in range(samples):
+        command = RAINBOW_COMMAND if i % 2 else "rgb:%d,%d,%d" % (i % 256, 255 - i % 256, 3)
+        before = [simulator.commands for simulator in simulators]
+        start = time.perf_counter()
+        group.broadcast(command)
+        received = []
+        for simulator, count in zip(simulators, before):
+            if simulator.wait_for(lambda device: device.commands > count, WAIT_TIMEOUT):
+                received.append(simulator.last_command)
+        if len(received) < len(simulators):
+            lost += 1
+        elif received:
+            wire_skews.append(max(written) - min(written))
+            skews.append(max(received) - min(received))
+            latencies.append(max(received) - start)
+        time.sleep(SETTLE_TIME)
+    group.close()
+    if not skews:
+        return (float('nan'),) * 6 + (lost,)
+    result = [value for series in (wire_skews, skews, latencies) for value in np.percentile(series, [50, 99]) * 1000]
+    return tuple(result) + (lost,)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast latency skew across simulated rings")
+    parser.add_argument("--devices", type=int, nargs="+", default=DEFAULT_DEVICES)
+    parser.add_argument("--baud", type=int, default=DEFAULT_BAUDRATE)
+    parser.add_argument("--leds", type=int, default=DEFAULT_LEDS)
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument("--dead", action="store_true", help="add a ring on a port that never opens")
+    args = parser.parse_args()
+    for devices in args.devices:
+        for synchronized in (False, True):
+            result = measure_skew(devices, args.baud, args.leds, args.samples, synchronized, args.dead)
+            print(SKEW_LINE % ((devices, synchronized, args.dead) + result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import threading
+import time
+import numpy as np
+from effect_engine import NUM_LEDS, EFFECT_RAINBOW, Rainbow, FrameStreamer
+from frame_protocol import PROTOCOL_ASCII, PROTOCOL_AUTO, HELLO_COMMAND, encode_command
+from device_simulator import (DeviceSimulator, SERIAL_RX_BUFFER, SERIAL_READ_TIMEOUT, STEP_TIME, latency_bound,
+                              show_duration)
+from transport import loopback_pair
+from serial_manager import SerialManager
+
+DEFAULT_BAUDRATES = [9600, 115200, 1000000]
+DEFAULT_COMMANDS = 200
+DEFAULT_SECONDS = 2.0
+STREAM_FPS = 1000         #Faster than any link here, so the link sets the pace
+WAIT_TIMEOUT = 2.0
+SIM_URL = "sim://?leds=%d"
+LATENCY_LINE = "%-7s baud=%-8d leds=%-5d latency p50=%7.2f ms p99=%7.2f ms"
+THROUGHPUT_LINE = "%-7s baud=%-8d leds=%-5d frames=%8.1f fps  %8.1f bytes/frame"
+LOOP_LINE = ("%-7s baud=%-8d leds=%-5d effect running: p50=%6.2f p99=%6.2f max=%6.2f ms  bound=%6.2f ms %s"
+             "  (delay() firmware: %.2f ms, %.0f ms for a split line)")
+LOOP_COMMANDS = 100
+EFFECT_SETTLE = 0.03      #Lets the effect run a few steps before the timed command
+SCHEDULING_SLACK = 0.002  #Thread wake-up jitter of the Python model itself, not part of the firmware bound
+
+
+def connect(baudrate, num_leds, protocol):
+    """
+    This function connects a SerialManager to a fresh simulated ring.
+    :param baudrate: Line speed.
+    :type baudrate: int
+    :param num_leds: Number of LEDs of the simulated ring.
+    :type num_leds: int
+    :param protocol: PROTOCOL_ASCII, or PROTOCOL_AUTO to negotiate binary frames like the app does.
+    :type protocol: str
+    :return: (manager, simulator).
+    :rtype: tuple[SerialManager, DeviceSimulator]
+    Time: O(1)
+    """
+    manager = SerialManager(port=SIM_URL % num_leds, baudrate=baudrate, protocol=protocol)
+    manager.writer.on_sent = None  #printing every command would dominate the timings
+    manager.reader.on_message = None
+    manager.connect()
+    return manager, manager.ser.device
+
+
+def measure_latency(baudrate, num_leds, protocol, commands):
+    """
+    This function times send_command until the simulated ring shows the color.
+    :param baudrate: Line speed.
+    :type baudrate: int
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :param protocol: PROTOCOL_ASCII or PROTOCOL_AUTO.
+    :type protocol: str
+    :param commands: Number of commands to time.
+    :type commands: int
+    :return: The protocol used and the (p50, p99) latency in milliseconds.
+    :rtype: tuple[str, float, float]
+    Time: O(commands)
+    """
+    manager, device = connect(baudrate, num_leds, protocol)
+    latencies = []
+    for i in range(commands):
+        color = (i % 256, 255 - i % 256, 7)
+        start = time.perf_counter()
+        manager.send_command("rgb:%d,%d,%d" % color)
+        if device.wait_for(lambda simulator: simulator.showing(color), WAIT_TIMEOUT):
+            latencies.append(device.last_show - start)
+    manager.close()
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000 if latencies else (float('nan'),) * 2
+    return manager.active_protocol, p50, p99
+
+
+def measure_throughput(baudrate, num_leds, seconds):
+    """
+    This function streams a host-rendered rainbow and counts the frames the ring applied.
+    :param baudrate: Line speed.
+    :type baudrate: int
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :param seconds: How long to stream.
+    :type seconds: float
+    :return: (frames per second, wire bytes per frame).
+    :rtype: tuple[float, float]
+    Time: O(seconds * fps * num_leds)
+    """
+    manager, device = connect(baudrate, num_leds, PROTOCOL_AUTO)
+    streamer = FrameStreamer(manager, Rainbow(num_leds), STREAM_FPS)
+    sent = manager.writer.bytes_written
+    start = time.perf_counter()
+    streamer.start()
+    time.sleep(seconds)
+    streamer.stop()
+    #Count what the ring received, including frames still on the line when streaming stopped
+    manager.writer.flush()
+    manager.ser.flush()
+    device.wait_for(lambda simulator: simulator.transport.in_waiting == 0, WAIT_TIMEOUT)
+    elapsed = time.perf_counter() - start
+    frames = device.frames
+    wire_bytes = manager.writer.bytes_written - sent
+    manager.close()
+    return frames / elapsed, wire_bytes / max(frames, 1)
+
+
+def blocking_bound(command, baudrate, num_leds):
+    """
+    This function is the command to LED bound of the firmware that slept in delay(DELAY_TIME) after
+    every effect step: the wire time, a whole step with its delay, then the command's show.
+    :return: Seconds, without the readStringUntil timeout a split line adds.
+    :rtype: float
+    Time: O(k), where k is the length of the command.
+    """
+    return latency_bound(command, baudrate, num_leds) + STEP_TIME
+
+
+def measure_loop_latency(baudrate, num_leds, binary, commands=LOOP_COMMANDS):
+    """
+    This function times colors sent while an effect runs, straight on the line to the firmware
+    model (no writer thread), with FastLED.show() taking its WS2812 time, and checks them against
+    latency_bound.
+    :return: (p50, p99, max, bound) in seconds.
+    :rtype: tuple[float, float, float, float]
+    Time: O(commands * (EFFECT_SETTLE + latency))
+    """
+    host, end = loopback_pair(baudrate, SERIAL_RX_BUFFER, SERIAL_READ_TIMEOUT)
+    shown = threading.Condition()
+    shows = []
+
+    def on_show(leds):
+        with shown:
+            shows.append((time.perf_counter(), tuple(leds[0])))
+            shown.notify_all()
+
+    device = DeviceSimulator(end, num_leds, on_show=on_show, show_time=show_duration(num_leds)).start()
+    host.readline()  #Ready
+    encode = encode_command if binary else (lambda command: (command + "\n").encode())
+    if binary:
+        host.write((HELLO_COMMAND + "\n").encode())
+        host.readline()
+    latencies = []
+    command = None
+    for index in range(commands):
+        host.write(encode(str(EFFECT_RAINBOW)))
+        time.sleep(EFFECT_SETTLE + (index % 7) * 0.0013)  #lands at different points of a step
+        color = (index % 200 + 20, 7, 9)
+        command = "rgb:%d,%d,%d" % color
+        start = time.perf_counter()
+        host.write(encode(command))
+        with shown:
+            shown.wait_for(lambda: shows[-1][1] == color, WAIT_TIMEOUT)
+            latencies.append(shows[-1][0] - start)
+    device.stop()
+    host.close()
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return p50, p99, max(latencies), latency_bound(command, baudrate, num_leds, binary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Command latency and frame throughput against the ring simulator")
+    parser.add_argument("--baud", type=int, nargs="+", default=DEFAULT_BAUDRATES)
+    parser.add_argument("--leds", type=int, nargs="+", default=[NUM_LEDS, 144])
+    parser.add_argument("--commands", type=int, default=DEFAULT_COMMANDS)
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS)
+    args = parser.parse_args()
+    for baudrate in args.baud:
+        for num_leds in args.leds:
+            for protocol in (PROTOCOL_ASCII, PROTOCOL_AUTO):
+                used, p50, p99 = measure_latency(baudrate, num_leds, protocol, args.commands)
+                print(LATENCY_LINE % (used, baudrate, num_leds, p50, p99))
+            fps, size = measure_throughput(baudrate, num_leds, args.seconds)
+            print(THROUGHPUT_LINE % ("stream", baudrate, num_leds, fps, size))
+            for binary in (False, True):
+                p50, p99, worst, bound = measure_loop_latency(baudrate, num_leds, binary, args.commands)
+                verdict = "ok" if p99 <= bound + SCHEDULING_SLACK else "OVER"
+                print(LOOP_LINE % (PROTOCOL_AUTO if binary else PROTOCOL_ASCII, baudrate, num_leds, p50 * 1000,
+                                   p99 * 1000, worst * 1000, bound * 1000, verdict,
+                                   blocking_bound("rgb:255,255,255", baudrate, num_leds) * 1000,
+                                   SERIAL_READ_TIMEOUT * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import time
+from effect_engine import NUM_LEDS, Rainbow
+from link_speed import BaudCache
+from preset_cache import PresetCache
+from serial_manager import SerialManager
+from bench_latency import WAIT_TIMEOUT
+
+DEFAULT_LEDS = [NUM_LEDS, 30]
+DEFAULT_FRAMES = 12       #A rainbow clip that fits the 1 KB EEPROM at NUM_LEDS
+DEFAULT_INTERVAL = 20     #ms between two frames of the clip
+DEFAULT_SECONDS = 2.0
+SIM_URL = "sim://?leds=%d&eeprom=%g"
+EEPROM_WRITE_TIME = 3.3e-3
+CLIP_NAME = "clip"
+UPLOAD_LINE = "leds=%-4d clip=%d frames  %5d bytes stored, uploaded in %7.1f ms (%s)"
+MODE_LINE = "leds=%-4d %-7s %7.1f fps on the ring  %8.1f bytes/s written  switch=%6.2f ms"
+
+
+def connect(num_leds):
+    """
+    This function connects to a simulated ring whose EEPROM writes take as long as on the ATmega328P.
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :return: The manager.
+    :rtype: SerialManager
+    Time: O(1)
+    """
+    manager = SerialManager(port=SIM_URL % (num_leds, EEPROM_WRITE_TIME), discover=False, baud_cache=BaudCache())
+    manager.writer.on_sent = None
+    manager.reader.on_message = None
+    manager.connect()
+    return manager
+
+
+def measure(manager, start, tick, seconds):
+    """
+    This function runs a mode and measures what the ring shows and what the link carries.
+    :param manager: The link.
+    :type manager: SerialManager
+    :param start: Called once to start the mode.
+    :type start: callable
+    :param tick: Called with the frame index every interval, None when the device runs on its own.
+    :type tick: callable
+    :param seconds: Length of the run.
+    :type seconds: float
+    :return: (frames per second shown, bytes per second written, seconds from start to the first show).
+    :rtype: tuple[float, float, float]
+    Time: O(seconds / interval)
+    """
+    device = manager.ser.device
+    manager.writer.flush()
+    manager.ser.flush()  #frames of the previous mode still on the line would stop the sequence
+    device.wait_for(lambda simulator: simulator.transport.in_waiting == 0, WAIT_TIMEOUT)
+    shows = device.shows
+    written = manager.writer.bytes_written
+    began = time.perf_counter()
+    start()
+    device.wait_for(lambda simulator: simulator.shows > shows, WAIT_TIMEOUT)
+    switch = device.last_show - began
+    index = 0
+    while time.perf_counter() - began < seconds:
+        if tick:
+            tick(index)
+            index += 1
+        time.sleep(DEFAULT_INTERVAL / 1000)
+    elapsed = time.perf_counter() - began
+    return (device.shows - shows) / elapsed, (manager.writer.bytes_written - written) / elapsed, switch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming a clip versus playing it from the device's store")
+    parser.add_argument("--leds", type=int, nargs="+", default=DEFAULT_LEDS)
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES)
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS)
+    args = parser.parse_args()
+    for num_leds in args.leds:
+        clip = Rainbow(num_leds).render_block(args.frames)
+        manager = connect(num_leds)
+        cache = PresetCache(manager)
+        cache.define_sequence(CLIP_NAME, clip, DEFAULT_INTERVAL)
+        started = time.perf_counter()
+        stored = cache.store(CLIP_NAME)
+        upload = time.perf_counter() - started
+        print(UPLOAD_LINE % (num_leds, args.frames, len(cache.entries[CLIP_NAME].data), upload * 1000,
+                             "ok" if stored else "did not fit"))
+        fps, rate, switch = measure(manager, lambda: manager.send_frame(clip[0]),
+                                    lambda index: manager.send_frame(clip[index % len(clip)]), args.seconds)
+        print(MODE_LINE % (num_leds, "stream", fps, rate, switch * 1000))
+        if stored:
+            fps, rate, switch = measure(manager, lambda: cache.play(CLIP_NAME), None, args.seconds)
+            print(MODE_LINE % (num_leds, "play", fps, rate, switch * 1000))
+        cache.close()
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
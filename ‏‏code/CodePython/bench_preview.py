@@ -0,0 +1,130 @@
+import argparse
+import math
+import random
+import time
+import tkinter as tk
+from preview_renderer import RingPreview, ColorPalette, COLOR_TRUN_OFF, SIZE_LED
+
+DEFAULT_FRAMES = 200
+CANVAS_SIZE = 600
+RADIUS = 250
+MAX_NUM_COLOR_OX = 0xFFFFFF
+REPORT_LINE = "%-8s leds=%-6d %10.1f tcl calls/frame %8.3f ms/frame"
+
+
+class CountingTk:
+    def __init__(self, tkapp):
+        """
+        Wraps the Tcl interpreter of a widget and counts every call into it.
+        :param tkapp: The widget's tk attribute.
+        :type tkapp: _tkinter.tkapp
+        Time: O(1)
+        """
+        self.tkapp = tkapp
+        self.calls = 0
+
+    def call(self, *args):
+        self.calls += 1
+        return self.tkapp.call(*args)
+
+    def eval(self, script):
+        self.calls += 1
+        return self.tkapp.eval(script)
+
+    def __getattr__(self, name):
+        return getattr(self.tkapp, name)
+
+
+def ring_positions(num_leds):
+    """
+    This function computes LED centers on the bench ring.
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :return: (x, y) per LED.
+    :rtype: list[tuple[float, float]]
+    Time: O(num_leds)
+    """
+    center = CANVAS_SIZE // 2
+    return [(center + RADIUS * math.cos(2 * math.pi * i / num_leds),
+             center + RADIUS * math.sin(2 * math.pi * i / num_leds)) for i in range(num_leds)]
+
+
+def bench_per_led(canvas, num_leds, frames):
+    """
+    This function times the original LedRingApp path: one itemconfig and one random hex string per LED,
+    then one itemconfig per LED to reset.
+    :param canvas: Canvas to draw on.
+    :type canvas: tk.Canvas
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :param frames: Animation steps to run.
+    :type frames: int
+    :return: (Tcl calls per frame, ms per frame).
+    :rtype: tuple[float, float]
+    Time: O(frames * num_leds)
+    """
+    leds = [canvas.create_oval(x - SIZE_LED, y - SIZE_LED, x + SIZE_LED, y + SIZE_LED, fill=COLOR_TRUN_OFF)
+            for x, y in ring_positions(num_leds)]
+    counter = CountingTk(canvas.tk)
+    canvas.tk = counter
+    start = time.perf_counter()
+    for step in range(frames):
+        for i in range(num_leds - 1):
+            canvas.itemconfig(leds[(step + i) % num_leds], fill=f'#{random.randint(0, MAX_NUM_COLOR_OX):06x}')
+        for i in range(num_leds - 1):
+            canvas.itemconfig(leds[(step + i) % num_leds], fill=COLOR_TRUN_OFF)
+        canvas.update_idletasks()
+    elapsed = time.perf_counter() - start
+    canvas.tk = counter.tkapp
+    return counter.calls / frames, elapsed * 1000 / frames
+
+
+def bench_batched(canvas, num_leds, frames):
+    """
+    This function times the RingPreview path: palette colors, one batched script per frame, tagged reset.
+    :param canvas: Canvas to draw on.
+    :type canvas: tk.Canvas
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :param frames: Animation steps to run.
+    :type frames: int
+    :return: (Tcl calls per frame, ms per frame).
+    :rtype: tuple[float, float]
+    Time: O(frames * num_leds)
+    """
+    center = (CANVAS_SIZE // 2, CANVAS_SIZE // 2)
+    preview = RingPreview(canvas, num_leds, center, RADIUS)
+    palette = ColorPalette(seed=0)
+    counter = CountingTk(canvas.tk)
+    canvas.tk = counter
+    start = time.perf_counter()
+    for step in range(frames):
+        colors = [COLOR_TRUN_OFF] * num_leds
+        for i, color in zip(range(num_leds - 1), palette.sample(num_leds - 1)):
+            colors[(step + i) % num_leds] = color
+        preview.update(colors)
+        preview.fill(COLOR_TRUN_OFF)
+        canvas.update_idletasks()
+    elapsed = time.perf_counter() - start
+    canvas.tk = counter.tkapp
+    return counter.calls / frames, elapsed * 1000 / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tcl calls and ms per frame of the ring animation")
+    parser.add_argument("--leds", type=int, nargs="+", default=[12, 144, 1000])
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES)
+    args = parser.parse_args()
+    root = tk.Tk()
+    for num_leds in args.leds:
+        for name, bench in (("per-led", bench_per_led), ("batched", bench_batched)):
+            canvas = tk.Canvas(root, width=CANVAS_SIZE, height=CANVAS_SIZE)
+            canvas.pack()
+            calls, ms = bench(canvas, num_leds, args.frames)
+            print(REPORT_LINE % (name, num_leds, calls, ms))
+            canvas.destroy()
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main()
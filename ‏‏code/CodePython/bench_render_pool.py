@@ -0,0 +1,106 @@
+import argparse
+import os
+import time
+import numpy as np
+from colors import apply_output
+from effect_engine import EFFECT_RAINBOW, create_effect
+from render_pool import MEDIAN, TAIL, RenderPool, RingSource
+
+DEFAULT_LEDS = [10000, 30000, 100000]
+DEFAULT_RINGS = [1, 8]    #One long strip, or the same LEDs spread over several rings
+DEFAULT_SECONDS = 3.0
+WARMUP = 0.5              #Process start up and the first frames stay out of the figures
+REPORT_LINE = "leds=%-7d rings=%-3d workers=%-6s %8.1f frames/s %8.1f Mpixel/s  latency p50=%7.2f ms p99=%7.2f ms"
+
+
+def make_sources(num_leds, rings, effect_id):
+    """
+    This function spreads the LEDs evenly over the rings.
+    :param num_leds: LEDs in total.
+    :type num_leds: int
+    :param rings: Number of rings.
+    :type rings: int
+    :param effect_id: Effect every ring shows.
+    :type effect_id: int
+    :return: The rings.
+    :rtype: list[RingSource]
+    Time: O(rings)
+    """
+    return [RingSource(effect_id, num_leds // rings) for _ in range(rings)]
+
+
+def measure_inline(sources, seconds):
+    """
+    This function renders the rings one after the other in this process, as the Tk thread would.
+    :param sources: The rings.
+    :type sources: list[RingSource]
+    :param seconds: Length of the run.
+    :type seconds: float
+    :return: (ring frames per second, latencies in seconds).
+    :rtype: tuple[float, list[float]]
+    Time: O(seconds)
+    """
+    effects = [create_effect(source.effect_id, source.num_leds) for source in sources]
+    handed = [np.empty((source.num_leds, 3), dtype=np.uint8) for source in sources]
+    latencies = []
+    began = time.monotonic()
+    while time.monotonic() - began < seconds:
+        for source, effect, target in zip(sources, effects, handed):
+            started = time.monotonic()
+            target[:] = apply_output(source.output, effect.render())  #the copy a writer would get
+            latencies.append(time.monotonic() - started)
+    return len(latencies) / (time.monotonic() - began), latencies
+
+
+def measure_pool(sources, workers, seconds):
+    """
+    This function renders the rings in a RenderPool and copies every frame out as a serial writer would.
+    :param sources: The rings.
+    :type sources: list[RingSource]
+    :param workers: Worker processes.
+    :type workers: int
+    :param seconds: Length of the run.
+    :type seconds: float
+    :return: (ring frames per second, latencies in seconds).
+    :rtype: tuple[float, list[float]]
+    Time: O(seconds)
+    """
+    handed = [np.empty((source.num_leds, 3), dtype=np.uint8) for source in sources]
+
+    def take(ring, pixels, frame):
+        handed[ring][:] = pixels
+
+    pool = RenderPool(sources, workers=workers, on_frame=take).start()
+    try:
+        time.sleep(WARMUP)
+        frames = sum(pool.delivered)
+        pool.latencies.clear()
+        began = time.monotonic()
+        time.sleep(seconds)
+        fps = (sum(pool.delivered) - frames) / (time.monotonic() - began)
+        latencies = list(pool.latencies)
+    finally:
+        pool.stop()
+    return fps, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frames per second and latency of the render pool against cores")
+    parser.add_argument("--leds", type=int, nargs="+", default=DEFAULT_LEDS)
+    parser.add_argument("--rings", type=int, nargs="+", default=DEFAULT_RINGS)
+    parser.add_argument("--workers", type=int, nargs="+", default=list(range(1, (os.cpu_count() or 1) + 1)))
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS)
+    args = parser.parse_args()
+    for num_leds in args.leds:
+        for rings in args.rings:
+            sources = make_sources(num_leds, rings, EFFECT_RAINBOW)
+            runs = [("inline", measure_inline(sources, args.seconds))]
+            runs += [(str(workers), measure_pool(sources, workers, args.seconds)) for workers in args.workers]
+            for label, (fps, latencies) in runs:
+                latencies = latencies or [0.0]
+                print(REPORT_LINE % (num_leds, rings, label, fps / rings, fps * num_leds / rings / 1e6,
+                                     np.percentile(latencies, MEDIAN) * 1000, np.percentile(latencies, TAIL) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+import numpy as np
+from effect_engine import Rainbow
+from recorder import Recorder, Recording, Player, SPEED_FAST
+from serial_manager import SerialManager
+
+DEFAULT_SECONDS = 600
+DEFAULT_FPS = 60
+DEFAULT_LEDS = 14
+DEFAULT_BAUDS = [115200, 1000000]
+DEFAULT_SEEKS = 1000
+DEFAULT_SPEEDS = [1, 4, 16, 64]
+REPLAY_WALL_TIME = 2.0    #Seconds each replay runs; faster speeds play a longer part of the recording
+COMMAND_EVERY = 30        #Frames between two color commands in the synthetic session
+WAIT_TIMEOUT = 30.0
+SIM_URL = "sim://?leds=%d"
+FILE_NAME = "bench-replay.rec"
+RECORD_LINE = "record   events=%-8d %8.2f us/event  file=%.1f MB"
+SEEK_LINE = "seek     keyframes=%-6d p50=%7.1f p99=%7.1f us"
+HOST_LINE = "host     %-16s %10.0f events/s"
+LINK_LINE = ("link     baud=%-8d speed=%-5s offered=%8.0f /s  shown=%8.0f /s (%5.1f%%)  "
+             "lag mean=%7.3f max=%7.3f ms")
+
+
+class NullLink:
+    def __init__(self):
+        """
+        A target that only counts, so a replay into it measures the host side alone.
+        Time: O(1)
+        """
+        self.commands = 0
+        self.frames = 0
+
+    def send_command(self, command, policy=None):
+        self.commands += 1
+
+    def send_frame(self, frame, copy=True):
+        self.frames += 1
+        return True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def record_session(path, seconds, fps, num_leds):
+    """
+    This function writes a synthetic session: a rainbow streamed at fps with a color command now
+    and then and the device answering it, with a fake clock so a long session records in seconds.
+    :param path: Recording file.
+    :type path: str
+    :param seconds: Session length.
+    :type seconds: float
+    :param fps: Frames per second.
+    :type fps: int
+    :param num_leds: LEDs per frame.
+    :type num_leds: int
+    :return: (events recorded, seconds spent recording).
+    :rtype: tuple[int, float]
+    Time: O(seconds * fps * num_leds)
+    """
+    clock = FakeClock()
+    recorder = Recorder(path, clock=clock)
+    effect = Rainbow(num_leds)
+    spent = 0.0
+    for i in range(int(seconds * fps)):
+        clock.now = i / fps
+        frame = effect.render()
+        start = time.perf_counter()
+        recorder.frame(frame)
+        if i % COMMAND_EVERY == 0:
+            recorder.command("rgb:%d,0,0" % (i % 256))
+            recorder.response("ok")
+        spent += time.perf_counter() - start
+    recorder.close()
+    return recorder.records, spent
+
+
+def measure_seeks(recording, seeks):
+    """
+    This function times seeking to random points until the first event comes out.
+    :param recording: The recording.
+    :type recording: Recording
+    :param seeks: Number of seeks.
+    :type seeks: int
+    :return: p50 and p99 in microseconds.
+    :rtype: tuple[float, float]
+    Time: O(seeks * (log i + records per keyframe))
+    """
+    duration = recording.duration()
+    times = []
+    for _ in range(seeks):
+        start = time.perf_counter()
+        next(recording.events(random.uniform(0, duration)), None)
+        times.append(time.perf_counter() - start)
+    p50, p99 = np.percentile(times, [50, 99]) * 1e6
+    return p50, p99
+
+
+def replay_link(recording, baudrate, num_leds, speed):
+    """
+    This function replays a recording into a simulated ring for about REPLAY_WALL_TIME and counts
+    what the ring showed. Events the link could not carry in time are superseded in the writer
+    queue, so a falling shown share with a small lag means the link is the limit, and a growing
+    lag means the host is.
+    :param recording: The recording.
+    :type recording: Recording
+    :param baudrate: Line speed.
+    :type baudrate: int
+    :param num_leds: LEDs of the ring.
+    :type num_leds: int
+    :param speed: Playback speed factor.
+    :type speed: float
+    :return: (events offered per second, events shown per second, play statistics).
+    :rtype: tuple[float, float, dict]
+    Time: O(events)
+    """
+    link = SerialManager(port=SIM_URL % num_leds, baudrate=baudrate, discover=False)
+    link.writer.on_sent = None  #logging every command would dominate the timings
+    link.reader.on_message = None
+    link.connect()
+    device = link.ser.device
+    before = device.commands + device.frames
+    stats = Player(recording).play(link, speed=speed, end=REPLAY_WALL_TIME * speed)
+    link.writer.flush(WAIT_TIMEOUT)
+    expected = stats["commands"] + stats["frames"] - link.writer.coalesced - link.writer.dropped - link.suppressed
+    device.wait_for(lambda device: device.commands + device.frames - before >= expected, WAIT_TIMEOUT)
+    shown = device.commands + device.frames - before
+    link.close()
+    offered = stats["commands"] + stats["frames"]
+    return offered / stats["elapsed"], shown / stats["elapsed"], stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recording, seeking and replay speed")
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS, help="length of the synthetic session")
+    parser.add_argument("--fps", type=int, default=DEFAULT_FPS)
+    parser.add_argument("--leds", type=int, default=DEFAULT_LEDS)
+    parser.add_argument("--baud", type=int, nargs="+", default=DEFAULT_BAUDS)
+    parser.add_argument("--speed", type=float, nargs="+", default=DEFAULT_SPEEDS)
+    parser.add_argument("--seeks", type=int, default=DEFAULT_SEEKS)
+    args = parser.parse_args()
+    path = os.path.join(tempfile.gettempdir(), FILE_NAME)
+    events, spent = record_session(path, args.seconds, args.fps, args.leds)
+    print(RECORD_LINE % (events, spent / events * 1e6, os.path.getsize(path) / 1e6))
+    recording = Recording(path)
+    print(SEEK_LINE % ((len(recording.index),) + measure_seeks(recording, args.seeks)))
+    start = time.perf_counter()
+    decoded = sum(1 for _ in recording.events())
+    print(HOST_LINE % ("decode", decoded / (time.perf_counter() - start)))
+    stats = Player(recording).play(NullLink(), speed=SPEED_FAST)
+    print(HOST_LINE % ("replay", (stats["commands"] + stats["frames"]) / stats["elapsed"]))
+    for baudrate in args.baud:
+        for speed in args.speed:
+            offered, shown, stats = replay_link(recording, baudrate, args.leds, speed)
+            print(LINK_LINE % (baudrate, "%gx" % speed, offered, shown, 100 * shown / offered,
+                               stats["mean_lag"] * 1000, stats["max_lag"] * 1000))
+    recording.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import os
+import pty
+import threading
+import time
+import tkinter as tk
+from serial_manager import SerialManager
+from frame_protocol import HELLO_COMMAND, HELLO_REPLY
+
+DEFAULT_BOOT_DELAY = 0.3
+DEFAULT_RUNS = 3
+LEGACY_CONNECT_DELAY = 2.0
+READY_REPLY = b"Ready\r\n"
+LINE_END = b"\r\n"
+READ_SIZE = 64
+REPORT_LINE = "%-22s %8.1f ms"
+
+
+class FakeBoard:
+    def __init__(self, boot_delay):
+        """
+        A pty that behaves like the Arduino after a reset: silent while booting, then prints Ready
+        and answers the protocol handshake.
+        :param boot_delay: Seconds before Ready is printed.
+        :type boot_delay: float
+        Time: O(1)
+        """
+        self.master_fd, self.slave_fd = pty.openpty()
+        self.port = os.ttyname(self.slave_fd)
+        self.boot_delay = boot_delay
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        time.sleep(self.boot_delay)
+        os.write(self.master_fd, READY_REPLY)
+        buffer = b""
+        while self.running:
+            try:
+                buffer += os.read(self.master_fd, READ_SIZE)
+            except OSError:
+                return
+            if HELLO_COMMAND.encode() in buffer:
+                os.write(self.master_fd, HELLO_REPLY.encode() + LINE_END)
+                buffer = b""
+
+    def close(self):
+        self.running = False
+        os.close(self.slave_fd)
+        os.close(self.master_fd)
+
+
+def time_connect(boot_delay):
+    """
+    This function measures how long SerialManager.connect takes against a fresh fake board.
+    :param boot_delay: Simulated firmware boot time.
+    :type boot_delay: float
+    :return: Seconds until connected.
+    :rtype: float
+    Time: O(boot_delay)
+    """
+    board = FakeBoard(boot_delay)
+    manager = SerialManager(port=board.port)
+    start = time.perf_counter()
+    manager.connect()
+    elapsed = time.perf_counter() - start
+    manager.close()
+    board.close()
+    return elapsed
+
+
+def time_ui():
+    """
+    This function measures how long the controller window takes to become usable.
+    :return: Seconds until the first idle event loop pass, or None without a display.
+    :rtype: float or None
+    Time: O(1)
+    """
+    from led_ring_app import LedRingApp
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    start = time.perf_counter()
+    app = LedRingApp(root)
+    root.update_idletasks()
+    elapsed = time.perf_counter() - start
+    app.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time against a fake serial port")
+    parser.add_argument("--boot-delay", type=float, default=DEFAULT_BOOT_DELAY)
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    args = parser.parse_args()
+    connect = min(time_connect(args.boot_delay) for _ in range(args.runs))
+    print(REPORT_LINE % ("connect (Ready line)", connect * 1000))
+    print(REPORT_LINE % ("connect (fixed sleep)", (LEGACY_CONNECT_DELAY + connect - args.boot_delay) * 1000))
+    ui = time_ui()
+    if ui is not None:
+        print(REPORT_LINE % ("controller usable", ui * 1000))
+
+
+if __name__ == "__main__":
+    main()
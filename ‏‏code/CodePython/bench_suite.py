@@ -0,0 +1,472 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tkinter as tk
+import numpy as np
+from bench_latency import measure_throughput
+from frame_protocol import PROTOCOL_AUTO
+from preview_renderer import RingPreview, COLOR_TRUN_OFF
+from serial_manager import SerialManager
+
+DEFAULT_BAUDRATE = 115200
+DEFAULT_LEDS = 14
+DEFAULT_SAMPLES = 200
+DEFAULT_SECONDS = 2.0
+DEFAULT_TOLERANCE = 0.2
+PREVIEW_LEDS = 144
+PREVIEW_FRAMES = 200
+PROBE_INTERVAL_MS = 10    #Tk lag probe period
+WAIT_TIMEOUT = 2.0
+SIM_URL = "sim://?leds=%d&boot=%g"
+PERCENTILES = (50, 95, 99)
+PROC_TASK_STAT = "/proc/self/task/%d/stat"
+UTIME_FIELD = 11          #Fields after the ")" that closes the thread name
+STIME_FIELD = 12
+REPORT_LINE = "%-44s %12.3f"
+REGRESSION_LINE = "REGRESSION %-33s %12.3f -> %12.3f"
+# Metric name suffix -> (lower is better, smallest change that counts)
+DIRECTIONS = {
+    "_ms": (True, 0.5),
+    "_pct": (True, 2.0),
+    "_calls_per_frame": (True, 0.5),
+    "_bytes_per_frame": (True, 1.0),
+    "_per_s": (False, 1.0),
+    "_lost": (True, 0.5),
+}
+
+
+def thread_cpu_times():
+    """
+    This function reads the CPU time of every Python thread of this process from /proc.
+    :return: CPU seconds per thread name (threads sharing a name are summed); empty where /proc is missing.
+    :rtype: dict
+    Time: O(t), where t is the number of threads.
+    """
+    ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+    times = {}
+    for thread in threading.enumerate():
+        try:
+            with open(PROC_TASK_STAT % thread.native_id) as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except (OSError, TypeError):
+            continue
+        cpu = (int(fields[UTIME_FIELD]) + int(fields[STIME_FIELD])) / ticks
+        times[thread.name] = times.get(thread.name, 0.0) + cpu
+    return times
+
+
+class CpuMeter:
+    def __init__(self):
+        """
+        Measures CPU use per thread between start() and stop().
+        Time: O(1)
+        """
+        self.start_times = {}
+        self.start_wall = 0.0
+
+    def start(self):
+        self.start_times = thread_cpu_times()
+        self.start_wall = time.perf_counter()
+        return self
+
+    def stop(self, prefix):
+        """
+        This function returns the CPU use of each thread since start() as metrics.
+        Threads that ended in between are not reported.
+        :param prefix: Metric name prefix.
+        :type prefix: str
+        :return: "<prefix>.cpu.<thread>_pct" -> percent of one core.
+        :rtype: dict
+        Time: O(t), where t is the number of threads.
+        """
+        wall = time.perf_counter() - self.start_wall
+        metrics = {}
+        for name, cpu in thread_cpu_times().items():
+            used = cpu - self.start_times.get(name, 0.0)
+            metrics[f"{prefix}.cpu.{name}_pct"] = 100.0 * used / wall
+        return metrics
+
+
+class WireClock:
+    def __init__(self, manager):
+        """
+        Timestamps every command when the writer thread has put it on the wire.
+        :param manager: The connected manager.
+        :type manager: SerialManager
+        Time: O(1)
+        """
+        self.sent_at = {}
+        self.count = 0
+        self.condition = threading.Condition()
+        manager.writer.on_sent = self.on_sent
+
+    def on_sent(self, command):
+        with self.condition:
+            self.sent_at[command] = time.perf_counter()
+            self.count += 1
+            self.condition.notify_all()
+
+    def wait(self, command, since):
+        """
+        This function waits until command is on the wire after since.
+        :param command: The command.
+        :type command: str
+        :param since: perf_counter() before the command was issued.
+        :type since: float
+        :return: When it was written, or None on timeout.
+        :rtype: float or None
+        Time: O(1)
+        """
+        with self.condition:
+            if self.condition.wait_for(lambda: self.sent_at.get(command, 0.0) >= since, WAIT_TIMEOUT):
+                return self.sent_at[command]
+        return None
+
+
+class RecordingCanvas:
+    class Interpreter:
+        def __init__(self):
+            self.calls = 0
+
+        def eval(self, script):
+            self.calls += 1
+
+        def call(self, *args):
+            self.calls += 1
+
+    def __init__(self):
+        """
+        Stand-in for tk.Canvas without a display: counts the Tcl round-trips RingPreview makes.
+        Time: O(1)
+        """
+        self.tk = RecordingCanvas.Interpreter()
+        self.items = 0
+
+    def create_oval(self, *args, **kwargs):
+        self.items += 1
+        self.tk.calls += 1
+        return self.items
+
+    def itemconfig(self, *args, **kwargs):
+        self.tk.calls += 1
+
+    def __str__(self):
+        return ".bench"
+
+
+def summarize(prefix, seconds):
+    """
+    This function turns a list of durations into percentile metrics.
+    :param prefix: Metric name prefix.
+    :type prefix: str
+    :param seconds: Durations in seconds.
+    :type seconds: list[float]
+    :return: "<prefix>.p50_ms" and friends, empty without samples.
+    :rtype: dict
+    Time: O(n log n)
+    """
+    if not seconds:
+        return {}
+    values = np.percentile(np.asarray(seconds) * 1000, PERCENTILES)
+    return {f"{prefix}.p{p}_ms": float(value) for p, value in zip(PERCENTILES, values)}
+
+
+def open_tk():
+    """
+    This function creates a hidden Tk root, or returns None without a display.
+    :return: The root or None.
+    :rtype: tk.Tk or None
+    Time: O(1)
+    """
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    root.withdraw()
+    return root
+
+
+def connect(baudrate, num_leds, boot_delay=0.0):
+    """
+    This function connects a quiet SerialManager to a fresh simulated ring.
+    :return: (manager, simulator).
+    :rtype: tuple[SerialManager, DeviceSimulator]
+    Time: O(boot_delay)
+    """
+    #Every sample has to reach the ring, so repeated buttons (rainbow) must not be dropped as no-ops
+    manager = SerialManager(port=SIM_URL % (num_leds, boot_delay), baudrate=baudrate, protocol=PROTOCOL_AUTO,
+                            suppress_redundant=False)
+    manager.writer.on_sent = None
+    manager.reader.on_message = None
+    manager.connect()
+    return manager, manager.ser.device
+
+
+def button_actions(manager, root):
+    """
+    This function builds the button handlers to time: the LEDController methods when Tk is
+    available, otherwise the same command strings sent straight to the manager.
+    Each action takes a sample number and returns the command it issued.
+    :return: (driver name, {action name: action}, cleanup callable).
+    :rtype: tuple[str, dict, callable]
+    Time: O(1)
+    """
+    def rgb(i):
+        return (i % 256, 255 - i % 256, (7 * i) % 256)
+
+    if root is None:
+        def send(command):
+            manager.send_command(command)
+            return command
+        actions = {
+            "color": lambda i: send("rgb:%d,%d,%d" % rgb(i)),
+            "chase": lambda i: send("chase:%d,%d,%d" % rgb(i)),
+            "pulse": lambda i: send("pulse:%d,%d,%d,1" % rgb(i)),
+            "rainbow": lambda i: send("1"),
+        }
+        return "serial_manager", actions, lambda: None
+    from led_controller import LEDController
+    controller = LEDController(root, manager)
+
+    def color(i):
+        controller.send_color_command(rgb(i))
+        return "rgb:%d,%d,%d" % rgb(i)
+
+    def chase(i):
+        command = "chase:%d,%d,%d" % rgb(i)
+        controller.send_command(command)  #what open_chase_dialog does after the color picker
+        return command
+
+    def pulse(i):
+        command = "pulse:%d,%d,%d,1" % rgb(i)
+        controller.start_pulse(command)   #first tick goes out right away on the scheduler thread
+        return command
+
+    def rainbow(i):
+        controller.send_rainbow_command()
+        return "1"
+
+    actions = {"color": color, "chase": chase, "pulse": pulse, "rainbow": rainbow}
+    return "controller", actions, controller.stop_pulse
+
+
+def bench_buttons(baudrate, num_leds, samples, root):
+    """
+    This function times button-to-wire latency of each controller command, button-to-ring
+    latency of colors, the end-to-end command rate, and how long a burst of clicks takes to settle.
+    :return: Metrics and the driver used.
+    :rtype: tuple[dict, str]
+    Time: O(samples)
+    """
+    manager, device = connect(baudrate, num_leds)
+    clock = WireClock(manager)
+    driver, actions, cleanup = button_actions(manager, root)
+    metrics = {}
+    lost = 0
+    meter = CpuMeter().start()
+    for name, action in actions.items():
+        wire = []
+        ring = []
+        for i in range(samples):
+            handled = device.commands
+            start = time.perf_counter()
+            command = action(i)
+            sent = clock.wait(command, start)
+            cleanup()
+            if sent is not None:
+                wire.append(sent - start)
+            if device.wait_for(lambda simulator: simulator.commands > handled, WAIT_TIMEOUT):
+                ring.append(device.last_command - start)
+            else:
+                lost += 1
+        metrics.update(summarize(f"buttons.{name}.to_wire", wire))
+        metrics.update(summarize(f"buttons.{name}.to_ring", ring))
+    metrics["buttons.commands_lost"] = lost
+    metrics.update(meter.stop("buttons"))
+
+    #Sustained: every command must reach the ring before the next one
+    lost = 0
+    start = time.perf_counter()
+    for i in range(samples):
+        handled = device.commands
+        actions["color"](i)
+        if not device.wait_for(lambda simulator: simulator.commands > handled, WAIT_TIMEOUT):
+            lost += 1
+    metrics["sustained.ring_commands_per_s"] = (samples - lost) / (time.perf_counter() - start)
+    metrics["sustained.commands_lost"] = lost
+
+    #Burst: as fast as a user (or a script) can click; the writer keeps only the newest color
+    coalesced = manager.writer.coalesced
+    start = time.perf_counter()
+    for i in range(samples):
+        command = actions["color"](i + 1)
+    metrics["burst.submitted_per_s"] = samples / (time.perf_counter() - start)
+    color = tuple(int(value) for value in command.split(":")[1].split(","))
+    device.wait_for(lambda simulator: simulator.showing(color), WAIT_TIMEOUT)
+    metrics["burst.last_to_ring_ms"] = (device.last_show - start) * 1000
+    metrics["burst.coalesced"] = manager.writer.coalesced - coalesced
+    manager.close()
+    return metrics, driver
+
+
+def bench_frames(baudrate, num_leds, seconds):
+    """
+    This function measures streamed frames per second and the CPU it costs.
+    :return: Metrics.
+    :rtype: dict
+    Time: O(seconds)
+    """
+    meter = CpuMeter().start()
+    fps, size = measure_throughput(baudrate, num_leds, seconds)
+    metrics = {"frames.delivered_per_s": fps, "frames.wire_bytes_per_frame": size}
+    metrics.update(meter.stop("frames"))
+    return metrics
+
+
+def bench_idle(baudrate, num_leds, seconds):
+    """
+    This function measures CPU use of a connected but quiet link; a polling reader shows up here.
+    :return: Metrics.
+    :rtype: dict
+    Time: O(seconds)
+    """
+    manager, device = connect(baudrate, num_leds)
+    meter = CpuMeter().start()
+    time.sleep(seconds)
+    metrics = meter.stop("idle")
+    manager.close()
+    return metrics
+
+
+def bench_preview(root):
+    """
+    This function counts Tcl round-trips per frame of the ring preview; per-LED itemconfig
+    calls show up as one call per LED.
+    :return: Metrics.
+    :rtype: dict
+    Time: O(PREVIEW_FRAMES * PREVIEW_LEDS)
+    """
+    canvas = tk.Canvas(root) if root is not None else RecordingCanvas()
+    preview = RingPreview(canvas, PREVIEW_LEDS, (0, 0), PREVIEW_LEDS)
+    frames = np.random.default_rng(0).integers(0, 256, (PREVIEW_FRAMES, PREVIEW_LEDS, 3), dtype=np.uint8)
+    start = time.perf_counter()
+    for frame in frames:
+        preview.show_frame(frame)
+        preview.fill(COLOR_TRUN_OFF)
+    elapsed = time.perf_counter() - start
+    if root is not None:
+        canvas.destroy()
+    return {"preview.tcl_calls_per_frame": preview.tcl_calls / PREVIEW_FRAMES,
+            "preview.render_ms": elapsed * 1000 / PREVIEW_FRAMES}
+
+
+def bench_ui(root, baudrate, num_leds, seconds):
+    """
+    This function runs the LedRingApp splash animation (the simulated board boots slowly, so it keeps
+    animating) and measures how late a periodic Tk timer fires: the event-loop lag a user feels.
+    :return: Metrics, empty without a display.
+    :rtype: dict
+    Time: O(seconds)
+    """
+    if root is None:
+        return {}
+    from led_ring_app import LedRingApp
+    window = tk.Toplevel(root)
+    manager = SerialManager(port=SIM_URL % (num_leds, seconds * 2), baudrate=baudrate)
+    app = LedRingApp(window, manager)
+    lateness = []
+    expected = [time.perf_counter() + PROBE_INTERVAL_MS / 1000]
+
+    def probe():
+        now = time.perf_counter()
+        lateness.append(max(0.0, now - expected[0]))
+        expected[0] = now + PROBE_INTERVAL_MS / 1000
+        window.after(PROBE_INTERVAL_MS, probe)
+
+    window.after(PROBE_INTERVAL_MS, probe)
+    meter = CpuMeter().start()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        root.update()
+        time.sleep(0.001)
+    metrics = summarize("ui.event_loop_lag", lateness)
+    metrics.update(meter.stop("ui"))
+    metrics["ui.animation_tcl_calls_per_s"] = app.preview.tcl_calls / seconds
+    app.running = False
+    manager.close()
+    window.destroy()
+    return metrics
+
+
+def compare(baseline, metrics, tolerance):
+    """
+    This function lists metrics that got worse than the baseline by more than tolerance.
+    :param baseline: Metrics of an earlier run.
+    :type baseline: dict
+    :param metrics: Metrics of this run.
+    :type metrics: dict
+    :param tolerance: Allowed relative change, e.g. 0.2 for 20 %.
+    :type tolerance: float
+    :return: (name, old, new) per regression.
+    :rtype: list[tuple[str, float, float]]
+    Time: O(m), where m is the number of metrics.
+    """
+    regressions = []
+    for name, new in metrics.items():
+        old = baseline.get(name)
+        direction = next((value for suffix, value in DIRECTIONS.items() if name.endswith(suffix)), None)
+        if old is None or direction is None:
+            continue
+        lower_is_better, min_change = direction
+        change = new - old if lower_is_better else old - new
+        if change > min_change and change > tolerance * abs(old):
+            regressions.append((name, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks against the simulated ring")
+    parser.add_argument("--baud", type=int, default=DEFAULT_BAUDRATE)
+    parser.add_argument("--leds", type=int, default=DEFAULT_LEDS)
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    root = open_tk()
+    metrics, driver = bench_buttons(args.baud, args.leds, args.samples, root)
+    metrics.update(bench_frames(args.baud, args.leds, args.seconds))
+    metrics.update(bench_idle(args.baud, args.leds, args.seconds))
+    metrics.update(bench_preview(root))
+    metrics.update(bench_ui(root, args.baud, args.leds, args.seconds))
+    if root is not None:
+        root.destroy()
+
+    for name in sorted(metrics):
+        print(REPORT_LINE % (name, metrics[name]))
+    results = {
+        "meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "platform": platform.platform(), "baudrate": args.baud, "leds": args.leds,
+                 "samples": args.samples, "seconds": args.seconds, "driver": driver, "display": root is not None},
+        "metrics": metrics,
+    }
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as previous:
+            regressions = compare(json.load(previous)["metrics"], metrics, args.tolerance)
+        for name, old, new in regressions:
+            print(REGRESSION_LINE % (name, old, new))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import random
+import time
+from effect_engine import EFFECTS, create_effect
+from timeline import TimelinePlayer, FrameCache, parse_show, crossfade, DEFAULT_CACHE_BYTES
+
+DEFAULT_STEPS = 200
+DEFAULT_LEDS = [14, 300]
+DEFAULT_FPS = 100
+DEFAULT_SECONDS = 10.0
+STEP_SECONDS = (0.2, 1.0)
+FADE_SHARE = 0.5          #Part of a step spent crossfading in
+TICKS = 5000
+LINE = ("leds=%-4d precomputed=%7.2f us/frame  live=%7.2f us/frame  jitter p50=%6.3f p99=%6.3f max=%6.3f ms  "
+        "sent=%-5d skipped=%-3d cache=%.1f MB evictions=%d")
+
+
+class CountingLink:
+    def __init__(self):
+        self.frames = 0
+
+    def send_frame(self, frame):
+        self.frames += 1
+        return True
+
+
+def random_show(steps, fps, seed=1):
+    """
+    This function builds a looping show of random effects and colors with crossfades.
+    :param steps: Number of steps.
+    :type steps: int
+    :param fps: Frames per second.
+    :type fps: int
+    :param seed: Random seed, so runs compare.
+    :type seed: int
+    :return: The decoded show.
+    :rtype: dict
+    Time: O(steps)
+    """
+    rng = random.Random(seed)
+    entries = []
+    for _ in range(steps):
+        duration = rng.uniform(*STEP_SECONDS)
+        entry = {"duration": duration, "fade": duration * FADE_SHARE}
+        if rng.random() < 0.5:
+            entry["effect"] = rng.choice(sorted(EFFECTS))
+        else:
+            entry["color"] = [rng.randrange(256) for _ in range(3)]
+        entries.append(entry)
+    return {"fps": fps, "loop": True, "steps": entries}
+
+
+def live_frame_cost(num_leds, ticks):
+    """
+    This function times rendering a crossfade between two effects frame by frame, the work a tick
+    would do without the precomputed buffers.
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :param ticks: Frames to render.
+    :type ticks: int
+    :return: Seconds per frame.
+    :rtype: float
+    Time: O(ticks * num_leds)
+    """
+    start_effect = create_effect(1, num_leds)
+    end_effect = create_effect(3, num_leds)
+    began = time.perf_counter()
+    for _ in range(ticks):
+        crossfade(start_effect.render_block(1), end_effect.render_block(1))
+    return (time.perf_counter() - began) / ticks
+
+
+def precomputed_frame_cost(player, ticks):
+    began = time.perf_counter()
+    for position in range(ticks):
+        player.serial_manager.send_frame(player.frame_at(position % player.total_frames))
+    return (time.perf_counter() - began) / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Timeline playback cost and frame timing")
+    parser.add_argument("--steps", type=int, default=DEFAULT_STEPS)
+    parser.add_argument("--leds", type=int, nargs="+", default=DEFAULT_LEDS)
+    parser.add_argument("--fps", type=int, default=DEFAULT_FPS)
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS, help="playback time per run")
+    parser.add_argument("--cache-mb", type=float, default=DEFAULT_CACHE_BYTES / 1e6)
+    args = parser.parse_args()
+    timeline = parse_show(random_show(args.steps, args.fps))
+    for num_leds in args.leds:
+        cache = FrameCache(int(args.cache_mb * 1e6))
+        player = TimelinePlayer(CountingLink(), timeline, num_leds, cache=cache)
+        player.prepare()
+        precomputed = precomputed_frame_cost(player, TICKS)
+        live = live_frame_cost(num_leds, TICKS)
+        player.start()
+        time.sleep(args.seconds)
+        player.stop()
+        stats = player.stats()
+        jitter = stats["jitter"]
+        print(LINE % (num_leds, precomputed * 1e6, live * 1e6, jitter["p50_ms"], jitter["p99_ms"], jitter["max_ms"],
+                      stats["sent"], stats["skipped"], stats["cache"]["bytes"] / 1e6, stats["cache"]["evictions"]))
+
+
+if __name__ == "__main__":
+    main()
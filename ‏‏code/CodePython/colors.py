@@ -0,0 +1,397 @@
+import functools
+import numpy as np
+
+# Host side of the ring's color handling, as lookup tables so whole frames convert with a few
+# NumPy indexing operations. Values follow FastLED 3.x with FASTLED_SCALE8_FIXED (the default).
+CHANNELS = 3
+MAX_VALUE = 255
+LEVELS = 256
+HUE_SECTION = 0x20
+CHANNEL_INDEX = np.arange(CHANNELS)
+# FastLED color corrections (CRGB values) and the setup of now.ino
+UNCORRECTED = (255, 255, 255)
+TYPICAL_LED_STRIP = (255, 176, 240)     #0xFFB0F0, also TypicalSMD5050
+TYPICAL_PIXEL_STRING = (255, 224, 140)  #0xFFE08C
+FIRMWARE_BRIGHTNESS = 100               #BRIGHTNESS in now.ino
+# WS2812 current at full level per channel and per idle LED, as in FastLED's power_mgt
+LED_MILLIAMPS = np.array([16, 11, 15])
+LED_IDLE_MILLIAMPS = 1
+HEX_PREFIX = '#'
+HEX_CACHE_SIZE = 4096
+
+
+def scale8(value, scale):
+    """
+    This function mirrors FastLED's scale8 (FASTLED_SCALE8_FIXED): value * (scale + 1) / 256.
+    :param value: Value or array of values in 0..255.
+    :type value: int or np.ndarray
+    :param scale: Scale in 0..255.
+    :type scale: int or np.ndarray
+    :return: The scaled value(s).
+    :rtype: int or np.ndarray
+    Time: O(1) per element
+    """
+    return (value * (scale + 1)) >> 8
+
+
+def scale8_video(value, scale):
+    """
+    This function mirrors FastLED's scale8_video: like scale8, but a non-zero value never scales to zero.
+    :param value: Value or array of values in 0..255.
+    :type value: int or np.ndarray
+    :param scale: Scale in 0..255.
+    :type scale: int or np.ndarray
+    :return: The scaled value(s).
+    :rtype: int or np.ndarray
+    Time: O(1) per element
+    """
+    return ((value * scale) >> 8) + ((value != 0) & (scale != 0))
+
+
+def build_scale8_lut():
+    """
+    This function tabulates scale8 for every scale and value.
+    :return: A (256, 256) uint8 table indexed by [scale, value].
+    :rtype: np.ndarray
+    Time: O(256 * 256)
+    """
+    levels = np.arange(LEVELS, dtype=np.int32)
+    return scale8(levels[None, :], levels[:, None]).astype(np.uint8)
+
+
+def build_hue_lut():
+    """
+    This function precomputes FastLED's hsv2rgb_rainbow for every hue at full saturation and value,
+    which is what CHSV(hue, 255, 255) assigns to a CRGB in the firmware effects.
+    :return: A (256, 3) uint8 table indexed by hue.
+    :rtype: np.ndarray
+    Time: O(256)
+    """
+    hue = np.arange(LEVELS, dtype=np.int32)
+    offset8 = (hue & 0x1F) << 3
+    third = scale8(offset8, 256 // 3)
+    twothirds = scale8(offset8, (256 * 2) // 3)
+    zero = np.zeros_like(hue)
+    section = hue // HUE_SECTION
+    # One (r, g, b) formula per 32-hue section, straight from hsv2rgb_rainbow with Y1 = 1
+    sections = [
+        (255 - third, third, zero),
+        (zero + 171, 85 + third, zero),
+        (171 - twothirds, 170 + third, zero),
+        (zero, 255 - third, third),
+        (zero, 171 - twothirds, 85 + twothirds),
+        (third, zero, 255 - third),
+        (85 + third, zero, 171 - third),
+        (170 + third, zero, 85 - third),
+    ]
+    lut = np.zeros((LEVELS, CHANNELS), dtype=np.uint8)
+    for index, channels in enumerate(sections):
+        mask = section == index
+        for channel, values in enumerate(channels):
+            lut[mask, channel] = values[mask]
+    return lut
+
+
+def build_saturation_lut():
+    """
+    This function tabulates the desaturation step of hsv2rgb_rainbow: each channel is scaled by
+    255 - desat and lifted by the brightness floor desat, where desat = scale8_video(255 - sat, 255 - sat).
+    :return: A (256, 256) uint8 table indexed by [saturation, channel value].
+    :rtype: np.ndarray
+    Time: O(256 * 256)
+    """
+    sat = np.arange(LEVELS, dtype=np.int32)[:, None]
+    value = np.arange(LEVELS, dtype=np.int32)[None, :]
+    desat = scale8_video(MAX_VALUE - sat, MAX_VALUE - sat)
+    lut = scale8(value, MAX_VALUE - desat) + desat
+    lut[0, :] = MAX_VALUE
+    lut[MAX_VALUE, :] = value[0]
+    return lut.astype(np.uint8)
+
+
+def build_value_lut():
+    """
+    This function tabulates the value step of hsv2rgb_rainbow: each channel is scaled by
+    scale8_video(val, val), with a dimmed value of zero turning the LED off.
+    :return: A (256, 256) uint8 table indexed by [value, channel value].
+    :rtype: np.ndarray
+    Time: O(256 * 256)
+    """
+    val = np.arange(LEVELS, dtype=np.int32)[:, None]
+    value = np.arange(LEVELS, dtype=np.int32)[None, :]
+    dimmed = scale8_video(val, val)
+    lut = np.where(dimmed == 0, 0, scale8(value, dimmed))
+    lut[MAX_VALUE, :] = value[0]
+    return lut.astype(np.uint8)
+
+
+SCALE8_LUT = build_scale8_lut()
+HUE_LUT = build_hue_lut()
+SATURATION_LUT = build_saturation_lut()
+VALUE_LUT = build_value_lut()
+
+
+def hsv_to_rgb(hue):
+    """
+    This function converts an array of hues (full saturation and value) to RGB with one table lookup.
+    :param hue: Hue values; any shape, wrapped to 0..255.
+    :type hue: np.ndarray
+    :return: An array of shape hue.shape + (3,) of uint8.
+    :rtype: np.ndarray
+    Time: O(n), where n is the number of hues.
+    """
+    return HUE_LUT[np.asarray(hue) & 0xFF]
+
+
+def chsv_to_rgb(hue, sat=MAX_VALUE, val=MAX_VALUE):
+    """
+    This function converts CHSV colors to RGB exactly like assigning a CHSV to a CRGB in FastLED
+    (hsv2rgb_rainbow), with three table lookups per color.
+    :param hue: Hues in 0..255, any shape.
+    :type hue: int or np.ndarray
+    :param sat: Saturations, broadcast against hue.
+    :type sat: int or np.ndarray
+    :param val: Values (brightness), broadcast against hue.
+    :type val: int or np.ndarray
+    :return: An array of shape broadcast(hue, sat, val).shape + (3,) of uint8.
+    :rtype: np.ndarray
+    Time: O(n), where n is the number of colors.
+    """
+    rgb = HUE_LUT[np.asarray(hue) & 0xFF]
+    #Row 255 of both tables is the identity, so full saturation or value skips a lookup
+    if np.any(np.not_equal(sat, MAX_VALUE)):
+        rgb = SATURATION_LUT[(np.asarray(sat) & 0xFF)[..., None], rgb]
+    if np.any(np.not_equal(val, MAX_VALUE)):
+        rgb = VALUE_LUT[(np.asarray(val) & 0xFF)[..., None], rgb]
+    return rgb
+
+
+def build_gamma_lut(gamma=1.0):
+    """
+    This function tabulates a gamma curve.
+    :param gamma: Gamma exponent, 1.0 keeps values linear.
+    :type gamma: float
+    :return: A (256,) uint8 table.
+    :rtype: np.ndarray
+    Time: O(256)
+    """
+    levels = np.arange(LEVELS, dtype=np.float64)
+    return np.round(MAX_VALUE * (levels / MAX_VALUE) ** gamma).astype(np.uint8)
+
+
+def build_output_lut(brightness=MAX_VALUE, gamma=1.0):
+    """
+    This function combines a gamma curve and a brightness scale into one 256 entry table.
+    :param brightness: Global brightness 0..255 (applied with scale8, like FastLED.setBrightness).
+    :type brightness: int
+    :param gamma: Gamma exponent, 1.0 keeps values linear.
+    :type gamma: float
+    :return: A (256,) uint8 table.
+    :rtype: np.ndarray
+    Time: O(256)
+    """
+    return SCALE8_LUT[brightness][build_gamma_lut(gamma)]
+
+
+def channel_scales(correction=UNCORRECTED, brightness=MAX_VALUE, temperature=UNCORRECTED):
+    """
+    This function mirrors CLEDController::computeAdjustment: the per channel scale FastLED.show()
+    applies for a color correction, a color temperature and the global brightness.
+    :param correction: Correction, e.g. TYPICAL_LED_STRIP.
+    :type correction: tuple[int, int, int]
+    :param brightness: Global brightness 0..255.
+    :type brightness: int
+    :param temperature: Color temperature, UNCORRECTED for none.
+    :type temperature: tuple[int, int, int]
+    :return: The scale of each channel.
+    :rtype: tuple[int, int, int]
+    Time: O(1)
+    """
+    if not brightness:
+        return 0, 0, 0
+    return tuple(((c + 1) * (t + 1) * brightness // 0x10000) & 0xFF if c and t else 0
+                 for c, t in zip(correction, temperature))
+
+
+def build_channel_lut(gamma=1.0, correction=UNCORRECTED, brightness=MAX_VALUE):
+    """
+    This function builds one table per channel: gamma, then color correction and brightness.
+    :param gamma: Gamma exponent.
+    :type gamma: float
+    :param correction: Color correction.
+    :type correction: tuple[int, int, int]
+    :param brightness: Global brightness 0..255.
+    :type brightness: int
+    :return: A (3, 256) uint8 table indexed by [channel, value].
+    :rtype: np.ndarray
+    Time: O(3 * 256)
+    """
+    return SCALE8_LUT[np.array(channel_scales(correction, brightness))][:, build_gamma_lut(gamma)]
+
+
+def apply_lut(lut, frames):
+    """
+    This function maps frames through a shared (256,) table or a per channel (3, 256) table.
+    :param lut: The table.
+    :type lut: np.ndarray
+    :param frames: uint8 array whose last axis holds the channels.
+    :type frames: np.ndarray
+    :return: The mapped frames, same shape.
+    :rtype: np.ndarray
+    Time: O(n), where n is the number of values.
+    """
+    return lut[frames] if lut.ndim == 1 else lut[CHANNEL_INDEX, frames]
+
+
+def frame_milliamps(frames):
+    """
+    This function estimates what frames draw from the supply, like calculate_unscaled_power_mW.
+    :param frames: A (num_leds, 3) frame or a (count, num_leds, 3) batch, as sent to the LEDs.
+    :type frames: np.ndarray
+    :return: Milliamps per frame (a scalar for one frame).
+    :rtype: float or np.ndarray
+    Time: O(n), where n is the number of values.
+    """
+    levels = frames.sum(axis=-2, dtype=np.int64)
+    return levels @ LED_MILLIAMPS / MAX_VALUE + frames.shape[-2] * LED_IDLE_MILLIAMPS
+
+
+def limit_power(frames, max_milliamps):
+    """
+    This function scales down every frame that would draw more than the budget, the whole frame by
+    one factor so colors keep their balance, like FastLED.setMaxPowerInVoltsAndMilliamps.
+    :param frames: A (num_leds, 3) frame or a (count, num_leds, 3) batch.
+    :type frames: np.ndarray
+    :param max_milliamps: Current budget of the supply.
+    :type max_milliamps: float
+    :return: The frames within budget (the input itself when none is over).
+    :rtype: np.ndarray
+    Time: O(n), where n is the number of values.
+    """
+    draw = np.atleast_1d(frame_milliamps(frames))
+    over = draw > max_milliamps
+    if not over.any():
+        return frames
+    idle = frames.shape[-2] * LED_IDLE_MILLIAMPS
+    #scale8 by s multiplies by (s + 1) / 256; idle current does not scale
+    scales = np.floor(LEVELS * max(max_milliamps - idle, 0) / np.maximum(draw - idle, 1)) - 1
+    scales = np.where(over, np.clip(scales, 0, MAX_VALUE), MAX_VALUE).astype(np.intp)
+    batch = frames.reshape((-1,) + frames.shape[-2:])
+    return SCALE8_LUT[scales[:, None, None], batch].reshape(frames.shape)
+
+
+@functools.lru_cache(maxsize=HEX_CACHE_SIZE)
+def hex_to_rgb(hex_color):
+    """
+    This function parses "#rrggbb"; results are cached, color pickers and palettes repeat colors.
+    :param hex_color: The color string, with or without '#'.
+    :type hex_color: str
+    :return: (r, g, b).
+    :rtype: tuple[int, int, int]
+    Time: O(1)
+    """
+    return tuple(bytes.fromhex(hex_color.lstrip(HEX_PREFIX)))
+
+
+def hex_to_frame(hex_colors):
+    """
+    This function parses many "#rrggbb" strings at once.
+    :param hex_colors: The colors.
+    :type hex_colors: list[str]
+    :return: A (len(hex_colors), 3) uint8 array.
+    :rtype: np.ndarray
+    Time: O(n)
+    """
+    data = bytes.fromhex("".join(color.lstrip(HEX_PREFIX) for color in hex_colors))
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, CHANNELS)
+
+
+class ColorPipeline:
+    def __init__(self, gamma=1.0, correction=UNCORRECTED, brightness=MAX_VALUE, max_milliamps=None):
+        """
+        Output stage for host rendered frames: gamma, color correction and brightness folded into one
+        table per channel, then an optional current limit.
+        :param gamma: Gamma exponent.
+        :type gamma: float
+        :param correction: Color correction, e.g. TYPICAL_LED_STRIP.
+        :type correction: tuple[int, int, int]
+        :param brightness: Global brightness 0..255.
+        :type brightness: int
+        :param max_milliamps: Supply budget, None for no limit.
+        :type max_milliamps: float
+        Time: O(3 * 256)
+        """
+        self.gamma = gamma
+        self.correction = tuple(correction)
+        self.brightness = brightness
+        self.max_milliamps = max_milliamps
+        self.lut = build_channel_lut(gamma, correction, brightness)
+
+    @classmethod
+    def firmware(cls, max_milliamps=None):
+        """
+        This function returns the stage now.ino applies in FastLED.show(): TypicalLEDStrip and BRIGHTNESS,
+        so a preview can show what the LEDs emit rather than the leds[] values.
+        :param max_milliamps: Supply budget, None for no limit.
+        :type max_milliamps: float
+        :return: The pipeline.
+        :rtype: ColorPipeline
+        Time: O(3 * 256)
+        """
+        return cls(correction=TYPICAL_LED_STRIP, brightness=FIRMWARE_BRIGHTNESS, max_milliamps=max_milliamps)
+
+    def key(self):
+        """
+        This function describes the pipeline for caches of converted frames.
+        :return: Its parameters.
+        :rtype: tuple
+        Time: O(1)
+        """
+        return self.gamma, self.correction, self.brightness, self.max_milliamps
+
+    def apply(self, frames):
+        """
+        This function converts a frame or a batch of frames.
+        :param frames: A (num_leds, 3) frame or a (count, num_leds, 3) batch of uint8.
+        :type frames: np.ndarray
+        :return: The converted frames.
+        :rtype: np.ndarray
+        Time: O(n), where n is the number of values.
+        """
+        frames = self.lut[CHANNEL_INDEX, frames]
+        if self.max_milliamps is not None:
+            frames = limit_power(frames, self.max_milliamps)
+        return frames
+
+
+def apply_output(output, frames):
+    """
+    This function runs frames through an output stage: None, a table from build_output_lut or
+    build_channel_lut, or a ColorPipeline.
+    :param output: The output stage.
+    :type output: ColorPipeline or np.ndarray
+    :param frames: uint8 frames.
+    :type frames: np.ndarray
+    :return: The converted frames.
+    :rtype: np.ndarray
+    Time: O(n), where n is the number of values.
+    """
+    if output is None:
+        return frames
+    if isinstance(output, ColorPipeline):
+        return output.apply(frames)
+    return apply_lut(output, frames)
+
+
+def output_key(output):
+    """
+    This function returns a hashable description of an output stage, for caches.
+    :param output: None, a table or a ColorPipeline.
+    :type output: ColorPipeline or np.ndarray
+    :return: The description.
+    :rtype: tuple or bytes or None
+    Time: O(size of the table)
+    """
+    if output is None or isinstance(output, ColorPipeline):
+        return output and output.key()
+    return output.tobytes()
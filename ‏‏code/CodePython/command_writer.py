@@ -0,0 +1,519 @@
+import collections
+import threading
+import time
+from metrics import NULL_METRIC
+from frame_protocol import FrameError
+from async_logger import get_logger
+
+COMMAND_TERMINATOR = '\n'
+ENCODING = 'ascii'
+WRITER_QUEUE_SIZE = 64
+THREAD_NAME = "command-writer"
+MAX_BATCH_BYTES = 64
+COMMAND_UNENCODABLE = "command_unencodable"
+
+# Backpressure policies used when the queue is full
+POLICY_DROP_OLDEST = "drop-oldest"
+POLICY_BLOCK = "block"
+POLICY_REJECT = "reject"
+
+# Command kinds, used to decide which pending commands a new one supersedes
+KIND_RGB = "rgb"
+KIND_EFFECT = "effect"
+KIND_STOP = "stop"
+KIND_FRAME = "frame"
+KIND_SPEED = "speed"
+KIND_PLAY = "play"
+KIND_OTHER = "other"
+KIND_RAW = "raw"
+RGB_PREFIX = "rgb:"
+STOP_COMMAND = "stop"
+EFFECT_PREFIXES = ("pulse:", "chase:")
+SPEED_PREFIX = "speed:"
+PLAY_PREFIX = "play:"
+
+# A new command of the key kind removes pending commands of the listed kinds:
+# the ring only shows the latest color/effect, so older ones are dead weight on a slow link.
+SUPERSEDES = {
+    KIND_RGB: (KIND_RGB, KIND_EFFECT, KIND_PLAY),
+    KIND_EFFECT: (KIND_RGB, KIND_EFFECT, KIND_PLAY),
+    KIND_STOP: (KIND_EFFECT, KIND_STOP, KIND_PLAY),
+    KIND_PLAY: (KIND_RGB, KIND_EFFECT, KIND_PLAY),
+    KIND_FRAME: (KIND_FRAME,),
+    KIND_SPEED: (KIND_SPEED,),
+    KIND_OTHER: (),
+    KIND_RAW: (),
+}
+
+
+class QueueFullError(Exception):
+    """Raised by the reject policy when the writer queue is full."""
+
+
+class RawCommand(bytes):
+    """Wire bytes that are not a pixel frame (a store message): written as they are, never coalesced."""
+
+
+def command_kind(command):
+    """
+    This function classifies a command for coalescing.
+    :param command: The ASCII command, e.g. "rgb:1,2,3", "stop", "1" or "pulse:1,2,3,1",
+                    a frame (pre-encoded bytes or a pixel array) or a RawCommand.
+    :type command: str or bytes or np.ndarray
+    :return: One of KIND_RGB, KIND_EFFECT, KIND_STOP, KIND_FRAME, KIND_SPEED, KIND_PLAY, KIND_OTHER, KIND_RAW.
+    :rtype: str
+    Time: O(1)
+    """
+    if isinstance(command, RawCommand):
+        return KIND_RAW
+    if not isinstance(command, str):
+        return KIND_FRAME
+    if command.startswith(RGB_PREFIX):
+        return KIND_RGB
+    if command == STOP_COMMAND:
+        return KIND_STOP
+    if command.isdigit() or command.startswith(EFFECT_PREFIXES):
+        return KIND_EFFECT
+    if command.startswith(SPEED_PREFIX):
+        return KIND_SPEED
+    if command.startswith(PLAY_PREFIX):
+        return KIND_PLAY
+    return KIND_OTHER
+
+
+class CommandWriter:
+    def __init__(self, ser=None, maxsize=WRITER_QUEUE_SIZE, policy=POLICY_DROP_OLDEST,
+                 max_batch_bytes=MAX_BATCH_BYTES, encoder=None, frame_encoder=None, on_sent=None, on_error=None,
+                 on_dropped=None):
+        """
+        Dedicated writer thread fed by a bounded, coalescing queue.
+        Callers never touch the port, so the Tk thread cannot block on serial I/O.
+        While there is no port (before connecting or during an outage) commands stay queued.
+        :param ser: An open serial-like object with write(), or None until connected.
+        :type ser: serial.Serial
+        :param maxsize: Maximum number of pending commands.
+        :type maxsize: int
+        :param policy: Backpressure policy: POLICY_DROP_OLDEST, POLICY_BLOCK or POLICY_REJECT.
+        :type policy: str
+        :param max_batch_bytes: Upper bound on the bytes merged into one write() call.
+        :type max_batch_bytes: int
+        :param encoder: Turns a command string into wire bytes, defaults to ASCII plus '\\n'.
+        :type encoder: callable
+        :param frame_encoder: Turns a pixel array into wire bytes. It runs exactly once per frame
+                              that is written, so it may keep state (delta encoding).
+        :type frame_encoder: callable
+        :param on_sent: Called on the writer thread with each command after it is written.
+        :type on_sent: callable
+        :param on_error: Called on the writer thread with the exception when write() fails;
+                         the writer pauses (ser = None) until resume() gives it a new port.
+        :type on_error: callable
+        :param on_dropped: Called with each queued command the queue bound pushed out, or the encoder
+                           refused, before it was written (not those superseded by a newer command).
+        :type on_dropped: callable
+        Time: O(1)
+        """
+        self.ser = ser
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_batch_bytes = max_batch_bytes
+        self.encoder = encoder or self.encode_ascii
+        self.frame_encoder = frame_encoder
+        self.on_sent = on_sent
+        self.on_error = on_error
+        self.on_dropped = on_dropped
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.running = False
+        self.busy = False
+        self.thread = None
+        self.coalesced = 0
+        self.dropped = 0
+        self.unencodable = 0
+        self.writes = 0
+        self.commands_written = 0
+        self.bytes_written = 0
+        self.errors = 0
+        self.held = False
+        self.write_seconds = NULL_METRIC  #the owner installs a histogram when metrics are on
+
+    @staticmethod
+    def encode_ascii(command):
+        """
+        This function encodes a command in the firmware's line based ASCII format.
+        :param command: The command string.
+        :type command: str
+        :return: The bytes to put on the wire.
+        :rtype: bytes
+        Time: O(k), where k is the length of the command.
+        """
+        return (command + COMMAND_TERMINATOR).encode(ENCODING)
+
+    def submit(self, command, policy=None, timeout=None, encoded=None):
+        """
+        This function queues a command for the writer thread, merging it with superseded pending commands.
+        :param command: The command string, already encoded bytes (sent as they are) or a pixel array.
+        :type command: str or bytes or np.ndarray
+        :param policy: Overrides the writer's backpressure policy for this call.
+        :type policy: str
+        :param timeout: Seconds to wait under POLICY_BLOCK, None waits forever.
+        :type timeout: float
+        :param encoded: Wire bytes of a command string made with the current encoder, so a broadcast
+                        encodes once for many writers. Dropped by resume(), the new link may differ.
+        :type encoded: bytes
+        :return: True if the command was queued, False if it timed out under POLICY_BLOCK.
+        :rtype: bool
+        :raises QueueFullError: Under POLICY_REJECT when the queue is full.
+        Time: O(q), where q is the number of pending commands.
+        """
+        policy = policy or self.policy
+        kind = command_kind(command)
+        dropped = None
+        with self.condition:
+            self.coalesce(kind)
+            if len(self.pending) >= self.maxsize:
+                if policy == POLICY_REJECT:
+                    raise QueueFullError(command)
+                if policy == POLICY_BLOCK:
+                    if not self.condition.wait_for(lambda: len(self.pending) < self.maxsize, timeout):
+                        return False
+                else:
+                    dropped = self.pending.popleft()[1]
+                    self.dropped += 1
+            self.pending.append([kind, command, encoded])
+            self.condition.notify_all()
+        if dropped is not None and self.on_dropped:
+            self.on_dropped(dropped)
+        return True
+
+    def coalesce(self, kind):
+        """
+        This function removes pending commands made obsolete by a new command of the given kind.
+        Must be called with the condition held.
+        :param kind: The kind of the new command.
+        :type kind: str
+        :return: None
+        Time: O(q), where q is the number of pending commands.
+        """
+        superseded = SUPERSEDES[kind]
+        if not superseded or not self.pending:
+            return
+        #Frames already encoded are committed: a stateful frame encoder counted them as sent
+        kept = collections.deque(item for item in self.pending
+                                 if item[0] not in superseded or (item[0] == KIND_FRAME and item[2] is not None))
+        self.coalesced += len(self.pending) - len(kept)
+        self.pending = kept
+
+    def encode(self, command):
+        """
+        This function turns a queued item into wire bytes.
+        :param command: Command string, encoded bytes or pixel array.
+        :type command: str or bytes or np.ndarray
+        :return: Wire bytes.
+        :rtype: bytes
+        Time: O(k), where k is the size of the item.
+        """
+        if isinstance(command, str):
+            return self.encoder(command)
+        if isinstance(command, bytes):
+            return command
+        return self.frame_encoder(command)
+
+    def take_batch(self):
+        """
+        This function pops the pending commands that should fit in one write, judged by their wire
+        bytes or, before encoding, by their size. Must be called with the condition held and a
+        non-empty queue; encode_batch encodes them once the condition is released.
+        :return: The queue items, in order.
+        :rtype: list[list]
+        Time: O(b), where b is the number of items popped.
+        """
+        items = []
+        size = 0
+        while self.pending and size < self.max_batch_bytes:
+            item = self.pending.popleft()
+            items.append(item)
+            if item[2] is not None:
+                size += len(item[2])
+            elif isinstance(item[1], (str, bytes)):
+                size += len(item[1]) + len(COMMAND_TERMINATOR)
+            else:
+                size += item[1].nbytes
+        return items
+
+    def encode_batch(self, items):
+        """
+        This function encodes the items of take_batch outside the condition, so callers of submit() never
+        wait behind a frame encode. Items that turn out not to fit go back to the head of the queue,
+        keeping the bytes of the one that was encoded: a stateful frame encoder counted it as sent.
+        An item the encoder refuses (a frame too long for the protocol) is dropped, counted and logged,
+        the others still go out.
+        :param items: The queue items, in order.
+        :type items: list[list]
+        :return: The commands and their concatenated wire bytes.
+        :rtype: tuple[list, bytes]
+        Time: O(k), where k is the size of the items.
+        """
+        commands = []
+        chunks = []
+        size = 0
+        for index, item in enumerate(items):
+            if item[2] is None:
+                try:
+                    item[2] = self.encode(item[1])
+                except FrameError as error:
+                    self.unencodable += 1
+                    get_logger().warning(COMMAND_UNENCODABLE, kind=item[0], error=str(error))
+                    if self.on_dropped:
+                        self.on_dropped(item[1])
+                    continue
+            if chunks and size + len(item[2]) > self.max_batch_bytes:
+                with self.condition:
+                    self.pending.extendleft(reversed(items[index:]))
+                    self.condition.notify_all()
+                break
+            commands.append(item[1])
+            chunks.append(item[2])
+            size += len(item[2])
+        return commands, b''.join(chunks)
+
+    def run(self):
+        """
+        Writer loop: waits for commands and writes them in batches until stop() is called.
+        :return: None
+        Time: O(n), where n is the number of bytes written.
+        """
+        while True:
+            with self.condition:
+                #A held writer stays parked even when stopping: the holder is using the port
+                self.condition.wait_for(lambda: not self.held and (self.pending and self.ser is not None
+                                                                   or not self.running))
+                if not self.pending or self.ser is None:
+                    return
+                ser = self.ser
+                items = self.take_batch()
+                self.busy = True
+                self.condition.notify_all()
+            try:
+                commands, data = self.encode_batch(items)
+                if commands:
+                    self.write(ser, commands, data)
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def write(self, ser, commands, data):
+        """
+        This function puts one batch on the wire, or hands it back to the queue if the port fails.
+        Runs outside the condition, on the writer thread or on a thread that holds the writer.
+        :param ser: The port the batch was taken for.
+        :type ser: serial.Serial
+        :param commands: The commands of the batch, in order.
+        :type commands: list
+        :param data: Their concatenated wire bytes.
+        :type data: bytes
+        :return: True if the batch was written.
+        :rtype: bool
+        Time: O(len(data))
+        """
+        try:
+            start = time.perf_counter()
+            ser.write(data)
+            self.write_seconds.observe(time.perf_counter() - start)
+            self.writes += 1
+            self.commands_written += len(commands)
+            self.bytes_written += len(data)
+            if self.on_sent:
+                for command in commands:
+                    self.on_sent(command)
+            return True
+        except OSError as error:
+            self.errors += 1
+            with self.condition:
+                if self.ser is ser:
+                    self.ser = None  #wait for resume() instead of spinning on a dead port
+                dropped = self.requeue(commands)
+            if self.on_dropped:
+                for command in dropped:
+                    self.on_dropped(command)
+            if self.on_error:
+                self.on_error(error)
+            return False
+
+    def requeue(self, commands):
+        """
+        This function puts the commands of a failed write back at the head of the queue, unless a
+        newer pending command supersedes them. Frames are not kept, they are stale by the time the
+        link is back. Must be called with the condition held.
+        :param commands: The commands of the failed batch, in order.
+        :type commands: list
+        :return: The commands pushed out of the queue by its bound.
+        :rtype: list
+        Time: O(b + q), where b is the size of the batch and q the number of pending commands.
+        """
+        later = set(item[0] for item in self.pending)
+        retry = collections.deque()
+        for command in reversed(commands):
+            kind = command_kind(command)
+            if kind == KIND_FRAME or any(kind in SUPERSEDES[newer] for newer in later):
+                continue
+            retry.appendleft([kind, command, None])
+            later.add(kind)
+        self.pending = retry + self.pending
+        dropped = []
+        while len(self.pending) > self.maxsize:
+            dropped.append(self.pending.popleft()[1])
+            self.dropped += 1
+        return dropped
+
+    def start(self):
+        """
+        This function starts the writer thread.
+        :return: The writer thread.
+        :rtype: threading.Thread
+        Time: O(1)
+        """
+        with self.condition:
+            if self.thread and self.thread.is_alive() and self.running:
+                return self.thread
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name=THREAD_NAME, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def hold(self, timeout=None):
+        """
+        This function parks the writer thread until release(): queued commands stay queued and
+        write_now() may use the port from another thread.
+        :param timeout: Seconds to wait for a write in progress, None waits forever.
+        :type timeout: float
+        :return: True if the writer is parked, False if its current write did not end in time.
+        :rtype: bool
+        Time: O(1)
+        """
+        with self.condition:
+            self.held = True
+            return self.condition.wait_for(lambda: not self.busy, timeout)
+
+    def write_now(self, command, encoded=None):
+        """
+        This function writes a command on the calling thread while the writer is held, so one thread
+        can put a broadcast on many ports back to back. Superseded pending commands are dropped; if
+        older commands are still queued, or there is no port, the command is queued behind them instead.
+        :param command: The command string.
+        :type command: str
+        :param encoded: Its wire bytes, made with the current encoder.
+        :type encoded: bytes
+        :return: True if the command was written now.
+        :rtype: bool
+        Time: O(q + k), where q is the number of pending commands and k the length of the command.
+        """
+        with self.condition:
+            self.coalesce(command_kind(command))
+            ser = self.ser
+            direct = ser is not None and not self.pending and self.held and not self.busy
+            self.busy = self.busy or direct
+        if not direct:
+            self.submit(command, encoded=encoded)
+            return False
+        try:
+            return self.write(ser, [command], encoded or self.encoder(command))
+        finally:
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def release(self):
+        """
+        This function lets the writer go on after hold().
+        :return: None
+        Time: O(1)
+        """
+        with self.condition:
+            self.held = False
+            self.condition.notify_all()
+
+    def pause(self):
+        """
+        This function detaches the port; queued and new commands wait for resume().
+        :return: None
+        Time: O(1)
+        """
+        with self.condition:
+            self.ser = None
+
+    def resume(self, ser):
+        """
+        This function attaches a (re)opened port and lets the queue drain into it.
+        :param ser: The open port.
+        :type ser: serial.Serial
+        :return: None
+        Time: O(1)
+        """
+        with self.condition:
+            self.ser = ser
+            for item in self.pending:
+                if isinstance(item[1], str):
+                    item[2] = None  #the new link may have negotiated another protocol
+            self.condition.notify_all()
+
+    def discard(self, kind):
+        """
+        This function drops every pending command of one kind.
+        :param kind: One of the KIND_* constants.
+        :type kind: str
+        :return: Number of commands dropped.
+        :rtype: int
+        Time: O(q), where q is the number of pending commands.
+        """
+        with self.condition:
+            kept = collections.deque(item for item in self.pending if item[0] != kind)
+            dropped = len(self.pending) - len(kept)
+            self.pending = kept
+            self.condition.notify_all()
+        return dropped
+
+    def flush(self, timeout=None):
+        """
+        This function waits until every queued command has been written.
+        :param timeout: Seconds to wait, None waits forever.
+        :type timeout: float
+        :return: True if the queue drained in time.
+        :rtype: bool
+        Time: O(1)
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.busy, timeout)
+
+    def clear(self):
+        """
+        This function discards every pending command.
+        :return: None
+        Time: O(q), where q is the number of pending commands.
+        """
+        with self.condition:
+            self.pending.clear()
+            self.condition.notify_all()
+
+    def stop(self, timeout=None):
+        """
+        This function lets the writer drain the queue and then exit.
+        :param timeout: Seconds to wait for the thread.
+        :type timeout: float
+        :return: None
+        Time: O(1)
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def depth(self):
+        """
+        This function returns the number of pending commands.
+        :return: The queue depth.
+        :rtype: int
+        Time: O(1)
+        """
+        return len(self.pending)
@@ -0,0 +1,290 @@
+import collections
+import threading
+import time
+from command_writer import WRITER_QUEUE_SIZE
+from serial_manager import (SerialManager, BAUDRATE, CONNECT_THREAD, STATE_CONNECTED, STATE_CONNECTING,
+                            STATE_DISCONNECTED)
+
+HOLD_TIMEOUT = 0.005      #Longest wait for a ring's write in progress before it is left out of a synchronized write
+SYNC_QUEUE_SIZE = WRITER_QUEUE_SIZE
+SYNC_THREAD = "group-sync"
+
+
+class DeviceGroup:
+    def __init__(self, ports, baudrate=BAUDRATE, synchronized=True, **options):
+        """
+        Drives many rings from one host. Every ring is a SerialManager pinned to its own port with
+        its own reader and writer threads, so a slow or dead port only backs up its own queue and
+        reconnects on its own while the others keep going.
+        The group has the SerialManager interface used by LEDController, LedRingApp and FrameStreamer
+        (send_command, send_frame, connect, close, state listeners), so it can replace a single link.
+        :param ports: One port name or URL per ring (sim:// starts a simulated ring).
+        :type ports: list[str]
+        :param baudrate: Line speed of every ring.
+        :type baudrate: int
+        :param synchronized: Write broadcasts to every port back to back from one thread, so effects
+                             start on the same tick instead of when each writer thread gets scheduled.
+        :type synchronized: bool
+        :param options: Passed to each SerialManager (policy, protocol, silence_timeout...).
+        :type options: dict
+        Time: O(n), where n is the number of rings.
+        """
+        self.rings = [SerialManager(port=port, baudrate=baudrate, discover=False, name=f"{index}:{port}", **options)
+                      for index, port in enumerate(ports)]
+        self.synchronized = synchronized
+        self.state = STATE_DISCONNECTED
+        self.state_listeners = []
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.dropped = 0
+        for ring in self.rings:
+            ring.add_state_listener(self.on_ring_state)
+
+    @property
+    def connected(self):
+        return any(ring.connected for ring in self.rings)
+
+    @property
+    def frame_budget(self):
+        return self.rings[0].frame_budget
+
+    @frame_budget.setter
+    def frame_budget(self, seconds):
+        for ring in self.rings:
+            ring.frame_budget = seconds  #every ring's telemetry is judged against the stream feeding the group
+
+    def add_state_listener(self, listener):
+        """
+        Registers a callback for the group state: connected while at least one ring is up.
+        :param listener: Called with one of the STATE_* constants, on a connecting thread.
+        :type listener: callable
+        :return: None
+        Time: O(1)
+        """
+        self.state_listeners.append(listener)
+
+    def on_ring_state(self, state):
+        """
+        Ring state listener: recomputes the group state and reports changes.
+        :param state: The new state of one ring.
+        :type state: str
+        :return: None
+        Time: O(n + l), where l is the number of listeners.
+        """
+        states = [ring.state for ring in self.rings]
+        if STATE_CONNECTED in states:
+            state = STATE_CONNECTED
+        elif STATE_CONNECTING in states:
+            state = STATE_CONNECTING
+        else:
+            state = STATE_DISCONNECTED
+        with self.lock:
+            if state == self.state:
+                return
+            self.state = state
+        for listener in self.state_listeners:
+            listener(state)
+
+    def connect(self, timeout=None):
+        """
+        This function connects every ring in parallel; each keeps retrying on its own thread,
+        so a missing ring does not delay the others.
+        :param timeout: Seconds to wait for all rings, None waits until every ring is up or close() is called.
+        :type timeout: float
+        :return: True if every ring is connected.
+        :rtype: bool
+        Time: O(n) plus the slowest connection.
+        """
+        threads = [threading.Thread(target=ring.connect, name=f"{CONNECT_THREAD}-{index}", daemon=True)
+                   for index, ring in enumerate(self.rings)]
+        for thread in threads:
+            thread.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return all(ring.connected for ring in self.rings)
+
+    def broadcast(self, command, policy=None, rings=None):
+        """
+        This function sends one command to many rings and returns at once. The command is encoded
+        once per protocol in use, not once per ring. When synchronized, the group thread parks every
+        writer and puts the command on all ports back to back, so effects start on the same tick.
+        :param command: The command string.
+        :type command: str
+        :param policy: Backpressure policy for rings that get it through their queue.
+        :type policy: str
+        :param rings: Target rings, defaults to all of them.
+        :type rings: list[SerialManager]
+        :return: None
+        Time: O(1) when synchronized, O(n + p * k) otherwise, where p is the number of protocols
+              and k the length of the command.
+        """
+        rings = self.rings if rings is None else rings
+        if not self.synchronized or len(rings) < 2:
+            self.submit_all(command, policy, rings)
+            return
+        with self.condition:
+            if len(self.pending) >= SYNC_QUEUE_SIZE:
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append((command, policy, rings))
+            self.condition.notify_all()
+            if self.thread is None:
+                self.running = True
+                self.thread = threading.Thread(target=self.run, name=SYNC_THREAD, daemon=True)
+                self.thread.start()
+
+    @staticmethod
+    def encoding(ring, command, cache):
+        """
+        This function returns the wire bytes of a command for one ring, encoding it only once per encoder.
+        :param ring: The target ring.
+        :type ring: SerialManager
+        :param command: The command string.
+        :type command: str
+        :param cache: Encoder -> bytes, shared by the rings of one broadcast.
+        :type cache: dict
+        :return: The bytes, or None while the ring is down (the writer encodes it after the handshake).
+        :rtype: bytes or None
+        Time: O(k) on a cache miss, O(1) otherwise.
+        """
+        if not ring.connected:
+            return None
+        encoder = ring.writer.encoder
+        data = cache.get(encoder)
+        if data is None:
+            data = cache[encoder] = encoder(command)
+        return data
+
+    def submit_all(self, command, policy, rings):
+        cache = {}
+        for ring in rings:
+            ring.send_command(command, policy, encoded=self.encoding(ring, command, cache))
+
+    def write_together(self, command, policy, rings):
+        """
+        This function parks the writers of the rings and writes the command to every port back to back.
+        A ring whose current write does not end within HOLD_TIMEOUT (slow link) or that still has older
+        commands queued gets the command through its queue instead, so it cannot delay the others.
+        :param command: The command string.
+        :type command: str
+        :param policy: Backpressure policy for rings that get it through their queue.
+        :type policy: str
+        :param rings: Target rings.
+        :type rings: list[SerialManager]
+        :return: Number of rings written directly.
+        :rtype: int
+        Time: O(n + p * k) plus HOLD_TIMEOUT when a ring is busy.
+        """
+        parked = [ring for ring in rings if ring.writer.hold(0)]
+        busy = [ring for ring in rings if ring not in parked]
+        deadline = time.monotonic() + HOLD_TIMEOUT
+        for ring in busy:
+            if ring.writer.hold(max(0.0, deadline - time.monotonic())):
+                parked.append(ring)
+            else:
+                ring.writer.release()
+        cache = {}
+        written = 0
+        try:
+            for ring in parked:
+                written += ring.write_now(command, self.encoding(ring, command, cache))
+        finally:
+            for ring in parked:
+                ring.writer.release()
+        self.submit_all(command, policy, [ring for ring in busy if ring not in parked])
+        return written
+
+    def run(self):
+        """
+        Group thread: writes synchronized broadcasts in order until close().
+        :return: None
+        Time: O(b * n), where b is the number of broadcasts.
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or not self.running)
+                if not self.pending:
+                    return
+                command, policy, rings = self.pending.popleft()
+            self.write_together(command, policy, rings)
+
+    def send_command(self, command, policy=None):
+        """
+        This function broadcasts a command to every ring, like SerialManager.send_command does for one.
+        :param command: The command string.
+        :type command: str
+        :param policy: Optional backpressure policy.
+        :type policy: str
+        :return: None
+        Time: O(1) when synchronized, O(n + k) otherwise.
+        """
+        self.broadcast(command, policy)
+
+    def send_to(self, index, command, policy=None):
+        """
+        This function sends a command to one ring.
+        :param index: Position of the ring in ports.
+        :type index: int
+        :param command: The command string.
+        :type command: str
+        :param policy: Optional backpressure policy.
+        :type policy: str
+        :return: None
+        Time: O(q), as SerialManager.send_command.
+        """
+        self.rings[index].send_command(command, policy)
+
+    def send_frame(self, frame, copy=True):
+        """
+        This function shows one host-rendered frame on every binary ring. The frame is copied once
+        and shared; each ring's writer delta-encodes it against what that ring last received.
+        :param frame: A (num_leds, 3) uint8 array.
+        :type frame: np.ndarray
+        :param copy: Share a copy; False when the caller never modifies the array again.
+        :type copy: bool
+        :return: True if at least one ring queued the frame.
+        :rtype: bool
+        Time: O(n) on the calling thread; encoding is O(num_leds) on each writer thread.
+        """
+        if copy:
+            frame = frame.copy()
+        return any([ring.send_frame(frame, copy=False) for ring in self.rings])
+
+    def send_frames(self, frames):
+        """
+        This function sends a different frame to each ring.
+        :param frames: One (num_leds, 3) uint8 array per ring, None skips a ring.
+        :type frames: list[np.ndarray]
+        :return: Per ring, True if the frame was queued.
+        :rtype: list[bool]
+        Time: O(n * num_leds) for the copies.
+        """
+        return [frame is not None and ring.send_frame(frame) for ring, frame in zip(self.rings, frames)]
+
+    def link_metrics(self):
+        """
+        Returns the supervision counters of every ring.
+        :return: One SerialManager.link_metrics() dict per ring, keyed by ring name.
+        :rtype: dict
+        Time: O(n)
+        """
+        return {ring.name: ring.link_metrics() for ring in self.rings}
+
+    def close(self):
+        """
+        Writes the broadcasts still queued, then closes every ring.
+        :return: None
+        Time: O(n)
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        for ring in self.rings:
+            ring.close()
@@ -0,0 +1,1195 @@
+import asyncio
+import re
+import struct
+import threading
+import time
+import numpy as np
+from effect_engine import NUM_LEDS, DELAY_TIME, CHANNELS, AvrRandom, RandomSparkle, EFFECTS
+from frame_codec import FrameApplier
+from transport import byte_time
+from link_speed import (SAFE_BAUDRATE, BAUD_RATES, BAUD_PREFIX, BAUD_REFUSED, BAUD_OK, SYNC_LINE,
+                        BAUD_CONFIRM_TIMEOUT)
+from frame_protocol import (FrameDecoder, HELLO_COMMAND, RGB_PREFIX, PULSE_PREFIX, CHASE_PREFIX, SPEED_PREFIX, OP_RGB,
+                            OP_EFFECT, OP_PULSE, OP_CHASE, OP_STOP, OP_TEXT, OP_FRAME, OP_FRAME_DELTA, OP_FRAME_RLE,
+                            OP_SPEED, SPEED_FORMAT, OP_STORE_BEGIN, OP_STORE_DATA, OP_STORE_END, OP_PLAY, HEADER_FORMAT,
+                            STORE_BEGIN_FORMAT, STORE_DATA_FORMAT, STORE_PRESET, STORE_SEQUENCE, STORE_LOOP,
+                            SEQUENCE_FORMAT, PLAY_PREFIX, CACHE_QUERY, encode_command)
+from telemetry import TELEMETRY_KIND, TELEMETRY_PREFIX, MIN_TELEMETRY_INTERVAL, TELEMETRY_OFF
+from preset_cache import (STORE_KIND, EVICT_KIND, CACHE_KIND, PLAY_KIND, STORE_OK, STORE_FULL, STORE_DONE, STORE_BAD,
+                          PLAY_MISSING, HASH_SEPARATOR)
+
+# Mirrors of the now.ino defines
+READY = "Ready"
+EFFECT_PULSE = 2
+EFFECT_CHASE = 5
+SERIAL_RX_BUFFER = 64         #HardwareSerial receive buffer on AVR boards
+SERIAL_READ_TIMEOUT = 1.0     #Stream::setTimeout default, used by readStringUntil
+STEP_TIME = DELAY_TIME / 1000
+MIN_STEP_INTERVAL = 1         #ms, shortest "speed:" the firmware takes
+MAX_STEP_INTERVAL = 0xFFFF
+LINE_BUFFER_SIZE = 64         #lineBuffer[] of now.ino, including the terminating zero
+IDLE_WAIT = 0.05              #Longest sleep of the idle loop, bounds stop() latency
+LINE_END = '\n'
+LINE_END_BYTE = ord(LINE_END)
+SPEED_SIZE = struct.calcsize(SPEED_FORMAT)
+# FastLED.show() on WS2812: 24 bits at 800 kHz per LED, then the latch
+SHOW_TIME_PER_LED = 30e-6
+SHOW_LATCH = 50e-6
+LOOP_OVERHEAD = 200e-6        #Parsing a line and rendering a step on a 16 MHz AVR, rounded up
+PRINTLN_END = "\r\n"
+ENCODING = 'ascii'
+RGB_PATTERN = re.compile(r'rgb:\s*(-?\d+)(?:,\s*(-?\d+)(?:,\s*(-?\d+))?)?')
+BYTE_MASK = 0xFF
+THREAD_NAME = "device-simulator"
+READ_CHUNK = 4096
+MAX_BAUDRATE = 2000000        #Fastest rate the ATmega328P UART reaches at 16 MHz (U2X)
+NOISE_INTERVAL = 32           #Bytes between two bit errors at a rate the board cannot hold
+MAX_TELEMETRY_INTERVAL = 0xFFFF
+# ATmega328P RAM, and what the core, FastLED and the Serial buffers take besides the sketch's own arrays
+RAM_SIZE = 2048
+BASE_RAM_USE = 420
+US = 1e6
+# ATmega328P EEPROM and the store layout of now.ino (loadStore): magic word, index, then the entries' data
+EEPROM_SIZE = 1024
+EEPROM_WRITE_TIME = 3.3e-3    #Seconds per byte EEPROM.update() actually rewrites
+ERASED = 0xFF                 #A new chip reads all ones
+STORE_MAGIC = 0x5043
+MAGIC_FORMAT = '<H'
+STORE_SLOTS = 8
+ENTRY_FORMAT = '<BBBIHH'      #StoreEntry: id, type, flags, hash, offset, length
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+STORE_INDEX_START = struct.calcsize(MAGIC_FORMAT)
+STORE_DATA_START = STORE_INDEX_START + STORE_SLOTS * ENTRY_SIZE
+STORE_FREE = 0
+STAMP_SIZE = 2                #storeUsed[] entries, the LRU stamps kept in RAM only
+STORE_BEGIN_SIZE = struct.calcsize(STORE_BEGIN_FORMAT)
+STORE_DATA_HEADER = struct.calcsize(STORE_DATA_FORMAT)
+SEQUENCE_HEADER = struct.calcsize(SEQUENCE_FORMAT)
+RECORD_HEADER = struct.calcsize(HEADER_FORMAT)
+EFFECT_SEQUENCE = 100
+NO_SLOT = -1
+
+
+def frame_buffer_size(num_leds):
+    """
+    This function returns the firmware's FRAME_BUFFER_SIZE for a strip.
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :return: Longest COBS frame the device keeps.
+    :rtype: int
+    Time: O(1)
+    """
+    return num_leds * 4 + 16
+
+
+def show_duration(num_leds):
+    """
+    This function returns how long FastLED.show() keeps the firmware busy.
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :return: Seconds.
+    :rtype: float
+    Time: O(1)
+    """
+    return num_leds * SHOW_TIME_PER_LED + SHOW_LATCH
+
+
+def free_ram(num_leds):
+    """
+    This function estimates freeRam() of now.ino while processFrame() runs: RAM less the core's share,
+    leds[], the line and frame buffers, the store index, and the decoded copy of a frame on the stack.
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :return: Bytes, negative when the sketch would not fit.
+    :rtype: int
+    Time: O(1)
+    """
+    return (RAM_SIZE - BASE_RAM_USE - num_leds * CHANNELS - LINE_BUFFER_SIZE - 2 * frame_buffer_size(num_leds)
+            - STORE_SLOTS * (ENTRY_SIZE + STAMP_SIZE))
+
+
+def latency_bound(command, baudrate, num_leds, binary=False):
+    """
+    This function bounds the time from the host writing a command to the LEDs showing it, for the
+    millis() driven loop of now.ino: the command's bytes on the wire, at most one effect step the loop
+    was busy with when the last byte arrived, then the command's own FastLED.show().
+    The old firmware added up to a DELAY_TIME of delay() and, for a line split across reads,
+    readStringUntil's timeout on top.
+    :param command: An ASCII command.
+    :type command: str
+    :param baudrate: Line speed.
+    :type baudrate: int
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :param binary: The command goes out as a binary frame.
+    :type binary: bool
+    :return: Seconds.
+    :rtype: float
+    Time: O(k), where k is the length of the command.
+    """
+    size = len(encode_command(command)) if binary else len(command) + len(LINE_END)
+    return size * byte_time(baudrate) + 2 * (show_duration(num_leds) + LOOP_OVERHEAD)
+
+
+def parse_rgb(command):
+    """
+    This function reads "rgb:r,g,b" like the firmware's sscanf: missing values stay 0
+    and every value is truncated to a byte by CRGB.
+    :param command: The command line.
+    :type command: str
+    :return: (r, g, b).
+    :rtype: tuple[int, int, int]
+    Time: O(k), where k is the length of the command.
+    """
+    match = RGB_PATTERN.match(command)
+    values = [int(value) & BYTE_MASK if value else 0 for value in match.groups()] if match else [0, 0, 0]
+    return tuple(values)
+
+
+class StoreEntry:
+    def __init__(self, entry_id=0, kind=STORE_FREE, flags=0, content_hash=0, offset=0, length=0):
+        """
+        One entry of the firmware's store index, as it is laid out in EEPROM.
+        :param entry_id: The id the host stored it under.
+        :type entry_id: int
+        :param kind: STORE_FREE, STORE_PRESET or STORE_SEQUENCE.
+        :type kind: int
+        :param flags: STORE_LOOP for a looping sequence.
+        :type flags: int
+        :param content_hash: Hash of the content, given by the host.
+        :type content_hash: int
+        :param offset: EEPROM address of the data.
+        :type offset: int
+        :param length: Bytes of data.
+        :type length: int
+        Time: O(1)
+        """
+        self.id = entry_id
+        self.kind = kind
+        self.flags = flags
+        self.hash = content_hash
+        self.offset = offset
+        self.length = length
+
+    def pack(self):
+        return struct.pack(ENTRY_FORMAT, self.id, self.kind, self.flags, self.hash, self.offset, self.length)
+
+    @classmethod
+    def unpack(cls, data):
+        return cls(*struct.unpack(ENTRY_FORMAT, data))
+
+
+class DeviceSimulator:
+    def __init__(self, transport, num_leds=NUM_LEDS, boot_delay=0.0, step_time=STEP_TIME,
+                 read_timeout=SERIAL_READ_TIMEOUT, on_show=None, max_baudrate=MAX_BAUDRATE, noisy_baudrate=None,
+                 show_time=0.0, eeprom=None, eeprom_write_time=0.0):
+        """
+        Python model of the now.ino state machine behind any transport: the same ASCII and binary
+        command handling, the same effects (bit-exact, see effect_engine), the same millis() driven
+        loop that takes input as it arrives and advances effects by the steps that elapsed, the same
+        telemetry records (timed with the host's clock), the same preset store in an EEPROM that survives
+        reset(), and a leds[] buffer that tests and benchmarks can inspect.
+        :param transport: Device end of a link (LoopbackTransport or FileDescriptorTransport).
+        :type transport: LoopbackTransport
+        :param num_leds: Number of LEDs.
+        :type num_leds: int
+        :param boot_delay: Seconds before Ready is printed (the bootloader wait after a reset).
+        :type boot_delay: float
+        :param step_time: Seconds between two effect steps until the host sends "speed:" (DELAY_TIME).
+        :type step_time: float
+        :param read_timeout: Per byte timeout of readStringUntil (only the baud handshake still uses it).
+        :type read_timeout: float
+        :param on_show: Optional callback run with leds after every FastLED.show().
+        :type on_show: callable
+        :param max_baudrate: Rates above this one are refused ("baud:no"), like a board with a slower USB bridge.
+        :type max_baudrate: int
+        :param noisy_baudrate: From this rate up the line corrupts bytes, so the handshake has to fall back.
+        :type noisy_baudrate: int
+        :param show_time: Seconds each FastLED.show() keeps the loop busy (see show_duration), 0 for none.
+        :type show_time: float
+        :param eeprom: The board's EEPROM, shared with an earlier simulator to model the same board; None
+                       starts from an erased one.
+        :type eeprom: bytearray
+        :param eeprom_write_time: Seconds each rewritten EEPROM byte keeps the loop busy (EEPROM_WRITE_TIME).
+        :type eeprom_write_time: float
+        Time: O(num_leds)
+        """
+        self.transport = transport
+        self.num_leds = num_leds
+        self.boot_delay = boot_delay
+        self.step_time = step_time
+        self.read_timeout = read_timeout
+        self.on_show = on_show
+        self.show_time = show_time
+        self.boot_step_time = step_time
+        self.max_baudrate = max_baudrate
+        self.noisy_baudrate = noisy_baudrate
+        self.boot_rate = getattr(transport, "baudrate", SAFE_BAUDRATE)  #Serial.begin(BAUDRATE) in setup()
+        self.line_rate = self.boot_rate
+        self.applier = FrameApplier(num_leds)
+        self.leds = self.applier.leds
+        self.decoder = FrameDecoder(frame_buffer_size(num_leds))
+        self.pending = bytearray()
+        self.line = bytearray()
+        self.line_overflow = False
+        self.last_step = 0.0
+        self.binary_mode = False
+        self.command_in_progress = False
+        self.current_effect = -1
+        self.rng = AvrRandom()
+        self.effects = {}
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.shows = 0
+        self.last_show = None
+        self.last_command = None
+        self.commands = 0
+        self.frames = 0
+        self.telemetry_interval = TELEMETRY_OFF
+        self.last_telemetry = 0.0
+        self.line_errors = 0
+        self.line_dropped = 0
+        self.loop_start = time.perf_counter()
+        self.reset_telemetry_window()
+        self.eeprom = eeprom if eeprom is not None else bytearray([ERASED]) * EEPROM_SIZE
+        self.eeprom_write_time = eeprom_write_time
+        self.eeprom_writes = 0
+        self.load_store()
+
+    def start(self):
+        """
+        This function boots the simulated board on a daemon thread.
+        :return: self, so it can be chained after the constructor.
+        :rtype: DeviceSimulator
+        Time: O(1)
+        """
+        self.thread = threading.Thread(target=self.run, name=THREAD_NAME, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        This function powers the board off and closes its end of the link.
+        :param timeout: Seconds to wait for the thread.
+        :type timeout: float
+        :return: None
+        Time: O(1)
+        """
+        self.stop_event.set()
+        self.transport.close()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def disconnect(self):
+        """
+        This function simulates a pulled cable: the host sees an I/O error.
+        :return: None
+        Time: O(1)
+        """
+        self.stop()
+
+    def reset(self):
+        """
+        This function simulates the board resetting on its own (brown-out, watchdog) with the port
+        still open: back to the state after setup(), ASCII mode at the boot rate, and Ready printed again.
+        :return: None
+        Time: O(num_leds)
+        """
+        self.binary_mode = False
+        self.command_in_progress = False
+        self.current_effect = -1
+        self.step_time = self.boot_step_time
+        self.telemetry_interval = TELEMETRY_OFF
+        self.line_errors = 0
+        self.line_dropped = 0
+        self.decoder = FrameDecoder(frame_buffer_size(self.num_leds))
+        self.pending.clear()
+        self.line.clear()
+        self.line_overflow = False
+        self.leds[:] = 0
+        self.load_store()
+        self.line_rate = self.boot_rate
+        self.set_line_rate(self.boot_rate)
+        self.println(READY)
+
+    def run(self):
+        """
+        setup() and then loop() until stopped or the link goes away.
+        :return: None
+        Time: O(n), where n is the number of loop iterations.
+        """
+        if self.stop_event.wait(self.boot_delay):
+            return
+        try:
+            self.println(READY)
+            while not self.stop_event.is_set():
+                self.check_serial_input()
+                if self.command_in_progress:
+                    self.run_effect()
+                self.end_loop()
+        except (OSError, ValueError):
+            pass  #host closed the port
+        finally:
+            self.stop_event.set()
+
+    def println(self, text):
+        self.transport.write((text + PRINTLN_END).encode(ENCODING))
+
+    def poll_input(self, timeout):
+        """
+        This function is Serial.available() in the loop: it sleeps until a byte arrives or timeout
+        passes instead of spinning like the real loop(), then takes everything already received.
+        :param timeout: Longest wait in seconds, 0 only takes what is there.
+        :type timeout: float
+        :return: Bytes ready to handle.
+        :rtype: int
+        Time: O(k), where k is the number of bytes received.
+        """
+        if not self.pending and timeout > 0:
+            self.transport.timeout = timeout
+            self.pending += self.transport.read(1)
+        self.loop_start = time.perf_counter()  #the real loop() spins instead of waiting, that is not work
+        waiting = self.transport.in_waiting
+        if waiting:
+            self.pending += self.transport.read(waiting)
+        return len(self.pending)
+
+    def read_byte(self, timeout):
+        if self.pending:
+            return self.pending.pop(0)
+        self.transport.timeout = timeout
+        data = self.transport.read(1)
+        return data[0] if data else None
+
+    def read_string_until(self, terminator):
+        """
+        This function is Serial.readStringUntil: bytes up to the terminator, or what came before
+        a byte took longer than the read timeout.
+        :param terminator: The end character.
+        :type terminator: str
+        :return: The string without the terminator.
+        :rtype: str
+        Time: O(k), where k is the length of the line.
+        """
+        end = ord(terminator)
+        line = bytearray()
+        while True:
+            byte = self.read_byte(self.read_timeout)
+            if byte is None or byte == end:
+                return line.decode(ENCODING, errors='replace')
+            line.append(byte)
+
+    def next_step_wait(self):
+        """
+        This function tells how long the loop may wait for input before the next effect step is due.
+        :return: Seconds, IDLE_WAIT while no effect runs.
+        :rtype: float
+        Time: O(1)
+        """
+        wait = IDLE_WAIT
+        if self.telemetry_interval:
+            wait = min(wait, max(0.0, self.last_telemetry + self.telemetry_interval / 1000 - time.monotonic()))
+        if not self.command_in_progress:
+            return wait
+        return min(wait, max(0.0, self.last_step + self.effect_interval() - time.monotonic()))
+
+    def effect_interval(self):
+        """
+        effectInterval(): a sequence keeps the interval it was stored with, effects use "speed:".
+        :return: Seconds between two steps of the running effect.
+        :rtype: float
+        Time: O(1)
+        """
+        return self.sequence_time if self.current_effect == EFFECT_SEQUENCE else self.step_time
+
+    def check_serial_input(self):
+        """
+        checkSerialInput(): takes what arrived without waiting for the rest of a line, then handles
+        every complete ASCII line, or every buffered byte in binary mode.
+        :return: None
+        Time: O(k), where k is the number of bytes read.
+        """
+        if not self.poll_input(self.next_step_wait()):
+            return
+        if not self.binary_mode:
+            self.read_lines()
+        if self.binary_mode and self.pending:
+            data = bytes(self.pending)
+            self.pending.clear()
+            for opcode, payload in self.decoder.feed(data):
+                self.process_frame(opcode, payload)
+
+    def read_lines(self):
+        """
+        This function moves pending bytes into the line buffer and handles each complete line; a line
+        longer than LINE_BUFFER_SIZE is dropped. It stops after "proto:bin", what follows is binary.
+        :return: None
+        Time: O(k), where k is the number of pending bytes.
+        """
+        while self.pending and not self.binary_mode:
+            end = self.pending.find(LINE_END_BYTE)
+            chunk = self.pending if end == -1 else self.pending[:end]
+            room = LINE_BUFFER_SIZE - 1 - len(self.line)
+            self.line += chunk[:room]
+            self.line_dropped += max(0, len(chunk) - room)
+            self.line_overflow = self.line_overflow or len(chunk) > room
+            if end == -1:
+                self.pending.clear()
+                return
+            del self.pending[:end + 1]
+            command = self.line.decode(ENCODING, errors='replace')
+            complete = not self.line_overflow
+            if self.line_overflow:
+                self.line_errors += 1
+                self.line_dropped += len(self.line)
+            self.line.clear()
+            self.line_overflow = False
+            if complete:
+                self.handle_line(command)
+
+    def handle_line(self, command):
+        """
+        This function handles one ASCII line: the protocol handshake or a command.
+        :param command: The line without its terminator.
+        :type command: str
+        :return: None
+        Time: O(num_leds)
+        """
+        if command == HELLO_COMMAND:
+            self.println(HELLO_COMMAND)
+            self.binary_mode = True
+        elif command.startswith(BAUD_PREFIX):
+            self.handle_baud(command)
+        else:
+            self.dispatch_command(command)
+
+    def handle_baud(self, command):
+        """
+        handleBaudCommand(): answers a rate proposal, switches, and keeps the new rate only if the
+        sync pattern and the confirmation arrive intact within BAUD_CONFIRM_TIMEOUT each.
+        :param command: "baud:<rate>".
+        :type command: str
+        :return: None
+        Time: O(BAUD_CONFIRM_TIMEOUT)
+        """
+        rate = int(command[len(BAUD_PREFIX):]) if command[len(BAUD_PREFIX):].isdigit() else 0
+        if rate not in BAUD_RATES or rate > self.max_baudrate:
+            self.println(BAUD_REFUSED)
+            return
+        self.println(command)
+        self.transport.flush()  #Serial.flush(): the answer leaves at the old rate
+        self.set_line_rate(rate)
+        read_timeout = self.read_timeout
+        self.read_timeout = BAUD_CONFIRM_TIMEOUT
+        try:
+            if self.read_string_until(LINE_END) == SYNC_LINE:
+                self.println(SYNC_LINE)
+                if self.read_string_until(LINE_END) == BAUD_OK:
+                    self.println(BAUD_OK)
+                    self.line_rate = rate
+                    return
+        finally:
+            self.read_timeout = read_timeout
+        self.set_line_rate(self.line_rate)
+
+    def set_line_rate(self, rate):
+        """
+        This function is Serial.end(); Serial.begin(rate) on a link that models rates (a pty does not).
+        :param rate: The new rate.
+        :type rate: int
+        :return: None
+        Time: O(1)
+        """
+        if hasattr(self.transport, "line_noise"):
+            self.transport.flush()
+            self.transport.baudrate = rate
+            noisy = self.noisy_baudrate is not None and rate >= self.noisy_baudrate
+            self.transport.line_noise(NOISE_INTERVAL if noisy else 0)
+
+    def dispatch_command(self, command):
+        """
+        dispatchCommand(): routes an ASCII command to its handler.
+        :param command: The command line.
+        :type command: str
+        :return: None
+        Time: O(num_leds)
+        """
+        self.received()
+        if command.startswith(RGB_PREFIX):
+            self.set_color(*parse_rgb(command))
+            self.command_in_progress = False
+        elif command.startswith(PULSE_PREFIX):
+            self.start_effect(EFFECT_PULSE)
+        elif command.startswith(CHASE_PREFIX):
+            self.start_effect(EFFECT_CHASE)
+        elif command.startswith(SPEED_PREFIX):
+            value = command[len(SPEED_PREFIX):].strip()
+            self.set_step_interval(int(value) if value.isdigit() else 0)
+        elif command.startswith(TELEMETRY_PREFIX):
+            value = command[len(TELEMETRY_PREFIX):].strip()
+            self.set_telemetry_interval(int(value) if value.isdigit() else 0)
+        elif command.startswith(PLAY_PREFIX):
+            value = command[len(PLAY_PREFIX):].strip()
+            self.play_stored(int(value) & BYTE_MASK if value.isdigit() else 0)
+        elif command == CACHE_QUERY:
+            self.report_store()
+        elif command:
+            self.start_effect(ord(command[0]) - ord('0'))
+
+    def process_frame(self, opcode, payload):
+        """
+        processFrame(): runs one validated binary frame.
+        :param opcode: The OP_* code.
+        :type opcode: int
+        :param payload: The payload.
+        :type payload: bytes
+        :return: None
+        Time: O(len(payload) + num_leds)
+        """
+        if opcode == OP_RGB:
+            if len(payload) >= 3:
+                self.received()
+                self.set_color(payload[0], payload[1], payload[2])
+                self.command_in_progress = False
+        elif opcode == OP_EFFECT:
+            if payload:
+                self.received()
+                self.start_effect(payload[0])
+        elif opcode == OP_PULSE:
+            self.received()
+            self.start_effect(EFFECT_PULSE)
+        elif opcode == OP_CHASE:
+            self.received()
+            self.start_effect(EFFECT_CHASE)
+        elif opcode == OP_STOP:
+            self.received()
+            self.command_in_progress = False
+        elif opcode == OP_SPEED:
+            if len(payload) >= SPEED_SIZE:
+                self.received()
+                self.set_step_interval(struct.unpack_from(SPEED_FORMAT, payload)[0])
+        elif opcode == OP_TEXT:
+            self.dispatch_command(payload.decode(ENCODING, errors='replace'))
+        elif opcode in (OP_FRAME, OP_FRAME_DELTA, OP_FRAME_RLE):
+            with self.condition:
+                self.applier.apply(opcode, payload)
+            self.frames += 1
+            self.command_in_progress = False  #the host drives the ring now
+            self.show()
+        elif opcode == OP_STORE_BEGIN:
+            self.handle_store_begin(payload)
+        elif opcode == OP_STORE_DATA:
+            self.handle_store_data(payload)
+        elif opcode == OP_STORE_END:
+            self.handle_store_end(payload)
+        elif opcode == OP_PLAY:
+            if payload:
+                self.play_stored(payload[0])
+
+    def received(self):
+        """
+        This function counts a handled command, timestamps it and wakes wait_for().
+        :return: None
+        Time: O(1)
+        """
+        with self.condition:
+            self.commands += 1
+            self.last_command = time.perf_counter()
+            self.condition.notify_all()
+
+    def start_effect(self, effect):
+        """
+        startEffect(): makes the effect the active one and shows its first step right away.
+        :param effect: The effect id.
+        :type effect: int
+        :return: None
+        Time: O(num_leds)
+        """
+        self.command_in_progress = True
+        self.current_effect = effect
+        self.last_step = time.monotonic()
+        self.step_effect()
+
+    def set_step_interval(self, interval):
+        """
+        setStepInterval(): the time between two effect steps, ignored when out of range.
+        :param interval: Milliseconds.
+        :type interval: int
+        :return: None
+        Time: O(1)
+        """
+        if MIN_STEP_INTERVAL <= interval <= MAX_STEP_INTERVAL:
+            self.step_time = interval / 1000
+
+    def set_telemetry_interval(self, interval):
+        """
+        setTelemetryInterval(): the time between two telemetry records, TELEMETRY_OFF stops them.
+        :param interval: Milliseconds, raised to MIN_TELEMETRY_INTERVAL.
+        :type interval: int
+        :return: None
+        Time: O(1)
+        """
+        if 0 <= interval <= MAX_TELEMETRY_INTERVAL:
+            self.telemetry_interval = max(interval, MIN_TELEMETRY_INTERVAL) if interval else TELEMETRY_OFF
+            self.last_telemetry = time.monotonic()
+            self.reset_telemetry_window()
+
+    def reset_telemetry_window(self):
+        self.show_count = 0
+        self.show_total = 0.0
+        self.show_max = 0.0
+        self.step_count = 0
+        self.step_total = 0.0
+        self.loop_max = 0.0
+
+    def end_loop(self):
+        """
+        The end of loop(): records how long the iteration worked and reports telemetry when due.
+        :return: None
+        Time: O(1)
+        """
+        self.loop_max = max(self.loop_max, time.perf_counter() - self.loop_start)
+        self.report_telemetry()
+
+    def report_telemetry(self):
+        """
+        reportTelemetry(): prints a record once the interval has passed, while no command is arriving.
+        :return: True if a record was printed.
+        :rtype: bool
+        Time: O(1)
+        """
+        now = time.monotonic()
+        if not self.telemetry_interval or now - self.last_telemetry < self.telemetry_interval / 1000:
+            return False
+        if self.pending or self.line or self.decoder.buffer:
+            return False
+        values = (self.show_count, int((now - self.last_telemetry) * 1000),
+                  int(self.show_total / self.show_count * US) if self.show_count else 0, int(self.show_max * US),
+                  int(self.step_total / self.step_count * US) if self.step_count else 0, int(self.loop_max * US),
+                  self.current_effect if self.command_in_progress else 0, int(round(self.effect_interval() * 1000)),
+                  self.line_errors + self.decoder.errors, self.line_dropped + self.decoder.dropped,
+                  free_ram(self.num_leds))
+        self.println(TELEMETRY_KIND + ":" + ",".join(str(value) for value in values))
+        self.last_telemetry = now
+        self.reset_telemetry_window()
+        return True
+
+    def eeprom_update(self, address, data):
+        """
+        EEPROM.update() over a range: only the bytes that differ are written, each taking eeprom_write_time.
+        :param address: First address.
+        :type address: int
+        :param data: The bytes.
+        :type data: bytes
+        :return: Bytes rewritten.
+        :rtype: int
+        Time: O(len(data))
+        """
+        changed = sum(1 for index, value in enumerate(data) if self.eeprom[address + index] != value)
+        self.eeprom[address:address + len(data)] = data
+        self.eeprom_writes += changed
+        if changed and self.eeprom_write_time:
+            time.sleep(changed * self.eeprom_write_time)
+        return changed
+
+    def load_store(self):
+        """
+        loadStore(): reads the index back from EEPROM, or starts an empty store on an erased chip.
+        Which entry was played last lives in RAM, so every entry is equally old after a reset.
+        :return: None
+        Time: O(STORE_SLOTS)
+        """
+        magic, = struct.unpack_from(MAGIC_FORMAT, self.eeprom)
+        self.store_index = []
+        self.store_used = [0] * STORE_SLOTS
+        self.store_clock = 0
+        self.upload_slot = NO_SLOT
+        self.upload_received = 0
+        self.play_slot = NO_SLOT
+        self.play_cursor = 0
+        self.sequence_time = self.step_time
+        for slot in range(STORE_SLOTS):
+            address = STORE_INDEX_START + slot * ENTRY_SIZE
+            self.store_index.append(StoreEntry.unpack(self.eeprom[address:address + ENTRY_SIZE]))
+            entry = self.store_index[slot]
+            valid = (magic == STORE_MAGIC and entry.offset >= STORE_DATA_START
+                     and entry.offset + entry.length <= EEPROM_SIZE)
+            if not valid and entry.kind != STORE_FREE:
+                self.free_slot(slot)
+        if magic != STORE_MAGIC:
+            self.eeprom_update(0, struct.pack(MAGIC_FORMAT, STORE_MAGIC))
+
+    def save_entry(self, slot):
+        self.eeprom_update(STORE_INDEX_START + slot * ENTRY_SIZE, self.store_index[slot].pack())
+
+    def free_slot(self, slot):
+        """
+        freeSlot(): drops an entry, stopping it first if it is playing.
+        :param slot: Index slot.
+        :type slot: int
+        :return: None
+        Time: O(ENTRY_SIZE)
+        """
+        if slot == self.play_slot and self.current_effect == EFFECT_SEQUENCE:
+            self.command_in_progress = False
+        if slot == self.play_slot:
+            self.play_slot = NO_SLOT
+        self.store_index[slot].kind = STORE_FREE
+        self.save_entry(slot)
+
+    def find_slot(self, entry_id):
+        for slot, entry in enumerate(self.store_index):
+            if entry.kind != STORE_FREE and entry.id == entry_id and slot != self.upload_slot:
+                return slot
+        return NO_SLOT
+
+    def compact_store(self):
+        """
+        compactStore(): moves the entries down over the gaps evicted ones left, each marked free while it moves.
+        :return: The first free EEPROM address.
+        :rtype: int
+        Time: O(STORE_SLOTS^2 + bytes moved)
+        """
+        cursor = STORE_DATA_START
+        for entry in sorted((entry for entry in self.store_index if entry.kind != STORE_FREE),
+                            key=lambda entry: entry.offset):
+            if entry.offset != cursor:
+                slot = self.store_index.index(entry)
+                kind = entry.kind
+                entry.kind = STORE_FREE
+                self.save_entry(slot)
+                self.eeprom_update(cursor, bytes(self.eeprom[entry.offset:entry.offset + entry.length]))
+                entry.offset = cursor
+                entry.kind = kind
+                self.save_entry(slot)
+            cursor += entry.length
+        return cursor
+
+    def make_room(self, length):
+        """
+        makeRoom(): evicts the least recently played entries until a slot and length bytes are free,
+        printing "evict:<id>" for each.
+        :param length: Bytes needed.
+        :type length: int
+        :return: False if even an empty store has no room.
+        :rtype: bool
+        Time: O(STORE_SLOTS^2)
+        """
+        while True:
+            stored = [slot for slot, entry in enumerate(self.store_index) if entry.kind != STORE_FREE]
+            used = sum(self.store_index[slot].length for slot in stored)
+            if len(stored) < STORE_SLOTS and EEPROM_SIZE - STORE_DATA_START - used >= length:
+                return True
+            if not stored:
+                return False
+            oldest = min(stored, key=lambda slot: self.store_used[slot])
+            self.println(f"{EVICT_KIND}:{self.store_index[oldest].id}")
+            self.free_slot(oldest)
+
+    def handle_store_begin(self, payload):
+        """
+        handleStoreBegin(): drops the entry with the id, makes room and opens the upload,
+        answered "store:<id>,ok" or "store:<id>,full".
+        :param payload: id, type, flags, hash, length (STORE_BEGIN_FORMAT).
+        :type payload: bytes
+        :return: None
+        Time: O(bytes moved by compact_store)
+        """
+        if len(payload) < STORE_BEGIN_SIZE:
+            return
+        entry_id, kind, flags, content_hash, length = struct.unpack_from(STORE_BEGIN_FORMAT, payload)
+        self.received()
+        if self.upload_slot != NO_SLOT:
+            self.store_index[self.upload_slot].kind = STORE_FREE  #an upload never finished
+        self.upload_slot = NO_SLOT
+        slot = self.find_slot(entry_id)
+        if slot != NO_SLOT:
+            self.free_slot(slot)
+        known = kind in (STORE_PRESET, STORE_SEQUENCE)
+        if not known or length > EEPROM_SIZE - STORE_DATA_START or not self.make_room(length):
+            self.reply_store(entry_id, STORE_FULL)
+            return
+        offset = self.compact_store()
+        slot = next(slot for slot, entry in enumerate(self.store_index) if entry.kind == STORE_FREE)
+        self.store_index[slot] = StoreEntry(entry_id, kind, flags, content_hash, offset, length)
+        self.upload_slot = slot
+        self.upload_received = 0
+        self.reply_store(entry_id, STORE_OK)
+
+    def handle_store_data(self, payload):
+        """
+        handleStoreData(): writes the chunk that continues the upload, answered with the bytes received so far.
+        :param payload: id, offset (STORE_DATA_FORMAT), then the bytes.
+        :type payload: bytes
+        :return: None
+        Time: O(len(payload)) EEPROM writes.
+        """
+        if len(payload) < STORE_DATA_HEADER:
+            return
+        entry_id, offset = struct.unpack_from(STORE_DATA_FORMAT, payload)
+        data = payload[STORE_DATA_HEADER:]
+        if self.upload_slot == NO_SLOT or self.store_index[self.upload_slot].id != entry_id:
+            self.reply_store(entry_id, STORE_BAD)
+            return
+        entry = self.store_index[self.upload_slot]
+        if offset == self.upload_received and offset + len(data) <= entry.length:
+            self.eeprom_update(entry.offset + offset, data)
+            self.upload_received += len(data)
+        self.reply_store(entry_id, self.upload_received)
+
+    def handle_store_end(self, payload):
+        """
+        handleStoreEnd(): the entry goes into the index if every byte arrived, "store:<id>,done", else
+        it is dropped, "store:<id>,bad".
+        :param payload: The id.
+        :type payload: bytes
+        :return: None
+        Time: O(ENTRY_SIZE)
+        """
+        if not payload:
+            return
+        entry_id = payload[0]
+        slot = self.upload_slot
+        self.upload_slot = NO_SLOT
+        entry = self.store_index[slot] if slot != NO_SLOT else None
+        if entry is None or entry.id != entry_id or self.upload_received != entry.length:
+            if entry is not None:
+                entry.kind = STORE_FREE
+            self.reply_store(entry_id, STORE_BAD)
+            return
+        self.save_entry(slot)
+        self.store_clock += 1
+        self.store_used[slot] = self.store_clock
+        self.reply_store(entry_id, STORE_DONE)
+
+    def reply_store(self, entry_id, status):
+        self.println(f"{STORE_KIND}:{entry_id},{status}")
+
+    def report_store(self):
+        """
+        reportStore(): prints the complete entries as "cache:<id>/<hash in hex>,...".
+        :return: None
+        Time: O(STORE_SLOTS)
+        """
+        self.received()
+        entries = [f"{entry.id}{HASH_SEPARATOR}{entry.hash:X}" for slot, entry in enumerate(self.store_index)
+                   if entry.kind != STORE_FREE and slot != self.upload_slot]
+        self.println(f"{CACHE_KIND}:" + ",".join(entries))
+
+    def play_stored(self, entry_id):
+        """
+        playStored(): a preset runs its commands, a sequence becomes the running effect; an id that is
+        not stored is answered "play:<id>,missing".
+        :param entry_id: The id.
+        :type entry_id: int
+        :return: None
+        Time: O(entry length) for a preset, O(num_leds) for a sequence.
+        """
+        self.received()
+        slot = self.find_slot(entry_id)
+        if slot == NO_SLOT:
+            self.println(f"{PLAY_KIND}:{entry_id},{PLAY_MISSING}")
+            return
+        self.store_clock += 1
+        self.store_used[slot] = self.store_clock
+        entry = self.store_index[slot]
+        if entry.kind == STORE_PRESET:
+            self.run_preset(entry)
+            return
+        if entry.length < SEQUENCE_HEADER:
+            return
+        self.play_slot = slot
+        self.play_cursor = SEQUENCE_HEADER
+        interval, = struct.unpack_from(SEQUENCE_FORMAT, self.eeprom, entry.offset)
+        self.sequence_time = max(interval, MIN_STEP_INTERVAL) / 1000
+        self.start_effect(EFFECT_SEQUENCE)
+
+    def run_preset(self, entry):
+        """
+        runPreset(): dispatches the preset's lines, cut to the line buffer; a preset never plays another entry.
+        :param entry: The preset.
+        :type entry: StoreEntry
+        :return: None
+        Time: O(entry length)
+        """
+        data = bytes(self.eeprom[entry.offset:entry.offset + entry.length])
+        for line in data.split(bytes([LINE_END_BYTE])):
+            command = line[:LINE_BUFFER_SIZE - 1].decode(ENCODING, errors='replace')
+            if not command.startswith(PLAY_PREFIX):
+                self.dispatch_command(command)
+
+    def apply_stored_frame(self):
+        """
+        applyStoredFrame(): applies the next frame record of the playing sequence, going back to the first
+        one at the end of a looping sequence.
+        :return: False at the end of a one-shot sequence or on a broken record.
+        :rtype: bool
+        Time: O(record length)
+        """
+        if self.play_slot == NO_SLOT or self.store_index[self.play_slot].kind != STORE_SEQUENCE:
+            return False
+        entry = self.store_index[self.play_slot]
+        if self.play_cursor + RECORD_HEADER > entry.length:
+            if not entry.flags & STORE_LOOP or self.play_cursor == SEQUENCE_HEADER:
+                return False
+            self.play_cursor = SEQUENCE_HEADER
+        opcode, length = struct.unpack_from(HEADER_FORMAT, self.eeprom, entry.offset + self.play_cursor)
+        if length > frame_buffer_size(self.num_leds) or self.play_cursor + RECORD_HEADER + length > entry.length:
+            return False
+        start = entry.offset + self.play_cursor + RECORD_HEADER
+        with self.condition:
+            self.applier.apply(opcode, bytes(self.eeprom[start:start + length]))
+        self.play_cursor += RECORD_HEADER + length
+        return True
+
+    def apply_stored_frames(self, skipped):
+        """
+        The frames of runSequence(): skipped frames are still applied, deltas build on them.
+        :param skipped: Frames to go past before the one shown.
+        :type skipped: int
+        :return: False once a one-shot sequence ended.
+        :rtype: bool
+        Time: O((skipped + 1) * record length)
+        """
+        more = True
+        for _ in range(skipped + 1):
+            more = self.apply_stored_frame()
+            if not more:
+                break
+        return more
+
+    def effect(self, effect_id):
+        """
+        This function returns the effect object for an id; it is kept for the whole session,
+        like the static variables of the firmware effect functions.
+        :param effect_id: The effect number.
+        :type effect_id: int
+        :return: The effect, or None for an unknown id.
+        :rtype: Effect or None
+        Time: O(1)
+        """
+        if effect_id not in self.effects and effect_id in EFFECTS:
+            effect_class = EFFECTS[effect_id]
+            if effect_class is RandomSparkle:
+                self.effects[effect_id] = RandomSparkle(self.num_leds, self.rng)
+            else:
+                self.effects[effect_id] = effect_class(self.num_leds)
+        return self.effects.get(effect_id)
+
+    def run_effect(self):
+        """
+        The effect branch of loop(): once a step interval has passed, skip the steps missed while busy
+        and show the one that is due.
+        :return: True if a step was shown.
+        :rtype: bool
+        Time: O(num_leds)
+        """
+        interval = self.effect_interval()
+        steps = int((time.monotonic() - self.last_step) / interval)
+        if steps < 1:
+            return False
+        self.last_step += steps * interval
+        return self.step_effect(steps - 1)
+
+    def step_effect(self, skipped=0):
+        """
+        runEffect(skipped): renders and shows the current effect after skipping steps.
+        :param skipped: Steps to jump over, like the firmware after a busy loop iteration.
+        :type skipped: int
+        :return: True if a step was shown, False if the effect id is unknown (the effect stops).
+        :rtype: bool
+        Time: O(num_leds)
+        """
+        if self.current_effect == EFFECT_SEQUENCE:
+            start = time.perf_counter()
+            more = self.apply_stored_frames(skipped)
+            self.step_total += time.perf_counter() - start
+            self.step_count += 1
+            self.show()
+            if not more:
+                self.command_in_progress = False  #a one-shot sequence keeps its last frame
+            return True
+        effect = self.effect(self.current_effect)
+        if effect is None:
+            self.command_in_progress = False
+            return False
+        start = time.perf_counter()
+        effect.step += skipped  #sparkle draws only for shown steps, like random() on the board
+        frame = effect.render()
+        with self.condition:
+            self.leds[:] = frame
+        self.step_total += time.perf_counter() - start
+        self.step_count += 1
+        self.show()
+        return True
+
+    def set_color(self, r, g, b):
+        with self.condition:
+            self.leds[:] = (r, g, b)
+        self.show()
+
+    def show(self):
+        """
+        FastLED.show(): takes show_time to clock the pixels out, then counts the update, timestamps it
+        and wakes wait_for().
+        :return: None
+        Time: O(1), plus the on_show callback.
+        """
+        start = time.perf_counter()
+        if self.show_time:
+            time.sleep(self.show_time)
+        elapsed = time.perf_counter() - start
+        self.show_count += 1
+        self.show_total += elapsed
+        self.show_max = max(self.show_max, elapsed)
+        with self.condition:
+            self.shows += 1
+            self.last_show = time.perf_counter()
+            self.condition.notify_all()
+        if self.on_show:
+            self.on_show(self.leds)
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        This function waits until predicate(simulator) is true after a show or a command.
+        :param predicate: Condition on the simulator state.
+        :type predicate: callable
+        :param timeout: Seconds to wait, None waits forever.
+        :type timeout: float
+        :return: True if the condition was met in time.
+        :rtype: bool
+        Time: O(number of shows while waiting)
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: predicate(self), timeout)
+
+    def snapshot(self):
+        """
+        This function copies leds[].
+        :return: A (num_leds, 3) uint8 array.
+        :rtype: np.ndarray
+        Time: O(num_leds)
+        """
+        with self.condition:
+            return self.leds.copy()
+
+    def showing(self, color):
+        """
+        This function tells if every LED shows one color.
+        :param color: (r, g, b).
+        :type color: tuple[int, int, int]
+        :return: True if the whole strip has that color.
+        :rtype: bool
+        Time: O(num_leds)
+        """
+        return bool(np.all(self.leds == np.asarray(color, dtype=np.uint8).reshape(1, CHANNELS)))
+
+
+class AsyncDeviceSimulator(DeviceSimulator):
+    def __init__(self, reader, writer, baudrate=None, **options):
+        """
+        The same ring model run as a coroutine on an asyncio stream, so hundreds of simulated
+        links fit in one event loop instead of needing a thread each.
+        :param reader: Device end of the link, read side.
+        :type reader: asyncio.StreamReader
+        :param writer: Device end of the link, write side (Serial.println goes here).
+        :type writer: asyncio.StreamWriter
+        :param baudrate: Paces received bytes at this line speed; None delivers them at once.
+        :type baudrate: int
+        :param options: num_leds, boot_delay, step_time, read_timeout, on_show, as DeviceSimulator (show_time
+                        would block the event loop).
+        :type options: dict
+        Time: O(num_leds)
+        """
+        super().__init__(writer, **options)
+        self.reader = reader
+        self.byte_time = byte_time(baudrate) if baudrate else 0.0
+        self.inbox = bytearray()
+        self.arrived = asyncio.Event()
+        self.eof = False
+
+    async def receive(self):
+        """
+        This coroutine is the UART: it moves received bytes into the inbox at line speed.
+        :return: None
+        Time: O(k), where k is the number of bytes received.
+        """
+        try:
+            while True:
+                data = await self.reader.read(READ_CHUNK)
+                if not data:
+                    break
+                if self.byte_time:
+                    await asyncio.sleep(len(data) * self.byte_time)
+                self.inbox += data
+                self.arrived.set()
+        except OSError:
+            pass  #host closed the link
+        finally:
+            self.eof = True
+            self.arrived.set()
+
+    async def wait_input(self, timeout=None):
+        """
+        This coroutine waits for new bytes (or the end of the link).
+        :param timeout: Seconds to wait, None waits forever.
+        :type timeout: float
+        :return: True if something arrived in time.
+        :rtype: bool
+        Time: O(1)
+        """
+        self.arrived.clear()
+        try:
+            await asyncio.wait_for(self.arrived.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def handle_baud(self, command):
+        self.println(BAUD_REFUSED)  #the stream has no rate to switch, the link stays as it is
+
+    async def check_input(self):
+        """
+        checkSerialInput() on the inbox: every complete ASCII line, or every buffered byte in binary mode.
+        :return: None
+        Time: O(k), where k is the number of bytes handled.
+        """
+        self.loop_start = time.perf_counter()
+        if not self.inbox:
+            return
+        self.pending += self.inbox
+        self.inbox.clear()
+        if not self.binary_mode:
+            self.read_lines()
+        if self.binary_mode and self.pending:
+            data = bytes(self.pending)
+            self.pending.clear()
+            for opcode, payload in self.decoder.feed(data):
+                self.process_frame(opcode, payload)
+
+    async def serve(self):
+        """
+        setup() and loop() until the host closes the link; between effect steps the coroutine sleeps
+        until input arrives or the next step is due.
+        :return: None
+        Time: O(n), where n is the number of loop iterations.
+        """
+        receiver = asyncio.ensure_future(self.receive())
+        try:
+            await asyncio.sleep(self.boot_delay)
+            self.println(READY)
+            while not self.stop_event.is_set() and not (self.eof and not self.inbox):
+                if not self.inbox:
+                    busy = self.command_in_progress or self.telemetry_interval
+                    await self.wait_input(self.next_step_wait() if busy else None)
+                await self.check_input()
+                if self.command_in_progress:
+                    self.run_effect()
+                self.end_loop()
+        except (OSError, ValueError):
+            pass  #host closed the link
+        finally:
+            receiver.cancel()
+            self.stop_event.set()
+            self.transport.close()
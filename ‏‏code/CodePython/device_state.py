@@ -0,0 +1,214 @@
+import threading
+import time
+from command_writer import command_kind, KIND_RGB, KIND_EFFECT, KIND_STOP, KIND_PLAY, RGB_PREFIX, PLAY_PREFIX
+from serial_reader import KIND_READY
+from effect_engine import EFFECTS, EFFECT_PULSE, EFFECT_COLOR_CHASE
+
+# Effect started by each parameterized command (now.ino reads only the prefix)
+PREFIX_EFFECTS = {"pulse:": EFFECT_PULSE, "chase:": EFFECT_COLOR_CHASE}
+PARAM_SEPARATOR = ','
+COLOR_MASK = 0xFF         #CRGB keeps the low byte of each sscanf'd int
+
+
+def parse_command(command):
+    """
+    This function decodes a command into what it does on the ring, following now.ino:
+    rgb sets a static color, a digit starts the effect named by its first character, pulse/chase
+    start their effect (parameters are kept, the firmware may honor them), stop halts the effect, play
+    runs a stored entry (its id is kept as the parameters).
+    :param command: An ASCII command.
+    :type command: str
+    :return: (kind, effect id, parameters, color); None where not applicable.
+    :rtype: tuple
+    Time: O(k), where k is the length of the command.
+    """
+    kind = command_kind(command)
+    if kind == KIND_RGB:
+        try:
+            color = tuple(int(value) & COLOR_MASK for value in command[len(RGB_PREFIX):].split(PARAM_SEPARATOR))
+        except ValueError:
+            color = None
+        return kind, None, None, color if color and len(color) == 3 else None
+    if kind == KIND_EFFECT:
+        for prefix, effect in PREFIX_EFFECTS.items():
+            if command.startswith(prefix):
+                return kind, effect, command[len(prefix):], None
+        return kind, int(command[0]), None, None
+    if kind == KIND_PLAY:
+        return kind, None, command[len(PLAY_PREFIX):], None
+    return kind, None, None, None
+
+
+class DeviceState:
+    def __init__(self):
+        """
+        Mirror of what the ring shows, kept from the commands and frames the host sends and the lines
+        the firmware prints. It tells SerialManager which commands would change nothing: the same
+        effect again, the same static color, stop while nothing runs. While the state is unknown
+        (a board that never printed Ready, a link that went down) nothing is treated as redundant.
+        Time: O(1)
+        """
+        self.lock = threading.Lock()
+        self.known = False
+        self.running = False
+        self.effect = None
+        self.params = None
+        self.color = None
+        self.frame = False
+        self.reported = {}
+        self.resets = 0
+        self.updated_at = None
+
+    def boot(self):
+        """
+        This function sets the state now.ino starts in: no effect running, nothing shown yet.
+        :return: None
+        Time: O(1)
+        """
+        with self.lock:
+            self.known = True
+            self.running = False
+            self.effect = None
+            self.params = None
+            self.color = None
+            self.frame = False
+            self.updated_at = time.monotonic()
+
+    def invalidate(self):
+        """
+        This function forgets the state, e.g. while the link is down, so the next command goes out
+        whatever it is.
+        :return: None
+        Time: O(1)
+        """
+        with self.lock:
+            self.known = False
+
+    def is_redundant(self, command):
+        """
+        This function tells if a command would leave the ring as it is.
+        :param command: An ASCII command.
+        :type command: str
+        :return: True if sending it changes nothing.
+        :rtype: bool
+        Time: O(k), where k is the length of the command.
+        """
+        kind, effect, params, color = parse_command(command)
+        with self.lock:
+            return self.redundant(kind, effect, params, color)
+
+    def redundant(self, kind, effect, params, color):
+        if not self.known:
+            return False
+        if kind == KIND_STOP:
+            return not self.running
+        if kind == KIND_EFFECT:
+            return self.running and effect == self.effect and params == self.params
+        if kind == KIND_RGB:
+            return color is not None and not self.running and not self.frame and color == self.color
+        return False  #a stored entry may have ended or been evicted, play always goes out
+
+    def accept(self, command):
+        """
+        This function records a command about to be sent, unless it is redundant.
+        :param command: An ASCII command.
+        :type command: str
+        :return: False if the command changes nothing and should be dropped.
+        :rtype: bool
+        Time: O(k), where k is the length of the command.
+        """
+        kind, effect, params, color = parse_command(command)
+        with self.lock:
+            if self.redundant(kind, effect, params, color):
+                return False
+            self.apply(kind, effect, params, color)
+            return True
+
+    def apply(self, kind, effect, params, color):
+        if kind == KIND_RGB:
+            self.running = False
+            self.color = color
+            self.frame = False
+        elif kind == KIND_EFFECT:
+            #An unknown id falls into runEffect's default branch, which stops the effect
+            self.running = effect in EFFECTS
+            self.effect = effect
+            self.params = params
+            self.color = None
+            self.frame = False
+        elif kind == KIND_STOP:
+            self.running = False
+        elif kind == KIND_PLAY:
+            #A sequence or a preset's commands: the mirror cannot tell what shows, only that it is not
+            #the effect or color it had, so the next one of those goes out
+            self.running = True
+            self.effect = None
+            self.params = params
+            self.color = None
+            self.frame = False
+        else:
+            return
+        self.known = True  #each of these leaves the ring in a state the mirror can describe
+        self.updated_at = time.monotonic()
+
+    def record(self, command):
+        """
+        This function records a command that goes out whether or not it is redundant.
+        :param command: An ASCII command.
+        :type command: str
+        :return: None
+        Time: O(k), where k is the length of the command.
+        """
+        kind, effect, params, color = parse_command(command)
+        with self.lock:
+            self.apply(kind, effect, params, color)
+
+    def restore(self, command):
+        """
+        This function records a command resent to rebuild the state (reconnect, reset), from boot.
+        :param command: The last state command.
+        :type command: str
+        :return: None
+        Time: O(k), where k is the length of the command.
+        """
+        self.boot()
+        self.record(command)
+
+    def show_frame(self):
+        """
+        This function records a host frame: the ring shows pixels the mirror does not track.
+        :return: None
+        Time: O(1)
+        """
+        with self.lock:
+            self.running = False
+            self.frame = True
+            self.color = None
+
+    def report(self, message):
+        """
+        This function takes a line from the firmware. A Ready line mid-session means the board
+        reset and lost its state.
+        :param message: The parsed message.
+        :type message: DeviceMessage
+        :return: True if the ring no longer shows what the host sent.
+        :rtype: bool
+        Time: O(1)
+        """
+        self.reported[message.kind] = message.fields or message.raw
+        if message.kind != KIND_READY:
+            return False
+        self.boot()
+        self.resets += 1
+        return True
+
+    def snapshot(self):
+        """
+        This function describes the mirrored state.
+        :return: known, running, effect, params, color, frame, resets and the last line of each kind.
+        :rtype: dict
+        Time: O(r), where r is the number of reported kinds.
+        """
+        with self.lock:
+            return {"known": self.known, "running": self.running, "effect": self.effect, "params": self.params,
+                    "color": self.color, "frame": self.frame, "resets": self.resets, "reported": dict(self.reported)}
@@ -0,0 +1,340 @@
+import abc
+import numpy as np
+from scheduler import get_scheduler
+from colors import hsv_to_rgb, apply_output
+
+# Same values as the defines in now.ino, so host frames match the firmware's leds[] bit for bit
+NUM_LEDS = 14
+MAX_NUM_COLOR = 255
+RAINBOW_STEP = 10
+COLORWIPE_STEP = 5
+SPARKLE_PROB = 2
+SPARKLE_RANGE = 100
+DELAY_TIME = 10
+DEFAULT_FPS = 1000 // DELAY_TIME
+CHANNELS = 3
+PULSE_PERIOD = 2 * MAX_NUM_COLOR
+
+# Firmware effect ids (currentEffect in now.ino)
+EFFECT_RAINBOW = 1
+EFFECT_PULSE = 2
+EFFECT_COLOR_WIPE = 3
+EFFECT_RANDOM_SPARKLE = 4
+EFFECT_COLOR_CHASE = 5
+
+# avr-libc random(): Park-Miller minimal standard generator, seed 1 after reset
+AVR_RANDOM_SEED = 1
+AVR_RANDOM_ZERO_SEED = 123459876
+AVR_RANDOM_MAX = 0x7FFFFFFF
+PARK_MILLER_A = 16807
+PARK_MILLER_Q = 127773
+PARK_MILLER_R = 2836
+
+
+class AvrRandom:
+    def __init__(self, seed=AVR_RANDOM_SEED):
+        """
+        Reproduces the Arduino random() sequence so host-rendered sparkles match the device.
+        :param seed: Initial state (1 after a reset, like avr-libc).
+        :type seed: int
+        Time: O(1)
+        """
+        self.state = seed
+
+    def next(self):
+        """
+        This function returns the next value of avr-libc random().
+        :return: A value in 0..AVR_RANDOM_MAX.
+        :rtype: int
+        Time: O(1)
+        """
+        x = self.state or AVR_RANDOM_ZERO_SEED
+        hi, lo = divmod(x, PARK_MILLER_Q)
+        x = PARK_MILLER_A * lo - PARK_MILLER_R * hi
+        if x < 0:
+            x += AVR_RANDOM_MAX
+        self.state = x
+        return x % (AVR_RANDOM_MAX + 1)
+
+    def randrange(self, howbig, count):
+        """
+        This function draws count values of Arduino random(howbig).
+        :param howbig: Exclusive upper bound.
+        :type howbig: int
+        :param count: Number of draws.
+        :type count: int
+        :return: The draws in order.
+        :rtype: np.ndarray
+        Time: O(count)
+        """
+        return np.fromiter((self.next() % howbig for _ in range(count)), dtype=np.int32, count=count)
+
+
+class Effect(abc.ABC):
+    effect_id = None
+    splittable = True   #Any part of the strip renders on its own (see segment)
+
+    def __init__(self, num_leds=NUM_LEDS):
+        """
+        Base class of host-rendered effects. Each call to render_block advances the effect
+        by that many firmware steps, exactly like calling the firmware function repeatedly.
+        :param num_leds: Number of LEDs on the strip.
+        :type num_leds: int
+        Time: O(1)
+        """
+        self.num_leds = num_leds
+        self.step = 0
+        self.positions = np.arange(num_leds)
+
+    def segment(self, start, stop):
+        """
+        This function restricts rendering to LEDs start..stop-1, so several processes can each render
+        a part of one long strip; the part looks exactly like that stretch of the whole strip.
+        :param start: First LED.
+        :type start: int
+        :param stop: LED after the last one.
+        :type stop: int
+        :return: self.
+        :rtype: Effect
+        Time: O(stop - start)
+        """
+        self.positions = np.arange(start, stop)
+        return self
+
+    def render_block(self, count):
+        """
+        This function renders the next count frames at once.
+        :param count: Number of frames.
+        :type count: int
+        :return: A (count, num_leds, 3) uint8 array.
+        :rtype: np.ndarray
+        Time: O(count * num_leds)
+        """
+        steps = np.arange(self.step, self.step + count)
+        self.step += count
+        return self.frames(steps)
+
+    def render(self):
+        """
+        This function renders the next frame.
+        :return: A (num_leds, 3) uint8 array.
+        :rtype: np.ndarray
+        Time: O(num_leds)
+        """
+        return self.render_block(1)[0]
+
+    @abc.abstractmethod
+    def frames(self, steps):
+        """
+        This function renders the frames of the given steps; each effect implements it.
+        :param steps: Step numbers to render.
+        :type steps: np.ndarray
+        :return: A (len(steps), num_leds, 3) uint8 array.
+        :rtype: np.ndarray
+        Time: O(len(steps) * num_leds)
+        """
+
+    def cycle_length(self):
+        """
+        This function tells after how many steps the effect repeats itself.
+        :return: Steps per cycle, None when the effect never repeats.
+        :rtype: int or None
+        Time: O(1)
+        """
+        return None
+
+
+class Rainbow(Effect):
+    effect_id = EFFECT_RAINBOW
+
+    def frames(self, steps):
+        """
+        leds[i] = CHSV(hue + i * RAINBOW_STEP, 255, 255), hue++ per step.
+        :param steps: Step numbers to render.
+        :type steps: np.ndarray
+        :return: Frames for these steps.
+        :rtype: np.ndarray
+        Time: O(len(steps) * num_leds)
+        """
+        return hsv_to_rgb(steps[:, None] + self.positions[None, :] * RAINBOW_STEP)
+
+    def cycle_length(self):
+        return MAX_NUM_COLOR + 1  #the hue is a byte
+
+
+class Pulse(Effect):
+    effect_id = EFFECT_PULSE
+
+    def frames(self, steps):
+        """
+        Red ramping 0..255..0, one level per step.
+        :param steps: Step numbers to render.
+        :type steps: np.ndarray
+        :return: Frames for these steps.
+        :rtype: np.ndarray
+        Time: O(len(steps) * num_leds)
+        """
+        phase = steps % PULSE_PERIOD
+        level = np.where(phase > MAX_NUM_COLOR, PULSE_PERIOD - phase, phase)
+        frames = np.zeros((len(steps), len(self.positions), CHANNELS), dtype=np.uint8)
+        frames[:, :, 0] = level[:, None]
+        return frames
+
+    def cycle_length(self):
+        return PULSE_PERIOD
+
+
+class ColorWipe(Effect):
+    effect_id = EFFECT_COLOR_WIPE
+
+    def frames(self, steps):
+        """
+        Whole strip set to CHSV(colorIndex), colorIndex += 5 and wraps to 0 at 255.
+        :param steps: Step numbers to render.
+        :type steps: np.ndarray
+        :return: Frames for these steps.
+        :rtype: np.ndarray
+        Time: O(len(steps) * num_leds)
+        """
+        color_index = (steps % self.cycle_length()) * COLORWIPE_STEP
+        return np.repeat(hsv_to_rgb(color_index)[:, None, :], len(self.positions), axis=1)
+
+    def cycle_length(self):
+        return (MAX_NUM_COLOR + COLORWIPE_STEP - 1) // COLORWIPE_STEP
+
+
+class RandomSparkle(Effect):
+    effect_id = EFFECT_RANDOM_SPARKLE
+    splittable = False  #the draws follow one random() sequence along the whole strip
+
+    def __init__(self, num_leds=NUM_LEDS, rng=None):
+        """
+        White sparkles with probability SPARKLE_PROB percent, drawn from the device's random() sequence.
+        :param num_leds: Number of LEDs on the strip.
+        :type num_leds: int
+        :param rng: Random source shared with other effects, like the single random() on the device.
+        :type rng: AvrRandom
+        Time: O(1)
+        """
+        super().__init__(num_leds)
+        self.rng = rng or AvrRandom()
+
+    def frames(self, steps):
+        """
+        One random(100) draw per LED per step, LED lit when the draw is below SPARKLE_PROB.
+        :param steps: Step numbers to render.
+        :type steps: np.ndarray
+        :return: Frames for these steps.
+        :rtype: np.ndarray
+        Time: O(len(steps) * num_leds)
+        """
+        draws = self.rng.randrange(SPARKLE_RANGE, len(steps) * self.num_leds)
+        lit = (draws < SPARKLE_PROB).reshape(len(steps), self.num_leds)
+        return np.repeat((lit * MAX_NUM_COLOR).astype(np.uint8)[:, :, None], CHANNELS, axis=2)
+
+
+class ColorChase(Effect):
+    effect_id = EFFECT_COLOR_CHASE
+
+    def frames(self, steps):
+        """
+        A single red LED moving one position per step.
+        :param steps: Step numbers to render.
+        :type steps: np.ndarray
+        :return: Frames for these steps.
+        :rtype: np.ndarray
+        Time: O(len(steps) * num_leds)
+        """
+        frames = np.zeros((len(steps), len(self.positions), CHANNELS), dtype=np.uint8)
+        frames[:, :, 0] = (self.positions[None, :] == (steps % self.num_leds)[:, None]) * MAX_NUM_COLOR
+        return frames
+
+    def cycle_length(self):
+        return self.num_leds
+
+
+EFFECTS = {effect.effect_id: effect for effect in (Rainbow, Pulse, ColorWipe, RandomSparkle, ColorChase)}
+
+
+def create_effect(effect_id, num_leds=NUM_LEDS):
+    """
+    This function creates a host effect from its firmware id.
+    :param effect_id: One of the EFFECT_* constants.
+    :type effect_id: int
+    :param num_leds: Number of LEDs on the strip.
+    :type num_leds: int
+    :return: The effect.
+    :rtype: Effect
+    Time: O(1)
+    """
+    return EFFECTS[effect_id](num_leds)
+
+
+class FrameStreamer:
+    def __init__(self, serial_manager, effect, fps=DEFAULT_FPS, output_lut=None, scheduler=None):
+        """
+        Renders an effect on the host and streams its frames to the ring at a target frame rate.
+        Frames go through the writer queue, where a newer frame replaces one still waiting,
+        so a slow link shows the latest frame instead of falling behind.
+        :param serial_manager: The connected manager (binary protocol required).
+        :type serial_manager: SerialManager
+        :param effect: The effect to render.
+        :type effect: Effect
+        :param fps: Target frames per second.
+        :type fps: float
+        :param output_lut: Optional output stage: a table from build_output_lut or a ColorPipeline.
+        :type output_lut: np.ndarray or ColorPipeline
+        :param scheduler: Timer thread pacing the frames, defaults to the shared scheduler.
+        :type scheduler: Scheduler
+        Time: O(1)
+        """
+        self.serial_manager = serial_manager
+        self.effect = effect
+        self.period = 1.0 / fps
+        self.output_lut = output_lut
+        self.scheduler = scheduler or get_scheduler()
+        self.timer = None
+        self.frames_rendered = 0
+
+    def next_frame(self):
+        """
+        This function renders one frame and applies the output stage.
+        :return: The frame to send.
+        :rtype: np.ndarray
+        Time: O(num_leds)
+        """
+        frame = apply_output(self.output_lut, self.effect.render())
+        self.frames_rendered += 1
+        return frame
+
+    def tick(self):
+        """
+        Scheduler callback: renders and queues one frame.
+        :return: None
+        Time: O(num_leds)
+        """
+        self.serial_manager.send_frame(self.next_frame())
+
+    def start(self):
+        """
+        This function starts streaming on absolute deadlines; missed ticks are skipped, not queued.
+        :return: The timer handle (its stats hold the frame jitter).
+        :rtype: TimerHandle
+        Time: O(log t)
+        """
+        self.stop()
+        name = f"stream-{type(self.effect).__name__}-{id(self)}"
+        self.serial_manager.frame_budget = self.period  #the telemetry judges the ring against it
+        self.timer = self.scheduler.call_every(self.period, self.tick, name=name)
+        return self.timer
+
+    def stop(self):
+        """
+        This function stops streaming.
+        :return: None
+        Time: O(1)
+        """
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+            self.serial_manager.frame_budget = None
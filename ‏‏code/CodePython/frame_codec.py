@@ -0,0 +1,219 @@
+import struct
+import numpy as np
+from frame_protocol import (encode_frame, encode_frame_upload, OP_FRAME, OP_FRAME_DELTA, OP_FRAME_RLE,
+                            FRAME_START_FORMAT, MAX_PAYLOAD, FrameError)
+
+CHANNELS = 3
+KEYFRAME_INTERVAL = 50
+MAX_RUN = 255
+SPAN_HEADER_FORMAT = '<HB'   # start index, pixel count
+SPAN_HEADER_SIZE = struct.calcsize(SPAN_HEADER_FORMAT)
+MAX_SPAN = 255
+RUN_SIZE = 1 + CHANNELS     # count + rgb
+START_SIZE = struct.calcsize(FRAME_START_FORMAT)
+MAX_UPLOAD_PIXELS = (MAX_PAYLOAD - START_SIZE) // CHANNELS  #Pixels one OP_FRAME carries
+MAX_FRAME_LEDS = 0x10000    #Start offsets and delta spans address LEDs with 16 bits
+
+ENCODING_FULL = "full"
+ENCODING_RLE = "rle"
+ENCODING_DELTA = "delta"
+ENCODING_AUTO = "auto"
+
+
+def split_runs(starts, lengths, limit):
+    """
+    This function cuts runs longer than limit into several runs, so counts fit in one byte.
+    :param starts: Start index of each run.
+    :type starts: np.ndarray
+    :param lengths: Length of each run.
+    :type lengths: np.ndarray
+    :param limit: Longest run allowed.
+    :type limit: int
+    :return: The new (starts, lengths).
+    :rtype: tuple[np.ndarray, np.ndarray]
+    Time: O(r), where r is the number of output runs.
+    """
+    if not len(lengths) or lengths.max() <= limit:
+        return starts, lengths
+    pieces = (lengths + limit - 1) // limit
+    first = np.repeat(starts, pieces)
+    offset = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    new_starts = first + offset * limit
+    new_lengths = np.minimum(np.repeat(starts + lengths, pieces) - new_starts, limit)
+    return new_starts, new_lengths
+
+
+def mask_runs(mask):
+    """
+    This function finds the runs of True values in a boolean mask.
+    :param mask: Boolean vector.
+    :type mask: np.ndarray
+    :return: Start index and length of each run.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    Time: O(n)
+    """
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts, ends - starts
+
+
+def encode_full(frame):
+    """
+    This function encodes a whole frame as raw RGB (OP_FRAME from index 0). A frame longer than one
+    payload goes as several OP_FRAME uploads, each starting where the previous one ended.
+    :param frame: A (num_leds, 3) uint8 array, at most MAX_FRAME_LEDS long.
+    :type frame: np.ndarray
+    :return: Wire bytes.
+    :rtype: bytes
+    Time: O(n)
+    """
+    starts = range(0, len(frame), MAX_UPLOAD_PIXELS) or [0]
+    return b''.join(encode_frame_upload(frame[start:start + MAX_UPLOAD_PIXELS].tobytes(), start) for start in starts)
+
+
+def encode_rle(frame):
+    """
+    This function encodes a whole frame as (count, r, g, b) runs of identical colors.
+    A solid frame from setColor or colorWipe becomes a single 4 byte run per 255 LEDs.
+    :param frame: A (num_leds, 3) uint8 array.
+    :type frame: np.ndarray
+    :return: Wire bytes.
+    :rtype: bytes
+    Time: O(n)
+    """
+    changes = np.any(frame[1:] != frame[:-1], axis=1)
+    starts = np.concatenate(([0], np.flatnonzero(changes) + 1))
+    lengths = np.diff(np.concatenate((starts, [len(frame)])))
+    starts, lengths = split_runs(starts, lengths, MAX_RUN)
+    runs = np.empty((len(starts), RUN_SIZE), dtype=np.uint8)
+    runs[:, 0] = lengths
+    runs[:, 1:] = frame[starts]
+    return encode_frame(OP_FRAME_RLE, runs.tobytes())
+
+
+def encode_delta(frame, previous):
+    """
+    This function encodes only the spans of pixels that differ from the previous frame,
+    each as (start, count) followed by count RGB triplets.
+    :param frame: The new (num_leds, 3) uint8 frame.
+    :type frame: np.ndarray
+    :param previous: The frame the device currently shows.
+    :type previous: np.ndarray
+    :return: Wire bytes.
+    :rtype: bytes
+    Time: O(n)
+    """
+    starts, lengths = split_runs(*mask_runs(np.any(frame != previous, axis=1)), MAX_SPAN)
+    chunks = []
+    for start, length in zip(starts.tolist(), lengths.tolist()):
+        chunks.append(struct.pack(SPAN_HEADER_FORMAT, start, length))
+        chunks.append(frame[start:start + length].tobytes())
+    return encode_frame(OP_FRAME_DELTA, b''.join(chunks))
+
+
+class FrameEncoder:
+    def __init__(self, encoding=ENCODING_AUTO, keyframe_interval=KEYFRAME_INTERVAL):
+        """
+        Stateful encoder that tracks what the device shows and sends the cheapest update.
+        Deltas are only valid if every encoded frame reaches the device, so encode() must be
+        called once per frame actually written (the writer thread does this).
+        :param encoding: ENCODING_AUTO picks the smallest; the others force one format.
+        :type encoding: str
+        :param keyframe_interval: A self-contained frame is sent at least this often for resync.
+        :type keyframe_interval: int
+        Time: O(1)
+        """
+        self.encoding = encoding
+        self.keyframe_interval = keyframe_interval
+        self.previous = None
+        self.since_keyframe = 0
+        self.counts = {ENCODING_FULL: 0, ENCODING_RLE: 0, ENCODING_DELTA: 0}
+
+    def reset(self):
+        """
+        This function forgets the device state so the next frame is a keyframe (after a reconnect).
+        :return: None
+        Time: O(1)
+        """
+        self.previous = None
+
+    def encode(self, frame):
+        """
+        This function encodes a frame as full, RLE or delta, whichever is allowed and shortest.
+        RLE runs or delta spans too long for one payload leave the frame to the full encoding.
+        :param frame: A (num_leds, 3) uint8 array.
+        :type frame: np.ndarray
+        :return: Wire bytes.
+        :rtype: bytes
+        :raises FrameError: If the frame has more LEDs than the protocol addresses (MAX_FRAME_LEDS).
+        Time: O(n)
+        """
+        if len(frame) > MAX_FRAME_LEDS:
+            raise FrameError(f"frame too long ({len(frame)} LEDs)")
+        keyframe_due = (self.previous is None or self.previous.shape != frame.shape
+                        or self.since_keyframe >= self.keyframe_interval)
+        candidates = []
+        if self.encoding in (ENCODING_AUTO, ENCODING_FULL) or (keyframe_due and self.encoding == ENCODING_DELTA):
+            candidates.append((ENCODING_FULL, encode_full(frame)))
+        optional = []
+        if self.encoding in (ENCODING_AUTO, ENCODING_RLE):
+            optional.append((ENCODING_RLE, encode_rle, (frame,)))
+        if not keyframe_due and self.encoding in (ENCODING_AUTO, ENCODING_DELTA):
+            optional.append((ENCODING_DELTA, encode_delta, (frame, self.previous)))
+        for encoding, encode, args in optional:
+            try:
+                candidates.append((encoding, encode(*args)))
+            except FrameError:
+                pass  #too long for one payload
+        if not candidates:
+            candidates.append((ENCODING_FULL, encode_full(frame)))
+        encoding, data = min(candidates, key=lambda candidate: len(candidate[1]))
+        self.since_keyframe = self.since_keyframe + 1 if encoding == ENCODING_DELTA else 0
+        self.counts[encoding] += 1
+        self.previous = frame.copy()
+        return data
+
+
+class FrameApplier:
+    def __init__(self, num_leds):
+        """
+        Host-side mirror of the firmware decoder, applies frame opcodes to a leds[] buffer.
+        :param num_leds: Number of LEDs.
+        :type num_leds: int
+        Time: O(n)
+        """
+        self.leds = np.zeros((num_leds, CHANNELS), dtype=np.uint8)
+
+    def apply(self, opcode, payload):
+        """
+        This function applies one decoded OP_FRAME, OP_FRAME_RLE or OP_FRAME_DELTA payload.
+        Pixels past the end of the strip are ignored, like on the device.
+        :param opcode: The frame opcode.
+        :type opcode: int
+        :param payload: The frame payload.
+        :type payload: bytes
+        :return: True if the opcode was a frame opcode.
+        :rtype: bool
+        Time: O(len(payload))
+        """
+        count = len(self.leds)
+        if opcode == OP_FRAME:
+            start, = struct.unpack_from(FRAME_START_FORMAT, payload)
+            pixels = np.frombuffer(payload, np.uint8, offset=START_SIZE).reshape(-1, CHANNELS)
+            self.leds[start:start + len(pixels)] = pixels[:max(0, count - start)]
+        elif opcode == OP_FRAME_RLE:
+            runs = np.frombuffer(payload, np.uint8).reshape(-1, RUN_SIZE)
+            colors = np.repeat(runs[:, 1:], runs[:, 0], axis=0)[:count]
+            self.leds[:len(colors)] = colors
+        elif opcode == OP_FRAME_DELTA:
+            offset = 0
+            while offset + SPAN_HEADER_SIZE <= len(payload):
+                start, length = struct.unpack_from(SPAN_HEADER_FORMAT, payload, offset)
+                offset += SPAN_HEADER_SIZE
+                pixels = np.frombuffer(payload, np.uint8, length * CHANNELS, offset).reshape(-1, CHANNELS)
+                offset += length * CHANNELS
+                self.leds[start:start + length] = pixels[:max(0, count - start)]
+        else:
+            return False
+        return True
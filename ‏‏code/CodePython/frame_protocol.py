@@ -0,0 +1,314 @@
+import struct
+
+# Wire layout of one frame before COBS: opcode(1) length(2, little endian) payload(length) crc8(1).
+# After COBS encoding the frame contains no zero byte, so 0x00 marks the end of every frame.
+FRAME_DELIMITER = 0x00
+HEADER_FORMAT = '<BH'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+CRC_SIZE = 1
+MAX_PAYLOAD = 0xFFFF
+COBS_BLOCK = 0xFF
+
+# CRC-8 (polynomial x^8 + x^2 + x + 1, init 0), same table in now.ino
+CRC8_POLY = 0x07
+CRC8_INIT = 0x00
+
+# Opcodes, kept in sync with the OP_* defines in now.ino
+OP_RGB = 0x01
+OP_EFFECT = 0x02
+OP_PULSE = 0x03
+OP_CHASE = 0x04
+OP_STOP = 0x05
+OP_TEXT = 0x06
+OP_FRAME = 0x07
+OP_FRAME_DELTA = 0x08
+OP_FRAME_RLE = 0x09
+OP_SPEED = 0x0A
+OP_STORE_BEGIN = 0x0B
+OP_STORE_DATA = 0x0C
+OP_STORE_END = 0x0D
+OP_PLAY = 0x0E
+FRAME_START_FORMAT = '<H'
+SPEED_FORMAT = '<H'        #Milliseconds between two effect steps
+STORE_BEGIN_FORMAT = '<BBBIH'  #id, type, flags, content hash, length
+STORE_DATA_FORMAT = '<BH'      #id, offset, then the bytes
+# Stored entries (see preset_cache.py): a preset holds ASCII commands, one per line; a sequence holds its
+# frame interval, then one record per frame: the frame's header (opcode, length) and payload, without CRC
+STORE_PRESET = 1
+STORE_SEQUENCE = 2
+STORE_LOOP = 0x01              #Flag: the sequence starts over after its last frame
+SEQUENCE_FORMAT = '<H'         #Milliseconds between two frames of a sequence
+
+# Negotiation: the host asks in ASCII, a binary capable firmware answers with the same line
+PROTOCOL_ASCII = "ascii"
+PROTOCOL_AUTO = "auto"
+PROTOCOL_BINARY = "binary"
+HELLO_COMMAND = "proto:bin"
+HELLO_REPLY = "proto:bin"
+
+RGB_PREFIX = "rgb:"
+PULSE_PREFIX = "pulse:"
+CHASE_PREFIX = "chase:"
+SPEED_PREFIX = "speed:"
+PLAY_PREFIX = "play:"
+CACHE_QUERY = "cache?"
+STOP_COMMAND = "stop"
+FIELD_SEPARATOR = ','
+ENCODING = 'ascii'
+BYTE_MASK = 0xFF
+
+
+class FrameError(Exception):
+    """Raised when a frame cannot be decoded."""
+
+
+def build_crc8_table():
+    """
+    This function precomputes the CRC-8 lookup table.
+    :return: 256 entry table.
+    :rtype: bytes
+    Time: O(256 * 8)
+    """
+    table = bytearray(256)
+    for value in range(256):
+        crc = value
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC8_POLY) & BYTE_MASK if crc & 0x80 else (crc << 1) & BYTE_MASK
+        table[value] = crc
+    return bytes(table)
+
+
+CRC8_TABLE = build_crc8_table()
+
+
+def crc8(data, crc=CRC8_INIT):
+    """
+    This function computes the CRC-8 of the given bytes.
+    :param data: The bytes to checksum.
+    :type data: bytes
+    :param crc: Initial value, allows incremental use.
+    :type crc: int
+    :return: The checksum.
+    :rtype: int
+    Time: O(k), where k is the number of bytes.
+    """
+    table = CRC8_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
+
+def cobs_encode(data):
+    """
+    This function removes every zero byte from data using Consistent Overhead Byte Stuffing.
+    :param data: Raw frame bytes.
+    :type data: bytes
+    :return: Encoded bytes (without the trailing delimiter).
+    :rtype: bytes
+    Time: O(k), where k is the number of bytes.
+    """
+    out = bytearray([0])
+    code_index = 0
+    code = 1
+    for byte in data:
+        if byte:
+            out.append(byte)
+            code += 1
+        if not byte or code == COBS_BLOCK:
+            out[code_index] = code
+            code_index = len(out)
+            out.append(0)
+            code = 1
+    out[code_index] = code
+    return bytes(out)
+
+
+def cobs_decode(data):
+    """
+    This function reverses cobs_encode.
+    :param data: Encoded bytes (without the trailing delimiter).
+    :type data: bytes
+    :return: The raw frame bytes.
+    :rtype: bytes
+    :raises FrameError: If the encoding is malformed.
+    Time: O(k), where k is the number of bytes.
+    """
+    out = bytearray()
+    index = 0
+    length = len(data)
+    while index < length:
+        code = data[index]
+        if code == 0:
+            raise FrameError("zero byte inside COBS frame")
+        end = index + code
+        if end > length:
+            raise FrameError("truncated COBS block")
+        out += data[index + 1:end]
+        index = end
+        if code != COBS_BLOCK and index < length:
+            out.append(0)
+    return bytes(out)
+
+
+def encode_frame(opcode, payload=b''):
+    """
+    This function builds a complete wire frame: header, payload, CRC, COBS and delimiter.
+    :param opcode: One of the OP_* constants.
+    :type opcode: int
+    :param payload: The opcode specific payload.
+    :type payload: bytes
+    :return: Bytes ready to write to the port.
+    :rtype: bytes
+    Time: O(k), where k is the payload length.
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise FrameError("payload too long")
+    raw = struct.pack(HEADER_FORMAT, opcode, len(payload)) + payload
+    raw += bytes([crc8(raw)])
+    return cobs_encode(raw) + bytes([FRAME_DELIMITER])
+
+
+def decode_frame(encoded):
+    """
+    This function decodes one frame (without its delimiter) and checks length and CRC.
+    :param encoded: COBS encoded frame.
+    :type encoded: bytes
+    :return: The opcode and payload.
+    :rtype: tuple[int, bytes]
+    :raises FrameError: On a malformed frame or bad checksum.
+    Time: O(k), where k is the frame length.
+    """
+    raw = cobs_decode(encoded)
+    if len(raw) < HEADER_SIZE + CRC_SIZE:
+        raise FrameError("frame too short")
+    if crc8(raw[:-CRC_SIZE]) != raw[-1]:
+        raise FrameError("bad checksum")
+    opcode, length = struct.unpack_from(HEADER_FORMAT, raw)
+    payload = raw[HEADER_SIZE:-CRC_SIZE]
+    if len(payload) != length:
+        raise FrameError("bad length")
+    return opcode, payload
+
+
+def parse_values(text):
+    """
+    This function parses the comma separated integers of an ASCII command.
+    :param text: e.g. "255,0,10".
+    :type text: str
+    :return: The integers.
+    :rtype: list[int]
+    Time: O(k), where k is the length of the text.
+    """
+    return [int(value) for value in text.split(FIELD_SEPARATOR)]
+
+
+def encode_command(command):
+    """
+    This function translates an ASCII command into its binary frame.
+    Commands without a dedicated opcode are carried verbatim in an OP_TEXT frame.
+    :param command: ASCII command such as "rgb:1,2,3", "pulse:1,2,3,4", "chase:1,2,3", "speed:20", "play:3", "stop"
+                    or "1".
+    :type command: str
+    :return: Wire bytes.
+    :rtype: bytes
+    Time: O(k), where k is the length of the command.
+    """
+    try:
+        if command.startswith(RGB_PREFIX):
+            return encode_frame(OP_RGB, bytes(parse_values(command[len(RGB_PREFIX):])[:3]))
+        if command.startswith(PULSE_PREFIX):
+            r, g, b, speed = parse_values(command[len(PULSE_PREFIX):])[:4]
+            return encode_frame(OP_PULSE, struct.pack('<BBBH', r, g, b, speed))
+        if command.startswith(CHASE_PREFIX):
+            return encode_frame(OP_CHASE, bytes(parse_values(command[len(CHASE_PREFIX):])[:3]))
+        if command.startswith(SPEED_PREFIX):
+            return encode_frame(OP_SPEED, struct.pack(SPEED_FORMAT, int(command[len(SPEED_PREFIX):])))
+        if command.startswith(PLAY_PREFIX):
+            return encode_frame(OP_PLAY, bytes([int(command[len(PLAY_PREFIX):])]))
+        if command == STOP_COMMAND:
+            return encode_frame(OP_STOP)
+        if command.isdigit() and len(command) == 1:
+            return encode_frame(OP_EFFECT, bytes([int(command)]))
+    except (ValueError, struct.error):
+        pass
+    return encode_frame(OP_TEXT, command.encode(ENCODING))
+
+
+def speed_command(interval_ms):
+    """
+    This function builds the command that sets the time between two firmware effect steps.
+    :param interval_ms: Milliseconds per step, 1..65535.
+    :type interval_ms: int
+    :return: "speed:<ms>".
+    :rtype: str
+    Time: O(1)
+    """
+    return f"{SPEED_PREFIX}{int(interval_ms)}"
+
+
+def play_command(entry_id):
+    """
+    This function builds the command that plays a preset or sequence stored on the device.
+    :param entry_id: The id it was stored under, 0..255.
+    :type entry_id: int
+    :return: "play:<id>".
+    :rtype: str
+    Time: O(1)
+    """
+    return f"{PLAY_PREFIX}{int(entry_id)}"
+
+
+def encode_frame_upload(pixels, start=0):
+    """
+    This function builds an OP_FRAME frame that writes RGB pixels into leds[] starting at start.
+    :param pixels: Packed RGB bytes (an (n, 3) uint8 array's tobytes()).
+    :type pixels: bytes
+    :param start: Index of the first LED written.
+    :type start: int
+    :return: Wire bytes.
+    :rtype: bytes
+    Time: O(k), where k is the number of pixel bytes.
+    """
+    return encode_frame(OP_FRAME, struct.pack(FRAME_START_FORMAT, start) + pixels)
+
+
+class FrameDecoder:
+    def __init__(self, max_frame=MAX_PAYLOAD + HEADER_SIZE + CRC_SIZE + MAX_PAYLOAD // COBS_BLOCK + 2):
+        """
+        Incremental decoder that splits a byte stream on the frame delimiter.
+        :param max_frame: Longest encoded frame accepted before the buffer is dropped.
+        :type max_frame: int
+        Time: O(1)
+        """
+        self.max_frame = max_frame
+        self.buffer = bytearray()
+        self.errors = 0
+        self.dropped = 0
+
+    def feed(self, data):
+        """
+        This function adds bytes and returns every valid frame completed by them.
+        Corrupt frames are counted in self.errors, their bytes in self.dropped, and skipped.
+        :param data: Bytes from the stream.
+        :type data: bytes
+        :return: List of (opcode, payload) tuples.
+        :rtype: list[tuple[int, bytes]]
+        Time: O(k), where k is the number of bytes fed.
+        """
+        frames = []
+        for byte in data:
+            if byte == FRAME_DELIMITER:
+                if self.buffer:
+                    try:
+                        frames.append(decode_frame(bytes(self.buffer)))
+                    except FrameError:
+                        self.errors += 1
+                        self.dropped += len(self.buffer)
+                    self.buffer.clear()
+            elif len(self.buffer) < self.max_frame:
+                self.buffer.append(byte)
+            else:
+                self.errors += 1
+                self.dropped += len(self.buffer) + 1
+                self.buffer.clear()
+        return frames
@@ -1,7 +1,11 @@
 import tkinter as tk
-from tkinter import colorchooser, simpledialog
+from tkinter import colorchooser, simpledialog, filedialog
 from material_button import MaterialButton
-import threading
+from scheduler import get_scheduler
+from metrics import get_registry
+from preview_renderer import RingPreview
+from colors import hex_to_rgb
+from audio_reactive import AudioStreamer, WavSource, AudioFormatError
 
 # Constants for UI elements
 TITLE_TEXT = "LED Controller"
@@ -15,6 +19,28 @@ ARROW_BUTTON_SPACING = 20
 GET_PULSE_SPEED = "Enter pulse speed(seconds): "
 GET_PULSE_INTERVAL = "Enter interval between pulse (milliseconds): "
 
+# Constants for the live ring preview
+PREVIEW_SIZE = 160
+PREVIEW_RADIUS = 60
+PREVIEW_LED_SIZE = 6
+PREVIEW_NUM_LEDS = 14
+PREVIEW_OFF_COLOR = "gray"
+PREVIEW_BACKGROUND = "white"
+
+# Constants for the connection status indicator
+STATUS_FONT = ("Helvetica", 11)
+STATUS_TEXTS = {
+    "disconnected": "● Disconnected",
+    "connecting": "● Connecting...",
+    "connected": "● Connected",
+}
+STATUS_COLORS = {
+    "disconnected": "#B00020",
+    "connecting": "#F9A825",
+    "connected": "#2E7D32",
+}
+STATUS_DEFAULT = "disconnected"
+
 # Constants for pages
 PAGE_1 = 0
 PAGE_2 = 1
@@ -33,6 +59,8 @@ PULSE_MIN_SPEED = 1
 PULSE_DEFAULT_SPEED = 1
 PULSE_MIN_INTERVAL = 0
 PULSE_DEFAULT_INTERVAL = 1000
+PULSE_TIMER_NAME = "pulse"
+MS_PER_SECOND = 1000.0
 #FOTO_PATH = "Foto\\Foto\\fotoApp.ico"
 # Constants for dialog titles
 DIALOG_TITLE_COLOR_PICKER = "Choose a color"
@@ -40,6 +68,8 @@ DIALOG_TITLE_PULSE_SPEED = "Speed"
 DIALOG_TITLE_PULSE_INTERVAL = "Interval"
 DIALOG_TITLE_CHASE_COLOR = "Choose a color"
 DIALOG_TITLE_STOP_EFFECT = "Stop Effect"
+DIALOG_TITLE_AUDIO = "Choose a WAV file"
+AUDIO_FILE_TYPES = [("WAV audio", "*.wav")]
 
 # Constants for button texts
 BUTTON_TEXT_RAINBOW = "🌈 Rainbow"
@@ -48,10 +78,13 @@ BUTTON_TEXT_COLOR_WIPE = "🖌 Color Wipe"
 BUTTON_TEXT_RANDOM_SPARKLE = "✨ Random Sparkle"
 BUTTON_TEXT_COLOR_CHASE = "🏃 Color Chase"
 BUTTON_TEXT_CHOOSE_COLOR = "🎨 Choose Color"
+BUTTON_TEXT_AUDIO = "🎵 Audio"
 BUTTON_TEXT_STOP = "⛔ Stop"
 
 BUTTON_RIGHT = ">"
 BUTTON_LEFT = "<"
+CALLBACK_METRIC = "tk_callback_seconds"
+CALLBACK_HELP = "Time a button callback held the Tk event loop"
 
 class LEDController:
     def __init__(self, master, serial_manager):
@@ -71,15 +104,22 @@ class LEDController:
         self.pulse_running = False
         self.pulse_interval = PULSE_DEFAULT_INTERVAL
         self.pulse_delay = 0
+        self.pulse_timer = None
+        self.audio_streamer = None
+        self.scheduler = get_scheduler()
+        self.callback_timers = {}
 
         # Initialize UI components
         self.label = self.create_title_label()
+        self.status_label = self.create_status_label()
+        self.preview = self.create_preview()
         self.arrow_frame = self.create_arrow_frame()
         self.buttons_frame = self.create_buttons_frame()
 
-        # Initialize buttons and threading
+        # Initialize buttons and connection status
         self.create_buttons()
-        self.start_read_thread()
+        self.show_connection_state(self.ser_manager.state)
+        self.ser_manager.add_state_listener(self.on_state_change)
 
     def create_title_label(self):
         """
@@ -91,6 +131,63 @@ class LEDController:
         """
         return tk.Label(self.master, text=TITLE_TEXT, font=TITLE_FONT, fg=BACKGROUND_COLOR)
 
+    def create_status_label(self):
+        """
+        This function creates the connection status indicator.
+        :param: None
+        :return: The status label.
+        :rtype: tk.Label
+        Time: O(1)
+        """
+        status_label = tk.Label(self.master, font=STATUS_FONT)
+        status_label.pack()
+        return status_label
+
+    def on_state_change(self, state):
+        """
+        Connection state listener, called on the connecting thread; hands the update to the Tk loop.
+        :param state: The new connection state.
+        :type state: str
+        :return: None
+        Time: O(1)
+        """
+        self.master.after(0, self.show_connection_state, state)
+
+    def show_connection_state(self, state):
+        """
+        This function updates the status indicator. Must run on the Tk thread.
+        :param state: The connection state.
+        :type state: str
+        :return: None
+        Time: O(1)
+        """
+        state = state if state in STATUS_TEXTS else STATUS_DEFAULT
+        self.status_label.configure(text=STATUS_TEXTS[state], fg=STATUS_COLORS[state])
+
+    def create_preview(self):
+        """
+        This function creates a small live preview of the ring, drawn with batched canvas updates.
+        :param: None
+        :return: The preview renderer.
+        :rtype: RingPreview
+        Time: O(PREVIEW_NUM_LEDS)
+        """
+        canvas = tk.Canvas(self.master, width=PREVIEW_SIZE, height=PREVIEW_SIZE, bg=PREVIEW_BACKGROUND,
+                           highlightthickness=0)
+        canvas.pack()
+        center = (PREVIEW_SIZE // 2, PREVIEW_SIZE // 2)
+        return RingPreview(canvas, PREVIEW_NUM_LEDS, center, PREVIEW_RADIUS, PREVIEW_LED_SIZE, PREVIEW_OFF_COLOR)
+
+    def show_frame(self, frame):
+        """
+        Shows a host-rendered frame in the live preview. Must run on the Tk thread.
+        :param frame: A (num_leds, 3) uint8 array.
+        :type frame: np.ndarray
+        :return: None
+        Time: O(n), where n is the number of LEDs.
+        """
+        self.preview.show_frame(frame)
+
     def create_arrow_frame(self):
         """
         This function creates a frame for navigation buttons (previous and next).
@@ -129,7 +226,7 @@ class LEDController:
         Time: O(1)
         """
         button = tk.Button(
-            parent_frame, text=text, command=command,
+            parent_frame, text=text, command=self.timed_callback(text, command),
             font=BUTTON_FONT, bg=BACKGROUND_COLOR, fg=TEXT_COLOR,
             relief="flat", padx=BUTTON_PADDING, pady=BUTTON_PADDING
         )
@@ -185,6 +282,7 @@ class LEDController:
         return [
             (BUTTON_TEXT_COLOR_CHASE, self.open_chase_dialog),
             (BUTTON_TEXT_CHOOSE_COLOR, self.open_color_picker),
+            (BUTTON_TEXT_AUDIO, self.open_audio_dialog),
             (BUTTON_TEXT_STOP, self.stop_effect)
         ]
 
@@ -231,12 +329,29 @@ class LEDController:
         :return: None
         Time: O(1)
         """
-        if callable(command):
-            btn = MaterialButton(self.buttons_frame, text=text, command=command)
-        else:
-            btn = MaterialButton(self.buttons_frame, text=text, command=lambda c=command: self.send_command(c))
+        if not callable(command):
+            command = lambda c=command: self.send_command(c)
+        btn = MaterialButton(self.buttons_frame, text=text, command=self.timed_callback(text, command))
         btn.pack(pady=BUTTON_SPACING)
 
+    def timed_callback(self, text, command):
+        """
+        This function wraps a button callback so its run time on the Tk thread is recorded,
+        one histogram per button. While metrics are disabled the callback is returned as it is.
+        :param text: The button text, used as the metric label.
+        :type text: str
+        :param command: The callback.
+        :type command: callable
+        :return: The callback to give to the button.
+        :rtype: callable
+        Time: O(1)
+        """
+        timer = self.callback_timers.get(text)
+        if timer is None:
+            timer = get_registry().histogram(CALLBACK_METRIC, CALLBACK_HELP, labels={"button": text})
+            self.callback_timers[text] = timer
+        return timer.time(command)
+
     def previous_page(self):
         """
         This function navigates to the previous page, if possible.
@@ -262,13 +377,14 @@ class LEDController:
 
     def send_command(self, command):
         """
-        Sends a command to the serial manager after stopping any pulse effect.
+        Sends a command to the serial manager after stopping any pulse effect or audio stream.
         :param command: The command to send to the serial manager.
         :type command: str
         :return: None
         Time: O(1)
         """
         self.stop_pulse()
+        self.stop_audio()
         if command.startswith(COMMAND_PULSE):
             self.start_pulse(command)
         else:
@@ -276,18 +392,22 @@ class LEDController:
 
     def start_pulse(self, command):
         """
-        Starts the pulse effect if it is not already running.
+        Starts the pulse effect on the scheduler thread, replacing any pulse already running.
+        Ticks use absolute monotonic deadlines, so Tk latency and open dialogs add no drift.
         :param command: The pulse command to start.
         :type command: str
         :return: None
-        Time: O(1)
+        Time: O(log t), where t is the number of scheduled timers.
         """
-        if not self.pulse_running:
-            self.pulse_running = True
-            self.send_pulse_command(command)
+        self.stop_pulse()
+        self.pulse_running = True
+        period = (self.pulse_interval + self.pulse_delay) / MS_PER_SECOND
+        self.pulse_timer = self.scheduler.call_every(period, lambda: self.send_pulse_command(command),
+                                                     name=PULSE_TIMER_NAME)
+
     def send_pulse_command(self, command):
         """
-        Thsi function sends the pulse command to the serial manager repeatedly.
+        Thsi function sends the pulse command to the serial manager, called on every scheduler tick.
         :param command: The pulse command to send.
         :type command: str
         :return: None
@@ -295,15 +415,67 @@ class LEDController:
         """
         if self.pulse_running:
             self.ser_manager.send_command(command)
-            self.master.after(self.pulse_interval + self.pulse_delay, lambda: self.send_pulse_command(command))
 
     def stop_pulse(self):
         """
-        Stops the pulse effect.
+        Stops the pulse effect by cancelling its timer, so a quick stop/start never leaves two chains.
         :return: None
         Time: O(1)
         """
         self.pulse_running = False
+        if self.pulse_timer:
+            self.pulse_timer.cancel()
+            self.pulse_timer = None
+
+    def open_audio_dialog(self):
+        """
+        Opens a file dialog and streams the chosen WAV file as an audio reactive effect.
+        :return: None
+        Time: O(1)
+        """
+        path = filedialog.askopenfilename(title=DIALOG_TITLE_AUDIO, filetypes=AUDIO_FILE_TYPES)
+        if path:
+            self.start_audio(path)
+
+    def start_audio(self, path):
+        """
+        Starts streaming a WAV file to the ring on the audio thread, replacing any stream already running.
+        Frames need the binary protocol; an ASCII-only ring ignores them.
+        :param path: The WAV file.
+        :type path: str
+        :return: The streamer, or None if the file cannot be read.
+        :rtype: AudioStreamer
+        Time: O(1)
+        """
+        self.stop_pulse()
+        self.stop_audio()
+        try:
+            source = WavSource(path)
+        except (OSError, ValueError, AudioFormatError):
+            return None
+        self.audio_streamer = AudioStreamer(self.ser_manager, source, PREVIEW_NUM_LEDS)
+        self.audio_streamer.start()
+        return self.audio_streamer
+
+    def stop_audio(self):
+        """
+        Stops the audio stream, if one is playing.
+        :return: None
+        Time: O(1)
+        """
+        if self.audio_streamer:
+            self.audio_streamer.stop()
+            self.audio_streamer.source.close()
+            self.audio_streamer = None
+
+    def timer_stats(self):
+        """
+        Returns jitter statistics of the periodic host to device timers (pulse, frame streaming).
+        :return: Mapping of timer name to lateness summary in milliseconds.
+        :rtype: dict
+        Time: O(t * w log w)
+        """
+        return self.scheduler.stats()
 
     def open_color_picker(self):
         """
@@ -354,23 +526,14 @@ class LEDController:
 
     def hex_to_rgb(self, hex_color):
         """
-        Converts a hexadecimal color string to an RGB tuple.
+        Converts a hexadecimal color string to an RGB tuple (parsed once per color, see colors.hex_to_rgb).
         :param hex_color: The hexadecimal color string to convert (e.g., '#FF5733').
         :type hex_color: str
         :return: A tuple of integers representing the RGB values.
         :rtype: tuple[int, int, int]
         Time: O(1)
         """
-        hex_color = hex_color.lstrip('#')
-        return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
-
-    def start_read_thread(self):
-        """
-        Starts a background thread to handle serial communication and read data from the serial port.
-        :return: None
-        Time: O(1)
-        """
-        threading.Thread(target=self.ser_manager.read_from_serial, daemon=True).start()
+        return hex_to_rgb(hex_color)
 
     def open_chase_dialog(self):
         """
@@ -398,6 +561,7 @@ class LEDController:
         :return: None
         Time: O(1)
         """
+        self.stop_audio()
         self.ser_manager.send_command(COMMAND_RAINBOW)
 
     def send_color_wipe_command(self):
@@ -406,6 +570,7 @@ class LEDController:
         :return: None
         Time: O(1)
         """
+        self.stop_audio()
         self.ser_manager.send_command(COMMAND_COLOR_WIPE)
 
     def send_random_sparkle_command(self):
@@ -414,15 +579,18 @@ class LEDController:
         :return: None
         Time: O(1)
         """
+        self.stop_audio()
         self.ser_manager.send_command(COMMAND_RANDOM_SPARKLE)
 
     def send_color_command(self, rgb):
         """
-        Sends the RGB color command to the serial manager.
+        Sends the RGB color command to the serial manager after stopping any audio stream.
         :param rgb: The RGB color to send.
         :type rgb: tuple[int, int, int]
         :return: None
         Time: O(1)
         """
+        self.stop_audio()
         command = f'rgb:{rgb[0]},{rgb[1]},{rgb[2]}'
         self.ser_manager.send_command(command)
+        self.preview.fill(f'#{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}')
@@ -1,129 +1,122 @@
-import tkinter as tk
-import math
 import threading
-import random
-from material_button import MaterialButton
-from serial_manager import SerialManager
+from preview_renderer import ColorPalette
+from serial_manager import SerialManager, STATE_CONNECTED, CONNECT_THREAD
 from led_controller import LEDController
+from telemetry import TELEMETRY_INTERVAL
 
 
-SIZE_WIDTH = 600
-SIZE_HEIGHT = 600
 RESET_TIME = 300
-SIZE_LED = 10
+NEXT_STEP_TIME = 100
 NAME_PROJECT = "RGB LED RING"
 COLOR_TRUN_OFF = "gray"
-BACK_COLOR = "white"
-RADIUS = 100
-CENTER_X = 300
-CENTER_Y = 300
-NUM_LED = 12
 NUM_LED_OFF = 1
-NUM_LED_ON = NUM_LED - NUM_LED_OFF
-MAX_NUM_COLOR_OX = 0xFFFFFF
-MIN_NUM_COLOR_OX = 0
+CLOSE_EVENT = "WM_DELETE_WINDOW"
+MAX_BAUDRATE = 1000000    #Negotiated after connecting, firmware without the handshake stays at 9600
 
 class LedRingApp:
-    def __init__(self, master):
+    def __init__(self, master, serial_manager=None):
+        """
+        Builds the controller in the given root right away and connects to the Arduino in the background.
+        The ring preview plays the splash animation until the connection is up.
+        :param master: The single Tk root of the application.
+        :type master: tk.Tk
+        :param serial_manager: Link to use, defaults to a SerialManager on the configured port that negotiates
+                               the line speed up to MAX_BAUDRATE and reads the firmware's telemetry.
+        :type serial_manager: SerialManager
+        """
         self.master = master
         self.master.title(NAME_PROJECT)
-        self.canvas = tk.Canvas(master, width=SIZE_WIDTH, height=SIZE_HEIGHT, bg=BACK_COLOR)
-        self.canvas.pack()
-
-        self.leds = []
-        self.radius = RADIUS
-        self.center = (CENTER_X, CENTER_Y)
-        self.create_leds()
+        self.serial_manager = serial_manager or SerialManager(max_baudrate=MAX_BAUDRATE,
+                                                              telemetry_interval=TELEMETRY_INTERVAL)
+        self.controller = LEDController(master, self.serial_manager)
+        self.preview = self.controller.preview
+        self.palette = ColorPalette()
         self.running = True
         self.current_led = 0
-        self.num_leds_on = NUM_LED_ON
-        self.serial_manager = SerialManager()
+        self.num_leds_on = self.preview.num_leds - NUM_LED_OFF
+        self.serial_manager.add_state_listener(self.on_state_change)
+        self.master.protocol(CLOSE_EVENT, self.close)
         self.start_animation()
 
-        self.label = tk.Label(master, text=NAME_PROJECT, font=("Arial", 16, "bold"), fg="#6200EE")
-        self.label.pack(pady=20)
-
         self.check_connection()
 
-    def create_leds(self):
-        """
-        This function create the led ring
-        :return: None
-        """
-        for i in range(NUM_LED):
-            angle = 2 * math.pi * i / NUM_LED
-            x = self.center[0] + self.radius * math.cos(angle)
-            y = self.center[1] + self.radius * math.sin(angle)
-            led = self.canvas.create_oval(x - SIZE_LED, y - SIZE_LED, x + SIZE_LED, y + SIZE_LED, fill=COLOR_TRUN_OFF)
-            self.leds.append(led)
-
     def start_animation(self):
         self.animate()
 
+    def lit_indexes(self):
+        """
+        This function returns the LEDs lit in the current animation step
+        :param: None
+        :return: LED indexes
+        :rtype: list[int]
+        """
+        num_leds = self.preview.num_leds
+        return [(self.current_led + i) % num_leds for i in range(self.num_leds_on)]
+
     def animate(self):
         """
-        This function make led ring animation
+        This function make led ring animation, one batched canvas update per step
         :param: None
         :return: None
-        time: O(num_leds_On)
+        time: O(num_leds)
         """
         if not self.running:
             #If flage stop
             return
-        for i in range(self.num_leds_on):
-            led_index = (self.current_led + i) % len(self.leds)  #Calculte the led index
-            color = self.random_color()                          #random color for led
-            self.canvas.itemconfig(self.leds[led_index], fill=color) #Chenge led color
-        self.master.after(RESET_TIME, self.reset_leds)                      #reset led
+        colors = [COLOR_TRUN_OFF] * self.preview.num_leds
+        for led_index, color in zip(self.lit_indexes(), self.palette.sample(self.num_leds_on)):
+            colors[led_index] = color                           #random color for led
+        self.preview.update(colors)                             #Chenge all changed leds at once
+        self.master.after(RESET_TIME, self.reset_leds)          #reset led
 
     def reset_leds(self):
         """
         This funcrtion reset led to the default color
         :param: None
         :return: None
-        :time: O(num_leds_on)
-        """
-        for i in range(self.num_leds_on):
-            led_index = (self.current_led + i) % len(self.leds)
-            self.canvas.itemconfig(self.leds[led_index], fill=COLOR_TRUN_OFF) #set color to COLOR_TRUE_OFF
-        self.current_led = (self.current_led + 1) % len(self.leds) #Move to the next led
-        self.master.after(100, self.animate)
-
-    def random_color(self):
-        """
-        This function generate a randome color in HEX format
-        :param: None
-        :return: random color in HEX format
-        :rtype: HEX
+        :time: O(1) canvas calls
         """
-        return f'#{random.randint(MIN_NUM_COLOR_OX, MAX_NUM_COLOR_OX):06x}'
+        if not self.running:
+            return
+        self.preview.fill(COLOR_TRUN_OFF)                              #set color to COLOR_TRUE_OFF
+        self.current_led = (self.current_led + 1) % self.preview.num_leds #Move to the next led
+        self.master.after(NEXT_STEP_TIME, self.animate)
 
     def check_connection(self):
-        """C
-        This function check ardouni conect
+        """
+        This function connect to the ardouni in the background, the UI stays usable meanwhile
         :param: None
         :return: none
         """
+        threading.Thread(target=self.serial_manager.connect, name=CONNECT_THREAD, daemon=True).start()
 
-        threading.Thread(target=self.connect_arduino).start()
-
-    def connect_arduino(self):
+    def on_state_change(self, state):
         """
-        This functiom connect tp arduino
-        param: None
+        This function is called on the connecting thread when the link state changes
+        :param state: The new connection state
+        :type state: str
         :return: None
         """
-        self.serial_manager.connect()
-        self.master.after(0, self.show_main_app)
+        if state == STATE_CONNECTED:
+            self.master.after(0, self.show_main_app)
 
     def show_main_app(self):
         """
-        This function display the main application
+        This function ends the splash animation once the ring is connected
+        :param: none
+        :return: None
+        """
+        if not self.running:
+            return  #reconnected after a drop, keep the ring as the user left it
+        self.running = False
+        self.preview.fill(COLOR_TRUN_OFF)
+
+    def close(self):
+        """
+        This function closes the serial link and the window
         :param: none
         :return: None
         """
+        self.running = False
+        self.serial_manager.close()
         self.master.destroy()
-        main_root = tk.Tk()
-        main_root.iconbitmap(FOTO_PATH) #Foto app
-        LEDController(main_root, self.serial_manager)
-        main_root.mainloop()
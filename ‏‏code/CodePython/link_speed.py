@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+from async_logger import get_logger
+from telemetry import TELEMETRY_KIND
+
+# Handshake, kept in sync with now.ino. Every board boots at the safe rate; the host proposes a
+# faster one, both switch, and the rate only sticks if a test pattern goes both ways intact.
+SAFE_BAUDRATE = 9600
+BAUD_RATES = (115200, 250000, 500000, 1000000, 2000000)  #Exact divisors of 16 MHz, except 115200 (2.1 % off)
+BAUD_PREFIX = "baud:"
+BAUD_REFUSED = "baud:no"
+BAUD_OK = "baud:ok"
+# 'U' (0x55) and '*' (0x2A) alternate every bit; the rest covers digits, both cases and the top of ASCII
+SYNC_LINE = "sync:UUUU****0123456789ABCDEFabcdef~~~~"
+BAUD_REPLY_TIMEOUT = 0.5      #Wait for the answer to a proposal; old firmware never answers
+BAUD_CONFIRM_TIMEOUT = 0.25   #Firmware's BAUD_TIMEOUT: how long each side waits at the new rate
+BAUD_SETTLE = 0.002           #Lets the board finish Serial.begin() before the pattern goes out
+BAUD_REVERT = 2 * BAUD_CONFIRM_TIMEOUT  #After a failed rate the board is back on the old one by then
+ENCODING = 'ascii'
+LINE_END = "\n"
+TELEMETRY_LINE = TELEMETRY_KIND + ":"
+# Cache of the best rate per port; MAX_FAILURES short lived links at a rate demote it one step
+CACHE_FILE = ".led_ring_baud.json"
+MAX_FAILURES = 2
+STABLE_LINK = 60.0            #Seconds up before a link error no longer counts against the rate
+# Log events
+BAUD_SWITCHED = "baud_switched"
+BAUD_FAILED = "baud_failed"
+BAUD_DEMOTED = "baud_demoted"
+
+
+def baud_candidates(max_baudrate, current=SAFE_BAUDRATE):
+    """
+    This function lists the rates to propose, slowest first, above the current one and up to the cap.
+    :param max_baudrate: Highest rate to try.
+    :type max_baudrate: int
+    :param current: Rate the link runs at now.
+    :type current: int
+    :return: The rates in the order they are proposed.
+    :rtype: list[int]
+    Time: O(r), where r is the number of known rates.
+    """
+    return [rate for rate in BAUD_RATES if current < rate <= max_baudrate]
+
+
+def read_reply(ser, timeout):
+    """
+    This function reads one line within timeout, passing over telemetry records of a board that was
+    not reset when the port opened.
+    :param ser: An open port.
+    :type ser: serial.Serial
+    :param timeout: Seconds to wait.
+    :type timeout: float
+    :return: The line without its terminator, empty on timeout.
+    :rtype: str
+    Time: O(timeout)
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        ser.timeout = max(0.0, deadline - time.monotonic())
+        line = ser.readline().decode(ENCODING, errors='replace').strip()
+        if not line.startswith(TELEMETRY_LINE):
+            return line
+        if time.monotonic() >= deadline:
+            return ""
+
+
+def propose(ser, rate, current):
+    """
+    This function runs the handshake for one rate. At the current rate the host sends "baud:<rate>",
+    the firmware answers the same line (or "baud:no") and switches; at the new rate the host sends
+    the sync pattern, the firmware echoes it, then both confirm with "baud:ok". On any mismatch or
+    timeout both sides go back to the current rate.
+    :param ser: An open port, nothing else reading or writing it.
+    :type ser: serial.Serial
+    :param rate: The proposed rate.
+    :type rate: int
+    :param current: The rate both sides use now.
+    :type current: int
+    :return: True if switched, False if the rate failed, None if the firmware never answered.
+    :rtype: bool or None
+    Time: O(BAUD_REPLY_TIMEOUT + BAUD_REVERT) in the worst case.
+    """
+    proposal = BAUD_PREFIX + str(rate)
+    ser.reset_input_buffer()
+    #The leading empty line ends whatever garbage a failed attempt left in the firmware's line
+    ser.write((LINE_END + proposal + LINE_END).encode(ENCODING))
+    reply = read_reply(ser, BAUD_REPLY_TIMEOUT)
+    if not reply:
+        return None
+    if reply != proposal:
+        return False
+    ser.baudrate = rate
+    time.sleep(BAUD_SETTLE)
+    ser.reset_input_buffer()
+    ser.write((SYNC_LINE + LINE_END).encode(ENCODING))
+    if read_reply(ser, BAUD_CONFIRM_TIMEOUT) == SYNC_LINE:
+        ser.write((BAUD_OK + LINE_END).encode(ENCODING))
+        if read_reply(ser, BAUD_CONFIRM_TIMEOUT) == BAUD_OK:
+            return True
+    ser.baudrate = current
+    time.sleep(BAUD_REVERT)
+    ser.reset_input_buffer()
+    return False
+
+
+def negotiate_baudrate(ser, max_baudrate, preferred=None, current=SAFE_BAUDRATE):
+    """
+    This function raises the line speed as far as the link holds. A cached rate is proposed first;
+    without one (or if it fails) the rates are proposed one after the other, slowest first, and
+    the climb stops at the first failure. A port demoted to the current rate is left there. Firmware
+    that does not know the handshake never answers, so the link stays where it was.
+    :param ser: An open port at the current rate, nothing else reading or writing it.
+    :type ser: serial.Serial
+    :param max_baudrate: Highest rate to try.
+    :type max_baudrate: int
+    :param preferred: Rate that worked last time on this port, or None.
+    :type preferred: int
+    :param current: Rate both sides use now.
+    :type current: int
+    :return: The rate in use afterwards.
+    :rtype: int
+    Time: O(r * (BAUD_REPLY_TIMEOUT + BAUD_REVERT)), where r is the number of rates tried.
+    """
+    log = get_logger()
+    timeout = ser.timeout
+    try:
+        if preferred is not None and preferred <= current:
+            return current  #demoted all the way down, see BaudCache.link_error
+        if preferred and preferred <= max_baudrate:
+            result = propose(ser, preferred, current)
+            if result is None:
+                return current
+            if result:
+                log.info(BAUD_SWITCHED, baudrate=preferred, cached=True)
+                return preferred
+            log.warning(BAUD_FAILED, baudrate=preferred)
+        for rate in baud_candidates(max_baudrate, current):
+            result = propose(ser, rate, current)
+            if not result:
+                if result is False:
+                    log.warning(BAUD_FAILED, baudrate=rate)
+                break
+            current = rate
+        if current != SAFE_BAUDRATE:
+            log.info(BAUD_SWITCHED, baudrate=current, cached=False)
+        return current
+    finally:
+        ser.timeout = timeout
+
+
+class BaudCache:
+    def __init__(self, path=None):
+        """
+        The best rate each port held, in a small JSON file, so the next connect proposes it first
+        instead of climbing again. A rate whose links keep dying soon after the connect is demoted
+        one step.
+        :param path: The file, None keeps the cache in memory only.
+        :type path: str
+        Time: O(1)
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def load(self):
+        if self.entries is None:
+            self.entries = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path) as file:
+                        self.entries = json.load(file)
+                except (OSError, ValueError):
+                    pass  #a broken cache only costs one climb
+        return self.entries
+
+    def save(self):
+        """
+        This function writes the cache, through a temporary file so a crash never leaves half of it.
+        :return: None
+        Time: O(p), where p is the number of ports.
+        """
+        if not self.path:
+            return
+        temporary = self.path + ".tmp"
+        try:
+            with open(temporary, "w") as file:
+                json.dump(self.entries, file, indent=1, sort_keys=True)
+            os.replace(temporary, self.path)
+        except OSError:
+            pass
+
+    def get(self, port):
+        """
+        This function returns the rate cached for a port.
+        :param port: Port name.
+        :type port: str
+        :return: The rate, or None.
+        :rtype: int
+        Time: O(1)
+        """
+        with self.lock:
+            entry = self.load().get(port)
+            return entry["rate"] if entry else None
+
+    def store(self, port, rate):
+        """
+        This function records the rate a port was negotiated to.
+        :param port: Port name.
+        :type port: str
+        :param rate: The rate.
+        :type rate: int
+        :return: None
+        Time: O(p), where p is the number of ports.
+        """
+        with self.lock:
+            entries = self.load()
+            entry = entries.get(port)
+            if entry and entry["rate"] == rate:
+                return
+            entries[port] = {"rate": rate, "failures": 0}
+            self.save()
+
+    def link_error(self, port, rate, uptime):
+        """
+        This function counts a link that failed at a negotiated rate. After MAX_FAILURES failures
+        within STABLE_LINK of the connect, the port is demoted to the next slower rate; a link that
+        stayed up longer clears the count.
+        :param port: Port name.
+        :type port: str
+        :param rate: The rate the link ran at.
+        :type rate: int
+        :param uptime: Seconds the link was up.
+        :type uptime: float
+        :return: The rate to propose next time.
+        :rtype: int
+        Time: O(p + r), where p is the number of ports and r the number of known rates.
+        """
+        with self.lock:
+            entry = self.load().setdefault(port, {"rate": rate, "failures": 0})
+            if uptime >= STABLE_LINK:
+                entry["failures"] = 0
+            else:
+                entry["failures"] += 1
+                if entry["failures"] >= MAX_FAILURES:
+                    slower = [candidate for candidate in BAUD_RATES if candidate < rate]
+                    entry["rate"] = slower[-1] if slower else SAFE_BAUDRATE
+                    entry["failures"] = 0
+                    get_logger().warning(BAUD_DEMOTED, port=port, baudrate=entry["rate"])
+            self.save()
+            return entry["rate"]
+
+
+default_cache = None
+default_cache_lock = threading.Lock()
+
+
+def get_baud_cache():
+    """
+    This function returns the process wide cache, kept in a file in the home directory; the rings of
+    a DeviceGroup share it so none of them overwrites what another one stored.
+    :return: The shared cache.
+    :rtype: BaudCache
+    Time: O(1)
+    """
+    global default_cache
+    with default_cache_lock:
+        if default_cache is None:
+            default_cache = BaudCache(os.path.join(os.path.expanduser("~"), CACHE_FILE))
+        return default_cache
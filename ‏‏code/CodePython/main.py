@@ -1,12 +1,20 @@
+import argparse
 import tkinter as tk
 from led_ring_app import LedRingApp
+from metrics import start_from_env
+from ring_daemon import DaemonClient
 
 FOTO_PATH = "Foto\\Foto\\fotoApp.ico"
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RGB LED ring controller")
+    parser.add_argument("--daemon", help="drive the ring through a ring_daemon socket (path or host:port)")
+    args = parser.parse_args()
+    start_from_env()             #Metrics endpoint, only when RGB_RING_METRICS asks for it
+    link = DaemonClient(args.daemon) if args.daemon else None
     root = tk.Tk()               #Creat the main application window
     root.iconbitmap(FOTO_PATH)   #Foto app
-    splash = LedRingApp(root)    #Initalize the LedRingApp class, passong gthe main window
+    splash = LedRingApp(root, link)  #Initalize the LedRingApp class, passong gthe main window
     root.geometry("600x600")     #Set the size of the window
     root.mainloop()
 
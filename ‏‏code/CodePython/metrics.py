@@ -0,0 +1,374 @@
+import bisect
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_ENV = "RGB_RING_METRICS"      #"1" enables metrics, a port number or a socket path also serves them
+METRICS_HOST = "127.0.0.1"
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+NAMESPACE = "rgb_ring_"
+# Seconds, from a fast write on a USB serial adapter up to a Tk callback that froze the UI
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+HELP_LINE = "# HELP %s %s"
+TYPE_LINE = "# TYPE %s %s"
+SAMPLE_LINE = "%s%s %s"
+SERVER_THREAD = "metrics-server"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    """
+    This function renders labels in the Prometheus text format.
+    :param labels: Label names and values.
+    :type labels: dict
+    :return: '{a="1",b="2"}' or an empty string.
+    :rtype: str
+    Time: O(l), where l is the number of labels.
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in sorted(labels.items())) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=None):
+        """
+        A monotonically increasing value.
+        :param name: Metric name without the namespace.
+        :type name: str
+        :param help_text: One line description.
+        :type help_text: str
+        :param labels: Constant labels of this series.
+        :type labels: dict
+        Time: O(1)
+        """
+        self.name = NAMESPACE + name
+        self.help_text = help_text
+        self.labels = format_labels(labels)
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+
+class FunctionMetric:
+    def __init__(self, name, help_text, kind, function, labels=None):
+        """
+        A counter or gauge read from existing state when scraped, so the hot path pays nothing.
+        :param name: Metric name without the namespace.
+        :type name: str
+        :param help_text: One line description.
+        :type help_text: str
+        :param kind: "counter" or "gauge".
+        :type kind: str
+        :param function: Returns the current value.
+        :type function: callable
+        :param labels: Constant labels of this series.
+        :type labels: dict
+        Time: O(1)
+        """
+        self.name = NAMESPACE + name
+        self.help_text = help_text
+        self.kind = kind
+        self.function = function
+        self.labels = format_labels(labels)
+
+    def samples(self):
+        return [(self.name, self.labels, self.function())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS, labels=None):
+        """
+        Counts observations in fixed buckets, plus their sum; percentiles are computed by the scraper.
+        :param name: Metric name without the namespace.
+        :type name: str
+        :param help_text: One line description.
+        :type help_text: str
+        :param buckets: Sorted upper bounds.
+        :type buckets: tuple[float]
+        :param labels: Constant labels of this series.
+        :type labels: dict
+        Time: O(b), where b is the number of buckets.
+        """
+        self.name = NAMESPACE + name
+        self.help_text = help_text
+        self.label_dict = labels or {}
+        self.labels = format_labels(labels)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        This function records one observation.
+        :param value: The observed value (seconds for timers).
+        :type value: float
+        :return: None
+        Time: O(log b)
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self, function):
+        """
+        This function wraps a callable so every call is observed, in seconds.
+        :param function: The callable to time.
+        :type function: callable
+        :return: The wrapper.
+        :rtype: callable
+        Time: O(1)
+        """
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - start)
+        return timed
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = format_labels(dict(self.label_dict, le="+Inf" if bound == float("inf") else repr(bound)))
+            samples.append((self.name + "_bucket", labels, cumulative))
+        samples.append((self.name + "_sum", self.labels, total))
+        samples.append((self.name + "_count", self.labels, cumulative))
+        return samples
+
+
+class NullMetric:
+    """
+    Shared stand-in for every metric while metrics are disabled: each call is a no-op.
+    """
+    kind = None
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self, function):
+        return function
+
+    def samples(self):
+        return []
+
+
+NULL_METRIC = NullMetric()
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=False):
+        """
+        Holds the process' metrics and renders them as Prometheus text.
+        While disabled every factory returns NULL_METRIC, so instrumented code costs one no-op call.
+        :param enabled: Whether metrics are collected.
+        :type enabled: bool
+        Time: O(1)
+        """
+        self.enabled = enabled
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        if not self.enabled:
+            return NULL_METRIC
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def unregister(self, metric):
+        """
+        This function drops a metric (e.g. of a closed SerialManager).
+        :param metric: A metric returned by this registry.
+        :type metric: object
+        :return: None
+        Time: O(m), where m is the number of metrics.
+        """
+        with self.lock:
+            self.metrics = [m for m in self.metrics if m is not metric]
+
+    def counter(self, name, help_text, labels=None):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=None):
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS, labels=None):
+        return self.register(Histogram(name, help_text, buckets, labels))
+
+    def counter_function(self, name, help_text, function, labels=None):
+        return self.register(FunctionMetric(name, help_text, Counter.kind, function, labels))
+
+    def gauge_function(self, name, help_text, function, labels=None):
+        return self.register(FunctionMetric(name, help_text, Gauge.kind, function, labels))
+
+    def render(self):
+        """
+        This function dumps every metric in the Prometheus text exposition format.
+        :return: The text.
+        :rtype: str
+        Time: O(s), where s is the number of samples.
+        """
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        described = set()
+        for metric in metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(HELP_LINE % (metric.name, metric.help_text))
+                lines.append(TYPE_LINE % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append(SAMPLE_LINE % (name, labels, value))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        This function returns every sample as a flat mapping, for tests and benchmarks.
+        :return: "name{labels}" -> value.
+        :rtype: dict
+        Time: O(s), where s is the number of samples.
+        """
+        with self.lock:
+            metrics = list(self.metrics)
+        return {name + labels: value for metric in metrics for name, labels, value in metric.samples()}
+
+
+default_registry = MetricsRegistry(enabled=bool(os.environ.get(METRICS_ENV)))
+
+
+def get_registry():
+    """
+    This function returns the process wide registry (enabled by the RGB_RING_METRICS variable).
+    :return: The registry.
+    :rtype: MetricsRegistry
+    Time: O(1)
+    """
+    return default_registry
+
+
+def enable_metrics():
+    """
+    This function turns metrics on; only objects created afterwards are instrumented.
+    :return: The registry.
+    :rtype: MetricsRegistry
+    Time: O(1)
+    """
+    default_registry.enabled = True
+    return default_registry
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = default_registry
+
+    def do_GET(self):
+        if self.path != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  #scrapes every few seconds would flood the console
+
+
+def serve_in_thread(server):
+    threading.Thread(target=server.serve_forever, name=SERVER_THREAD, daemon=True).start()
+    return server
+
+
+def start_http_server(port, host=METRICS_HOST, registry=None):
+    """
+    This function serves GET /metrics on a daemon thread; local only by default.
+    :param port: TCP port, 0 picks a free one (see server.server_address).
+    :type port: int
+    :param host: Interface to bind.
+    :type host: str
+    :param registry: Registry to expose, defaults to the process wide one.
+    :type registry: MetricsRegistry
+    :return: The server, call shutdown() to stop it.
+    :rtype: ThreadingHTTPServer
+    Time: O(1)
+    """
+    handler = type("BoundMetricsHandler", (MetricsHandler,), {"registry": registry or default_registry})
+    return serve_in_thread(ThreadingHTTPServer((host, port), handler))
+
+
+class UnixMetricsHandler(socketserver.StreamRequestHandler):
+    registry = default_registry
+
+    def handle(self):
+        self.wfile.write(self.registry.render().encode())
+
+
+def start_unix_server(path, registry=None):
+    """
+    This function writes the metrics dump to every client of a Unix socket (e.g. socat - UNIX:path).
+    :param path: Socket path; a stale socket file is replaced.
+    :type path: str
+    :param registry: Registry to expose, defaults to the process wide one.
+    :type registry: MetricsRegistry
+    :return: The server, call shutdown() to stop it.
+    :rtype: socketserver.UnixStreamServer
+    Time: O(1)
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    handler = type("BoundUnixMetricsHandler", (UnixMetricsHandler,), {"registry": registry or default_registry})
+    return serve_in_thread(socketserver.ThreadingUnixStreamServer(path, handler))
+
+
+def start_from_env():
+    """
+    This function starts the endpoint named by RGB_RING_METRICS: HTTP when it holds a port number,
+    a Unix socket when it holds a path.
+    :return: The server or None.
+    :rtype: socketserver.BaseServer or None
+    Time: O(1)
+    """
+    value = os.environ.get(METRICS_ENV, "")
+    if value.isdigit() and int(value) > 1:
+        return start_http_server(int(value))
+    if os.sep in value:
+        return start_unix_server(value)
+    return None
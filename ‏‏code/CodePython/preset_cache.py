@@ -0,0 +1,396 @@
+import struct
+import threading
+import time
+import zlib
+from async_logger import get_logger
+from command_writer import RawCommand
+from frame_codec import FrameEncoder
+from frame_protocol import (encode_frame, decode_frame, play_command, OP_STORE_BEGIN, OP_STORE_DATA, OP_STORE_END,
+                            HEADER_FORMAT, STORE_BEGIN_FORMAT, STORE_DATA_FORMAT, STORE_PRESET, STORE_SEQUENCE,
+                            STORE_LOOP, SEQUENCE_FORMAT, CACHE_QUERY, PROTOCOL_BINARY, ENCODING)
+
+# Replies of the store in now.ino
+STORE_KIND = "store"          #store:<id>,ok|full|done|bad, or store:<id>,<bytes received> after a chunk
+EVICT_KIND = "evict"          #evict:<id>, an entry dropped to make room
+CACHE_KIND = "cache"          #cache:<id>/<hash in hex>,... the answer to "cache?"
+PLAY_KIND = "play"            #play:<id>,missing
+STORE_OK = "ok"
+STORE_FULL = "full"
+STORE_DONE = "done"
+STORE_BAD = "bad"
+PLAY_MISSING = "missing"
+HASH_SEPARATOR = "/"
+HASH_BASE = 16
+PRESET_SEPARATOR = "\n"
+MAX_PRESET_LINE = 63          #lineBuffer[] of now.ino less its terminating zero
+MIN_ENTRY_ID = 0
+MAX_ENTRY_ID = 255
+MAX_INTERVAL = 0xFFFF
+# Uploads are stop-and-wait: every EEPROM byte takes 3.3 ms to write, so a chunk is acked before the next goes out
+STORE_CHUNK = 32
+ACK_TIMEOUT = 0.5             #A chunk: its bytes on the wire plus 32 EEPROM writes
+BEGIN_TIMEOUT = 4.0           #Making room may move the whole 1 KB EEPROM
+QUERY_TIMEOUT = 0.5
+UPLOAD_RETRIES = 3            #Times one message is sent again before the upload gives up
+# Log events
+EVENT_UPLOADED = "preset_uploaded"
+EVENT_UPLOAD_FAILED = "preset_upload_failed"
+EVENT_EVICTED = "preset_evicted"
+
+
+class PresetError(Exception):
+    """Raised when a preset or sequence cannot be stored on the device."""
+
+
+def content_hash(kind, flags, data):
+    """
+    This function hashes what an entry stores, so the host can tell whether the device holds it already.
+    :param kind: STORE_PRESET or STORE_SEQUENCE.
+    :type kind: int
+    :param flags: The entry's flags.
+    :type flags: int
+    :param data: The entry's bytes.
+    :type data: bytes
+    :return: CRC-32 of the three.
+    :rtype: int
+    Time: O(len(data))
+    """
+    return zlib.crc32(data, zlib.crc32(bytes([kind, flags])))
+
+
+def encode_preset(commands):
+    """
+    This function packs ASCII commands into a preset; the firmware runs them in order when it is played.
+    :param commands: e.g. ["speed:20", "1"].
+    :type commands: list[str]
+    :return: The preset's bytes.
+    :rtype: bytes
+    :raises PresetError: On a command the firmware's line buffer cannot take.
+    Time: O(k), where k is the total length of the commands.
+    """
+    for command in commands:
+        if PRESET_SEPARATOR in command or len(command) > MAX_PRESET_LINE:
+            raise PresetError(f"bad preset command {command!r}")
+    return PRESET_SEPARATOR.join(commands).encode(ENCODING)
+
+
+def encode_sequence(frames, interval_ms):
+    """
+    This function packs frames into a sequence: the interval, then one record per frame, encoded like
+    a stream (keyframe first, then the cheapest of full, RLE or delta). A looping sequence starts over
+    on its first record, which is always self-contained.
+    :param frames: (num_leds, 3) uint8 arrays, or a (count, num_leds, 3) array.
+    :type frames: list[np.ndarray]
+    :param interval_ms: Milliseconds between two frames.
+    :type interval_ms: int
+    :return: The sequence's bytes.
+    :rtype: bytes
+    :raises PresetError: On an interval the firmware cannot keep.
+    Time: O(count * num_leds)
+    """
+    if not 0 < interval_ms <= MAX_INTERVAL:
+        raise PresetError(f"bad interval {interval_ms!r}")
+    encoder = FrameEncoder(keyframe_interval=len(frames))
+    records = [struct.pack(SEQUENCE_FORMAT, int(interval_ms))]
+    for frame in frames:
+        wire = encoder.encode(frame)
+        opcode, payload = decode_frame(wire[:-1])  #the record keeps the frame's header and payload
+        records.append(struct.pack(HEADER_FORMAT, opcode, len(payload)) + payload)
+    return b''.join(records)
+
+
+class Entry:
+    def __init__(self, entry_id, kind, flags, data):
+        """
+        A preset or sequence the host wants on the device.
+        :param entry_id: Id it is stored and played under.
+        :type entry_id: int
+        :param kind: STORE_PRESET or STORE_SEQUENCE.
+        :type kind: int
+        :param flags: STORE_LOOP for a looping sequence.
+        :type flags: int
+        :param data: What is stored.
+        :type data: bytes
+        Time: O(len(data))
+        """
+        self.id = entry_id
+        self.kind = kind
+        self.flags = flags
+        self.data = data
+        self.hash = content_hash(kind, flags, data)
+
+
+class PresetCache:
+    def __init__(self, serial_manager, chunk_size=STORE_CHUNK, ack_timeout=ACK_TIMEOUT, retries=UPLOAD_RETRIES):
+        """
+        Presets and frame sequences kept in the firmware's EEPROM store, played with a two byte command
+        instead of being sent again. Each name gets an id; the device lists what it holds with a content
+        hash, so an entry is uploaded only when it is missing or changed. The device evicts the least
+        recently played entries when it runs out of room and says so; those are uploaded again when
+        played. Uploads need the binary protocol and block the caller, play() of a stored entry does not.
+        :param serial_manager: The ring's link.
+        :type serial_manager: SerialManager
+        :param chunk_size: Bytes per upload chunk.
+        :type chunk_size: int
+        :param ack_timeout: Seconds to wait for the answer to a chunk before sending it again.
+        :type ack_timeout: float
+        :param retries: Times a chunk is sent again before the upload fails.
+        :type retries: int
+        Time: O(1)
+        """
+        self.manager = serial_manager
+        self.chunk_size = chunk_size
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.subscription = serial_manager.subscribe()
+        self.lock = threading.RLock()
+        self.entries = {}
+        self.stored = None    #id -> hash the device reported, None until synced
+        self.mark = None      #(reconnects, resets) when it was synced
+        self.uploads = 0
+        self.bytes_uploaded = 0
+        self.evictions = 0
+        self.misses = 0
+        self.log = get_logger()
+
+    def define_preset(self, name, commands):
+        """
+        This function names a preset, nothing is sent until it is stored or played.
+        :param name: The preset's name.
+        :type name: str
+        :param commands: ASCII commands run in order, e.g. ["speed:20", "1"].
+        :type commands: list[str]
+        :return: Its id.
+        :rtype: int
+        Time: O(k), where k is the total length of the commands.
+        """
+        return self.define(name, STORE_PRESET, 0, encode_preset(commands))
+
+    def define_sequence(self, name, frames, interval_ms, loop=True):
+        """
+        This function names a frame sequence, nothing is sent until it is stored or played.
+        :param name: The sequence's name.
+        :type name: str
+        :param frames: (num_leds, 3) uint8 arrays.
+        :type frames: list[np.ndarray]
+        :param interval_ms: Milliseconds between two frames.
+        :type interval_ms: int
+        :param loop: Start over after the last frame; otherwise the last frame stays.
+        :type loop: bool
+        :return: Its id.
+        :rtype: int
+        Time: O(count * num_leds)
+        """
+        return self.define(name, STORE_SEQUENCE, STORE_LOOP if loop else 0, encode_sequence(frames, interval_ms))
+
+    def define(self, name, kind, flags, data):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                used = {entry.id for entry in self.entries.values()}
+                free = [entry_id for entry_id in range(MIN_ENTRY_ID, MAX_ENTRY_ID + 1) if entry_id not in used]
+                if not free:
+                    raise PresetError(f"no id left for {name!r}")
+                entry_id = free[0]
+            else:
+                entry_id = entry.id
+            self.entries[name] = Entry(entry_id, kind, flags, data)
+            return entry_id
+
+    def sync(self):
+        """
+        This function asks the device which entries it holds ("cache?").
+        :return: True if it answered.
+        :rtype: bool
+        Time: O(QUERY_TIMEOUT)
+        """
+        with self.lock:
+            self.drain()
+            self.manager.writer.submit(CACHE_QUERY)
+            message = self.wait_for(lambda message: message.kind == CACHE_KIND, QUERY_TIMEOUT)
+            if message is None:
+                return False
+            self.stored = {}
+            for field in message.fields:
+                entry_id, _, value = field.partition(HASH_SEPARATOR)
+                self.stored[int(entry_id)] = int(value, HASH_BASE)
+            self.mark = self.link_mark()
+            return True
+
+    def link_mark(self):
+        return self.manager.reconnects, self.manager.device_state.resets
+
+    def store(self, name):
+        """
+        This function makes sure the device holds the named entry as defined, uploading it if not.
+        After a reconnect or a reset of the board the store is listed again first: the EEPROM kept the
+        entries, an upload that was under way is lost.
+        :param name: A defined preset or sequence.
+        :type name: str
+        :return: True once the device holds it.
+        :rtype: bool
+        Time: O(1) when stored, O(len(data) / chunk_size * ack_timeout) for an upload.
+        """
+        with self.lock:
+            entry = self.entries[name]
+            self.drain()
+            if self.stored is None or self.mark != self.link_mark():
+                if not self.sync():
+                    return False
+            if self.stored.get(entry.id) == entry.hash:
+                return True
+            return self.upload(name, entry)
+
+    def play(self, name):
+        """
+        This function plays the named entry, uploading it first when the device does not hold it.
+        A preset runs its commands, a sequence runs on the device like an effect until something else
+        is sent. Should the device have lost it meanwhile, it answers "missing" and the next play()
+        uploads it again.
+        :param name: A defined preset or sequence.
+        :type name: str
+        :return: True if the play command was queued.
+        :rtype: bool
+        Time: O(1) when stored, as store() otherwise.
+        """
+        if not self.store(name):
+            return False
+        self.manager.send_command(play_command(self.entries[name].id))
+        return True
+
+    def upload(self, name, entry):
+        """
+        This function writes an entry into the device's store: begin, then stop-and-wait chunks, each sent
+        again from where the device is when its answer is lost or short, then end.
+        :param name: The entry's name, for the log.
+        :type name: str
+        :param entry: The entry.
+        :type entry: Entry
+        :return: True if the device holds it now.
+        :rtype: bool
+        Time: O(len(data) / chunk_size * ack_timeout) in the worst case.
+        """
+        if self.manager.active_protocol != PROTOCOL_BINARY:
+            self.log.warning(EVENT_UPLOAD_FAILED, name=name, error="needs the binary protocol")
+            return False
+        begin = encode_frame(OP_STORE_BEGIN, struct.pack(STORE_BEGIN_FORMAT, entry.id, entry.kind, entry.flags,
+                                                         entry.hash, len(entry.data)))
+        status = self.request(entry.id, begin, BEGIN_TIMEOUT)
+        self.stored.pop(entry.id, None)  #the device dropped the old entry with this id
+        if status != STORE_OK:
+            self.log.warning(EVENT_UPLOAD_FAILED, name=name, error=status or "no answer")
+            return False
+        received = 0
+        failures = 0
+        while received < len(entry.data) and failures <= self.retries:
+            chunk = entry.data[received:received + self.chunk_size]
+            data = encode_frame(OP_STORE_DATA, struct.pack(STORE_DATA_FORMAT, entry.id, received) + chunk)
+            status = self.request(entry.id, data, self.ack_timeout)
+            if status is not None and status.isdigit() and int(status) > received:
+                received = int(status)
+                failures = 0
+            elif status is not None and not status.isdigit():
+                break  #the device lost the upload (reset, another begin)
+            else:
+                failures += 1
+        end = encode_frame(OP_STORE_END, bytes([entry.id]))
+        status = self.request(entry.id, end, self.ack_timeout) if received == len(entry.data) else None
+        if status != STORE_DONE:
+            self.log.warning(EVENT_UPLOAD_FAILED, name=name, received=received, size=len(entry.data))
+            return False
+        self.stored[entry.id] = entry.hash
+        self.uploads += 1
+        self.bytes_uploaded += len(entry.data)
+        self.log.info(EVENT_UPLOADED, name=name, id=entry.id, size=len(entry.data))
+        return True
+
+    def request(self, entry_id, data, timeout):
+        """
+        This function sends a store message and waits for the device's answer about the same id, sending
+        it again when none comes (a message or its answer corrupted on the line). It goes through the
+        writer's queue as a RawCommand, so frames streamed meanwhile never coalesce it away.
+        :param entry_id: The entry's id.
+        :type entry_id: int
+        :param data: The encoded frame.
+        :type data: bytes
+        :param timeout: Seconds to wait for each answer.
+        :type timeout: float
+        :return: The answer's status field, None if the device never answered.
+        :rtype: str or None
+        Time: O(retries * timeout)
+        """
+        for _ in range(self.retries + 1):
+            self.manager.writer.submit(RawCommand(data))
+            message = self.wait_for(lambda message: message.kind == STORE_KIND and len(message.fields) == 2
+                                    and message.fields[0] == str(entry_id), timeout)
+            if message is not None:
+                return message.fields[1]
+        return None
+
+    def wait_for(self, predicate, timeout):
+        """
+        This function reads device messages until one matches, keeping track of evictions meanwhile.
+        :param predicate: Condition on a DeviceMessage.
+        :type predicate: callable
+        :param timeout: Seconds to wait.
+        :type timeout: float
+        :return: The message, or None on timeout.
+        :rtype: DeviceMessage or None
+        Time: O(m), where m is the number of messages received while waiting.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = self.subscription.get(remaining)
+            if message is None:
+                return None
+            self.take(message)
+            if predicate(message):
+                return message
+
+    def drain(self):
+        """
+        This function takes the messages that arrived since the last call without waiting.
+        :return: None
+        Time: O(m), where m is the number of messages waiting.
+        """
+        while True:
+            message = self.subscription.get(0)
+            if message is None:
+                return
+            self.take(message)
+
+    def take(self, message):
+        """
+        This function forgets entries the device evicted or reported missing, so they are uploaded again.
+        :param message: A device message.
+        :type message: DeviceMessage
+        :return: None
+        Time: O(1)
+        """
+        if message.kind == EVICT_KIND and message.fields and message.fields[0].isdigit():
+            self.evictions += 1
+            self.log.info(EVENT_EVICTED, id=int(message.fields[0]))
+        elif message.kind == PLAY_KIND and message.fields[-1:] == [PLAY_MISSING] and message.fields[0].isdigit():
+            self.misses += 1
+        else:
+            return
+        if self.stored is not None:
+            self.stored.pop(int(message.fields[0]), None)
+
+    def snapshot(self):
+        """
+        This function describes the cache.
+        :return: Defined names and ids, ids the device holds, uploads, bytes uploaded, evictions and misses.
+        :rtype: dict
+        Time: O(e), where e is the number of entries.
+        """
+        with self.lock:
+            return {"entries": {name: entry.id for name, entry in self.entries.items()},
+                    "stored": sorted(self.stored) if self.stored is not None else None, "uploads": self.uploads,
+                    "bytes_uploaded": self.bytes_uploaded, "evictions": self.evictions, "misses": self.misses}
+
+    def close(self):
+        self.subscription.close()
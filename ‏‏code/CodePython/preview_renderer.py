@@ -0,0 +1,151 @@
+import math
+import numpy as np
+from colors import apply_output
+
+PALETTE_SIZE = 4096
+MAX_NUM_COLOR_OX = 0xFFFFFF
+COLOR_TRUN_OFF = "gray"
+SIZE_LED = 10
+LED_TAG = "led-%d"
+HEX_BYTE = [f"{value:02x}" for value in range(256)]
+ITEM_CONFIG = "%s itemconfigure %d -fill %s"
+SCRIPT_SEPARATOR = "\n"
+
+
+def frame_to_hex(frame):
+    """
+    This function converts a (num_leds, 3) uint8 frame to Tk color strings with table lookups.
+    :param frame: RGB frame.
+    :type frame: np.ndarray
+    :return: One "#rrggbb" string per LED.
+    :rtype: list[str]
+    Time: O(n)
+    """
+    hex_byte = HEX_BYTE
+    return ['#' + hex_byte[r] + hex_byte[g] + hex_byte[b] for r, g, b in frame.tolist()]
+
+
+class ColorPalette:
+    def __init__(self, size=PALETTE_SIZE, seed=None):
+        """
+        A reusable set of pre-formatted random colors, so animations never format hex strings per LED.
+        :param size: Number of colors generated up front.
+        :type size: int
+        :param seed: Optional RNG seed for reproducible previews.
+        :type seed: int
+        Time: O(size)
+        """
+        self.rng = np.random.default_rng(seed)
+        values = self.rng.integers(0, MAX_NUM_COLOR_OX + 1, size)
+        self.colors = [f'#{value:06x}' for value in values.tolist()]
+
+    def sample(self, count):
+        """
+        This function picks count colors with one vectorized draw.
+        :param count: Number of colors.
+        :type count: int
+        :return: The colors.
+        :rtype: list[str]
+        Time: O(count)
+        """
+        colors = self.colors
+        return [colors[index] for index in self.rng.integers(0, len(colors), count).tolist()]
+
+
+class RingPreview:
+    def __init__(self, canvas, num_leds, center, radius, size=SIZE_LED, off_color=COLOR_TRUN_OFF, pipeline=None):
+        """
+        Draws a ring of LEDs on a Tk canvas and applies whole frames with a single Tcl call,
+        touching only the items whose color changed.
+        :param canvas: The canvas to draw on.
+        :type canvas: tk.Canvas
+        :param num_leds: Number of LEDs on the ring.
+        :type num_leds: int
+        :param center: (x, y) of the ring center.
+        :type center: tuple[int, int]
+        :param radius: Ring radius in pixels.
+        :type radius: int
+        :param size: LED radius in pixels.
+        :type size: int
+        :param off_color: Color of an LED that is off.
+        :type off_color: str
+        :param pipeline: Optional output stage for shown frames, e.g. ColorPipeline.firmware() to preview
+                         what the LEDs emit after the firmware's correction and brightness.
+        :type pipeline: ColorPipeline
+        Time: O(num_leds)
+        """
+        self.canvas = canvas
+        self.pipeline = pipeline
+        self.num_leds = num_leds
+        self.off_color = off_color
+        self.tag = LED_TAG % id(self)
+        self.items = self.create_leds(center, radius, size)
+        self.colors = [off_color] * num_leds
+        self.tcl_calls = 0
+
+    def create_leds(self, center, radius, size):
+        """
+        This function creates one oval per LED around the center.
+        :param center: (x, y) of the ring center.
+        :type center: tuple[int, int]
+        :param radius: Ring radius in pixels.
+        :type radius: int
+        :param size: LED radius in pixels.
+        :type size: int
+        :return: Canvas item ids in LED order.
+        :rtype: list[int]
+        Time: O(num_leds)
+        """
+        items = []
+        for i in range(self.num_leds):
+            angle = 2 * math.pi * i / self.num_leds
+            x = center[0] + radius * math.cos(angle)
+            y = center[1] + radius * math.sin(angle)
+            items.append(self.canvas.create_oval(x - size, y - size, x + size, y + size,
+                                                 fill=self.off_color, tags=(self.tag,)))
+        return items
+
+    def update(self, colors):
+        """
+        This function shows a frame of Tk color strings. Unchanged LEDs are skipped and all
+        changes go to Tcl as one script, instead of one itemconfig round-trip per LED.
+        :param colors: One color string per LED.
+        :type colors: list[str]
+        :return: Number of items changed.
+        :rtype: int
+        Time: O(num_leds)
+        """
+        path = str(self.canvas)
+        current = self.colors
+        items = self.items
+        commands = [ITEM_CONFIG % (path, items[i], color)
+                    for i, color in enumerate(colors) if current[i] != color]
+        if commands:
+            self.canvas.tk.eval(SCRIPT_SEPARATOR.join(commands))
+            self.tcl_calls += 1
+            self.colors = list(colors)
+        return len(commands)
+
+    def show_frame(self, frame):
+        """
+        This function shows an RGB frame from the effect engine or the device.
+        :param frame: A (num_leds, 3) uint8 array.
+        :type frame: np.ndarray
+        :return: Number of items changed.
+        :rtype: int
+        Time: O(num_leds)
+        """
+        return self.update(frame_to_hex(apply_output(self.pipeline, frame)))
+
+    def fill(self, color):
+        """
+        This function sets every LED to one color with a single tagged itemconfigure.
+        :param color: Tk color string.
+        :type color: str
+        :return: None
+        Time: O(1) Tcl calls
+        """
+        if self.colors != [color] * self.num_leds:
+            self.canvas.itemconfig(self.tag, fill=color)
+            self.tcl_calls += 1
+            self.colors = [color] * self.num_leds
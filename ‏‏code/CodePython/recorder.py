@@ -0,0 +1,435 @@
+import argparse
+import mmap
+import os
+import struct
+import threading
+import time
+import numpy as np
+from effect_engine import CHANNELS
+from command_writer import command_kind, KIND_RGB, KIND_EFFECT, KIND_STOP, KIND_PLAY
+from async_logger import get_logger
+from serial_manager import SerialManager, BAUDRATE
+
+# File layout: header, then records appended in time order, each followed by its payload.
+# Header: magic(8) version(2) wall clock start time(8). Record: seconds since start(8) kind(1) length(4).
+MAGIC = b"RGBREC\r\n"
+VERSION = 1
+HEADER_FORMAT = '<8sHd'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_FORMAT = '<dBI'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+COMMAND_LENGTH_FORMAT = '<H'
+COMMAND_LENGTH_SIZE = struct.calcsize(COMMAND_LENGTH_FORMAT)
+ENCODING = 'ascii'
+# Record kinds
+KIND_COMMAND = 1          #command handed to send_command
+KIND_RESPONSE = 2         #line received from the device
+KIND_FRAME = 3            #frame handed to send_frame, raw RGB bytes
+KIND_KEYFRAME = 4         #what the ring shows: last state command and last frame, written for seeking
+KIND_UNKNOWN = "unknown"
+KIND_NAMES = {KIND_COMMAND: "command", KIND_RESPONSE: "response", KIND_FRAME: "frame", KIND_KEYFRAME: "keyframe"}
+# Sidecar index: (time, file offset) of every keyframe, so seeking is a binary search
+INDEX_SUFFIX = ".idx"
+INDEX_FORMAT = '<dQ'
+INDEX_DTYPE = np.dtype([("time", '<f8'), ("offset", '<u8')])
+KEYFRAME_INTERVAL = 1.0   #Seconds between keyframes, bounds the records scanned after a seek
+SPEED_FAST = None         #Replay as fast as the target takes the events
+STATE_KINDS = (KIND_RGB, KIND_EFFECT, KIND_STOP, KIND_PLAY)
+EVENT_RECORDING = "recording_started"
+EVENT_TRUNCATED = "recording_truncated"
+EVENT_REPLAY = "replay_finished"
+
+
+class RecordingError(Exception):
+    """Raised when a file is not a recording this version can read."""
+
+
+def encode_keyframe(command, frame):
+    """
+    This function packs the ring state into a keyframe payload.
+    :param command: Last color/effect command, or None.
+    :type command: str
+    :param frame: Last frame bytes, or None.
+    :type frame: bytes
+    :return: Payload: command length, command, frame bytes.
+    :rtype: bytes
+    Time: O(k + n), where k is the length of the command and n the frame size.
+    """
+    text = (command or "").encode(ENCODING)
+    return struct.pack(COMMAND_LENGTH_FORMAT, len(text)) + text + (frame or b"")
+
+
+class Recorder:
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL, clock=time.monotonic):
+        """
+        Append-only recorder of a link's traffic: commands and frames the application sent and the
+        lines the device answered, with their time since the recording started. Every
+        keyframe_interval seconds the ring state is written as a keyframe and added to the index.
+        Safe to call from the Tk, scheduler and reader threads at once.
+        :param path: Recording file, replaced if it exists; the index goes to path + ".idx".
+        :type path: str
+        :param keyframe_interval: Seconds between keyframes.
+        :type keyframe_interval: float
+        :param clock: Time source, monotonic seconds.
+        :type clock: callable
+        Time: O(1)
+        """
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb')
+        self.index = open(path + INDEX_SUFFIX, 'wb')
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, time.time()))
+        self.offset = HEADER_SIZE
+        self.start = clock()
+        self.next_keyframe = 0.0
+        self.state_command = None
+        self.last_frame = None
+        self.records = 0
+        get_logger().info(EVENT_RECORDING, path=path)
+
+    def write(self, kind, payload):
+        """
+        This function appends one record; writes a keyframe first when one is due.
+        Must be called with the lock held.
+        :param kind: One of the KIND_* record kinds.
+        :type kind: int
+        :param payload: The record payload.
+        :type payload: bytes
+        :return: None
+        Time: O(len(payload))
+        """
+        timestamp = self.clock() - self.start
+        if timestamp >= self.next_keyframe:
+            self.write_keyframe(timestamp)
+        self.file.write(struct.pack(RECORD_FORMAT, timestamp, kind, len(payload)))
+        self.file.write(payload)
+        self.offset += RECORD_SIZE + len(payload)
+        self.records += 1
+
+    def write_keyframe(self, timestamp):
+        """
+        This function writes the ring state and indexes it. The data is flushed before the index
+        entry, so after a crash the index never points past the end of the file.
+        :param timestamp: Seconds since the start.
+        :type timestamp: float
+        :return: None
+        Time: O(n), where n is the frame size.
+        """
+        payload = encode_keyframe(self.state_command, self.last_frame)
+        self.file.write(struct.pack(RECORD_FORMAT, timestamp, KIND_KEYFRAME, len(payload)))
+        self.file.write(payload)
+        self.file.flush()
+        self.index.write(struct.pack(INDEX_FORMAT, timestamp, self.offset))
+        self.index.flush()
+        self.offset += RECORD_SIZE + len(payload)
+        self.next_keyframe = timestamp + self.keyframe_interval
+
+    def command(self, command):
+        """
+        Records a command given to the link.
+        :param command: The ASCII command.
+        :type command: str
+        :return: None
+        Time: O(k), where k is the length of the command.
+        """
+        with self.lock:
+            if command_kind(command) in STATE_KINDS:
+                self.state_command = command
+            self.write(KIND_COMMAND, command.encode(ENCODING))
+
+    def frame(self, frame):
+        """
+        Records a frame given to the link.
+        :param frame: A (num_leds, 3) uint8 array.
+        :type frame: np.ndarray
+        :return: None
+        Time: O(n), where n is the frame size.
+        """
+        data = np.ascontiguousarray(frame, dtype=np.uint8).tobytes()
+        with self.lock:
+            self.last_frame = data
+            self.write(KIND_FRAME, data)
+
+    def response(self, line):
+        """
+        Records a line received from the device.
+        :param line: The decoded line.
+        :type line: str
+        :return: None
+        Time: O(k), where k is the length of the line.
+        """
+        with self.lock:
+            self.write(KIND_RESPONSE, line.encode(ENCODING, errors='replace'))
+
+    def close(self):
+        """
+        Flushes and closes the recording.
+        :return: None
+        Time: O(1)
+        """
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.close()
+            self.index.close()
+
+
+class Recording:
+    def __init__(self, path):
+        """
+        Read side of a recording. The file is mapped, not read, so opening a long session is instant
+        and frames are handed out as views on the mapping. A missing or stale index (a crashed
+        recorder) is rebuilt with one scan; a truncated last record is ignored.
+        :param path: The recording file.
+        :type path: str
+        :raises RecordingError: If the file is not a recording.
+        Time: O(i) for the index, where i is the number of keyframes; O(n) if it has to be rebuilt.
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < HEADER_SIZE:
+                raise RecordingError(f"{path}: too short")
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.started = struct.unpack_from(HEADER_FORMAT, self.map)
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise RecordingError(f"{path}: not a version {VERSION} recording")
+        self.size = size
+        self.index = self.load_index()
+
+    def load_index(self):
+        """
+        This function reads the keyframe index, dropping entries past the end of the data.
+        :return: Keyframe times and offsets, sorted by time.
+        :rtype: np.ndarray
+        Time: O(i), or O(n) when the index has to be rebuilt.
+        """
+        try:
+            index = np.fromfile(self.path + INDEX_SUFFIX, dtype=INDEX_DTYPE)
+        except (OSError, ValueError):
+            index = np.empty(0, dtype=INDEX_DTYPE)
+        index = index[index["offset"] + RECORD_SIZE <= self.size]
+        if not len(index):
+            keyframes = [(timestamp, offset) for offset, timestamp, kind, _ in self.records(HEADER_SIZE)
+                         if kind == KIND_KEYFRAME]
+            index = np.array(keyframes, dtype=INDEX_DTYPE)
+        return index
+
+    def records(self, offset):
+        """
+        This generator walks the raw records from a file offset.
+        :param offset: Offset of a record.
+        :type offset: int
+        :return: (offset, timestamp, kind, payload as a memoryview on the mapping) per record.
+        :rtype: generator
+        Time: O(1) per record, plus the payload size for the caller.
+        """
+        view = memoryview(self.map)
+        try:
+            while offset + RECORD_SIZE <= self.size:
+                timestamp, kind, length = struct.unpack_from(RECORD_FORMAT, self.map, offset)
+                start = offset + RECORD_SIZE
+                if start + length > self.size:
+                    get_logger().warning(EVENT_TRUNCATED, path=self.path, offset=offset)
+                    return
+                yield offset, timestamp, kind, view[start:start + length]
+                offset = start + length
+        finally:
+            view.release()
+
+    def seek(self, timestamp):
+        """
+        This function finds the last keyframe at or before a time with a binary search on the index.
+        :param timestamp: Seconds since the start.
+        :type timestamp: float
+        :return: File offset to start scanning from.
+        :rtype: int
+        Time: O(log i), where i is the number of keyframes.
+        """
+        position = int(np.searchsorted(self.index["time"], timestamp, side='right')) - 1
+        return int(self.index["offset"][position]) if position >= 0 else HEADER_SIZE
+
+    def events(self, start=0.0):
+        """
+        This generator yields the recorded events from a point in time. When start is past the
+        beginning, the first event is a keyframe with the ring state at start, so a replay shows
+        what the ring showed then. Keyframes stored in the file are not repeated.
+        :param start: Seconds since the start of the recording.
+        :type start: float
+        :return: (timestamp, kind, data): data is a str for commands and responses, a read-only
+                 (n, 3) uint8 array on the mapping for frames, and (command, frame) for the keyframe.
+        :rtype: generator
+        Time: O(log i + r), where r is the number of records from the keyframe before start to the end.
+        """
+        command = None
+        frame = None
+        seeking = start > 0
+        for offset, timestamp, kind, payload in self.records(self.seek(start) if seeking else HEADER_SIZE):
+            if seeking and timestamp >= start:
+                seeking = False
+                yield start, KIND_KEYFRAME, (command, frame)
+            if kind == KIND_KEYFRAME:
+                if seeking:
+                    length, = struct.unpack_from(COMMAND_LENGTH_FORMAT, payload)
+                    command = bytes(payload[COMMAND_LENGTH_SIZE:COMMAND_LENGTH_SIZE + length]).decode(ENCODING) or None
+                    pixels = payload[COMMAND_LENGTH_SIZE + length:]
+                    frame = np.frombuffer(pixels, dtype=np.uint8).reshape(-1, CHANNELS) if len(pixels) else None
+                continue
+            if kind == KIND_FRAME:
+                data = np.frombuffer(payload, dtype=np.uint8).reshape(-1, CHANNELS)
+                frame = data
+            else:
+                data = bytes(payload).decode(ENCODING, errors='replace')
+                if kind == KIND_COMMAND and command_kind(data) in STATE_KINDS:
+                    command = data
+            if not seeking:
+                yield timestamp, kind, data
+
+    def duration(self):
+        """
+        This function returns the time of the last complete record.
+        :return: Seconds since the start.
+        :rtype: float
+        Time: O(r) from the last keyframe.
+        """
+        last = 0.0
+        for _, timestamp, _, _ in self.records(self.seek(float('inf'))):
+            last = timestamp
+        return last
+
+    def close(self):
+        """
+        Unmaps the file. Frames still referenced by the caller keep the mapping alive until released.
+        :return: None
+        Time: O(1)
+        """
+        try:
+            self.map.close()
+        except BufferError:
+            pass  #views are still exported, the mapping goes away with the last one
+
+
+class Player:
+    def __init__(self, recording):
+        """
+        Replays a recording into anything with send_command and send_frame: a SerialManager (the
+        sim:// simulator included), a DeviceGroup or a DaemonClient. Device responses are not sent.
+        :param recording: The recording.
+        :type recording: Recording
+        Time: O(1)
+        """
+        self.recording = recording
+        self.stop_event = threading.Event()
+
+    def play(self, target, start=0.0, speed=1.0, end=None):
+        """
+        This function sends the events with their original spacing divided by speed, or back to
+        back with SPEED_FAST. It reports how late the events went out: when the lag grows the host
+        cannot keep up; when the host keeps up but the device falls behind, the link is the limit.
+        :param target: The link to drive.
+        :type target: SerialManager
+        :param start: Seconds into the recording to start from.
+        :type start: float
+        :param speed: Playback speed factor, or SPEED_FAST.
+        :type speed: float
+        :param end: Seconds into the recording to stop at, None for the end.
+        :type end: float
+        :return: commands, frames, elapsed seconds, mean and max lag in seconds.
+        :rtype: dict
+        Time: O(log i + r), where r is the number of records played.
+        """
+        self.stop_event.clear()
+        commands = frames = 0
+        lag_total = lag_max = 0.0
+        began = time.perf_counter()
+        for timestamp, kind, data in self.recording.events(start):
+            if self.stop_event.is_set() or (end is not None and timestamp > end):
+                break
+            if speed is not SPEED_FAST:
+                due = began + (timestamp - start) / speed
+                wait = due - time.perf_counter()
+                if wait > 0 and self.stop_event.wait(wait):
+                    break
+            if kind == KIND_KEYFRAME:
+                command, frame = data
+                if frame is not None:
+                    target.send_frame(frame)
+                    frames += 1
+                if command is not None:
+                    target.send_command(command)
+                    commands += 1
+            elif kind == KIND_COMMAND:
+                target.send_command(data)
+                commands += 1
+            elif kind == KIND_FRAME:
+                target.send_frame(data)
+                frames += 1
+            else:
+                continue
+            if speed is not SPEED_FAST:
+                lag = time.perf_counter() - due
+                lag_total += lag
+                lag_max = max(lag_max, lag)
+        elapsed = time.perf_counter() - began
+        sent = commands + frames
+        stats = {"commands": commands, "frames": frames, "elapsed": elapsed,
+                 "mean_lag": lag_total / sent if sent else 0.0, "max_lag": lag_max}
+        get_logger().info(EVENT_REPLAY, **stats)
+        return stats
+
+    def stop(self):
+        """
+        Stops a running play() after the current event.
+        :return: None
+        Time: O(1)
+        """
+        self.stop_event.set()
+
+
+def summary(recording):
+    """
+    This function counts the records of each kind.
+    :param recording: The recording.
+    :type recording: Recording
+    :return: Record count per kind name, plus the duration in seconds.
+    :rtype: dict
+    Time: O(r), where r is the number of records.
+    """
+    counts = dict.fromkeys(KIND_NAMES.values(), 0)
+    last = 0.0
+    for _, timestamp, kind, _ in recording.records(HEADER_SIZE):
+        name = KIND_NAMES.get(kind, KIND_UNKNOWN)
+        counts[name] = counts.get(name, 0) + 1
+        last = timestamp
+    counts["duration"] = round(last, 3)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay an RGB ring recording")
+    parser.add_argument("recording")
+    parser.add_argument("--port", help="replay into this port (sim:// for the simulator); without it, print a summary")
+    parser.add_argument("--baud", type=int, default=BAUDRATE)
+    parser.add_argument("--start", type=float, default=0.0, help="seconds into the recording")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--fast", action="store_true", help="replay as fast as the link takes it")
+    args = parser.parse_args()
+    recording = Recording(args.recording)
+    if not args.port:
+        print(summary(recording))
+        return
+    link = SerialManager(port=args.port, baudrate=args.baud, discover=False)
+    link.connect()
+    try:
+        print(Player(recording).play(link, args.start, SPEED_FAST if args.fast else args.speed))
+        link.writer.flush()
+    finally:
+        link.close()
+        recording.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+import collections
+import heapq
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+from async_logger import get_logger
+from colors import ColorPipeline, apply_output
+from effect_engine import CHANNELS, EFFECTS, create_effect
+from frame_codec import MAX_FRAME_LEDS
+
+DEFAULT_SLOTS = 4         #Frames of a ring the workers may render ahead of the consumer
+MIN_SEGMENT = 4096        #A strip is split across workers only into parts of at least this many LEDs
+POLL_INTERVAL = 0.1       #Longest a blocked worker or the dispatcher waits before checking for stop
+JOIN_TIMEOUT = 2.0
+LATENCY_HISTORY = 1000
+DISPATCH_THREAD = "render-dispatch"
+WORKER_NAME = "render-worker-%d"
+# Messages from the workers: only slot coordinates cross the process boundary, never pixels
+MESSAGE_FRAME = "frame"   #(MESSAGE_FRAME, ring, frame number, render start)
+MESSAGE_ERROR = "error"   #(MESSAGE_ERROR, worker, error, None)
+WORKER_EXITED = "exited with code %s"
+MEDIAN = 50
+TAIL = 99
+# Log events
+EVENT_POOL_STARTED = "render_pool_started"
+EVENT_POOL_STOPPED = "render_pool_stopped"
+EVENT_WORKER_FAILED = "render_worker_failed"
+
+
+class RingSource:
+    def __init__(self, effect_id, num_leds, output=None):
+        """
+        What one ring of a RenderPool shows: a firmware effect rendered on the host, then its output stage.
+        :param effect_id: One of the EFFECT_* constants.
+        :type effect_id: int
+        :param num_leds: Number of LEDs of the ring or strip.
+        :type num_leds: int
+        :param output: Optional output stage: a table from build_output_lut or a ColorPipeline.
+        :type output: np.ndarray or ColorPipeline
+        Time: O(1)
+        """
+        self.effect_id = effect_id
+        self.num_leds = num_leds
+        self.output = output
+
+    @property
+    def splittable(self):
+        """
+        A ring can be rendered in parts unless its effect draws one random sequence along the strip or its
+        output stage limits the current of the whole frame.
+        """
+        power_limit = isinstance(self.output, ColorPipeline) and self.output.max_milliamps is not None
+        return EFFECTS[self.effect_id].splittable and not power_limit
+
+
+def plan_parts(sources, workers, min_segment=MIN_SEGMENT):
+    """
+    This function cuts the rings into parts and spreads them over the workers, largest first onto the
+    least loaded one. A ring is cut into at most one contiguous part per worker, none shorter than min_segment.
+    :param sources: The rings.
+    :type sources: list[RingSource]
+    :param workers: Number of worker processes.
+    :type workers: int
+    :param min_segment: Shortest part worth its own process.
+    :type min_segment: int
+    :return: For each worker, its parts as (ring, start, stop).
+    :rtype: list[list[tuple[int, int, int]]]
+    Time: O(p log w), where p is the number of parts and w the number of workers.
+    """
+    pieces = []
+    for ring, source in enumerate(sources):
+        count = max(1, min(workers, source.num_leds // min_segment)) if source.splittable else 1
+        bounds = [source.num_leds * part // count for part in range(count + 1)]
+        pieces += [(ring, bounds[part], bounds[part + 1]) for part in range(count)]
+    plan = [[] for _ in range(workers)]
+    loads = [(0, worker) for worker in range(workers)]
+    for ring, start, stop in sorted(pieces, key=lambda piece: piece[2] - piece[1], reverse=True):
+        load, worker = heapq.heappop(loads)
+        plan[worker].append((ring, start, stop))
+        heapq.heappush(loads, (load + stop - start, worker))
+    return plan
+
+
+class SharedFrameRing:
+    def __init__(self, num_leds, slots=DEFAULT_SLOTS, name=None):
+        """
+        The frames of one ring in shared memory: slots (num_leds, 3) uint8 frames the workers render into
+        and the consumer reads in place, frame n in slot n % slots.
+        :param num_leds: Number of LEDs.
+        :type num_leds: int
+        :param slots: Frames in the ring buffer.
+        :type slots: int
+        :param name: Block created by another process to attach to, None creates one.
+        :type name: str
+        Time: O(slots * num_leds) to create, O(1) to attach.
+        """
+        size = slots * num_leds * CHANNELS
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.memory.name
+        self.owner = name is None
+        self.slots = slots
+        self.frames = np.ndarray((slots, num_leds, CHANNELS), dtype=np.uint8, buffer=self.memory.buf)
+
+    def slot(self, frame):
+        return self.frames[frame % self.slots]
+
+    def close(self):
+        """
+        This function detaches the block, and frees it in the process that created it.
+        :return: None
+        Time: O(1)
+        """
+        self.frames = None
+        if self.owner:
+            self.memory.unlink()
+        try:
+            self.memory.close()
+        except BufferError:
+            pass  #a consumer still holds a view, the mapping goes with it
+
+
+def render_worker(index, pieces, sources, names, slots, free, ready, stop, fps, epoch):
+    """
+    Worker process: renders its parts of every frame straight into the rings' shared slots, in frame
+    order, each once the consumer gave the slot back. Frame n is due at epoch + n / fps, or at once
+    without a frame rate. An exception is reported to the dispatcher before the process exits.
+    :param index: Worker number, for errors.
+    :type index: int
+    :param pieces: Its parts as (ring, start, stop).
+    :type pieces: list[tuple[int, int, int]]
+    :param sources: Every ring of the pool.
+    :type sources: list[RingSource]
+    :param names: Shared memory block of each ring.
+    :type names: list[str]
+    :param slots: Frames per ring buffer.
+    :type slots: int
+    :param free: Free slots of each part, per ring then per part start.
+    :type free: list[dict[int, multiprocessing.Semaphore]]
+    :param ready: Where finished parts are announced.
+    :type ready: multiprocessing.Queue
+    :param stop: Flag the pool sets to end the worker. Not a multiprocessing.Event: a worker killed while
+                 waiting on one leaves its lock taken, and the pool's set() would hang.
+    :type stop: multiprocessing.RawValue
+    :param fps: Frames per second, None renders as fast as the consumer takes them.
+    :type fps: float
+    :param epoch: time.monotonic() of frame 0 (the clock is system wide).
+    :type epoch: float
+    :return: None
+    Time: O(frames * LEDs of its parts)
+    """
+    rings = {}
+    try:
+        for ring, _, _ in pieces:
+            if ring not in rings:
+                rings[ring] = SharedFrameRing(sources[ring].num_leds, slots, names[ring])
+        render_frames(pieces, sources, rings, free, ready, stop, fps, epoch)
+        ready.cancel_join_thread()  #stopped: exit without waiting for a dispatcher that no longer reads
+    except Exception as error:
+        ready.put((MESSAGE_ERROR, index, repr(error), None))  #flushed to the pipe before the process exits
+    finally:
+        for shared in rings.values():
+            shared.close()
+
+
+def sleep_until(deadline, stop):
+    """
+    This function sleeps until deadline in steps of at most POLL_INTERVAL, checking the stop flag.
+    :param deadline: time.monotonic() to wake at.
+    :type deadline: float
+    :param stop: The pool's stop flag.
+    :type stop: multiprocessing.RawValue
+    :return: False if stopped first.
+    :rtype: bool
+    Time: O((deadline - now) / POLL_INTERVAL)
+    """
+    while not stop.value:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return True
+        time.sleep(min(remaining, POLL_INTERVAL))
+    return False
+
+
+def render_frames(pieces, sources, rings, free, ready, stop, fps, epoch):
+    """
+    The loop of render_worker, until stop is set.
+    :return: None
+    Time: O(frames * LEDs of the parts)
+    """
+    effects = [create_effect(sources[ring].effect_id, sources[ring].num_leds).segment(start, end)
+               for ring, start, end in pieces]
+    frame = 0
+    while not stop.value:
+        if fps and not sleep_until(epoch + frame / fps, stop):
+            return
+        for (ring, start, end), effect in zip(pieces, effects):
+            while not free[ring][start].acquire(timeout=POLL_INTERVAL):
+                if stop.value:
+                    return
+            started = time.monotonic()
+            effect.step = frame
+            rings[ring].slot(frame)[start:end] = apply_output(sources[ring].output, effect.render())
+            ready.put((MESSAGE_FRAME, ring, frame, started))
+        frame += 1
+
+
+class RenderPool:
+    def __init__(self, sources, workers=None, slots=DEFAULT_SLOTS, fps=None, on_frame=None, min_segment=MIN_SEGMENT,
+                 on_error=None):
+        """
+        Renders the frames of many rings, or of very long strips, in worker processes, clear of the GIL
+        of the Tk thread. Workers write into a shared memory ring buffer per ring and only announce slot
+        numbers; a dispatcher thread hands each complete frame to the consumer in place and gives the
+        slot back, so a slow consumer holds the workers back by at most slots frames.
+        :param sources: The rings.
+        :type sources: list[RingSource]
+        :param workers: Worker processes, defaults to one per core; parts beyond the rings are idle.
+        :type workers: int
+        :param slots: Frames per ring buffer.
+        :type slots: int
+        :param fps: Frames per second, None renders as fast as the consumer takes them.
+        :type fps: float
+        :param on_frame: Called on the dispatcher thread with (ring, pixels, frame number). pixels is the
+                         slot itself, valid until the call returns: copy what is kept.
+        :type on_frame: callable
+        :param min_segment: Shortest part of a strip given to its own worker.
+        :type min_segment: int
+        :param on_error: Called on the dispatcher thread with (worker name, error) when a worker raised or
+                         died, or on_frame raised. The rings it rendered would wait for it forever, so the
+                         pool has stopped rendering by then; stop() still frees it.
+        :type on_error: callable
+        Time: O(1)
+        """
+        self.sources = list(sources)
+        self.workers = workers or os.cpu_count() or 1
+        self.slots = slots
+        self.fps = fps
+        self.on_frame = on_frame
+        self.min_segment = min_segment
+        self.on_error = on_error
+        self.failure = None
+        self.managers = None
+        self.rings = []
+        self.processes = []
+        self.parts = []
+        self.free = []
+        self.ready = None
+        self.stopping = None
+        self.thread = None
+        self.started_at = None
+        self.stopped_at = None
+        self.delivered = [0] * len(self.sources)
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=LATENCY_HISTORY)
+        self.log = get_logger()
+
+    def stream(self, managers):
+        """
+        This function sends each ring's frames to its link (SerialManager or DeviceGroup); the writer
+        thread gets a copy, the slot goes straight back to the workers.
+        :param managers: One link per ring, in the order of the sources.
+        :type managers: list
+        :return: self.
+        :rtype: RenderPool
+        :raises ValueError: If a ring has more LEDs than one link addresses; spread them over several rings.
+        Time: O(rings)
+        """
+        for source in self.sources:
+            if source.num_leds > MAX_FRAME_LEDS:
+                raise ValueError("%d LEDs do not fit one link, at most %d per ring" % (source.num_leds, MAX_FRAME_LEDS))
+        self.managers = list(managers)
+        self.on_frame = lambda ring, pixels, frame: self.managers[ring].send_frame(pixels)
+        return self
+
+    def start(self):
+        """
+        This function creates the shared buffers, starts the workers and the dispatcher.
+        :return: self.
+        :rtype: RenderPool
+        Time: O(rings * slots * num_leds + workers) plus the process start up.
+        """
+        plan = plan_parts(self.sources, self.workers, self.min_segment)
+        context = multiprocessing.get_context()
+        self.rings = [SharedFrameRing(source.num_leds, self.slots) for source in self.sources]
+        starts = [[] for _ in self.sources]
+        for pieces in plan:
+            for ring, start, _ in pieces:
+                starts[ring].append(start)
+        self.parts = [len(ring_starts) for ring_starts in starts]
+        self.free = [{start: context.Semaphore(self.slots) for start in ring_starts} for ring_starts in starts]
+        self.ready = context.Queue()
+        self.stopping = context.RawValue('b', 0)
+        self.started_at = time.monotonic()
+        names = [shared.name for shared in self.rings]
+        self.processes = [context.Process(target=render_worker, name=WORKER_NAME % index, daemon=True,
+                                          args=(index, pieces, self.sources, names, self.slots, self.free, self.ready,
+                                                self.stopping, self.fps, self.started_at))
+                          for index, pieces in enumerate(plan) if pieces]
+        for process in self.processes:
+            process.start()
+        if self.managers and self.fps:
+            for manager in self.managers:
+                manager.frame_budget = 1 / self.fps  #the telemetry judges the ring against it
+        self.thread = threading.Thread(target=self.dispatch, name=DISPATCH_THREAD, daemon=True)
+        self.thread.start()
+        self.log.info(EVENT_POOL_STARTED, rings=len(self.sources), workers=len(self.processes),
+                      leds=sum(source.num_leds for source in self.sources))
+        return self
+
+    def dispatch(self):
+        """
+        Dispatcher loop: collects the parts of each frame and, once all arrived, hands the slot to the
+        consumer and frees it. Every worker renders its parts in frame order, so frames complete in order.
+        Every POLL_INTERVAL it also checks that no worker died without a word (killed, out of memory).
+        :return: None
+        Time: O(m), where m is the number of messages.
+        """
+        stopping = self.stopping
+        arrived = {}  #(ring, frame) -> [parts in, earliest render start]
+        next_check = time.monotonic() + POLL_INTERVAL
+        while not stopping.value:
+            if time.monotonic() >= next_check:
+                next_check = time.monotonic() + POLL_INTERVAL
+                for process in self.processes:
+                    if process.exitcode is not None and not stopping.value:
+                        return self.fail(process.name, WORKER_EXITED % process.exitcode)
+            try:
+                kind, ring, frame, started = self.ready.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if kind == MESSAGE_ERROR:
+                return self.fail(WORKER_NAME % ring, frame)
+            entry = arrived.setdefault((ring, frame), [0, started])
+            entry[0] += 1
+            entry[1] = min(entry[1], started)
+            if entry[0] < self.parts[ring]:
+                continue
+            del arrived[(ring, frame)]
+            if self.on_frame:
+                try:
+                    self.on_frame(ring, self.rings[ring].slot(frame), frame)
+                except Exception as error:
+                    return self.fail(DISPATCH_THREAD, repr(error))
+            self.latencies.append(time.monotonic() - entry[1])
+            self.delivered[ring] += 1
+            for semaphore in self.free[ring].values():
+                semaphore.release()
+
+    def fail(self, name, error):
+        """
+        This function stops rendering after a failure: the frames of every ring the failed part belongs to
+        would never complete, and the other rings would go on alone. The failure is kept for snapshot()
+        and handed to on_error.
+        :param name: The worker process or the dispatcher thread.
+        :type name: str
+        :param error: What happened.
+        :type error: str
+        :return: None
+        Time: O(1)
+        """
+        self.errors += 1
+        self.failure = (name, error)
+        self.stopped_at = time.monotonic()
+        self.stopping.value = 1
+        self.log.warning(EVENT_WORKER_FAILED, worker=name, error=error)
+        if self.on_error:
+            self.on_error(name, error)
+
+    def stop(self):
+        """
+        This function stops the workers and the dispatcher and frees the shared buffers.
+        :return: None
+        Time: O(workers * JOIN_TIMEOUT) in the worst case.
+        """
+        if self.stopping is None:
+            return
+        self.stopping.value = 1
+        self.stopped_at = self.stopped_at or time.monotonic()
+        if self.thread:
+            self.thread.join(JOIN_TIMEOUT)
+        for process in self.processes:
+            process.join(JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        self.ready.close()
+        for shared in self.rings:
+            shared.close()
+        if self.managers and self.fps:
+            for manager in self.managers:
+                manager.frame_budget = None
+        self.stopping = None
+        self.log.info(EVENT_POOL_STOPPED, frames=sum(self.delivered), errors=self.errors)
+
+    def snapshot(self):
+        """
+        This function summarizes the run so far.
+        :return: workers, frames delivered, frames per second over all rings, the median and 99th
+                 percentile of the latency from a frame's render start to the consumer having it in seconds,
+                 errors, and the failure that stopped the pool as (worker, error), or None.
+        :rtype: dict
+        Time: O(h log h), where h is the latency history.
+        """
+        end = self.stopped_at or time.monotonic()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        frames = sum(self.delivered)
+        return {"workers": len(self.processes), "frames": frames, "fps": frames / elapsed if elapsed else 0.0,
+                "latency_p50": float(np.percentile(latencies, MEDIAN)),
+                "latency_p99": float(np.percentile(latencies, TAIL)), "errors": self.errors, "failure": self.failure}
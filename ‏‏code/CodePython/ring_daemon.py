@@ -0,0 +1,437 @@
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import threading
+import numpy as np
+from async_logger import get_logger
+from command_writer import CommandWriter, POLICY_DROP_OLDEST, KIND_OTHER, command_kind
+from device_group import DeviceGroup
+from effect_engine import CHANNELS, NUM_LEDS
+from metrics import start_from_env
+from recorder import Recorder
+from serial_manager import (SerialManager, PORT, BAUDRATE, CONNECT_THREAD, STATE_CONNECTED, STATE_CONNECTING,
+                            STATE_DISCONNECTED, backoff_delay)
+from timeline import TimelinePlayer, load_show
+from telemetry import TELEMETRY_INTERVAL
+
+# Request format: one line per request, answered in order, so clients may pipeline freely.
+#   <firmware command>        rgb:255,0,0 | pulse:r,g,b,speed | chase:r,g,b | 1..9 | stop
+#   @<ring> <command>         the same, for one ring of a group
+#   frame <bytes>             followed by <bytes> raw RGB bytes (num_leds * 3)
+#   status | ping
+# Reply: "ok[ key=value...]" or "err <reason>", one line each.
+DEFAULT_SOCKET = "/tmp/rgb-ring.sock"
+SOCKET_ENV = "RGB_RING_SOCKET"
+ENCODING = 'ascii'
+LINE_END = b'\n'
+REPLY_OK = b"ok\n"
+REPLY_PONG = b"ok pong\n"
+REPLY_ERROR = "err %s\n"
+NO_BOTTLENECK = "none"
+FRAME_VERB = "frame"
+STATUS_VERB = "status"
+PING_VERB = "ping"
+RING_PREFIX = "@"
+MAX_REQUEST_LINE = 1024
+MAX_FRAME_BYTES = 4096 * CHANNELS
+ERR_UNKNOWN = "unknown command"
+ERR_FRAME_SIZE = "bad frame size"
+ERR_NO_FRAMES = "link is not binary"
+ERR_NO_RING = "no such ring"
+ERR_TOO_LONG = "request too long"
+ERR_DAEMON_GONE = "daemon closed the connection"
+OK_PREFIX = b"ok"
+CLIENT_THREAD = "daemon-client-reader"
+RECONNECT_THREAD = "daemon-client-reconnect"
+EVENT_LISTENING = "daemon_listening"
+EVENT_REQUEST_ERROR = "daemon_request_failed"
+
+
+def parse_address(address):
+    """
+    This function tells a Unix socket path from a TCP "host:port".
+    :param address: "/tmp/rgb-ring.sock" or "127.0.0.1:7878".
+    :type address: str
+    :return: (socket family, address for connect/bind).
+    :rtype: tuple
+    Time: O(k), where k is the length of the address.
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit() and os.sep not in address:
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+class RingDaemon:
+    def __init__(self, link):
+        """
+        Headless owner of the ring links; serves the request format above to any number of local
+        clients on one asyncio loop. Commands go to the link's writer queue and never wait for the port.
+        :param link: A SerialManager, or a DeviceGroup for several rings.
+        :type link: SerialManager or DeviceGroup
+        Time: O(1)
+        """
+        self.link = link
+        self.rings = link.rings if isinstance(link, DeviceGroup) else [link]
+        self.clients = set()  #open client streams, closed on shutdown
+        self.requests = 0
+        self.errors = 0
+        self.log = get_logger()
+
+    def execute(self, text):
+        """
+        This function runs one command line.
+        :param text: The decoded request line.
+        :type text: str
+        :return: The reply.
+        :rtype: bytes
+        Time: O(q), as SerialManager.send_command.
+        """
+        if text == PING_VERB:
+            return REPLY_PONG
+        if text == STATUS_VERB:
+            return self.status()
+        target = self.link
+        if text.startswith(RING_PREFIX):
+            index, _, text = text[len(RING_PREFIX):].partition(" ")
+            if not index.isdigit() or int(index) >= len(self.rings):
+                return self.error(ERR_NO_RING)
+            target = self.rings[int(index)]
+        if command_kind(text) == KIND_OTHER:
+            return self.error(ERR_UNKNOWN)
+        target.send_command(text)
+        return REPLY_OK
+
+    def show_frame(self, payload):
+        """
+        This function queues an uploaded frame on every ring.
+        :param payload: num_leds * 3 RGB bytes.
+        :type payload: bytes
+        :return: The reply.
+        :rtype: bytes
+        Time: O(num_leds)
+        """
+        frame = np.frombuffer(payload, dtype=np.uint8).reshape(-1, CHANNELS)
+        return REPLY_OK if self.link.send_frame(frame) else self.error(ERR_NO_FRAMES)
+
+    def status(self):
+        if isinstance(self.link, DeviceGroup):
+            rings = self.link.link_metrics()
+        else:
+            rings = {self.link.port: self.link.link_metrics()}
+        connected = sum(metrics["connected"] for metrics in rings.values())
+        queued = sum(metrics["queued"] for metrics in rings.values())
+        slow = sorted({metrics["telemetry"].get("bottleneck") for metrics in rings.values()} - {None})
+        return (f"ok state={self.link.state} rings={len(rings)} connected={connected} queued={queued} "
+                f"bottleneck={','.join(slow) or NO_BOTTLENECK} "
+                f"clients={len(self.clients)} requests={self.requests} errors={self.errors}\n").encode(ENCODING)
+
+    def error(self, reason):
+        self.errors += 1
+        return (REPLY_ERROR % reason).encode(ENCODING)
+
+    async def serve_client(self, reader, writer):
+        """
+        Per connection coroutine: reads requests and writes the replies in order.
+        :param reader: Client stream, read side.
+        :type reader: asyncio.StreamReader
+        :param writer: Client stream, write side.
+        :type writer: asyncio.StreamWriter
+        :return: None
+        Time: O(r), where r is the number of requests.
+        """
+        self.clients.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(self.error(ERR_TOO_LONG))
+                    break  #the rest of the line would be read as requests
+                if not line.endswith(LINE_END):
+                    break  #end of stream, a partial last line is ignored
+                self.requests += 1
+                text = line.decode(ENCODING, errors='replace').strip()
+                verb, _, size = text.partition(" ")
+                if verb == FRAME_VERB:
+                    if not size.isdigit() or int(size) % CHANNELS or int(size) > MAX_FRAME_BYTES:
+                        writer.write(self.error(ERR_FRAME_SIZE))
+                        break  #the payload cannot be skipped reliably, drop the client
+                    writer.write(self.show_frame(await reader.readexactly(int(size))))
+                else:
+                    writer.write(self.execute(text))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as error:
+            self.log.warning(EVENT_REQUEST_ERROR, error=str(error))
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def close_clients(self):
+        """
+        This coroutine closes every open client stream; closing the server alone leaves them open.
+        :return: None
+        Time: O(c), where c is the number of clients.
+        """
+        writers = list(self.clients)
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start_server(self, address):
+        """
+        This coroutine listens on a Unix socket path or a local TCP "host:port".
+        :param address: Where to listen; a stale socket file is replaced.
+        :type address: str
+        :return: The server.
+        :rtype: asyncio.AbstractServer
+        Time: O(1)
+        """
+        family, where = parse_address(address)
+        if family == socket.AF_INET:
+            server = await asyncio.start_server(self.serve_client, *where, limit=MAX_REQUEST_LINE)
+        else:
+            if os.path.exists(where):
+                os.unlink(where)
+            server = await asyncio.start_unix_server(self.serve_client, where, limit=MAX_REQUEST_LINE)
+        self.log.info(EVENT_LISTENING, address=address)
+        return server
+
+    def connect_links(self):
+        """
+        This function connects the links on a background thread, the server answers meanwhile.
+        :return: The connecting thread.
+        :rtype: threading.Thread
+        Time: O(1)
+        """
+        thread = threading.Thread(target=self.link.connect, name=CONNECT_THREAD, daemon=True)
+        thread.start()
+        return thread
+
+    async def serve(self, address, stop=None):
+        """
+        This coroutine runs the daemon until stop is set (or forever).
+        :param address: Where to listen.
+        :type address: str
+        :param stop: Set to shut down.
+        :type stop: asyncio.Event
+        :return: None
+        Time: O(1) plus the requests served.
+        """
+        self.connect_links()
+        server = await self.start_server(address)
+        try:
+            await (stop.wait() if stop else asyncio.Event().wait())
+        finally:
+            server.close()
+            await self.close_clients()
+            await server.wait_closed()
+            self.link.close()
+
+
+class SocketPort:
+    def __init__(self, sock):
+        """
+        A connected socket with the write()/close() subset of pyserial that CommandWriter uses.
+        :param sock: The connected socket.
+        :type sock: socket.socket
+        Time: O(1)
+        """
+        self.sock = sock
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.sock.close()
+
+
+def encode_request(command):
+    return (command + "\n").encode(ENCODING)
+
+
+def encode_frame_request(frame):
+    payload = np.ascontiguousarray(frame, dtype=np.uint8).tobytes()
+    return f"{FRAME_VERB} {len(payload)}\n".encode(ENCODING) + payload
+
+
+class DaemonClient:
+    def __init__(self, address=DEFAULT_SOCKET, policy=POLICY_DROP_OLDEST):
+        """
+        Talks to a RingDaemon with the SerialManager interface used by LEDController, LedRingApp and
+        FrameStreamer, so the GUI becomes one client of the daemon. Requests go through the same
+        coalescing writer thread as a serial link; replies are read and counted on a reader thread.
+        :param address: Daemon socket path or "host:port".
+        :type address: str
+        :param policy: Backpressure policy of the request queue.
+        :type policy: str
+        Time: O(1)
+        """
+        self.address = address
+        self.port = address
+        self.sock = None
+        self.connected = False
+        self.state = STATE_DISCONNECTED
+        self.state_listeners = []
+        self.stop_event = threading.Event()
+        self.link_lock = threading.Lock()
+        self.writer = CommandWriter(policy=policy, encoder=encode_request, frame_encoder=encode_frame_request,
+                                    on_error=self.handle_link_error)
+        self.reader_thread = None
+        self.replies = 0
+        self.errors = 0
+        self.last_error = None
+        self.log = get_logger()
+
+    def add_state_listener(self, listener):
+        self.state_listeners.append(listener)
+
+    def set_state(self, state):
+        self.state = state
+        for listener in self.state_listeners:
+            listener(state)
+
+    def connect(self):
+        """
+        This function connects to the daemon, backing off between attempts until successful or closed.
+        :return: True if connected, False if cancelled.
+        :rtype: bool
+        Time: O(n), where n is the number of attempts.
+        """
+        self.stop_event.clear()
+        return self.retry_connect()
+
+    def retry_connect(self):
+        self.set_state(STATE_CONNECTING)
+        family, where = parse_address(self.address)
+        attempt = 0
+        while not self.stop_event.is_set():
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                sock.connect(where)
+            except OSError:
+                sock.close()
+                if self.stop_event.wait(backoff_delay(attempt)):
+                    break
+                attempt += 1
+                continue
+            self.sock = sock
+            self.connected = True
+            self.writer.resume(SocketPort(sock))
+            self.writer.start()
+            self.reader_thread = threading.Thread(target=self.read_replies, args=(sock,), name=CLIENT_THREAD,
+                                                  daemon=True)
+            self.reader_thread.start()
+            self.set_state(STATE_CONNECTED)
+            return True
+        self.set_state(STATE_DISCONNECTED)
+        return False
+
+    def read_replies(self, sock):
+        """
+        Reader loop: counts replies and logs errors until the daemon goes away.
+        :param sock: The connected socket.
+        :type sock: socket.socket
+        :return: None
+        Time: O(r), where r is the number of replies.
+        """
+        try:
+            for line in sock.makefile('rb'):
+                self.replies += 1
+                if not line.startswith(OK_PREFIX):
+                    self.errors += 1
+                    self.last_error = line.decode(ENCODING, errors='replace').strip()
+                    self.log.warning(EVENT_REQUEST_ERROR, reply=self.last_error)
+        except OSError:
+            pass
+        self.handle_link_error(ConnectionError(ERR_DAEMON_GONE))
+
+    def handle_link_error(self, error):
+        """
+        Called when the daemon connection fails: pauses the queue and reconnects in the background.
+        :param error: The exception.
+        :type error: Exception
+        :return: None
+        Time: O(1)
+        """
+        with self.link_lock:
+            if not self.connected or self.stop_event.is_set():
+                return
+            self.connected = False
+        self.writer.pause()
+        if self.sock:
+            self.sock.close()
+        threading.Thread(target=self.retry_connect, name=RECONNECT_THREAD, daemon=True).start()
+
+    def send_command(self, command, policy=None):
+        self.writer.submit(command, policy)
+
+    def send_frame(self, frame, copy=True):
+        if not self.connected:
+            return False
+        return self.writer.submit(frame.copy() if copy else frame)
+
+    def close(self):
+        self.stop_event.set()
+        self.connected = False
+        self.writer.stop()
+        if self.sock:
+            self.sock.close()
+        self.set_state(STATE_DISCONNECTED)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless RGB ring controller with a local control socket")
+    parser.add_argument("--port", nargs="+", default=[PORT], help="serial ports (sim:// for a simulated ring)")
+    parser.add_argument("--baud", type=int, default=BAUDRATE)
+    parser.add_argument("--max-baud", type=int, help="negotiate the line speed up to this rate after connecting")
+    parser.add_argument("--telemetry", type=int, default=TELEMETRY_INTERVAL, metavar="MS",
+                        help="ask each ring for a telemetry record every MS milliseconds, 0 for none")
+    parser.add_argument("--listen", default=os.environ.get(SOCKET_ENV, DEFAULT_SOCKET),
+                        help="Unix socket path or local host:port")
+    parser.add_argument("--record", help="record the traffic of each ring to this file (.<i> appended for a group)")
+    parser.add_argument("--show", help="play this show file (see timeline.py) on every ring")
+    parser.add_argument("--leds", type=int, default=NUM_LEDS, help="LEDs per ring, for --show")
+    args = parser.parse_args()
+    start_from_env()
+    if len(args.port) > 1:
+        link = DeviceGroup(args.port, args.baud, max_baudrate=args.max_baud, telemetry_interval=args.telemetry)
+    else:
+        link = SerialManager(port=args.port[0], baudrate=args.baud, max_baudrate=args.max_baud,
+                             telemetry_interval=args.telemetry)
+    rings = link.rings if len(args.port) > 1 else [link]
+    for index, ring in enumerate(rings if args.record else []):
+        ring.recorder = Recorder(args.record if len(rings) == 1 else f"{args.record}.{index}")
+    show = TimelinePlayer(link, load_show(args.show), args.leds) if args.show else None
+
+    async def run():
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+            except NotImplementedError:
+                pass  #Windows: Ctrl+C still raises KeyboardInterrupt
+        if show:
+            show.start()  #frames are dropped until the links are up, the show keeps its clock
+        await RingDaemon(link).serve(args.listen, stop)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        link.close()
+    finally:
+        if show:
+            show.stop()
+        for ring in rings:
+            if ring.recorder:
+                ring.recorder.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from async_logger import get_logger
+
+STATS_WINDOW = 1024
+MS_PER_SECOND = 1000.0
+PERCENTILES = (50, 95, 99)
+ERR_CALLBACK = "timer_failed"
+
+
+class TimerStats:
+    def __init__(self, window=STATS_WINDOW):
+        """
+        Lateness statistics of one timer: how far after its absolute deadline each tick ran.
+        Keeps a fixed window of recent samples for percentiles plus running totals.
+        :param window: Number of recent samples kept.
+        :type window: int
+        Time: O(1)
+        """
+        self.window = window
+        self.samples = []
+        self.next_sample = 0
+        self.count = 0
+        self.skipped = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, lateness):
+        """
+        This function adds one lateness sample.
+        :param lateness: Seconds between the deadline and the actual run.
+        :type lateness: float
+        :return: None
+        Time: O(1)
+        """
+        if len(self.samples) < self.window:
+            self.samples.append(lateness)
+        else:
+            self.samples[self.next_sample] = lateness
+            self.next_sample = (self.next_sample + 1) % self.window
+        self.count += 1
+        self.total += lateness
+        if lateness > self.max:
+            self.max = lateness
+
+    def snapshot(self):
+        """
+        This function summarizes the statistics in milliseconds.
+        :return: count, skipped, mean/max lateness and p50/p95/p99 over the recent window.
+        :rtype: dict
+        Time: O(w log w), where w is the window size.
+        """
+        ordered = sorted(self.samples)
+        summary = {
+            "count": self.count,
+            "skipped": self.skipped,
+            "mean_ms": self.total / self.count * MS_PER_SECOND if self.count else 0.0,
+            "max_ms": self.max * MS_PER_SECOND,
+        }
+        for percentile in PERCENTILES:
+            value = ordered[min(len(ordered) - 1, len(ordered) * percentile // 100)] if ordered else 0.0
+            summary[f"p{percentile}_ms"] = value * MS_PER_SECOND
+        return summary
+
+
+class TimerHandle:
+    def __init__(self, scheduler, callback, deadline, interval, skip_missed, name):
+        """
+        A scheduled callback. Periodic timers keep absolute deadlines (start + k * interval),
+        so late ticks do not push later ticks back.
+        :param scheduler: Owning scheduler.
+        :type scheduler: Scheduler
+        :param callback: Function run on the scheduler thread.
+        :type callback: callable
+        :param deadline: First deadline on the time.monotonic() clock.
+        :type deadline: float
+        :param interval: Period in seconds, None for a one-shot timer.
+        :type interval: float
+        :param skip_missed: Drop ticks that are already a full period late instead of bursting them.
+        :type skip_missed: bool
+        :param name: Label used in statistics.
+        :type name: str
+        Time: O(1)
+        """
+        self.scheduler = scheduler
+        self.callback = callback
+        self.deadline = deadline
+        self.interval = interval
+        self.skip_missed = skip_missed
+        self.name = name
+        self.cancelled = False
+        self.stats = TimerStats()
+
+    def cancel(self):
+        """
+        This function cancels the timer; a tick already running still completes.
+        :return: None
+        Time: O(1)
+        """
+        self.cancelled = True
+        self.scheduler.wake()
+
+    def next_deadline(self, now):
+        """
+        This function moves a periodic timer to its next deadline.
+        :param now: Current monotonic time.
+        :type now: float
+        :return: None
+        Time: O(1)
+        """
+        self.deadline += self.interval
+        if self.skip_missed and self.deadline <= now:
+            missed = int((now - self.deadline) // self.interval) + 1
+            self.stats.skipped += missed
+            self.deadline += missed * self.interval
+
+
+class Scheduler:
+    def __init__(self, name="scheduler"):
+        """
+        Monotonic-clock timer thread for periodic host to device traffic, independent of the Tk event loop.
+        :param name: Thread name.
+        :type name: str
+        Time: O(1)
+        """
+        self.name = name
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.timers = {}
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        This function starts the scheduler thread if it is not running.
+        :return: The scheduler itself.
+        :rtype: Scheduler
+        Time: O(1)
+        """
+        with self.condition:
+            if self.running:
+                return self
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        This function stops the scheduler thread; pending timers are dropped.
+        :param timeout: Seconds to wait for the thread.
+        :type timeout: float
+        :return: None
+        Time: O(1)
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def wake(self):
+        """
+        This function wakes the scheduler thread so it re-reads the timer heap.
+        :return: None
+        Time: O(1)
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def schedule(self, handle):
+        """
+        This function pushes a timer on the heap.
+        :param handle: The timer.
+        :type handle: TimerHandle
+        :return: The same handle.
+        :rtype: TimerHandle
+        Time: O(log t), where t is the number of timers.
+        """
+        with self.condition:
+            heapq.heappush(self.heap, (handle.deadline, next(self.counter), handle))
+            self.timers[handle.name] = handle
+            self.condition.notify_all()
+        return handle
+
+    def call_later(self, delay, callback, name=None):
+        """
+        This function runs callback once after delay seconds.
+        :param delay: Seconds from now.
+        :type delay: float
+        :param callback: Function to run.
+        :type callback: callable
+        :param name: Label used in statistics.
+        :type name: str
+        :return: A cancellable handle.
+        :rtype: TimerHandle
+        Time: O(log t)
+        """
+        name = name or f"once-{next(self.counter)}"
+        return self.schedule(TimerHandle(self, callback, time.monotonic() + delay, None, False, name))
+
+    def call_every(self, interval, callback, start_delay=0.0, skip_missed=True, name=None):
+        """
+        This function runs callback every interval seconds on absolute deadlines.
+        :param interval: Period in seconds.
+        :type interval: float
+        :param callback: Function to run.
+        :type callback: callable
+        :param start_delay: Seconds until the first tick.
+        :type start_delay: float
+        :param skip_missed: Skip ticks already a full period late instead of running them back to back.
+        :type skip_missed: bool
+        :param name: Label used in statistics.
+        :type name: str
+        :return: A cancellable handle.
+        :rtype: TimerHandle
+        Time: O(log t)
+        """
+        name = name or f"every-{next(self.counter)}"
+        deadline = time.monotonic() + start_delay
+        return self.schedule(TimerHandle(self, callback, deadline, interval, skip_missed, name))
+
+    def stats(self):
+        """
+        This function returns the jitter statistics of every timer.
+        :return: Mapping of timer name to TimerStats.snapshot().
+        :rtype: dict
+        Time: O(t * w log w)
+        """
+        with self.condition:
+            timers = list(self.timers.values())
+        return {timer.name: timer.stats.snapshot() for timer in timers}
+
+    def forget(self, handle):
+        """
+        This function drops a finished or cancelled timer from the statistics table.
+        Must be called with the condition held.
+        :param handle: The timer.
+        :type handle: TimerHandle
+        :return: None
+        Time: O(1)
+        """
+        if self.timers.get(handle.name) is handle:
+            del self.timers[handle.name]
+
+    def next_due(self):
+        """
+        This function waits for the earliest timer to become due. Must be called with the condition held.
+        :return: The due timer, or None when stopping.
+        :rtype: TimerHandle or None
+        Time: O(log t) per wake-up
+        """
+        while self.running:
+            if not self.heap:
+                self.condition.wait()
+                continue
+            deadline, _, handle = self.heap[0]
+            if handle.cancelled:
+                heapq.heappop(self.heap)
+                self.forget(handle)
+                continue
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                heapq.heappop(self.heap)
+                return handle
+            self.condition.wait(delay)
+        return None
+
+    def run(self):
+        """
+        Scheduler loop: runs each due callback, records its lateness and re-arms periodic timers.
+        :return: None
+        Time: O(log t) per tick plus the callbacks.
+        """
+        while True:
+            with self.condition:
+                handle = self.next_due()
+                if handle is None:
+                    return
+            now = time.monotonic()
+            handle.stats.record(now - handle.deadline)
+            try:
+                handle.callback()
+            except Exception:
+                get_logger().error(ERR_CALLBACK, timer=handle.name, traceback=traceback.format_exc())
+            with self.condition:
+                if handle.interval is not None and not handle.cancelled:
+                    handle.next_deadline(time.monotonic())
+                    heapq.heappush(self.heap, (handle.deadline, next(self.counter), handle))
+                else:
+                    self.forget(handle)
+
+
+default_scheduler = None
+default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    This function returns the process wide scheduler, starting it on first use.
+    :return: The shared scheduler.
+    :rtype: Scheduler
+    Time: O(1)
+    """
+    global default_scheduler
+    with default_scheduler_lock:
+        if default_scheduler is None:
+            default_scheduler = Scheduler().start()
+        return default_scheduler
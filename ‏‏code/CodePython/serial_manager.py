@@ -1,70 +1,735 @@
 import time
+import random
 import serial
 import threading
+from serial.tools import list_ports
+from serial_reader import SerialReader, SUBSCRIBER_QUEUE_SIZE, READY_LINE
+from device_state import DeviceState
+from command_writer import (CommandWriter, POLICY_DROP_OLDEST, KIND_RGB, KIND_EFFECT, KIND_STOP, KIND_FRAME, KIND_SPEED,
+                            KIND_PLAY, KIND_RAW, QueueFullError, command_kind)
+from scheduler import get_scheduler
+from transport import open_transport, byte_time
+from metrics import get_registry
+from async_logger import get_logger
+from frame_codec import FrameEncoder, ENCODING_AUTO, MAX_FRAME_LEDS
+from frame_protocol import encode_command, PROTOCOL_ASCII, PROTOCOL_AUTO, PROTOCOL_BINARY, HELLO_COMMAND, HELLO_REPLY
+from link_speed import SAFE_BAUDRATE, get_baud_cache, negotiate_baudrate
+from telemetry import DeviceTelemetry, BOTTLENECK_DEVICE, parse_telemetry, telemetry_command
 
 PORT = 'COM5'
-BAUDRATE = 9600
-ERR_CONNECT = "Connection error, retry..."
-OK_CONNECT = "Connections are successful"
-TIME_RETRY = 5
-COMMAND_SENT = "Command been sent: %s"
-MSG_FROM_ARDUINO = "Messages from Arduino: %s"
+BAUDRATE = SAFE_BAUDRATE     #Every board boots at this rate, negotiate_speed() raises it
+# Log events
+ERR_CONNECT = "connect_failed"
+OK_CONNECT = "connected"
+TIME_RETRY = 5            #Longest wait between two connection attempts (seconds)
+RETRY_BASE = 0.25         #First backoff delay (seconds), doubled after each failed round
+RETRY_JITTER = 0.5        #Each delay is scaled by a random factor in [1 - RETRY_JITTER, 1]
+COMMAND_SENT = "command_sent"
+MSG_FROM_ARDUINO = "device_message"
 SERIAL_TIMEOUT = 1
-SERIAL_WAITING = 0
-CONNECT_DELAY = 2
+READY_TIMEOUT = 2.5       #Longest wait for the firmware's Ready line after opening the port
 CONNECTED_STATE = True
+NEGOTIATE_MAX_LINES = 4
+PROTOCOL_SELECTED = "protocol_selected"
+PORT_AUTO = None
+# USB vendor ids of Arduino boards and the usual USB-serial bridges on clones
+ARDUINO_VIDS = (0x2341, 0x2A03, 0x1A86, 0x0403, 0x10C4)
+ARDUINO_HINT = "arduino"
+LINK_LOST = "link_lost"
+LINK_RESTORED = "link_restored"
+LINK_SILENT = "no data for %.1f s"
+READER_JOIN_TIMEOUT = 2 * SERIAL_TIMEOUT
+RECONNECT_THREAD = "serial-reconnect"
+CONNECT_THREAD = "serial-connect"
+# Commands that define what the ring shows, replayed after a reconnect (stored entries survive it)
+STATE_KINDS = (KIND_RGB, KIND_EFFECT, KIND_STOP, KIND_PLAY)
+DEVICE_RESET = "device_reset"
+DEVICE_RESET_ERROR = "device reset, binary protocol lost"
+LINE_GARBLED = "garbled line at %d baud"
+FRAME_TOO_LONG = "frame_too_long"
+
+# Connection states reported to listeners
+STATE_DISCONNECTED = "disconnected"
+STATE_CONNECTING = "connecting"
+STATE_CONNECTED = "connected"
+
+
+def discover_ports(preferred=PORT_AUTO):
+    """
+    This function lists candidate serial ports: the preferred one first, then likely Arduino
+    boards, then every other port.
+    :param preferred: Port to try first, or PORT_AUTO.
+    :type preferred: str
+    :return: Port names in the order they should be tried.
+    :rtype: list[str]
+    Time: O(p log p), where p is the number of ports on the system.
+    """
+    ports = list_ports.comports()
+    likely = [port.device for port in ports
+              if port.vid in ARDUINO_VIDS or ARDUINO_HINT in (port.description or "").lower()]
+    others = [port.device for port in ports if port.device not in likely]
+    candidates = ([preferred] if preferred else []) + likely + others
+    return list(dict.fromkeys(candidates))
+
+
+def backoff_delay(attempt):
+    """
+    This function computes the wait before the next connection round: exponential with jitter,
+    capped at TIME_RETRY, so many hosts retrying together do not hammer the ports in lock step.
+    :param attempt: Number of failed rounds so far.
+    :type attempt: int
+    :return: Seconds to wait.
+    :rtype: float
+    Time: O(1)
+    """
+    delay = min(TIME_RETRY, RETRY_BASE * (2 ** attempt))
+    return delay * random.uniform(1 - RETRY_JITTER, 1)
 
 class SerialManager:
-    def __init__(self, port=PORT, baudrate=BAUDRATE):
+    def __init__(self, port=PORT, baudrate=BAUDRATE, policy=POLICY_DROP_OLDEST, protocol=PROTOCOL_AUTO,
+                 frame_encoding=ENCODING_AUTO, silence_timeout=None, discover=True, name=None, recorder=None,
+                 suppress_redundant=True, max_baudrate=None, baud_cache=None, telemetry_interval=None):
+        """
+        Supervised serial link: I/O errors (and, optionally, read silence) tear the port down and
+        reopen it with backoff, then the last color or effect is sent again.
+        :param silence_timeout: Seconds without any byte from the device that count as a dead link.
+                                None disables the check, the stock firmware only talks when spoken to.
+        :type silence_timeout: float
+        :param discover: Also try auto-discovered ports; a DeviceGroup pins every ring to its own port.
+        :type discover: bool
+        :param name: Ring name, added as a label to the metrics when several links share a process.
+        :type name: str
+        :param recorder: Records the commands and frames sent and the lines received (see recorder.py).
+        :type recorder: Recorder
+        :param suppress_redundant: Drop commands the device state mirror says would change nothing.
+        :type suppress_redundant: bool
+        :param max_baudrate: Negotiate up to this rate after every connect (see link_speed.py); None stays at baudrate.
+        :type max_baudrate: int
+        :param baud_cache: Where the rate each port held is kept, defaults to get_baud_cache().
+        :type baud_cache: BaudCache
+        :param telemetry_interval: Ask the firmware for a telemetry record every this many ms after every
+                                   connect (see telemetry.py); None leaves it off.
+        :type telemetry_interval: int
+        """
         self.port = port
+        self.discover = discover
+        self.name = name
         self.baudrate = baudrate
+        self.max_baudrate = max_baudrate
+        self.baud_cache = baud_cache or get_baud_cache()
+        self.line_baudrate = baudrate
+        self.connected_at = None
+        self.protocol = protocol
+        self.active_protocol = PROTOCOL_ASCII
         self.ser = None
         self.connected = False
+        self.state = STATE_DISCONNECTED
+        self.state_listeners = []
+        self.stop_event = threading.Event()
+        self.link_lock = threading.Lock()
+        self.recorder = recorder
+        self.device_state = DeviceState()
+        self.suppress_redundant = suppress_redundant
+        self.state_commands = 0
+        self.suppressed = 0
+        self.reader = SerialReader(on_message=self.print_message, on_error=self.handle_link_error,
+                                   on_garbage=self.check_garbage)
+        self.frame_encoder = FrameEncoder(frame_encoding)
+        self.writer = CommandWriter(policy=policy, frame_encoder=self.frame_encoder.encode, on_sent=self.print_command,
+                                    on_error=self.handle_link_error, on_dropped=self.command_dropped)
+        self.last_state_command = None
+        self.last_speed_command = None
+        self.telemetry_interval = telemetry_interval
+        self.telemetry = DeviceTelemetry(name=name)
+        self.frame_budget = None  #seconds per frame while something streams frames, set by the streamer
+        self.telemetry_mark = None
+        self.silence_timeout = silence_timeout
+        self.watchdog = None
+        self.link_down_at = None
+        self.reconnects = 0
+        self.downtime_total = 0.0
+        self.log = get_logger()
+        self.metrics = self.register_metrics()
 
     def connect(self):
         """
-        this function establishes a connection to the serial device. Retries every TIME_RETRY seconds
-        if the connection fails, until successful.
+        this function establishes a connection to the serial device. Tries the configured port and
+        the auto-discovered ones, backing off exponentially with jitter between rounds, until successful
+        or until close() is called.
         :param: None
-        :return: None
-        :rtype: None
-        Time: O(n), where n is the number of retry attempts until connection is established.
+        :return: True if connected, False if cancelled.
+        :rtype: bool
+        Time: O(n * p), where n is the number of rounds and p the number of candidate ports.
+        """
+        self.stop_event.clear()
+        if self.silence_timeout and self.watchdog is None:
+            self.watchdog = get_scheduler().call_every(self.silence_timeout / 2, self.check_silence, name="link watchdog")
+        return self.retry_connect()
+
+    def retry_connect(self):
         """
+        This function is the connect loop without resetting the cancel flag, so a reconnect
+        started just before close() cannot undo it.
+        :return: True if connected, False if cancelled.
+        :rtype: bool
+        Time: O(n * p), where n is the number of rounds and p the number of candidate ports.
+        """
+        self.set_state(STATE_CONNECTING)
+        attempt = 0
         while not self.connected:
             #Loop will run until it connects
+            for port in discover_ports(self.port) if self.discover else [self.port]:
+                if self.stop_event.is_set():
+                    break
+                try:
+                    self.open_port(port)
+                    break
+                except serial.SerialException as error:
+                    #If not connect
+                    self.log.warning(ERR_CONNECT, port=port, error=str(error))
+            if self.connected:
+                break
+            if self.stop_event.wait(backoff_delay(attempt)):
+                self.set_state(STATE_DISCONNECTED)
+                return False
+            attempt += 1
+        self.set_state(STATE_CONNECTED)
+        self.log.info(OK_CONNECT, port=self.port, baudrate=self.line_baudrate)
+        return True
+
+    def open_port(self, port):
+        """
+        This function opens one port, waits for the firmware to be ready, negotiates the line speed
+        and the protocol, and starts the reader and writer threads.
+        :param port: Port name, pyserial URL (socket://, loop://) or sim:// for the built-in simulator.
+        :type port: str
+        :return: None
+        :raises serial.SerialException: If the port cannot be opened.
+        Time: O(READY_TIMEOUT) in the worst case.
+        """
+        ser = open_transport(port, self.baudrate, timeout=SERIAL_TIMEOUT) #trying to connect
+        self.ser = ser
+        try:
+            if self.wait_ready():
+                self.device_state.boot()
+            else:
+                self.device_state.invalidate()  #no reset seen, the ring may still show anything
+            self.negotiate_speed(port)
+            self.negotiate_protocol()
+            if self.telemetry_interval:
+                #Before the writer owns the port, so it is on before anything else goes out
+                ser.write(self.writer.encoder(telemetry_command(self.telemetry_interval)))
+        except serial.SerialException:
+            ser.close()
+            self.ser = None
+            raise
+        self.port = port
+        self.frame_encoder.reset()
+        self.connected_at = time.monotonic()
+        self.connected = CONNECTED_STATE #int he connection
+        self.writer.resume(ser)
+        self.writer.start()
+        self.reader.ser = ser
+        self.reader.start()
+
+    def wait_ready(self, timeout=READY_TIMEOUT):
+        """
+        Waits for the firmware's Ready line instead of sleeping a fixed time; boards that do not
+        reset when the port opens never print it, so the wait is bounded by timeout.
+        :param timeout: Longest wait in seconds.
+        :type timeout: float
+        :return: True if Ready was seen.
+        :rtype: bool
+        Time: O(timeout)
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.ser.timeout = max(0.0, deadline - time.monotonic())
+            line = self.ser.readline().decode('utf-8', errors='replace').strip()
+            if line == READY_LINE:
+                self.ser.timeout = SERIAL_TIMEOUT
+                return True
+        self.ser.timeout = SERIAL_TIMEOUT
+        return False
+
+    def add_state_listener(self, listener):
+        """
+        Registers a callback for connection state changes. It runs on the connecting thread,
+        so Tk listeners must hand the work to the event loop themselves.
+        :param listener: Called with one of the STATE_* constants.
+        :type listener: callable
+        :return: None
+        Time: O(1)
+        """
+        self.state_listeners.append(listener)
+
+    def set_state(self, state):
+        """
+        Records the connection state and notifies the listeners.
+        :param state: One of the STATE_* constants.
+        :type state: str
+        :return: None
+        Time: O(l), where l is the number of listeners.
+        """
+        self.state = state
+        for listener in self.state_listeners:
+            listener(state)
+
+    def negotiate_speed(self, port):
+        """
+        Raises the line speed up to max_baudrate, trying the rate cached for the port first.
+        Runs before the reader and writer threads own the port, like negotiate_protocol().
+        :param port: The port being opened, the cache key.
+        :type port: str
+        :return: The rate in use.
+        :rtype: int
+        Time: O(r * BAUD_REPLY_TIMEOUT) in the worst case, where r is the number of rates tried.
+        """
+        self.line_baudrate = self.baudrate
+        if not self.max_baudrate or self.max_baudrate <= self.baudrate:
+            return self.baudrate
+        rate = negotiate_baudrate(self.ser, self.max_baudrate, self.baud_cache.get(port), self.baudrate)
+        if rate > self.baudrate:
+            self.baud_cache.store(port, rate)
+        self.line_baudrate = rate
+        return rate
+
+    def negotiate_protocol(self):
+        """
+        Asks the firmware for the binary frame protocol and switches the writer to it when confirmed.
+        Old firmware never answers, so the link stays on ASCII after a silent read.
+        Runs before the reader and writer threads own the port.
+        :return: The protocol in use (PROTOCOL_ASCII or PROTOCOL_BINARY).
+        :rtype: str
+        Time: O(NEGOTIATE_MAX_LINES * SERIAL_TIMEOUT) in the worst case.
+        """
+        self.active_protocol = PROTOCOL_ASCII
+        self.writer.encoder = CommandWriter.encode_ascii
+        if self.protocol == PROTOCOL_BINARY:
+            #Caller knows the firmware, skip the handshake
+            self.active_protocol = PROTOCOL_BINARY
+            self.writer.encoder = encode_command
+        elif self.protocol == PROTOCOL_AUTO:
+            self.ser.write(CommandWriter.encode_ascii(HELLO_COMMAND))
+            for _ in range(NEGOTIATE_MAX_LINES):
+                line = self.ser.readline().decode('utf-8', errors='replace').strip()
+                if line == HELLO_REPLY:
+                    self.active_protocol = PROTOCOL_BINARY
+                    self.writer.encoder = encode_command
+                    break
+                if not line:
+                    break
+        self.log.info(PROTOCOL_SELECTED, protocol=self.active_protocol)
+        return self.active_protocol
+
+    def handle_link_error(self, error):
+        """
+        Called by the reader or writer thread when the port fails. Marks the link down once and
+        reconnects on a separate thread; commands sent meanwhile wait in the writer's bounded queue.
+        :param error: The exception raised by the port.
+        :type error: Exception
+        :return: None
+        Time: O(1)
+        """
+        with self.link_lock:
+            if not self.connected or self.stop_event.is_set():
+                return  #already reconnecting, or closing on purpose
+            self.connected = False
+            self.link_down_at = time.monotonic()
+        self.writer.pause()
+        self.log.warning(LINK_LOST, port=self.port, error=str(error))
+        threading.Thread(target=self.reconnect, name=RECONNECT_THREAD, daemon=True).start()
+
+    def reconnect(self):
+        """
+        Tears the dead port down, reopens it with backoff and sends the last effect speed and color or
+        effect again, so the ring comes back the way it was.
+        :return: True if the link is back, False if close() cancelled it.
+        :rtype: bool
+        Time: O(n * p), as retry_connect().
+        """
+        old = self.ser
+        self.ser = None
+        if old:
             try:
-                self.ser = serial.Serial(self.port, self.baudrate, timeout=SERIAL_TIMEOUT) #trying to connect
-                time.sleep(CONNECT_DELAY)   #wait after connecting
-                self.connected = CONNECTED_STATE #int he connection
-                print(OK_CONNECT)
-            except serial.SerialException:
-                #If not connect
-                print(ERR_CONNECT)
-                time.sleep(TIME_RETRY)
-
-    def send_command(self, command):
-        """
-        Sends a command to the connected serial device.
+                old.close()  #unblocks a reader still waiting in read()
+            except OSError:
+                pass
+        self.reader.stop(READER_JOIN_TIMEOUT)
+        #Frames queued for the dead link were encoded against its delta state
+        self.writer.discard(KIND_FRAME)
+        self.writer.discard(KIND_RAW)  #the chunks of an upload under way, the new link starts it over
+        self.device_state.invalidate()
+        if self.line_baudrate > self.baudrate and self.connected_at is not None:
+            #A link that dies soon after the connect counts against the negotiated rate
+            self.baud_cache.link_error(self.port, self.line_baudrate, self.link_down_at - self.connected_at)
+        if self.last_speed_command is not None:
+            self.writer.submit(self.last_speed_command)  #the board boots at DELAY_TIME again
+        if self.last_state_command is not None:
+            #Queued now, it merges with a pending copy and goes out as soon as the port is back
+            self.writer.submit(self.last_state_command)
+        if not self.retry_connect():
+            return False
+        if self.last_state_command is not None:
+            self.device_state.restore(self.last_state_command)
+        downtime = time.monotonic() - self.link_down_at
+        self.reconnects += 1
+        self.downtime_total += downtime
+        self.log.info(LINK_RESTORED, port=self.port, downtime=round(downtime, 3))
+        return True
+
+    def check_silence(self):
+        """
+        Watchdog tick: a link that has been silent longer than silence_timeout is treated as dead.
+        :return: None
+        Time: O(1)
+        """
+        if self.connected and time.monotonic() - self.reader.last_activity > self.silence_timeout:
+            self.handle_link_error(TimeoutError(LINK_SILENT % self.silence_timeout))
+
+    def link_metrics(self):
+        """
+        Returns the link supervision counters.
+        :return: reconnects, total and current downtime in seconds, commands waiting for the link, frames the
+                 encoder refused, the line speed, the device state mirror and the telemetry summary.
+        :rtype: dict
+        Time: O(1)
+        """
+        down_now = 0.0
+        if not self.connected and self.link_down_at is not None and not self.stop_event.is_set():
+            down_now = time.monotonic() - self.link_down_at
+        return {"connected": self.connected, "reconnects": self.reconnects,
+                "downtime": self.downtime_total + down_now, "current_downtime": down_now,
+                "queued": self.writer.depth(), "write_errors": self.writer.errors,
+                "unencodable": self.writer.unencodable, "baudrate": self.line_baudrate,
+                "suppressed": self.suppressed, "suppressed_ratio": self.suppressed_ratio(),
+                "device": self.device_state.snapshot(), "telemetry": self.telemetry.snapshot()}
+
+    def suppressed_ratio(self):
+        """
+        Returns the share of color/effect/stop commands dropped as redundant.
+        :return: Suppressed over all state commands asked for, 0.0 before the first one.
+        :rtype: float
+        Time: O(1)
+        """
+        total = self.state_commands + self.suppressed
+        return self.suppressed / total if total else 0.0
+
+    def register_metrics(self):
+        """
+        Exposes the link counters; they are read from the reader and writer at scrape time,
+        so the hot path only pays for the write timer.
+        :return: The registered metrics, for close().
+        :rtype: list
+        Time: O(1)
+        """
+        registry = get_registry()
+        writer = self.writer
+        labels = {"ring": self.name} if self.name else None
+        writer.write_seconds = registry.histogram("serial_write_seconds",
+                                                  "Time the writer thread spent blocked in write()", labels=labels)
+        return [
+            writer.write_seconds,
+            registry.counter_function("serial_writes_total", "write() calls", lambda: writer.writes, labels),
+            registry.counter_function("serial_commands_written_total", "Commands and frames put on the wire",
+                                      lambda: writer.commands_written, labels),
+            registry.counter_function("serial_bytes_written_total", "Bytes put on the wire",
+                                      lambda: writer.bytes_written, labels),
+            registry.counter_function("serial_commands_coalesced_total", "Pending commands superseded by newer ones",
+                                      lambda: writer.coalesced, labels),
+            registry.counter_function("serial_commands_dropped_total", "Commands dropped by a full queue",
+                                      lambda: writer.dropped, labels),
+            registry.counter_function("serial_write_errors_total", "Failed writes", lambda: writer.errors, labels),
+            registry.counter_function("serial_commands_suppressed_total", "Commands dropped as no-ops",
+                                      lambda: self.suppressed, labels),
+            registry.gauge_function("serial_commands_suppressed_ratio", "Share of state commands dropped as no-ops",
+                                    self.suppressed_ratio, labels),
+            registry.gauge_function("serial_queue_depth", "Commands waiting for the writer", writer.depth, labels),
+            registry.counter_function("serial_lines_read_total", "Lines received from the device",
+                                      lambda: self.reader.lines_read, labels),
+            registry.counter_function("serial_reconnects_total", "Links restored after a failure",
+                                      lambda: self.reconnects, labels),
+            registry.counter_function("serial_downtime_seconds_total", "Time the link was down",
+                                      lambda: self.link_metrics()["downtime"], labels),
+            registry.gauge_function("serial_connected", "1 while the link is up", lambda: int(self.connected), labels),
+            registry.gauge_function("serial_baudrate", "Negotiated line speed", lambda: self.line_baudrate, labels),
+            registry.gauge_function("device_fps", "Frames the firmware showed per second",
+                                    lambda: self.telemetry_value("fps"), labels),
+            registry.gauge_function("device_show_seconds", "Mean FastLED.show() time",
+                                    lambda: self.telemetry_value("show_us", 1e-6), labels),
+            registry.gauge_function("device_effect_step_seconds", "Mean time to render an effect step",
+                                    lambda: self.telemetry_value("step_us", 1e-6), labels),
+            registry.gauge_function("device_loop_max_seconds", "Longest loop() iteration",
+                                    lambda: self.telemetry_value("loop_max_us", 1e-6), labels),
+            registry.gauge_function("device_free_ram_bytes", "Free RAM between heap and stack",
+                                    lambda: self.telemetry_value("free_ram"), labels),
+            registry.counter_function("device_parse_errors_total", "Bad frames and overlong lines since boot",
+                                      lambda: self.telemetry_value("parse_errors"), labels),
+            registry.counter_function("device_dropped_bytes_total", "Input bytes the firmware threw away since boot",
+                                      lambda: self.telemetry_value("dropped_bytes"), labels),
+            registry.gauge_function("device_bottleneck", "1 while the ring itself cannot keep the frame rate",
+                                    lambda: int(self.telemetry.bottleneck == BOTTLENECK_DEVICE), labels),
+        ]
+
+    def telemetry_value(self, field, scale=1):
+        """
+        Returns a field of the latest telemetry record, for the metrics.
+        :param field: A TELEMETRY_FIELDS name or "fps".
+        :type field: str
+        :param scale: Factor applied to the value (1e-6 turns microseconds into seconds).
+        :type scale: float
+        :return: The value, 0 before the first record.
+        :rtype: float
+        Time: O(1)
+        """
+        record = self.telemetry.latest()
+        return getattr(record, field) * scale if record else 0
+
+    def send_command(self, command, policy=None, encoded=None):
+        """
+        Queues a command for the writer thread; never blocks on serial I/O unless the
+        caller asks for the block policy. Pending commands superseded by this one are dropped, and so
+        is this one when the device state mirror says the ring already shows it.
+        While the link is down commands stay queued and go out once it is back.
         :param command: The command string to be sent to the device.
         :type command: str
+        :param policy: Optional backpressure policy overriding the manager's default.
+        :type policy: str
+        :param encoded: The command already encoded with writer.encoder (see CommandWriter.submit).
+        :type encoded: bytes
         :return: None
         :rtype: None
-        Time: O(k), where k is the length of the command string.
+        :raises QueueFullError: Under POLICY_REJECT when the queue is full.
+        Time: O(q), where q is the number of commands waiting to be written.
         """
-        if self.ser:
-            self.ser.write(command.encode())
-            print(COMMAND_SENT % command)
+        previous = self.last_state_command
+        if not self.track_state(command):
+            return
+        if self.recorder:
+            self.recorder.command(command)
+        try:
+            queued = self.writer.submit(command, policy, encoded=encoded)
+        except QueueFullError:
+            self.forget_state(command, previous)
+            raise
+        if not queued:
+            self.forget_state(command, previous)
+
+    def track_state(self, command):
+        """
+        Updates the device state mirror with a command about to be sent, and keeps the last speed command.
+        :param command: The command.
+        :type command: str
+        :return: False if the command is a no-op to drop.
+        :rtype: bool
+        Time: O(k), where k is the length of the command.
+        """
+        kind = command_kind(command)
+        if kind == KIND_SPEED:
+            self.last_speed_command = command
+        if kind not in STATE_KINDS:
+            return True
+        if not self.suppress_redundant:
+            self.device_state.record(command)
+        elif not self.device_state.accept(command):
+            self.suppressed += 1
+            return False
+        self.state_commands += 1
+        self.last_state_command = command
+        return True
+
+    def forget_state(self, command, previous):
+        """
+        Undoes track_state for a command the writer refused (reject policy, block timeout): the ring never
+        gets it, so the mirror no longer knows what it shows and the last state to replay is the one before.
+        :param command: The refused command.
+        :type command: str
+        :param previous: last_state_command before it.
+        :type previous: str
+        :return: None
+        Time: O(1)
+        """
+        if command_kind(command) not in STATE_KINDS:
+            return
+        self.device_state.invalidate()
+        if self.last_state_command == command:
+            self.last_state_command = previous
+
+    def command_dropped(self, command):
+        """
+        Writer callback for a queued command pushed out by the queue bound. The mirror already counts a
+        dropped color or effect as shown, so it forgets the state and the next command goes out whatever it is.
+        :param command: The dropped command.
+        :type command: str or np.ndarray
+        :return: None
+        Time: O(1)
+        """
+        if command_kind(command) in STATE_KINDS:
+            self.device_state.invalidate()
+
+    def write_now(self, command, encoded=None):
+        """
+        Writes a command on the calling thread while the writer is held (see CommandWriter.write_now);
+        used by DeviceGroup to put a broadcast on many ports back to back.
+        :param command: The command string.
+        :type command: str
+        :param encoded: The command already encoded with writer.encoder.
+        :type encoded: bytes
+        :return: True if it was written now (or the ring already shows it), False if it was queued.
+        :rtype: bool
+        Time: O(q + k), where q is the number of pending commands and k the length of the command.
+        """
+        if not self.track_state(command):
+            return True
+        if self.recorder:
+            self.recorder.command(command)
+        return self.writer.write_now(command, encoded)
+
+    def send_frame(self, frame, copy=True):
+        """
+        Queues a full RGB frame for the ring; a frame still waiting in the queue is replaced.
+        The writer thread encodes it as a keyframe, RLE runs or a delta against the last frame sent.
+        Needs the binary protocol, ASCII firmware cannot take frames, and at most MAX_FRAME_LEDS LEDs.
+        :param frame: A (num_leds, 3) uint8 array.
+        :type frame: np.ndarray
+        :param copy: Queue a copy; False when the caller never modifies the array again.
+        :type copy: bool
+        :return: True if the frame was queued.
+        :rtype: bool
+        Time: O(1) on the calling thread; encoding is O(n) on the writer thread.
+        """
+        if not self.connected or self.active_protocol != PROTOCOL_BINARY:
+            return False  #a stale frame is useless after the outage, the next tick sends a fresh one
+        if len(frame) > MAX_FRAME_LEDS:
+            self.log.warning(FRAME_TOO_LONG, leds=len(frame), limit=MAX_FRAME_LEDS)
+            return False
+        if self.recorder:
+            self.recorder.frame(frame)
+        queued = self.writer.submit(frame.copy() if copy else frame)
+        if queued:
+            self.device_state.show_frame()
+        return queued
+
+    def print_command(self, command):
+        """
+        Logs a command after the writer thread put it on the wire (rate limited by the logger).
+        :param command: The command that was sent.
+        :type command: str
+        :return: None
+        Time: O(1)
+        """
+        if isinstance(command, str):
+            self.log.info(COMMAND_SENT, command=command)
 
     def read_from_serial(self):
         """
-        Reads incoming messages from the connected serial device and prints them.
-        Runs continuously as long as the connection is active.
+        Waits until the reader thread started by connect() exits.
+        Incoming messages are printed and fanned out to subscribers by that thread.
         :param: None
         :return: None
         :rtype: None
-        Time: O(n), where n is the number of messages read during the connection's lifetime.
+        Time: O(n), where n is the number of bytes read during the connection's lifetime.
+        """
+        if self.reader.thread:
+            self.reader.thread.join()
+
+    def subscribe(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        """
+        Registers a consumer for parsed device messages.
+        :param maxsize: Capacity of the consumer's bounded queue.
+        :type maxsize: int
+        :return: A subscription whose get() returns DeviceMessage objects.
+        :rtype: Subscription
+        Time: O(1)
+        """
+        return self.reader.subscribe(maxsize)
+
+    def print_message(self, message):
+        """
+        Logs a message received from the device, records it when a recorder is attached and passes
+        it to the device state mirror.
+        :param message: The parsed message.
+        :type message: DeviceMessage
+        :return: None
+        Time: O(1)
         """
-        while self.connected:
-            if self.ser and self.ser.in_waiting > SERIAL_WAITING:
-                message = self.ser.readline().decode('utf-8').strip()
-                print(MSG_FROM_ARDUINO % message)
+        if self.recorder:
+            self.recorder.response(message.raw)
+        record = parse_telemetry(message)
+        if record:
+            self.take_telemetry(record)
+            return
+        self.log.info(MSG_FROM_ARDUINO, message=message.raw)
+        if self.device_state.report(message):
+            self.resync()
+
+    def take_telemetry(self, record):
+        """
+        Adds a telemetry record to the history, with what the host knows: the frame budget of a running
+        stream, and the share of the line's capacity written since the previous record.
+        :param record: The record.
+        :type record: TelemetryRecord
+        :return: The diagnosis (see telemetry.diagnose).
+        :rtype: str or None
+        Time: O(1)
+        """
+        mark = (record.timestamp, self.writer.bytes_written)
+        link_load = None
+        if self.telemetry_mark and record.timestamp > self.telemetry_mark[0]:
+            written = mark[1] - self.telemetry_mark[1]
+            link_load = written * byte_time(self.line_baudrate) / (record.timestamp - self.telemetry_mark[0])
+        self.telemetry_mark = mark
+        return self.telemetry.add(record, self.frame_budget, link_load)
+
+    def check_garbage(self, data):
+        """
+        Called by the reader with bytes the firmware never prints. Above the boot rate they mean the
+        two ends no longer agree on the rate (the board reset to its boot rate, or the line cannot hold
+        the negotiated one), so the link is reopened and renegotiated.
+        :param data: The bytes read.
+        :type data: bytes
+        :return: None
+        Time: O(1)
+        """
+        if self.line_baudrate > self.baudrate:
+            self.handle_link_error(ConnectionResetError(LINE_GARBLED % self.line_baudrate))
+
+    def resync(self):
+        """
+        The board reset on its own (brown-out, watchdog) and printed Ready again: its state is gone.
+        The firmware boots in ASCII mode, so a binary link reconnects and renegotiates, which also
+        resends the last effect speed and color or effect; an ASCII link just resends them, and asks for
+        telemetry again.
+        :return: None
+        Time: O(q), as send_command.
+        """
+        self.log.warning(DEVICE_RESET, port=self.port, protocol=self.active_protocol)
+        if self.active_protocol == PROTOCOL_BINARY:
+            self.handle_link_error(ConnectionResetError(DEVICE_RESET_ERROR))
+        else:
+            if self.telemetry_interval:
+                self.writer.submit(telemetry_command(self.telemetry_interval))
+            if self.last_speed_command is not None:
+                self.writer.submit(self.last_speed_command)
+            if self.last_state_command is not None:
+                self.device_state.restore(self.last_state_command)
+                self.writer.submit(self.last_state_command)
+
+    def close(self):
+        """
+        Stops the reader and closes the serial port.
+        :return: None
+        Time: O(1)
+        """
+        self.stop_event.set()
+        self.connected = False
+        if self.watchdog:
+            self.watchdog.cancel()
+            self.watchdog = None
+        self.reader.stop()
+        self.writer.stop()
+        if self.ser:
+            self.ser.close()
+        for metric in self.metrics:
+            get_registry().unregister(metric)
+        self.set_state(STATE_DISCONNECTED)
@@ -0,0 +1,316 @@
+import queue
+import threading
+import time
+
+LINE_END = b'\n'
+CARRIAGE_RETURN = b'\r'
+ENCODING = 'utf-8'
+MAX_LINE_LENGTH = 256
+SUBSCRIBER_QUEUE_SIZE = 256
+FIRST_BYTE = 1
+MESSAGE_SEPARATOR = ':'
+FIELD_SEPARATOR = ','
+KIND_READY = "ready"
+KIND_TEXT = "text"
+READY_LINE = "Ready"
+THREAD_NAME = "serial-reader"
+
+
+class DeviceMessage:
+    def __init__(self, raw, kind, fields, timestamp):
+        """
+        A single parsed line received from the device.
+        :param raw: The decoded line without its terminator.
+        :type raw: str
+        :param kind: The message kind ("ready", "text" or the prefix before ':').
+        :type kind: str
+        :param fields: The comma separated values after the prefix.
+        :type fields: list[str]
+        :param timestamp: time.monotonic() when the line was completed.
+        :type timestamp: float
+        Time: O(1)
+        """
+        self.raw = raw
+        self.kind = kind
+        self.fields = fields
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"DeviceMessage({self.raw!r})"
+
+
+def parse_message(line, timestamp=None):
+    """
+    This function turns a raw line from the firmware into a DeviceMessage.
+    "Ready" becomes kind "ready", "key:a,b" becomes kind "key" with fields ["a", "b"],
+    anything else is kept as kind "text".
+    :param line: The decoded line.
+    :type line: str
+    :param timestamp: Optional receive time, defaults to now.
+    :type timestamp: float
+    :return: The parsed message.
+    :rtype: DeviceMessage
+    Time: O(k), where k is the length of the line.
+    """
+    if timestamp is None:
+        timestamp = time.monotonic()
+    if line == READY_LINE:
+        return DeviceMessage(line, KIND_READY, [], timestamp)
+    if MESSAGE_SEPARATOR in line:
+        kind, _, rest = line.partition(MESSAGE_SEPARATOR)
+        fields = rest.split(FIELD_SEPARATOR) if rest else []
+        return DeviceMessage(line, kind, fields, timestamp)
+    return DeviceMessage(line, KIND_TEXT, [], timestamp)
+
+
+class LineFramer:
+    def __init__(self, max_line_length=MAX_LINE_LENGTH):
+        """
+        Splits a byte stream into lines, keeping partial lines between reads.
+        :param max_line_length: Longest line kept; longer garbage is discarded up to its terminator.
+        :type max_line_length: int
+        Time: O(1)
+        """
+        self.max_line_length = max_line_length
+        self.buffer = bytearray()
+        self.overflows = 0
+        self.discarding = False  #the head of an over-long line was dropped, so is the rest of it
+
+    def feed(self, data):
+        """
+        This function adds received bytes and returns every line completed by them.
+        :param data: Bytes read from the port (may hold several lines or part of one).
+        :type data: bytes
+        :return: The completed lines, decoded and stripped of line endings.
+        :rtype: list[str]
+        Time: O(k), where k is the number of bytes fed.
+        """
+        self.buffer += data
+        lines = []
+        start = 0
+        end = self.buffer.find(LINE_END, start)
+        while end != -1:
+            raw = bytes(self.buffer[start:end]).rstrip(CARRIAGE_RETURN)
+            if self.discarding:
+                self.discarding = False
+            elif len(raw) > self.max_line_length:
+                self.overflows += 1
+            elif raw:
+                lines.append(raw.decode(ENCODING, errors='replace'))
+            start = end + 1
+            end = self.buffer.find(LINE_END, start)
+        del self.buffer[:start]
+        if len(self.buffer) > self.max_line_length:
+            #No terminator in sight, drop the garbage so memory stays bounded
+            if not self.discarding:
+                self.overflows += 1
+            self.discarding = True
+            self.buffer.clear()
+        return lines
+
+    def reset(self):
+        """
+        This function drops any partial line (used after a reconnect).
+        :return: None
+        Time: O(1)
+        """
+        self.buffer.clear()
+        self.discarding = False
+
+
+class Subscription:
+    def __init__(self, reader, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        """
+        A bounded mailbox of DeviceMessage objects for one consumer.
+        When the consumer falls behind the oldest message is dropped, so the reader never blocks.
+        :param reader: The reader that feeds this subscription.
+        :type reader: SerialReader
+        :param maxsize: Capacity of the queue.
+        :type maxsize: int
+        Time: O(1)
+        """
+        self.reader = reader
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, message):
+        """
+        This function delivers a message, evicting the oldest one if the queue is full.
+        :param message: The message to deliver.
+        :type message: DeviceMessage
+        :return: None
+        Time: O(1)
+        """
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """
+        This function waits for the next message.
+        :param timeout: Seconds to wait, None waits forever.
+        :type timeout: float
+        :return: The next message or None on timeout.
+        :rtype: DeviceMessage or None
+        Time: O(1)
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """
+        This function detaches the subscription from its reader.
+        :return: None
+        Time: O(s), where s is the number of subscriptions.
+        """
+        self.reader.unsubscribe(self)
+
+
+class SerialReader:
+    def __init__(self, ser=None, on_message=None, on_error=None, on_garbage=None):
+        """
+        Event driven reader: blocks in ser.read() instead of polling in_waiting,
+        frames lines and fans parsed messages out to subscribers.
+        :param ser: An open serial-like object with read() and in_waiting (its timeout bounds stop latency).
+        :type ser: serial.Serial
+        :param on_message: Optional callback run on the reader thread for every message.
+        :type on_message: callable
+        :param on_error: Optional callback run on the reader thread when the port fails; the loop then exits.
+        :type on_error: callable
+        :param on_garbage: Optional callback run with a read that holds non-ASCII bytes; the firmware only
+                           prints ASCII, so these are bytes received at the wrong rate or mangled on the line.
+        :type on_garbage: callable
+        Time: O(1)
+        """
+        self.ser = ser
+        self.on_message = on_message
+        self.on_error = on_error
+        self.on_garbage = on_garbage
+        self.garbled = 0
+        self.last_activity = time.monotonic()
+        self.framer = LineFramer()
+        self.subscriptions = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.lines_read = 0
+
+    def subscribe(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        """
+        This function registers a new consumer.
+        :param maxsize: Capacity of the consumer's queue.
+        :type maxsize: int
+        :return: The new subscription.
+        :rtype: Subscription
+        Time: O(1)
+        """
+        subscription = Subscription(self, maxsize)
+        with self.lock:
+            self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        This function removes a consumer.
+        :param subscription: The subscription to remove.
+        :type subscription: Subscription
+        :return: None
+        Time: O(s), where s is the number of subscriptions.
+        """
+        with self.lock:
+            self.subscriptions = [s for s in self.subscriptions if s is not subscription]
+
+    def read_chunk(self):
+        """
+        This function blocks until at least one byte arrives (or the port timeout expires)
+        and then drains whatever else is already buffered, so bursts cost a single wake-up.
+        :return: The bytes read, empty on timeout.
+        :rtype: bytes
+        Time: O(k), where k is the number of bytes read.
+        """
+        data = self.ser.read(FIRST_BYTE)
+        if data:
+            waiting = self.ser.in_waiting
+            if waiting:
+                data += self.ser.read(waiting)
+        return data
+
+    def dispatch(self, lines):
+        """
+        This function parses completed lines and hands them to every subscriber.
+        :param lines: Lines completed by the last read.
+        :type lines: list[str]
+        :return: None
+        Time: O(l * s), where l is the number of lines and s the number of subscriptions.
+        """
+        now = time.monotonic()
+        subscriptions = self.subscriptions  #copy-on-write list, safe without the lock
+        for line in lines:
+            message = parse_message(line, now)
+            self.lines_read += 1
+            if self.on_message:
+                self.on_message(message)
+            for subscription in subscriptions:
+                subscription.put(message)
+
+    def run(self):
+        """
+        Reader loop, runs on the calling thread until stop() is called or the port fails.
+        :return: None
+        Time: O(n), where n is the number of bytes received.
+        """
+        self.running = True
+        self.framer.reset()
+        self.last_activity = time.monotonic()
+        try:
+            while self.running and self.ser is not None:
+                data = self.read_chunk()
+                if data:
+                    self.last_activity = time.monotonic()
+                    if not data.isascii():
+                        self.garbled += 1
+                        if self.on_garbage:
+                            self.on_garbage(data)
+                    self.dispatch(self.framer.feed(data))
+        except OSError as error:
+            #Port went away (cable pulled, device reset), let the owner reconnect
+            if self.running and self.on_error:
+                self.running = False
+                self.on_error(error)
+        finally:
+            self.running = False
+
+    def start(self):
+        """
+        This function runs the reader loop on a daemon thread, unless it is already running.
+        :return: The reader thread.
+        :rtype: threading.Thread
+        Time: O(1)
+        """
+        if self.thread and self.thread.is_alive() and self.running:
+            return self.thread
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=THREAD_NAME, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self, timeout=None):
+        """
+        This function asks the loop to exit after the current blocking read returns.
+        :param timeout: Seconds to wait for the thread started by start().
+        :type timeout: float
+        :return: None
+        Time: O(1)
+        """
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
@@ -0,0 +1,204 @@
+import collections
+import threading
+from async_logger import get_logger
+
+# Telemetry record of now.ino (see reportTelemetry): "tm:" then these fields, comma separated.
+# Timings cover the window since the previous record, the error counters count since boot.
+TELEMETRY_KIND = "tm"
+TELEMETRY_PREFIX = "telem:"
+TELEMETRY_FIELDS = ("shows", "window_ms", "show_us", "show_max_us", "step_us", "loop_max_us", "effect", "interval_ms",
+                    "parse_errors", "dropped_bytes", "free_ram")
+TELEMETRY_INTERVAL = 1000     #ms between two records asked for by the applications
+MIN_TELEMETRY_INTERVAL = 100  #Firmware's floor, shorter intervals are raised to it
+TELEMETRY_OFF = 0
+HISTORY_SIZE = 300            #Records kept, five minutes at TELEMETRY_INTERVAL
+FPS_TOLERANCE = 0.9           #Below this share of the frame rate the budget allows, frames are late
+LINK_SATURATED = 0.9          #Share of the line's capacity the host writes when the link is full
+US = 1e-6
+# Where the frame rate is lost
+BOTTLENECK_DEVICE = "device"  #show() plus the effect step (or a stalled loop) do not fit the frame budget
+BOTTLENECK_LINK = "link"      #the host writes as fast as the line goes and frames are still late
+BOTTLENECK_HOST = "host"      #the device and the link keep up, but frames do not arrive in time
+# Log events
+EVENT_BOTTLENECK = "bottleneck"
+EVENT_KEEPING_UP = "keeping_up"
+
+
+def telemetry_command(interval_ms):
+    """
+    This function builds the command that sets how often the firmware reports telemetry.
+    :param interval_ms: Milliseconds between two records, TELEMETRY_OFF stops them.
+    :type interval_ms: int
+    :return: "telem:<ms>".
+    :rtype: str
+    Time: O(1)
+    """
+    return f"{TELEMETRY_PREFIX}{int(interval_ms)}"
+
+
+class TelemetryRecord:
+    def __init__(self, values, timestamp):
+        """
+        One telemetry record of the firmware.
+        :param values: The integers of the record, in TELEMETRY_FIELDS order.
+        :type values: list[int]
+        :param timestamp: time.monotonic() when the line was received.
+        :type timestamp: float
+        Time: O(1)
+        """
+        (self.shows, self.window_ms, self.show_us, self.show_max_us, self.step_us, self.loop_max_us, self.effect,
+         self.interval_ms, self.parse_errors, self.dropped_bytes, self.free_ram) = values
+        self.timestamp = timestamp
+
+    @property
+    def fps(self):
+        return self.shows * 1000 / self.window_ms if self.window_ms else 0.0
+
+    @property
+    def frame_time(self):
+        """
+        Seconds the device spends on one frame: the show, plus rendering the step when an effect runs.
+        """
+        return (self.show_us + (self.step_us if self.effect else 0)) * US
+
+    def as_dict(self):
+        values = {name: getattr(self, name) for name in TELEMETRY_FIELDS}
+        values["fps"] = round(self.fps, 1)
+        return values
+
+    def __repr__(self):
+        return f"TelemetryRecord({self.as_dict()!r})"
+
+
+def parse_telemetry(message):
+    """
+    This function reads a telemetry record from a device message.
+    :param message: A parsed line from the device.
+    :type message: DeviceMessage
+    :return: The record, or None when the line is not a (complete) record.
+    :rtype: TelemetryRecord or None
+    Time: O(f), where f is the number of fields.
+    """
+    if message.kind != TELEMETRY_KIND or len(message.fields) != len(TELEMETRY_FIELDS):
+        return None
+    try:
+        return TelemetryRecord([int(value) for value in message.fields], message.timestamp)
+    except ValueError:
+        return None
+
+
+def diagnose(record, frame_budget=None, link_load=None):
+    """
+    This function tells where the frame rate is lost. While an effect runs on the firmware the budget is
+    its step interval and only the device can miss it; for frames streamed from the host the budget is
+    the stream period and the link or the host can be the slow part as well.
+    :param record: The latest telemetry record.
+    :type record: TelemetryRecord
+    :param frame_budget: Seconds per host frame, None when the host streams nothing.
+    :type frame_budget: float
+    :param link_load: Share of the line's capacity the host wrote during the record's window.
+    :type link_load: float
+    :return: One of the BOTTLENECK_* constants, None while the frame rate is met or nothing is measured.
+    :rtype: str or None
+    Time: O(1)
+    """
+    budget = record.interval_ms / 1000 if record.effect else frame_budget
+    if not budget:
+        return None
+    if record.frame_time >= budget:
+        return BOTTLENECK_DEVICE
+    if record.effect:
+        late = record.fps < FPS_TOLERANCE / budget
+        return BOTTLENECK_DEVICE if late and record.loop_max_us * US >= budget else None
+    if record.fps >= FPS_TOLERANCE / budget:
+        return None
+    return BOTTLENECK_LINK if link_load and link_load >= LINK_SATURATED else BOTTLENECK_HOST
+
+
+class DeviceTelemetry:
+    def __init__(self, history_size=HISTORY_SIZE, name=None):
+        """
+        Rolling history of the firmware's telemetry records, with the bottleneck diagnosed on each one.
+        A change of diagnosis is logged once, not on every record.
+        :param history_size: Records kept.
+        :type history_size: int
+        :param name: Ring name for the log events.
+        :type name: str
+        Time: O(1)
+        """
+        self.history = collections.deque(maxlen=history_size)
+        self.lock = threading.Lock()
+        self.name = name
+        self.records = 0
+        self.bottleneck = None
+
+    def add(self, record, frame_budget=None, link_load=None):
+        """
+        This function keeps a record and diagnoses it (see diagnose).
+        :param record: The record.
+        :type record: TelemetryRecord
+        :param frame_budget: Seconds per host frame, None when the host streams nothing.
+        :type frame_budget: float
+        :param link_load: Share of the line's capacity the host wrote during the record's window.
+        :type link_load: float
+        :return: The diagnosis.
+        :rtype: str or None
+        Time: O(1)
+        """
+        bottleneck = diagnose(record, frame_budget, link_load)
+        with self.lock:
+            self.history.append(record)
+            self.records += 1
+            changed = bottleneck != self.bottleneck
+            self.bottleneck = bottleneck
+        if changed:
+            if bottleneck:
+                get_logger().warning(EVENT_BOTTLENECK, ring=self.name, where=bottleneck, fps=round(record.fps, 1),
+                                     show_ms=record.show_us / 1000, step_ms=record.step_us / 1000,
+                                     loop_max_ms=record.loop_max_us / 1000)
+            else:
+                get_logger().info(EVENT_KEEPING_UP, ring=self.name, fps=round(record.fps, 1))
+        return bottleneck
+
+    def latest(self):
+        with self.lock:
+            return self.history[-1] if self.history else None
+
+    def records_since(self, seconds, now):
+        """
+        This function returns the records of the last seconds.
+        :param seconds: Length of the window.
+        :type seconds: float
+        :param now: time.monotonic() at the end of the window.
+        :type now: float
+        :return: The records, oldest first.
+        :rtype: list[TelemetryRecord]
+        Time: O(h), where h is the history size.
+        """
+        with self.lock:
+            return [record for record in self.history if now - record.timestamp <= seconds]
+
+    def snapshot(self):
+        """
+        This function summarizes the history: the latest record, frame rate and show time ranges,
+        the longest loop, the lowest free RAM, errors counted within the history and the diagnosis.
+        :return: The summary, empty before the first record.
+        :rtype: dict
+        Time: O(h), where h is the history size.
+        """
+        with self.lock:
+            history = list(self.history)
+            bottleneck = self.bottleneck
+        if not history:
+            return {}
+        first, last = history[0], history[-1]
+        return {"records": self.records, "latest": last.as_dict(), "bottleneck": bottleneck,
+                "fps_min": round(min(record.fps for record in history), 1),
+                "fps_mean": round(sum(record.fps for record in history) / len(history), 1),
+                "show_us_max": max(record.show_max_us for record in history),
+                "loop_max_us": max(record.loop_max_us for record in history),
+                "free_ram_min": min(record.free_ram for record in history),
+                #the counters restart with the board, a reset within the history counts nothing
+                "parse_errors": max(0, last.parse_errors - first.parse_errors),
+                "dropped_bytes": max(0, last.dropped_bytes - first.dropped_bytes)}
+
@@ -0,0 +1,45 @@
+import io
+import numpy as np
+from audio_reactive import AudioStreamer, PcmSource
+from bench_daemon import DaemonThread, TCP_ADDRESS, WAIT_TIMEOUT
+from device_group import DeviceGroup
+from ring_daemon import DaemonClient
+
+NUM_LEDS = 14
+RATE = 44100
+SIM_URL = "sim://?leds=%d" % NUM_LEDS
+
+
+def tone(seconds=0.5, frequency=440):
+    """
+    This function makes a stereo 16-bit PCM stream of a sine tone.
+    :return: The stream.
+    :rtype: io.BytesIO
+    Time: O(seconds * RATE)
+    """
+    signal = np.sin(2 * np.pi * frequency * np.arange(int(RATE * seconds)) / RATE) * 20000
+    return io.BytesIO(np.stack([signal, signal], 1).astype('<i2').tobytes())
+
+
+def test_streams_to_a_device_group():
+    group = DeviceGroup([SIM_URL] * 2, 115200)
+    try:
+        assert group.connect(WAIT_TIMEOUT)
+        stats = AudioStreamer(group, PcmSource(tone(), RATE, 2), NUM_LEDS, realtime=False).run()
+        assert stats["sent"] > 0
+        assert all(ring.ser.device.wait_for(lambda device: device.frames > 0, WAIT_TIMEOUT) for ring in group.rings)
+    finally:
+        group.close()
+
+
+def test_streams_through_the_daemon():
+    daemon = DaemonThread(TCP_ADDRESS, NUM_LEDS, 115200)
+    client = DaemonClient(daemon.start())
+    try:
+        client.connect()
+        stats = AudioStreamer(client, PcmSource(tone(), RATE, 2), NUM_LEDS, realtime=False).run()
+        assert stats["sent"] > 0
+        assert daemon.link.ser.device.wait_for(lambda device: device.frames > 0, WAIT_TIMEOUT)
+    finally:
+        client.close()
+        daemon.stop()
@@ -0,0 +1,111 @@
+import threading
+import numpy as np
+from command_writer import CommandWriter
+from frame_codec import MAX_FRAME_LEDS, MAX_UPLOAD_PIXELS, FrameApplier, FrameEncoder
+from frame_protocol import FrameDecoder
+
+WAIT_TIMEOUT = 5.0
+
+
+class RecordingPort:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+        return len(data)
+
+
+def test_stop_while_held_leaves_the_port_to_the_holder():
+    port = RecordingPort()
+    writer = CommandWriter(port)
+    writer.start()
+    assert writer.hold(WAIT_TIMEOUT)
+    writer.stop(0.1)
+    assert writer.write_now("rgb:1,2,3")
+    writer.submit("speed:5")
+    writer.thread.join(0.1)
+    assert writer.thread.is_alive() and port.writes == [b"rgb:1,2,3\n"]
+    writer.release()
+    writer.thread.join(WAIT_TIMEOUT)
+    assert not writer.thread.is_alive()
+    assert port.writes == [b"rgb:1,2,3\n", b"speed:5\n"]
+
+
+def test_frames_are_encoded_outside_the_queue_lock():
+    entered = threading.Event()
+    proceed = threading.Event()
+    encoded = []
+
+    def slow_encoder(frame):
+        entered.set()
+        proceed.wait(WAIT_TIMEOUT)
+        encoded.append(frame)
+        return frame.tobytes()
+
+    port = RecordingPort()
+    writer = CommandWriter(port, frame_encoder=slow_encoder)
+    writer.start()
+    writer.submit(np.ones((4, 3), dtype=np.uint8))
+    assert entered.wait(WAIT_TIMEOUT)
+    submitted = threading.Event()
+
+    def submit():
+        writer.submit("rgb:1,2,3")
+        submitted.set()
+
+    threading.Thread(target=submit, daemon=True).start()
+    assert submitted.wait(WAIT_TIMEOUT)
+    proceed.set()
+    assert writer.flush(WAIT_TIMEOUT)
+    writer.stop(WAIT_TIMEOUT)
+    assert len(encoded) == 1
+    assert b"".join(port.writes) == bytes([1] * 12) + b"rgb:1,2,3\n"
+
+
+def test_batches_stay_within_max_batch_bytes():
+    encoded = []
+
+    def encoder(frame):
+        encoded.append(frame)
+        return frame.tobytes()
+
+    port = RecordingPort()
+    writer = CommandWriter(port, max_batch_bytes=30, frame_encoder=encoder)
+    commands = ["telem:%d" % index for index in range(6)]
+    for command in commands[:3]:
+        writer.submit(command)
+    writer.submit(np.full((8, 3), 7, dtype=np.uint8))
+    for command in commands[3:]:
+        writer.submit(command)
+    writer.start()
+    assert writer.flush(WAIT_TIMEOUT)
+    writer.stop(WAIT_TIMEOUT)
+    assert len(port.writes) > 1 and all(len(data) <= 30 for data in port.writes)
+    assert len(encoded) == 1
+    wire = [(command + "\n").encode() for command in commands]
+    assert b"".join(port.writes) == b"".join(wire[:3]) + bytes([7] * 24) + b"".join(wire[3:])
+
+
+def test_a_long_frame_goes_in_parts_and_a_too_long_one_is_dropped():
+    num_leds = MAX_UPLOAD_PIXELS + 1000
+    frame = np.random.default_rng(1).integers(0, 256, (num_leds, 3), dtype=np.uint8)
+    port = RecordingPort()
+    dropped = []
+    writer = CommandWriter(port, frame_encoder=FrameEncoder().encode, on_dropped=dropped.append)
+    writer.start()
+    too_long = np.zeros((MAX_FRAME_LEDS + 1, 3), dtype=np.uint8)
+    writer.submit(too_long)
+    assert writer.flush(WAIT_TIMEOUT)
+    writer.submit(frame)
+    assert writer.flush(WAIT_TIMEOUT)
+    writer.submit("1")
+    assert writer.flush(WAIT_TIMEOUT)
+    writer.stop(WAIT_TIMEOUT)
+    assert writer.unencodable == 1 and dropped == [too_long]
+    assert port.writes[-1] == b"1\n"
+    frames = FrameDecoder().feed(b"".join(port.writes[:-1]))
+    applier = FrameApplier(num_leds)
+    for opcode, payload in frames:
+        applier.apply(opcode, payload)
+    assert len(frames) == 2 and np.array_equal(applier.leds, frame)
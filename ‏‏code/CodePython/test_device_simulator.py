@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from bench_latency import WAIT_TIMEOUT, blocking_bound, measure_loop_latency
+from device_simulator import MAX_STEP_INTERVAL
+from effect_engine import EFFECT_PULSE, NUM_LEDS, Rainbow, create_effect
+from frame_protocol import PROTOCOL_BINARY
+from link_speed import BaudCache
+from serial_manager import SerialManager
+
+COMMANDS = 40
+SIM_URL = "sim://?leds=%d" % NUM_LEDS
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("baudrate, num_leds", [(9600, NUM_LEDS), (115200, 144), (1000000, 144)])
+def test_color_shows_within_the_latency_bound(baudrate, num_leds, binary):
+    p50, p99, worst, bound = measure_loop_latency(baudrate, num_leds, binary, COMMANDS)
+    #The tail of a short run is whatever stall the OS adds on a busy core; the median is the model's own latency
+    assert p50 <= bound, (p50, p99, bound)
+    assert bound < blocking_bound("rgb:255,255,255", baudrate, num_leds)
+
+
+@pytest.fixture
+def manager():
+    link = SerialManager(port=SIM_URL, discover=False, baud_cache=BaudCache())
+    assert link.connect()
+    yield link
+    link.close()
+
+
+def test_ring_shows_the_color_sent(manager):
+    manager.send_command("rgb:10,20,300")
+    assert manager.ser.device.wait_for(lambda device: device.showing((10, 20, 300 & 0xFF)), WAIT_TIMEOUT)
+
+
+def test_ring_runs_the_effect_sent(manager):
+    device = manager.ser.device
+    manager.send_command("speed:%d" % MAX_STEP_INTERVAL)  #no second step while the first one is checked
+    manager.send_command("pulse:255,0,0,5")
+    assert device.wait_for(lambda simulator: simulator.current_effect == EFFECT_PULSE, WAIT_TIMEOUT)
+    assert np.array_equal(device.snapshot(), create_effect(EFFECT_PULSE, NUM_LEDS).render())
+
+
+def test_ring_shows_the_frame_sent(manager):
+    assert manager.active_protocol == PROTOCOL_BINARY
+    device = manager.ser.device
+    for frame in Rainbow(NUM_LEDS).render_block(5):
+        assert manager.send_frame(frame)
+        assert device.wait_for(lambda simulator: np.array_equal(simulator.leds, frame), WAIT_TIMEOUT)
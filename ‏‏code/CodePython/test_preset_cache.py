@@ -0,0 +1,48 @@
+import math
+import threading
+from command_writer import RawCommand
+from effect_engine import Rainbow
+from link_speed import BaudCache
+from preset_cache import STORE_CHUNK, PresetCache
+from serial_manager import SerialManager
+
+NUM_LEDS = 16
+SIM_URL = "sim://?leds=%d" % NUM_LEDS
+STREAM_INTERVAL = 0.001
+
+
+def test_upload_goes_through_while_frames_stream():
+    manager = SerialManager(port=SIM_URL, baudrate=115200, discover=False, baud_cache=BaudCache())
+    assert manager.connect()
+    cache = PresetCache(manager)
+    cache.define_sequence("clip", list(Rainbow(NUM_LEDS).render_block(12)), 10)
+    sent = []
+    submit = manager.writer.submit
+
+    def counting_submit(command, *args, **kwargs):
+        if isinstance(command, RawCommand):
+            sent.append(command)
+        return submit(command, *args, **kwargs)
+
+    manager.writer.submit = counting_submit
+    streaming = threading.Event()
+
+    def stream():
+        frames = Rainbow(NUM_LEDS).render_block(64)
+        index = 0
+        while not streaming.wait(STREAM_INTERVAL):
+            manager.send_frame(frames[index % len(frames)])
+            index += 1
+
+    streamer = threading.Thread(target=stream, daemon=True)
+    streamer.start()
+    try:
+        assert cache.sync()
+        assert cache.store("clip")
+    finally:
+        streaming.set()
+        streamer.join()
+        cache.close()
+        manager.close()
+    chunks = math.ceil(len(cache.entries["clip"].data) / STORE_CHUNK)
+    assert len(sent) == chunks + 2  #begin, the chunks and end, none sent twice
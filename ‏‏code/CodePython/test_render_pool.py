@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+import numpy as np
+import pytest
+from colors import ColorPipeline, apply_output
+from effect_engine import EFFECT_COLOR_CHASE, EFFECT_PULSE, EFFECT_RAINBOW, EFFECT_RANDOM_SPARKLE, create_effect
+from frame_codec import MAX_FRAME_LEDS
+from render_pool import RenderPool, RingSource, plan_parts
+
+WAIT_TIMEOUT = 5.0
+CHECKED_FRAMES = 5
+
+
+def test_plan_splits_only_what_renders_in_parts():
+    sources = [RingSource(EFFECT_RAINBOW, 10000), RingSource(EFFECT_RANDOM_SPARKLE, 9000),
+               RingSource(EFFECT_PULSE, 9000, ColorPipeline(max_milliamps=500))]
+    plan = plan_parts(sources, 3, 4096)
+    parts = [piece for pieces in plan for piece in pieces]
+    assert sorted(parts) == [(0, 0, 5000), (0, 5000, 10000), (1, 0, 9000), (2, 0, 9000)]
+
+
+def test_split_frames_match_whole_frames():
+    sources = [RingSource(EFFECT_RAINBOW, 10000), RingSource(EFFECT_COLOR_CHASE, 9000),
+               RingSource(EFFECT_PULSE, 9000, ColorPipeline(gamma=2.2))]
+    kept = {}
+    done = threading.Event()
+
+    def keep(ring, pixels, frame):
+        if frame < CHECKED_FRAMES:
+            kept[(ring, frame)] = pixels.copy()
+        if len(kept) == len(sources) * CHECKED_FRAMES:
+            done.set()
+
+    pool = RenderPool(sources, workers=3, on_frame=keep, min_segment=4096).start()
+    names = [shared.name for shared in pool.rings]
+    assert done.wait(WAIT_TIMEOUT)
+    pool.stop()
+    assert pool.snapshot()["failure"] is None
+    for (ring, frame), pixels in kept.items():
+        effect = create_effect(sources[ring].effect_id, sources[ring].num_leds)
+        effect.step = frame
+        assert np.array_equal(pixels, apply_output(sources[ring].output, effect.render()))
+    assert not any(os.path.exists("/dev/shm/" + name.lstrip("/")) for name in names)
+
+
+def run_until_failure(pool):
+    failures = []
+    failed = threading.Event()
+
+    def on_error(name, error):
+        failures.append((name, error))
+        failed.set()
+
+    pool.on_error = on_error
+    pool.start()
+    try:
+        assert failed.wait(WAIT_TIMEOUT)
+        delivered = sum(pool.delivered)
+        time.sleep(0.2)
+        assert sum(pool.delivered) == delivered  #the healthy ring stopped too
+    finally:
+        pool.stop()
+    assert pool.snapshot()["failure"] == failures[0]
+    return failures[0]
+
+
+def test_a_worker_error_stops_the_pool():
+    broken = np.zeros(5, dtype=np.uint8)  #an output table too short for the pixel values
+    pool = RenderPool([RingSource(EFFECT_RAINBOW, 100), RingSource(EFFECT_RAINBOW, 100, broken)], workers=2)
+    name, error = run_until_failure(pool)
+    assert name.startswith("render-worker") and "IndexError" in error
+
+
+def test_a_dead_worker_stops_the_pool():
+    pool = RenderPool([RingSource(EFFECT_RAINBOW, 100), RingSource(EFFECT_RAINBOW, 100)], workers=2, fps=50)
+    killer = threading.Timer(0.3, lambda: pool.processes[0].kill())
+    killer.start()
+    name, error = run_until_failure(pool)
+    assert name == pool.processes[0].name and error == "exited with code -9"
+
+
+def test_a_ring_too_long_for_one_link_is_refused():
+    pool = RenderPool([RingSource(EFFECT_RAINBOW, MAX_FRAME_LEDS + 1)], workers=1)
+    with pytest.raises(ValueError):
+        pool.stream([None])
@@ -0,0 +1,118 @@
+import threading
+import time
+import pytest
+import serial
+import serial_manager
+from command_writer import POLICY_REJECT, QueueFullError
+from frame_protocol import PROTOCOL_ASCII
+from link_speed import BaudCache
+from serial_manager import SerialManager
+from transport import open_transport
+
+SIM_URL = "sim://?leds=8"
+WAIT_TIMEOUT = 5.0
+OUTAGE = 0.2
+
+
+def wait_until(predicate, timeout=WAIT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def record_commands(device, received):
+    """
+    This function makes a simulated board log every ASCII command it runs.
+    :param device: The board.
+    :type device: DeviceSimulator
+    :param received: Gets the commands.
+    :type received: list[str]
+    :return: None
+    Time: O(1)
+    """
+    dispatch = device.dispatch_command
+
+    def recording(command):
+        received.append(command)
+        dispatch(command)
+
+    device.dispatch_command = recording
+
+
+def test_reconnect_replays_state_and_flushes_the_outage_queue(monkeypatch):
+    unplugged = threading.Event()
+    received = []
+
+    def open_simulator(url, baudrate, timeout=None):
+        if unplugged.is_set():
+            raise serial.SerialException("unplugged")
+        ser = open_transport(url, baudrate, timeout)
+        record_commands(ser.device, received)
+        return ser
+
+    monkeypatch.setattr(serial_manager, "open_transport", open_simulator)
+    monkeypatch.setattr(serial_manager, "RETRY_BASE", 0.01)
+    manager = SerialManager(port=SIM_URL, protocol=PROTOCOL_ASCII, discover=False, baud_cache=BaudCache())
+    try:
+        assert manager.connect()
+        manager.send_command("speed:20")
+        manager.send_command("rgb:1,2,3")
+        assert wait_until(lambda: manager.ser.device.showing((1, 2, 3)))
+        unplugged.set()
+        manager.ser.device.disconnect()
+        assert wait_until(lambda: not manager.connected)
+        received.clear()
+        manager.send_command("telem:500")
+        time.sleep(OUTAGE)
+        assert manager.link_metrics()["queued"] > 0
+        unplugged.clear()
+        assert wait_until(lambda: manager.connected and manager.writer.depth() == 0)
+        device = manager.ser.device
+        #The replay is queued by the reconnect thread, before or after the outage command
+        assert wait_until(lambda: {"telem:500", "speed:20", "rgb:1,2,3"} <= set(received))
+        assert device.wait_for(lambda simulator: simulator.showing((1, 2, 3)), WAIT_TIMEOUT)
+        assert wait_until(lambda: device.step_time == 0.02)
+        metrics = manager.link_metrics()
+        assert metrics["reconnects"] == 1
+        assert metrics["downtime"] >= OUTAGE
+    finally:
+        manager.close()
+
+
+@pytest.fixture
+def manager():
+    link = SerialManager(port=SIM_URL, discover=False, baud_cache=BaudCache())
+    assert link.connect()
+    link.send_command("rgb:1,2,3")
+    assert link.ser.device.wait_for(lambda device: device.showing((1, 2, 3)), WAIT_TIMEOUT)
+    link.writer.maxsize = 2
+    yield link
+    link.writer.release()
+    link.close()
+
+
+def test_a_dropped_color_is_not_mirrored(manager):
+    assert manager.writer.hold(WAIT_TIMEOUT)
+    manager.send_command("rgb:4,5,6")
+    manager.send_command("telem:0")
+    manager.send_command("telem:0")  #the queue bound pushes the color out
+    manager.writer.release()
+    assert manager.writer.flush(WAIT_TIMEOUT)
+    manager.send_command("rgb:4,5,6")
+    assert manager.ser.device.wait_for(lambda device: device.showing((4, 5, 6)), WAIT_TIMEOUT)
+
+
+def test_a_rejected_color_is_not_mirrored(manager):
+    assert manager.writer.hold(WAIT_TIMEOUT)
+    manager.send_command("telem:0")
+    manager.send_command("telem:0")
+    with pytest.raises(QueueFullError):
+        manager.send_command("rgb:4,5,6", POLICY_REJECT)
+    assert manager.last_state_command == "rgb:1,2,3"
+    manager.writer.release()
+    assert manager.writer.flush(WAIT_TIMEOUT)
+    manager.send_command("rgb:4,5,6")
+    assert manager.ser.device.wait_for(lambda device: device.showing((4, 5, 6)), WAIT_TIMEOUT)
@@ -0,0 +1,91 @@
+import sys
+import time
+import pytest
+import serial
+from serial_reader import MAX_LINE_LENGTH, SerialReader
+from transport import PtyPair
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="needs a POSIX pseudo terminal")
+READ_TIMEOUT = 0.05
+WAIT_TIMEOUT = 5.0
+
+
+@pytest.fixture
+def link():
+    """
+    A SerialReader on the host end of a pty, and the device end to write to.
+    :return: (reader, device end).
+    :rtype: tuple[SerialReader, FileDescriptorTransport]
+    """
+    pair = PtyPair()
+    ser = serial.Serial(pair.port, timeout=READ_TIMEOUT)
+    reader = SerialReader(ser)
+    yield reader, pair.device_end
+    reader.stop(WAIT_TIMEOUT)
+    ser.close()
+    pair.close()
+
+
+def wait_until(predicate, timeout=WAIT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_partial_lines_are_joined_across_reads(link):
+    reader, device = link
+    subscription = reader.subscribe()
+    reader.start()
+    for part in (b"tel", b"em:12,3", b"4\r", b"\nRea", b"dy\r\n"):
+        device.write(part)
+        time.sleep(2 * READ_TIMEOUT)  #each part arrives in a read of its own
+    message = subscription.get(WAIT_TIMEOUT)
+    assert (message.kind, message.fields) == ("telem", ["12", "34"])
+    assert subscription.get(WAIT_TIMEOUT).raw == "Ready"
+
+
+def test_a_burst_of_lines_is_read_in_few_wake_ups(link):
+    reader, device = link
+    reads = []
+    read_chunk = reader.read_chunk
+
+    def counted():
+        reads.append(None)
+        return read_chunk()
+
+    reader.read_chunk = counted
+    subscription = reader.subscribe()
+    reader.start()
+    device.write(b"".join(b"line:%d\n" % index for index in range(200)))
+    assert wait_until(lambda: reader.lines_read == 200)
+    assert [subscription.get(0).fields for _ in range(200)] == [[str(index)] for index in range(200)]
+    assert len(reads) < 200
+
+
+def test_over_long_lines_are_discarded(link):
+    reader, device = link
+    subscription = reader.subscribe()
+    reader.start()
+    device.write(b"x" * (MAX_LINE_LENGTH + 10) + b"\nfirst\n")
+    device.write(b"y" * (4 * MAX_LINE_LENGTH))
+    time.sleep(2 * READ_TIMEOUT)
+    device.write(b"tail of it\nsecond\n")
+    assert subscription.get(WAIT_TIMEOUT).raw == "first"
+    assert subscription.get(WAIT_TIMEOUT).raw == "second"
+    assert subscription.get(2 * READ_TIMEOUT) is None
+    assert reader.framer.overflows == 2
+
+
+def test_a_slow_subscriber_loses_the_oldest_messages(link):
+    reader, device = link
+    slow = reader.subscribe(maxsize=4)
+    fast = reader.subscribe()
+    reader.start()
+    device.write(b"".join(b"n:%d\n" % index for index in range(10)))
+    assert wait_until(lambda: reader.lines_read == 10)
+    assert [slow.get(0).raw for _ in range(4)] == ["n:6", "n:7", "n:8", "n:9"]
+    assert slow.get(0) is None and slow.dropped == 6
+    assert fast.queue.qsize() == 10 and fast.dropped == 0
@@ -0,0 +1,510 @@
+import argparse
+import bisect
+import collections
+import json
+import threading
+import time
+import numpy as np
+from effect_engine import (NUM_LEDS, CHANNELS, DEFAULT_FPS, MAX_NUM_COLOR, EFFECTS, EFFECT_RAINBOW, EFFECT_PULSE,
+                           EFFECT_COLOR_WIPE, EFFECT_RANDOM_SPARKLE, EFFECT_COLOR_CHASE, create_effect)
+from colors import apply_output, output_key
+from scheduler import Scheduler
+from async_logger import get_logger
+from serial_manager import SerialManager, BAUDRATE
+
+# Show file (JSON), steps play in order:
+#   {"fps": 100, "loop": true, "steps": [
+#       {"effect": "rainbow", "duration": 30},
+#       {"color": [255, 80, 0], "duration": 10, "fade": 2},
+#       {"effect": 5, "duration": 20, "fade": 1.5}]}
+# "fade" crossfades from the previous step (the last one when looping, black otherwise)
+# during the first seconds of the step; the previous effect keeps running under the fade.
+EFFECT_NAMES = {"rainbow": EFFECT_RAINBOW, "pulse": EFFECT_PULSE, "wipe": EFFECT_COLOR_WIPE,
+                "sparkle": EFFECT_RANDOM_SPARKLE, "chase": EFFECT_COLOR_CHASE}
+SOURCE_EFFECT = "effect"
+SOURCE_COLOR = "color"
+BLACK = (SOURCE_COLOR, (0, 0, 0))
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+APERIODIC_CYCLE = 1024    #Frames kept of an effect that never repeats (sparkle), played in a loop
+FADE_SHIFT = 8
+FADE_ONE = 1 << FADE_SHIFT
+THREAD_NAME = "timeline"
+TIMER_NAME = "timeline-frames"
+EVENT_SHOW_STARTED = "show_started"
+EVENT_SHOW_FINISHED = "show_finished"
+EVENT_CACHE_SMALL = "timeline_cache_too_small"
+
+
+class TimelineError(Exception):
+    """Raised when a show file cannot be played."""
+
+
+class Step:
+    def __init__(self, source, frames, fade_frames):
+        """
+        One step of a show, in frames of the show's frame rate.
+        :param source: (SOURCE_EFFECT, effect id) or (SOURCE_COLOR, (r, g, b)).
+        :type source: tuple
+        :param frames: Length of the step, fade included.
+        :type frames: int
+        :param fade_frames: Frames crossfading in from the previous step.
+        :type fade_frames: int
+        Time: O(1)
+        """
+        self.source = source
+        self.frames = frames
+        self.fade_frames = fade_frames
+
+
+class Timeline:
+    def __init__(self, steps, fps=DEFAULT_FPS, loop=False):
+        """
+        A parsed show.
+        :param steps: The steps in play order.
+        :type steps: list[Step]
+        :param fps: Frames per second.
+        :type fps: float
+        :param loop: Start over after the last step.
+        :type loop: bool
+        Time: O(1)
+        """
+        self.steps = steps
+        self.fps = fps
+        self.loop = loop
+
+    def total_frames(self):
+        return sum(step.frames for step in self.steps)
+
+
+def parse_source(entry):
+    """
+    This function reads what a step shows.
+    :param entry: One step of the show file.
+    :type entry: dict
+    :return: (SOURCE_EFFECT, effect id) or (SOURCE_COLOR, (r, g, b)).
+    :rtype: tuple
+    :raises TimelineError: If the step names no known effect or no valid color.
+    Time: O(1)
+    """
+    if "effect" in entry:
+        effect = EFFECT_NAMES.get(entry["effect"], entry["effect"])
+        if effect not in EFFECTS:
+            raise TimelineError(f"unknown effect {entry['effect']!r}")
+        return SOURCE_EFFECT, effect
+    color = entry.get("color")
+    if (not isinstance(color, list) or len(color) != CHANNELS
+            or not all(isinstance(value, int) and 0 <= value <= MAX_NUM_COLOR for value in color)):
+        raise TimelineError(f"a step needs an effect or a color [r, g, b], got {entry!r}")
+    return SOURCE_COLOR, tuple(color)
+
+
+def parse_show(data):
+    """
+    This function turns a decoded show file into a Timeline.
+    :param data: The decoded JSON.
+    :type data: dict
+    :return: The timeline.
+    :rtype: Timeline
+    :raises TimelineError: If a field is missing or out of range.
+    Time: O(s), where s is the number of steps.
+    """
+    fps = data.get("fps", DEFAULT_FPS)
+    if not isinstance(fps, (int, float)) or fps <= 0:
+        raise TimelineError(f"bad fps {fps!r}")
+    steps = []
+    for entry in data.get("steps", []):
+        frames = round(entry.get("duration", 0) * fps)
+        fade_frames = round(entry.get("fade", 0) * fps)
+        if frames <= 0:
+            raise TimelineError(f"step without a duration: {entry!r}")
+        if not 0 <= fade_frames <= frames:
+            raise TimelineError(f"fade longer than its step: {entry!r}")
+        steps.append(Step(parse_source(entry), frames, fade_frames))
+    if not steps:
+        raise TimelineError("the show has no steps")
+    return Timeline(steps, fps, bool(data.get("loop", False)))
+
+
+def load_show(path):
+    """
+    This function reads a show file.
+    :param path: JSON file.
+    :type path: str
+    :return: The timeline.
+    :rtype: Timeline
+    :raises TimelineError: If the file is not a valid show.
+    Time: O(s), where s is the number of steps.
+    """
+    try:
+        with open(path) as file:
+            return parse_show(json.load(file))
+    except (ValueError, AttributeError, TypeError) as error:
+        raise TimelineError(f"{path}: {error}") from error
+
+
+def cycle_length(source, num_leds):
+    """
+    This function returns the number of frames render_cycle makes for a source.
+    :param source: (SOURCE_EFFECT, effect id) or (SOURCE_COLOR, (r, g, b)).
+    :type source: tuple
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :return: Frames per cycle.
+    :rtype: int
+    Time: O(1)
+    """
+    kind, value = source
+    if kind == SOURCE_COLOR:
+        return 1
+    return create_effect(value, num_leds).cycle_length() or APERIODIC_CYCLE
+
+
+def render_cycle(source, num_leds):
+    """
+    This function renders one full cycle of what a source shows: a single frame for a color, every
+    step until the effect repeats for an effect, or APERIODIC_CYCLE steps of a random one.
+    :param source: (SOURCE_EFFECT, effect id) or (SOURCE_COLOR, (r, g, b)).
+    :type source: tuple
+    :param num_leds: Number of LEDs.
+    :type num_leds: int
+    :return: A (cycle, num_leds, 3) uint8 array.
+    :rtype: np.ndarray
+    Time: O(cycle * num_leds)
+    """
+    kind, value = source
+    if kind == SOURCE_COLOR:
+        return np.tile(np.array(value, dtype=np.uint8), (1, num_leds, 1))
+    return create_effect(value, num_leds).render_block(cycle_length(source, num_leds))
+
+
+def crossfade(start, end):
+    """
+    This function blends two frame sequences, from all start to all end, with 8 bit weights.
+    :param start: A (n, num_leds, 3) uint8 array.
+    :type start: np.ndarray
+    :param end: A (n, num_leds, 3) uint8 array.
+    :type end: np.ndarray
+    :return: The blended (n, num_leds, 3) uint8 frames.
+    :rtype: np.ndarray
+    Time: O(n * num_leds)
+    """
+    count = len(start)
+    weights = ((np.arange(1, count + 1) * FADE_ONE) // (count + 1)).astype(np.uint16)[:, None, None]
+    blended = start.astype(np.uint16) * (FADE_ONE - weights) + end.astype(np.uint16) * weights
+    return (blended >> FADE_SHIFT).astype(np.uint8)
+
+
+class FrameCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        """
+        LRU cache of rendered frame buffers, bounded by their total size. Buffers are read-only
+        once cached, so the players sharing them can hand out rows without copying.
+        :param max_bytes: Size above which the least recently used buffers are evicted.
+        :type max_bytes: int
+        Time: O(1)
+        """
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, render):
+        """
+        This function returns the buffer for key, rendering it on a miss.
+        :param key: Hashable description of the buffer.
+        :type key: tuple
+        :param render: Builds the buffer.
+        :type render: callable
+        :return: The read-only buffer.
+        :rtype: np.ndarray
+        Time: O(1) on a hit, the render time on a miss.
+        """
+        with self.lock:
+            buffer = self.entries.get(key)
+            if buffer is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return buffer
+        buffer = render()
+        buffer.setflags(write=False)
+        with self.lock:
+            self.misses += 1
+            if key not in self.entries:
+                self.entries[key] = buffer
+                self.bytes += buffer.nbytes
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+        return buffer
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+class Clip:
+    def __init__(self, start, offset, length, key, render):
+        """
+        A run of show frames taken from one cached buffer: show frame start + i is buffer row
+        (offset + i) modulo the buffer length.
+        :param start: First show frame of the clip.
+        :type start: int
+        :param offset: Buffer row of the first frame.
+        :type offset: int
+        :param length: Frames in the buffer.
+        :type length: int
+        :param key: Cache key of the buffer.
+        :type key: tuple
+        :param render: Builds the buffer when it is not cached.
+        :type render: callable
+        Time: O(1)
+        """
+        self.start = start
+        self.offset = offset
+        self.length = length
+        self.key = key
+        self.render = render
+
+
+class TimelinePlayer:
+    def __init__(self, serial_manager, timeline, num_leds=NUM_LEDS, output_lut=None, cache=None, scheduler=None):
+        """
+        Plays a show by streaming frames. Every effect cycle, color and crossfade is rendered once
+        into the frame cache, so a tick only picks a row and queues it. Ticks run on a scheduler of
+        their own with absolute deadlines, and the frame shown follows the clock, not the tick count,
+        so a late tick never shifts the rest of an hours-long show.
+        :param serial_manager: The connected manager (binary protocol required), or anything with send_frame.
+        :type serial_manager: SerialManager
+        :param timeline: The show.
+        :type timeline: Timeline
+        :param num_leds: Number of LEDs.
+        :type num_leds: int
+        :param output_lut: Optional output stage, a table from build_output_lut or a ColorPipeline,
+                           baked into the buffers.
+        :type output_lut: np.ndarray or ColorPipeline
+        :param cache: Frame cache, shared between players to reuse buffers.
+        :type cache: FrameCache
+        :param scheduler: Clock for the frames, defaults to a dedicated one.
+        :type scheduler: Scheduler
+        Time: O(s), where s is the number of steps.
+        """
+        self.serial_manager = serial_manager
+        self.timeline = timeline
+        self.num_leds = num_leds
+        self.output_lut = output_lut
+        self.lut_key = output_key(output_lut)
+        self.cache = cache or FrameCache()
+        self.own_scheduler = scheduler is None
+        self.scheduler = scheduler or Scheduler(THREAD_NAME)
+        self.total_frames = timeline.total_frames()
+        self.clips = self.build_clips()
+        self.starts = [clip.start for clip in self.clips]
+        self.timer = None
+        self.jitter = None
+        self.started = None
+        self.position = -1
+        self.current = -1
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.finished = threading.Event()
+
+    def apply_lut(self, frames):
+        return apply_output(self.output_lut, frames)
+
+    def cycle(self, source):
+        """
+        This function returns the cached cycle of a source.
+        :param source: (SOURCE_EFFECT, effect id) or (SOURCE_COLOR, (r, g, b)).
+        :type source: tuple
+        :return: The read-only (cycle, num_leds, 3) buffer.
+        :rtype: np.ndarray
+        Time: O(1) on a hit, O(cycle * num_leds) on a miss.
+        """
+        key = ("cycle", source, self.num_leds, self.lut_key)
+        return self.cache.get(key, lambda: self.apply_lut(render_cycle(source, self.num_leds)))
+
+    def render_fade(self, previous, position, step):
+        """
+        This function renders a crossfade: the previous source from cycle row position on,
+        into the first frames of the step.
+        :param previous: Source of the previous step.
+        :type previous: tuple
+        :param position: Row of the previous cycle the fade starts at.
+        :type position: int
+        :param step: The step fading in.
+        :type step: Step
+        :return: A (step.fade_frames, num_leds, 3) uint8 array.
+        :rtype: np.ndarray
+        Time: O(fade_frames * num_leds)
+        """
+        start = self.cycle(previous)
+        end = self.cycle(step.source)
+        rows = np.arange(step.fade_frames)
+        return crossfade(start[(position + rows) % len(start)], end[rows % len(end)])
+
+    def build_clips(self):
+        """
+        This function lays the show out as clips: per step an optional crossfade, then the step itself.
+        :return: Clips sorted by start frame.
+        :rtype: list[Clip]
+        Time: O(s)
+        """
+        clips = []
+        start = 0
+        steps = self.timeline.steps
+        for index, step in enumerate(steps):
+            if step.fade_frames:
+                if index:
+                    previous, position = steps[index - 1].source, steps[index - 1].frames
+                elif self.timeline.loop:
+                    previous, position = steps[-1].source, steps[-1].frames
+                else:
+                    previous, position = BLACK, 0
+                #Only the row in the previous cycle matters, so equal fades at different times share a buffer
+                cycle = cycle_length(previous, self.num_leds)
+                key = ("fade", previous, position % cycle, step.source, step.fade_frames, self.num_leds, self.lut_key)
+                render = lambda p=previous, r=position % cycle, s=step: self.render_fade(p, r, s)
+                clips.append(Clip(start, 0, step.fade_frames, key, render))
+            if step.frames > step.fade_frames:
+                key = ("cycle", step.source, self.num_leds, self.lut_key)
+                render = lambda s=step.source: self.apply_lut(render_cycle(s, self.num_leds))
+                clips.append(Clip(start + step.fade_frames, step.fade_frames, cycle_length(step.source, self.num_leds),
+                                  key, render))
+            start += step.frames
+        return clips
+
+    def buffer(self, index):
+        clip = self.clips[index]
+        return self.cache.get(clip.key, clip.render)
+
+    def working_set(self):
+        """
+        This function returns the size of all the distinct buffers of the show.
+        :return: Bytes.
+        :rtype: int
+        Time: O(c), where c is the number of clips.
+        """
+        lengths = {clip.key: clip.length for clip in self.clips}
+        return sum(lengths.values()) * self.num_leds * CHANNELS
+
+    def prepare(self):
+        """
+        This function renders every buffer of the show before it starts (as far as the cache holds them).
+        A show larger than the cache is rendered again clip by clip on every pass, on the tick thread.
+        :return: None
+        Time: O(f * num_leds), where f is the number of distinct frames rendered.
+        """
+        needed = self.working_set()
+        if needed > self.cache.max_bytes:
+            get_logger().warning(EVENT_CACHE_SMALL, needed=needed, cache=self.cache.max_bytes)
+        for index in range(len(self.clips)):
+            self.buffer(index)
+
+    def frame_at(self, position):
+        """
+        This function returns the frame shown at a show position.
+        :param position: Frame number since the start, already wrapped for looping shows.
+        :type position: int
+        :return: A read-only (num_leds, 3) row of a cached buffer.
+        :rtype: np.ndarray
+        Time: O(log c), where c is the number of clips; a buffer evicted from the cache is rendered again.
+        """
+        index = bisect.bisect_right(self.starts, position) - 1
+        clip = self.clips[index]
+        buffer = self.cache.get(clip.key, clip.render)
+        if index != self.current:
+            self.current = index
+            self.buffer((index + 1) % len(self.clips))  #the next clip is ready before its first tick
+        return buffer[(clip.offset + position - clip.start) % len(buffer)]
+
+    def tick(self):
+        """
+        Scheduler callback: queues the frame due now.
+        :return: None
+        Time: O(log c)
+        """
+        position = int((time.monotonic() - self.started) * self.timeline.fps + 0.5)
+        if position <= self.position:
+            return  #early tick, this frame is already out
+        self.frames_skipped += position - self.position - 1
+        self.position = position
+        if position >= self.total_frames and not self.timeline.loop:
+            self.stop()
+            return
+        self.serial_manager.send_frame(self.frame_at(position % self.total_frames))
+        self.frames_sent += 1
+
+    def start(self):
+        """
+        This function renders the show's buffers and starts playing it.
+        :return: The timer handle (its stats hold the frame jitter).
+        :rtype: TimerHandle
+        Time: O(f * num_leds) for the buffers, then O(log c) per frame.
+        """
+        self.stop()
+        self.prepare()
+        self.finished.clear()
+        self.scheduler.start()
+        self.position = -1
+        self.current = -1
+        self.started = time.monotonic()
+        self.serial_manager.frame_budget = 1.0 / self.timeline.fps  #the telemetry judges the ring against it
+        self.timer = self.scheduler.call_every(1.0 / self.timeline.fps, self.tick, name=TIMER_NAME)
+        self.jitter = self.timer.stats
+        get_logger().info(EVENT_SHOW_STARTED, steps=len(self.timeline.steps), frames=self.total_frames,
+                          loop=self.timeline.loop)
+        return self.timer
+
+    def stop(self):
+        """
+        This function stops the show; safe to call from the tick itself.
+        :return: None
+        Time: O(1)
+        """
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+            self.serial_manager.frame_budget = None
+            get_logger().info(EVENT_SHOW_FINISHED, sent=self.frames_sent, skipped=self.frames_skipped)
+        if self.own_scheduler:
+            self.scheduler.stop()
+        self.finished.set()
+
+    def stats(self):
+        """
+        This function reports the playback counters, the frame jitter and the cache use.
+        :return: frames sent and skipped, timer lateness summary and cache counters.
+        :rtype: dict
+        Time: O(w log w), where w is the jitter window.
+        """
+        return {"sent": self.frames_sent, "skipped": self.frames_skipped,
+                "jitter": self.jitter.snapshot() if self.jitter else None, "cache": self.cache.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play a show file on the ring")
+    parser.add_argument("show")
+    parser.add_argument("--port", required=True, help="serial port (sim:// for a simulated ring)")
+    parser.add_argument("--baud", type=int, default=BAUDRATE)
+    parser.add_argument("--leds", type=int, default=NUM_LEDS)
+    args = parser.parse_args()
+    timeline = load_show(args.show)
+    link = SerialManager(port=args.port, baudrate=args.baud, discover=False)
+    link.connect()
+    player = TimelinePlayer(link, timeline, args.leds)
+    player.start()
+    try:
+        player.finished.wait()
+    except KeyboardInterrupt:
+        player.stop()
+    finally:
+        link.close()
+
+
+if __name__ == "__main__":
+    main()
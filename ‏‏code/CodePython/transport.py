@@ -0,0 +1,484 @@
+import os
+import select
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+import serial
+
+BITS_PER_BYTE = 10          #8N1: start bit, 8 data bits, stop bit
+UNLIMITED = None
+SEND_BUFFER = 4096          #Bytes a write may queue ahead of the line, like an OS tty buffer
+SIM_SCHEME = "sim://"
+SIM_OPTIONS = {"leds": ("num_leds", int), "boot": ("boot_delay", float), "step": ("step_time", float),
+               "maxbaud": ("max_baudrate", int), "noisybaud": ("noisy_baudrate", int), "show": ("show_time", float),
+               "eeprom": ("eeprom_write_time", float)}
+LINE_END = b'\n'
+READ_SIZE = 4096
+PORT_CLOSED = "Port is closed"
+PEER_CLOSED = "Device disconnected"
+GARBLE_MASK = 0xA5          #What a byte looks like to a UART sampling at the wrong rate (always sets bit 7 of ASCII)
+NOISE_MASK = 0x01           #Bit flipped by line noise
+
+
+def byte_time(baudrate):
+    """
+    This function returns how long one byte takes on the wire.
+    :param baudrate: Line speed in bits per second, None for an unpaced link.
+    :type baudrate: int
+    :return: Seconds per byte.
+    :rtype: float
+    Time: O(1)
+    """
+    return BITS_PER_BYTE / baudrate if baudrate else 0.0
+
+
+def garble(data):
+    """
+    This function turns bytes into what a receiver set to another baud rate reads: garbage.
+    :param data: The bytes sent.
+    :type data: bytes
+    :return: The bytes received.
+    :rtype: bytes
+    Time: O(len(data))
+    """
+    return bytes(value ^ GARBLE_MASK for value in data)
+
+
+class ByteChannel:
+    def __init__(self, baudrate=None, capacity=UNLIMITED, send_buffer=SEND_BUFFER):
+        """
+        One direction of an in-memory serial line. Bytes written become readable one by one at the
+        line rate, and a bounded capacity drops what the receiver did not read in time, like the
+        64 byte receive buffer of an Arduino UART.
+        Both ends have their own baud rate (see LoopbackTransport.baudrate): bytes are paced at the
+        sender's rate and arrive garbled when the receiver is set to another one.
+        :param baudrate: Line speed used for pacing, None delivers bytes immediately.
+        :type baudrate: int
+        :param capacity: Receive buffer size in bytes, None for unbounded.
+        :type capacity: int
+        :param send_buffer: Bytes that may wait for the line before send() blocks.
+        :type send_buffer: int
+        Time: O(1)
+        """
+        self.byte_time = byte_time(baudrate)
+        self.sender_rate = baudrate
+        self.receiver_rate = baudrate
+        self.noise_interval = 0     #Every noise_interval-th byte arrives with a flipped bit, 0 for a clean line
+        self.noise_count = 0
+        self.capacity = capacity
+        self.send_buffer = send_buffer
+        self.condition = threading.Condition()
+        self.in_flight = []     #[start time, data, bytes already moved to buffer, byte time, sender rate]
+        self.buffer = bytearray()
+        self.busy_until = 0.0
+        self.closed = False
+        self.overflows = 0
+        self.bytes_sent = 0
+
+    def send(self, data):
+        """
+        This function puts bytes on the line behind whatever is still being transmitted,
+        blocking while more than send_buffer bytes are waiting for the line.
+        :param data: Bytes to send.
+        :type data: bytes
+        :return: Number of bytes sent.
+        :rtype: int
+        Time: O(1), plus the wait for the line.
+        """
+        backlog = self.busy_until - time.monotonic() - self.send_buffer * self.byte_time
+        if backlog > 0:
+            time.sleep(backlog)
+        with self.condition:
+            start = max(time.monotonic(), self.busy_until)
+            self.busy_until = start + len(data) * self.byte_time
+            self.in_flight.append([start, bytes(data), 0, self.byte_time, self.sender_rate])
+            self.bytes_sent += len(data)
+            self.condition.notify_all()
+        return len(data)
+
+    def pump(self, now):
+        """
+        This function moves the bytes that have arrived by now into the receive buffer.
+        Must be called with the condition held.
+        :param now: time.monotonic() of the check.
+        :type now: float
+        :return: When the next byte arrives, or None if nothing is in flight.
+        :rtype: float or None
+        Time: O(k), where k is the number of bytes arrived.
+        """
+        while self.in_flight:
+            start, data, moved, chunk_byte_time, rate = chunk = self.in_flight[0]
+            if chunk_byte_time:
+                arrived = min(len(data), int((now - start) / chunk_byte_time))
+            else:
+                arrived = len(data)
+            if arrived > moved:
+                room = arrived - moved
+                if self.capacity is not None:
+                    room = min(room, self.capacity - len(self.buffer))
+                received = data[moved:moved + room]
+                if rate != self.receiver_rate:
+                    received = garble(received)
+                elif self.noise_interval:
+                    received = self.add_noise(received)
+                self.buffer += received
+                self.overflows += arrived - moved - room
+                chunk[2] = arrived
+            if arrived < len(data):
+                return start + (arrived + 1) * chunk_byte_time
+            self.in_flight.pop(0)
+        return None
+
+    def add_noise(self, data):
+        """
+        This function flips a bit in every noise_interval-th byte, like a line run faster than it can carry.
+        :param data: Bytes arriving now.
+        :type data: bytes
+        :return: The bytes as received.
+        :rtype: bytes
+        Time: O(len(data))
+        """
+        received = bytearray(data)
+        for index in range(-self.noise_count % self.noise_interval, len(received), self.noise_interval):
+            received[index] ^= NOISE_MASK
+        self.noise_count += len(received)
+        return bytes(received)
+
+    def receive(self, size, timeout):
+        """
+        This function waits for at least one byte and returns up to size of them.
+        :param size: Most bytes returned.
+        :type size: int
+        :param timeout: Seconds to wait, None waits forever.
+        :type timeout: float
+        :return: The bytes, empty on timeout.
+        :rtype: bytes
+        :raises serial.SerialException: If the other end closed and nothing is left to read.
+        Time: O(size)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                next_byte = self.pump(now)
+                if self.buffer:
+                    data = bytes(self.buffer[:size])
+                    del self.buffer[:size]
+                    return data
+                if self.closed:
+                    raise serial.SerialException(PEER_CLOSED)
+                if deadline is not None and now >= deadline:
+                    return b''
+                waits = [t - now for t in (next_byte, deadline) if t is not None]
+                self.condition.wait(min(waits) if waits else None)
+
+    def waiting(self):
+        """
+        This function returns the number of bytes that can be read without waiting.
+        :return: Bytes in the receive buffer.
+        :rtype: int
+        Time: O(k), where k is the number of bytes arrived since the last check.
+        """
+        with self.condition:
+            self.pump(time.monotonic())
+            return len(self.buffer)
+
+    def close(self):
+        """
+        This function hangs the line up; the reader gets what is left and then an error.
+        :return: None
+        Time: O(1)
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class LoopbackTransport:
+    def __init__(self, rx, tx, timeout=None):
+        """
+        One end of an in-memory serial line with the part of the pyserial API the manager uses
+        (read, readline, write, in_waiting, timeout, baudrate, close).
+        :param rx: Channel this end reads from.
+        :type rx: ByteChannel
+        :param tx: Channel this end writes to.
+        :type tx: ByteChannel
+        :param timeout: Read timeout in seconds, None blocks.
+        :type timeout: float
+        Time: O(1)
+        """
+        self.rx = rx
+        self.tx = tx
+        self.timeout = timeout
+        self.is_open = True
+        self.device = None
+
+    def check_open(self):
+        if not self.is_open:
+            raise serial.SerialException(PORT_CLOSED)
+
+    def read(self, size=1):
+        """
+        This function reads up to size bytes, waiting at most timeout for the first one
+        and taking whatever else arrives before the timeout, like pyserial.
+        :param size: Number of bytes wanted.
+        :type size: int
+        :return: The bytes read, shorter on timeout.
+        :rtype: bytes
+        Time: O(size)
+        """
+        self.check_open()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        data = bytearray()
+        while len(data) < size:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            chunk = self.rx.receive(size - len(data), remaining)
+            if not chunk:
+                break
+            data += chunk
+        return bytes(data)
+
+    def readline(self):
+        """
+        This function reads up to and including the next newline, or until the timeout.
+        :return: The line with its terminator, partial on timeout.
+        :rtype: bytes
+        Time: O(k), where k is the length of the line.
+        """
+        line = bytearray()
+        while not line.endswith(LINE_END):
+            byte = self.read(1)
+            if not byte:
+                break
+            line += byte
+        return bytes(line)
+
+    def write(self, data):
+        """
+        This function queues bytes on the line; like a USB serial adapter it returns before they are sent.
+        :param data: Bytes to send.
+        :type data: bytes
+        :return: Number of bytes written.
+        :rtype: int
+        Time: O(1)
+        """
+        self.check_open()
+        if self.tx.closed:
+            raise serial.SerialException(PEER_CLOSED)
+        return self.tx.send(data)
+
+    @property
+    def in_waiting(self):
+        self.check_open()
+        return self.rx.waiting()
+
+    @property
+    def baudrate(self):
+        return self.tx.sender_rate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        """
+        Sets the UART of this end to another rate, like pyserial: bytes already on the line keep
+        the rate they were sent at.
+        :param baudrate: Line speed.
+        :type baudrate: int
+        Time: O(1)
+        """
+        with self.tx.condition:
+            self.tx.sender_rate = baudrate
+            self.tx.byte_time = byte_time(baudrate)
+        with self.rx.condition:
+            self.rx.pump(time.monotonic())  #what arrived so far was received at the old rate
+            self.rx.receiver_rate = baudrate
+
+    def line_noise(self, interval):
+        """
+        This function makes both directions corrupt every interval-th byte (0 for a clean line);
+        the simulator uses it for rates the board cannot hold.
+        :param interval: Bytes between two errors.
+        :type interval: int
+        :return: None
+        Time: O(1)
+        """
+        for channel in (self.rx, self.tx):
+            with channel.condition:
+                channel.pump(time.monotonic())  #bytes already through crossed a clean line
+                channel.noise_interval = interval
+                channel.noise_count = 0
+
+    def flush(self):
+        """
+        This function waits until everything written has left the line.
+        :return: None
+        Time: O(bytes in flight)
+        """
+        delay = self.tx.busy_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def reset_input_buffer(self):
+        with self.rx.condition:
+            self.rx.pump(time.monotonic())
+            self.rx.buffer.clear()
+
+    def close(self):
+        """
+        This function closes this end; the other end sees a disconnect.
+        :return: None
+        Time: O(1)
+        """
+        if self.is_open:
+            self.is_open = False
+            self.tx.close()
+            self.rx.close()
+
+
+def loopback_pair(baudrate=None, device_buffer=UNLIMITED, timeout=None):
+    """
+    This function creates both ends of an in-memory serial line.
+    :param baudrate: Line speed used for pacing, None for an unpaced line.
+    :type baudrate: int
+    :param device_buffer: Receive buffer of the device end in bytes, None for unbounded.
+    :type device_buffer: int
+    :param timeout: Read timeout of both ends.
+    :type timeout: float
+    :return: (host end, device end).
+    :rtype: tuple[LoopbackTransport, LoopbackTransport]
+    Time: O(1)
+    """
+    to_device = ByteChannel(baudrate, device_buffer)
+    to_host = ByteChannel(baudrate)
+    return LoopbackTransport(to_host, to_device, timeout), LoopbackTransport(to_device, to_host, timeout)
+
+
+class FileDescriptorTransport:
+    def __init__(self, fd, timeout=None):
+        """
+        Device end of a pty pair or of an accepted TCP connection, with the same read/write API
+        as LoopbackTransport so the simulator can sit behind a real port name or socket:// URL.
+        :param fd: An open file descriptor (pty master or socket).
+        :type fd: int
+        :param timeout: Read timeout in seconds, None blocks.
+        :type timeout: float
+        Time: O(1)
+        """
+        self.fd = fd
+        self.timeout = timeout
+        self.is_open = True
+        self.buffer = bytearray()
+
+    def fill(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except OSError as error:
+                raise serial.SerialException(PEER_CLOSED) from error
+            if not data:
+                raise serial.SerialException(PEER_CLOSED)
+            self.buffer += data
+
+    def read(self, size=1):
+        """
+        This function reads up to size bytes, waiting at most timeout for them.
+        :param size: Number of bytes wanted.
+        :type size: int
+        :return: The bytes read, shorter on timeout.
+        :rtype: bytes
+        Time: O(size)
+        """
+        if not self.buffer:
+            self.fill(self.timeout)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    @property
+    def in_waiting(self):
+        self.fill(0)
+        return len(self.buffer)
+
+    def write(self, data):
+        """
+        This function writes all the bytes.
+        :param data: Bytes to send.
+        :type data: bytes
+        :return: Number of bytes written.
+        :rtype: int
+        Time: O(len(data))
+        """
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+        return len(data)
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            os.close(self.fd)
+
+
+class PtyPair:
+    def __init__(self, timeout=None):
+        """
+        A pseudo terminal pair: the host opens self.port with pyserial like a real board,
+        the device side is self.device_end.
+        :param timeout: Read timeout of the device end.
+        :type timeout: float
+        Time: O(1)
+        """
+        import pty, tty  #POSIX only, imported here so the module still loads on Windows
+        master_fd, slave_fd = pty.openpty()
+        tty.setraw(master_fd)
+        tty.setraw(slave_fd)
+        self.port = os.ttyname(slave_fd)
+        self.slave_fd = slave_fd  #kept open so the master never sees a hang-up between host opens
+        self.device_end = FileDescriptorTransport(master_fd, timeout)
+
+    def close(self):
+        self.device_end.close()
+        os.close(self.slave_fd)
+
+
+def simulator_options(url):
+    """
+    This function reads the simulator settings of a "sim://?leds=144&boot=0.3&step=0.01" URL.
+    :param url: The sim:// URL.
+    :type url: str
+    :return: Keyword arguments for DeviceSimulator.
+    :rtype: dict
+    :raises serial.SerialException: On an unknown option.
+    Time: O(k), where k is the length of the URL.
+    """
+    options = {}
+    for name, values in parse_qs(urlsplit(url).query).items():
+        if name not in SIM_OPTIONS:
+            raise serial.SerialException(f"Unknown simulator option: {name}")
+        argument, convert = SIM_OPTIONS[name]
+        options[argument] = convert(values[-1])
+    return options
+
+
+def open_transport(url, baudrate, timeout=None):
+    """
+    This function opens a serial link by name. "sim://" starts a DeviceSimulator on an in-memory
+    line paced at baudrate (see simulator_options); anything else (COM5, /dev/ttyACM0, a pty name, socket://host:port,
+    loop://) goes to pyserial.
+    :param url: Port name or URL.
+    :type url: str
+    :param baudrate: Line speed.
+    :type baudrate: int
+    :param timeout: Read timeout in seconds.
+    :type timeout: float
+    :return: An open transport with the pyserial read/write API.
+    :rtype: serial.Serial or LoopbackTransport
+    :raises serial.SerialException: If the port cannot be opened.
+    Time: O(1)
+    """
+    if url.startswith(SIM_SCHEME):
+        from device_simulator import DeviceSimulator, SERIAL_RX_BUFFER
+        host, device = loopback_pair(baudrate, SERIAL_RX_BUFFER, timeout)
+        host.device = DeviceSimulator(device, **simulator_options(url)).start()
+        return host
+    return serial.serial_for_url(url, baudrate, timeout=timeout)
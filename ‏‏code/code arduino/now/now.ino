@@ -1,69 +1,882 @@
 #include <FastLED.h>
+#include <EEPROM.h>
 
 #define NUM_LEDS 14       
 #define DATA_PIN 2        
 #define BRIGHTNESS 100    
-#define DELAY_TIME 10     
+#define DELAY_TIME 10      // Default step interval of the effects, in ms (see "speed:")
+#define MIN_STEP_INTERVAL 1
+#define PULSE_PERIOD (2 * MAX_NUM_COLOR)
+#define COLORWIPE_CYCLE ((MAX_NUM_COLOR + COLORWIPE_STEP - 1) / COLORWIPE_STEP)
+#define LINE_BUFFER_SIZE 64 // Longest ASCII command kept, longer lines are dropped
+#define SPEED_PREFIX "speed:"
+#define TELEMETRY_PREFIX "telem:"
+#define TELEMETRY_MIN_INTERVAL 100 // ms, shortest "telem:" interval kept
+#define TELEMETRY_RECORD_SIZE 96
+#ifndef SERIAL_TX_BUFFER_SIZE
+#define SERIAL_TX_BUFFER_SIZE 64
+#endif
 #define RAINBOW_STEP 10   
 #define COLORWIPE_STEP 5  
 #define SPARKLE_PROB 2   
 #define MAX_NUM_COLOR 255 
-#define BAUDRATE 960
+#define BAUDRATE 9600      // Safe rate every boot starts at, the host negotiates a faster one
 #define READY "Ready"
 #define NOT_PROGRES false
 #define PROGRES true
+#define HELLO "proto:bin"
+#define EFFECT_PULSE 2
+#define EFFECT_CHASE 5
+#define EFFECT_SEQUENCE 100 // A stored frame sequence, started by "play:<id>"
+
+// Line speed negotiation (see link_speed.py): "baud:<rate>" answered at the old rate, then a sync
+// pattern and "baud:ok" both ways at the new rate, each within BAUD_TIMEOUT, or back to the old rate
+#define BAUD_PREFIX "baud:"
+#define BAUD_REFUSED "baud:no"
+#define BAUD_OK "baud:ok"
+#define SYNC_LINE "sync:UUUU****0123456789ABCDEFabcdef~~~~"
+#define BAUD_TIMEOUT 250
+#define SERIAL_TIMEOUT 1000
+const long SUPPORTED_BAUDS[] = {115200, 250000, 500000, 1000000, 2000000};
+#define NUM_SUPPORTED_BAUDS (sizeof(SUPPORTED_BAUDS) / sizeof(SUPPORTED_BAUDS[0]))
+
+// Binary frame protocol (see frame_protocol.py): COBS(opcode, len16, payload, crc8) + 0x00
+#define FRAME_DELIMITER 0x00
+#define FRAME_HEADER_SIZE 3
+#define FRAME_START_SIZE 2
+#define FRAME_BUFFER_SIZE (NUM_LEDS * 4 + 16) // Worst case RLE frame: one 4 byte run per LED
+#define RLE_RUN_SIZE 4
+#define DELTA_SPAN_HEADER 3
+#define FRAME_CRC_SIZE 1
+#define CRC8_POLY 0x07
+#define OP_RGB 0x01
+#define OP_EFFECT 0x02
+#define OP_PULSE 0x03
+#define OP_CHASE 0x04
+#define OP_STOP 0x05
+#define OP_TEXT 0x06
+#define OP_FRAME 0x07
+#define OP_FRAME_DELTA 0x08
+#define OP_FRAME_RLE 0x09
+#define OP_SPEED 0x0A
+#define OP_STORE_BEGIN 0x0B
+#define OP_STORE_DATA 0x0C
+#define OP_STORE_END 0x0D
+#define OP_PLAY 0x0E
+
+// Preset and sequence store (see preset_cache.py), kept in EEPROM so it survives a reset: an index of
+// STORE_SLOTS entries after a magic word, then the data, packed. Uploads are binary; the least
+// recently played entries are evicted to make room. Which entry was played last is only kept in RAM,
+// so playing never wears the EEPROM.
+#define STORE_MAGIC 0x5043
+#define STORE_SLOTS 8
+#define STORE_INDEX_START 2
+#define STORE_DATA_START (STORE_INDEX_START + STORE_SLOTS * sizeof(StoreEntry))
+#define STORE_FREE 0
+#define STORE_PRESET 1    // ASCII commands, one per line, run in order
+#define STORE_SEQUENCE 2  // uint16 interval in ms, then (opcode, len16, payload) frame records
+#define STORE_LOOP 0x01
+#define STORE_BEGIN_SIZE 9
+#define STORE_DATA_HEADER 3
+#define SEQUENCE_HEADER 2
+#define PLAY_PREFIX "play:"
+#define CACHE_QUERY "cache?"
+
+struct StoreEntry
+{
+  uint8_t id;
+  uint8_t type;
+  uint8_t flags;
+  uint32_t hash;   // Content hash given by the host, so it can tell what is stored
+  uint16_t offset;
+  uint16_t length;
+};
 
 CRGB leds[NUM_LEDS];       
 char lastCommand = '0';   
 bool commandInProgress = false; 
 int currentEffect = -1;  
+bool binaryMode = false;
+uint8_t frameBuffer[FRAME_BUFFER_SIZE];
+uint16_t frameLength = 0;
+bool frameOverflow = false;
+long lineRate = BAUDRATE;
+char lineBuffer[LINE_BUFFER_SIZE];
+uint8_t lineLength = 0;
+bool lineOverflow = false;
+unsigned long lastStep = 0;
+unsigned int stepInterval = DELAY_TIME;
+
+// Telemetry (see telemetry.py): timings of the current window, error counters since boot
+unsigned int telemetryInterval = 0; // Off until the host asks with "telem:<ms>"
+unsigned long lastTelemetry = 0;
+unsigned int showCount = 0;
+unsigned long showTotal = 0;
+unsigned long showMax = 0;
+unsigned int stepCount = 0;
+unsigned long stepTotal = 0;
+unsigned long loopMax = 0;
+unsigned long parseErrors = 0;
+unsigned long droppedBytes = 0;
+
+StoreEntry storeIndex[STORE_SLOTS];
+uint16_t storeUsed[STORE_SLOTS]; // LRU stamps
+uint16_t storeClock = 0;
+int8_t uploadSlot = -1;
+uint16_t uploadReceived = 0;
+int8_t playSlot = -1;
+uint16_t playCursor = 0;
+unsigned int sequenceInterval = DELAY_TIME;
 
 void checkSerialInput();
+void handleLine(String command);
+void readBinaryInput();
+void processFrame();
+uint16_t cobsDecode(const uint8_t* input, uint16_t length, uint8_t* output);
+uint8_t crc8(const uint8_t* data, uint16_t length);
+void handleFrameUpload(const uint8_t* payload, uint16_t length);
+void handleFrameDelta(const uint8_t* payload, uint16_t length);
+void handleFrameRLE(const uint8_t* payload, uint16_t length);
+void copyPixels(uint16_t start, const uint8_t* pixels, uint16_t count);
+void dispatchCommand(String command);
+void handleBaudCommand(String command);
+bool isSupportedBaud(long rate);
+bool confirmBaud();
 void handleRGBCommand(String command);
 void handleEffectCommand(String command);
-void runEffect();
+void startEffect(int effect);
+void setStepInterval(long interval);
+unsigned int effectInterval();
+void setTelemetryInterval(long interval);
+void reportTelemetry();
+void resetTelemetryWindow();
+void countDropped(uint16_t length);
+int freeRam();
+void showLeds();
+void applyFrame(uint8_t opcode, const uint8_t* payload, uint16_t length);
+void loadStore();
+void saveEntry(int8_t slot);
+void freeSlot(int8_t slot);
+int8_t findSlot(uint8_t id);
+uint16_t compactStore();
+bool makeRoom(uint16_t length);
+void handleStoreBegin(const uint8_t* payload, uint16_t length);
+void handleStoreData(const uint8_t* payload, uint16_t length);
+void handleStoreEnd(const uint8_t* payload, uint16_t length);
+void replyStore(uint8_t id, const char* status);
+void reportStore();
+void playStored(uint8_t id);
+void runPreset(int8_t slot);
+bool applyStoredFrame();
+void runSequence(unsigned long skipped);
+void runEffect(unsigned long skipped);
 void setColor(int r, int g, int b);
-void rainbow();
-void pulse();
-void colorWipe();
-void randomSparkle();
-void colorChase();
+void rainbow(unsigned long skipped);
+void pulse(unsigned long skipped);
+void colorWipe(unsigned long skipped);
+void randomSparkle(unsigned long skipped);
+void colorChase(unsigned long skipped);
 
 void setup() 
 {
   FastLED.addLeds<WS2812, DATA_PIN, GRB>(leds, NUM_LEDS).setCorrection(TypicalLEDStrip);
   FastLED.setBrightness(BRIGHTNESS);
+  loadStore();
   Serial.begin(BAUDRATE);
   Serial.println(READY);
 }
 
 
+/*
+Never blocks: input is taken as it arrives, and the effect advances by the steps that elapsed
+since the last one, so a command waits at most for one effect step to be shown
+Time Complexity: O(available bytes + NUM_LEDS) per iteration
+*/
 void loop() 
 {
+  unsigned long start = micros();
   checkSerialInput(); // Check for commands from Serial input
 
   if (commandInProgress) 
   {
-    runEffect();
+    unsigned long elapsed = millis() - lastStep;
+    unsigned int interval = effectInterval();
+    if (elapsed >= interval)
+    {
+      unsigned long steps = elapsed / interval;
+      lastStep += steps * interval;
+      runEffect(steps - 1); // Steps missed while busy are skipped, not replayed
+    }
   }
+
+  unsigned long elapsed = micros() - start;
+  if (elapsed > loopMax) loopMax = elapsed;
+  reportTelemetry();
 }
 
-// Checks for incoming commands via Serial
+/*
+Collects ASCII input into lineBuffer and handles each complete line, never waits for more input
+Time Complexity: O(available bytes)
+*/
 void checkSerialInput()
  {
-  if (Serial.available() > 0) 
+  if (binaryMode)
+  {
+    readBinaryInput();
+    return;
+  }
+  while (Serial.available() > 0 && !binaryMode) // After proto:bin the rest is binary
+  {
+    char value = Serial.read();
+    if (value != '\n')
+    {
+      if (lineLength < LINE_BUFFER_SIZE - 1) lineBuffer[lineLength++] = value;
+      else
+      {
+        lineOverflow = true;
+        droppedBytes++;
+      }
+      continue;
+    }
+    lineBuffer[lineLength] = '\0';
+    bool complete = !lineOverflow;
+    if (lineOverflow) countDropped(lineLength);
+    lineLength = 0;
+    lineOverflow = false;
+    if (complete) handleLine(String(lineBuffer));
+  }
+}
+
+// Handles one ASCII line: the protocol and speed handshakes, or a command
+void handleLine(String command)
+{
+  if (command == HELLO)
+  {
+    // Host asked for the binary protocol: confirm and switch
+    Serial.println(HELLO);
+    binaryMode = true;
+    frameLength = 0;
+  }
+  else if (command.startsWith(BAUD_PREFIX))
+  {
+    handleBaudCommand(command);
+  }
+  else
+  {
+    dispatchCommand(command);
+  }
+}
+
+// Routes an ASCII command to its handler
+void dispatchCommand(String command)
+{
+  if (command.startsWith("rgb:")) 
+  {
+    handleRGBCommand(command);
+  } 
+  else if (command.startsWith("pulse:"))
+  {
+    startEffect(EFFECT_PULSE);
+  }
+  else if (command.startsWith("chase:"))
+  {
+    startEffect(EFFECT_CHASE);
+  }
+  else if (command.startsWith(SPEED_PREFIX))
+  {
+    setStepInterval(command.substring(strlen(SPEED_PREFIX)).toInt());
+  }
+  else if (command.startsWith(TELEMETRY_PREFIX))
+  {
+    setTelemetryInterval(command.substring(strlen(TELEMETRY_PREFIX)).toInt());
+  }
+  else if (command.startsWith(PLAY_PREFIX))
+  {
+    playStored(command.substring(strlen(PLAY_PREFIX)).toInt());
+  }
+  else if (command == CACHE_QUERY)
   {
-    String command = Serial.readStringUntil('\n');
+    reportStore();
+  }
+  else if (command.length() > 0) 
+  {
+    handleEffectCommand(command);
+  }
+}
 
-    if (command.startsWith("rgb:")) 
+/*
+Collects COBS encoded bytes until the frame delimiter, never waits for more input
+Time Complexity: O(available bytes)
+*/
+void readBinaryInput()
+{
+  while (Serial.available() > 0)
+  {
+    uint8_t value = Serial.read();
+    if (value == FRAME_DELIMITER)
     {
-      handleRGBCommand(command);
-    } 
-    else if (command.length() > 0) 
+      if (frameOverflow) countDropped(frameLength);
+      else if (frameLength > 0) processFrame();
+      frameLength = 0;
+      frameOverflow = false;
+    }
+    else if (frameLength < FRAME_BUFFER_SIZE)
+    {
+      frameBuffer[frameLength++] = value;
+    }
+    else
+    {
+      frameOverflow = true; // Too long for us, drop it at the next delimiter
+      droppedBytes++;
+    }
+  }
+}
+
+/*
+Decodes a COBS block, returns the decoded length or 0 on malformed input
+Time Complexity: O(length)
+*/
+uint16_t cobsDecode(const uint8_t* input, uint16_t length, uint8_t* output)
+{
+  uint16_t in = 0;
+  uint16_t out = 0;
+  while (in < length)
+  {
+    uint8_t code = input[in];
+    if (code == 0 || in + code > length) return 0;
+    in++;
+    for (uint8_t i = 1; i < code; i++)
+    {
+      output[out++] = input[in++];
+    }
+    if (code != 0xFF && in < length)
+    {
+      output[out++] = 0;
+    }
+  }
+  return out;
+}
+
+/*
+CRC-8 with polynomial 0x07, matches crc8() in frame_protocol.py
+Time Complexity: O(length)
+*/
+uint8_t crc8(const uint8_t* data, uint16_t length)
+{
+  uint8_t crc = 0;
+  for (uint16_t i = 0; i < length; i++)
+  {
+    crc ^= data[i];
+    for (uint8_t bit = 0; bit < 8; bit++)
+    {
+      crc = (crc & 0x80) ? (crc << 1) ^ CRC8_POLY : crc << 1;
+    }
+  }
+  return crc;
+}
+
+/*
+Validates the frame in frameBuffer and runs its opcode
+Time Complexity: O(frameLength)
+*/
+void processFrame()
+{
+  uint8_t decoded[FRAME_BUFFER_SIZE];
+  uint16_t length = cobsDecode(frameBuffer, frameLength, decoded);
+  if (length < FRAME_HEADER_SIZE + FRAME_CRC_SIZE
+      || crc8(decoded, length - FRAME_CRC_SIZE) != decoded[length - FRAME_CRC_SIZE]
+      || (decoded[1] | (decoded[2] << 8)) != length - FRAME_HEADER_SIZE - FRAME_CRC_SIZE)
+  {
+    countDropped(frameLength); // Malformed, corrupted or truncated on the line
+    return;
+  }
+  uint16_t payloadLength = decoded[1] | (decoded[2] << 8);
+  uint8_t* payload = decoded + FRAME_HEADER_SIZE;
+
+  switch (decoded[0])
+  {
+    case OP_RGB:
+      if (payloadLength >= 3)
+      {
+        setColor(payload[0], payload[1], payload[2]);
+        commandInProgress = NOT_PROGRES;
+      }
+      break;
+    case OP_EFFECT:
+      if (payloadLength >= 1) startEffect(payload[0]);
+      break;
+    case OP_PULSE: startEffect(EFFECT_PULSE); break;
+    case OP_CHASE: startEffect(EFFECT_CHASE); break;
+    case OP_STOP: commandInProgress = NOT_PROGRES; break;
+    case OP_SPEED:
+      if (payloadLength >= 2) setStepInterval(payload[0] | (payload[1] << 8));
+      break;
+    case OP_FRAME:
+    case OP_FRAME_DELTA:
+    case OP_FRAME_RLE:
+      applyFrame(decoded[0], payload, payloadLength);
+      commandInProgress = NOT_PROGRES; // The host drives the ring now
+      showLeds();
+      break;
+    case OP_STORE_BEGIN: handleStoreBegin(payload, payloadLength); break;
+    case OP_STORE_DATA: handleStoreData(payload, payloadLength); break;
+    case OP_STORE_END: handleStoreEnd(payload, payloadLength); break;
+    case OP_PLAY:
+      if (payloadLength >= 1) playStored(payload[0]);
+      break;
+    case OP_TEXT:
+    {
+      char text[FRAME_BUFFER_SIZE];
+      memcpy(text, payload, payloadLength);
+      text[payloadLength] = '\0';
+      dispatchCommand(String(text));
+      break;
+    }
+    default: break;
+  }
+}
+
+// Writes a frame from the host or from a stored sequence into leds[], without showing it
+void applyFrame(uint8_t opcode, const uint8_t* payload, uint16_t length)
+{
+  switch (opcode)
+  {
+    case OP_FRAME: handleFrameUpload(payload, length); break;
+    case OP_FRAME_DELTA: handleFrameDelta(payload, length); break;
+    case OP_FRAME_RLE: handleFrameRLE(payload, length); break;
+    default: break;
+  }
+}
+
+/*
+Copies a host-rendered frame (start index + RGB triplets) into leds[]
+Time Complexity: O(NUM_LEDS)
+*/
+void handleFrameUpload(const uint8_t* payload, uint16_t length)
+{
+  if (length < FRAME_START_SIZE) return;
+  uint16_t start = payload[0] | (payload[1] << 8);
+  copyPixels(start, payload + FRAME_START_SIZE, (length - FRAME_START_SIZE) / 3);
+}
+
+/*
+Applies changed spans: (start16, count8, count RGB triplets) repeated
+Time Complexity: O(length)
+*/
+void handleFrameDelta(const uint8_t* payload, uint16_t length)
+{
+  uint16_t offset = 0;
+  while (offset + DELTA_SPAN_HEADER <= length)
+  {
+    uint16_t start = payload[offset] | (payload[offset + 1] << 8);
+    uint8_t count = payload[offset + 2];
+    offset += DELTA_SPAN_HEADER;
+    if (offset + count * 3 > length) break; // Truncated span, keep what we have
+    copyPixels(start, payload + offset, count);
+    offset += count * 3;
+  }
+}
+
+/*
+Fills the strip from index 0 with (count, r, g, b) runs
+Time Complexity: O(NUM_LEDS)
+*/
+void handleFrameRLE(const uint8_t* payload, uint16_t length)
+{
+  uint16_t position = 0;
+  uint16_t offset = 0;
+  for (offset = 0; offset + RLE_RUN_SIZE <= length && position < NUM_LEDS; offset += RLE_RUN_SIZE)
+  {
+    CRGB color = CRGB(payload[offset + 1], payload[offset + 2], payload[offset + 3]);
+    uint8_t count = payload[offset];
+    for (uint8_t i = 0; i < count && position < NUM_LEDS; i++)
+    {
+      leds[position++] = color;
+    }
+  }
+}
+
+/*
+Reads the store index, or starts an empty store on a board that never had one
+Time Complexity: O(STORE_SLOTS)
+*/
+void loadStore()
+{
+  uint16_t magic = 0;
+  int8_t slot = 0;
+  EEPROM.get(0, magic);
+  for (slot = 0; slot < STORE_SLOTS; slot++)
+  {
+    EEPROM.get(STORE_INDEX_START + slot * sizeof(StoreEntry), storeIndex[slot]);
+    bool valid = magic == STORE_MAGIC && storeIndex[slot].offset >= STORE_DATA_START
+                 && (unsigned long)storeIndex[slot].offset + storeIndex[slot].length <= EEPROM.length();
+    if (!valid && storeIndex[slot].type != STORE_FREE) freeSlot(slot);
+    storeUsed[slot] = 0;
+  }
+  if (magic != STORE_MAGIC) EEPROM.put(0, (uint16_t)STORE_MAGIC);
+}
+
+// Writes one index entry (EEPROM.put only rewrites the bytes that changed)
+void saveEntry(int8_t slot)
+{
+  EEPROM.put(STORE_INDEX_START + slot * sizeof(StoreEntry), storeIndex[slot]);
+}
+
+// Drops an entry, stopping it first if it is playing
+void freeSlot(int8_t slot)
+{
+  if (slot == playSlot && currentEffect == EFFECT_SEQUENCE) commandInProgress = NOT_PROGRES;
+  if (slot == playSlot) playSlot = -1;
+  storeIndex[slot].type = STORE_FREE;
+  saveEntry(slot);
+}
+
+// Finds the complete entry with an id, -1 if there is none
+int8_t findSlot(uint8_t id)
+{
+  int8_t slot = 0;
+  for (slot = 0; slot < STORE_SLOTS; slot++)
+  {
+    if (storeIndex[slot].type != STORE_FREE && storeIndex[slot].id == id && slot != uploadSlot) return slot;
+  }
+  return -1;
+}
+
+/*
+Moves the entries down over the gaps evicted ones left and returns the first free byte. An entry is
+marked free while it moves, so a reset halfway loses that entry instead of leaving it corrupted
+Time Complexity: O(STORE_SLOTS^2 + bytes moved)
+*/
+uint16_t compactStore()
+{
+  uint16_t cursor = STORE_DATA_START;
+  int8_t slot = 0;
+  int8_t n = 0;
+  for (n = 0; n < STORE_SLOTS; n++)
+  {
+    int8_t next = -1;
+    for (slot = 0; slot < STORE_SLOTS; slot++)
+    {
+      if (storeIndex[slot].type == STORE_FREE || storeIndex[slot].offset < cursor) continue;
+      if (next < 0 || storeIndex[slot].offset < storeIndex[next].offset) next = slot;
+    }
+    if (next < 0) break;
+    if (storeIndex[next].offset != cursor)
+    {
+      uint8_t type = storeIndex[next].type;
+      uint16_t i = 0;
+      storeIndex[next].type = STORE_FREE;
+      saveEntry(next);
+      for (i = 0; i < storeIndex[next].length; i++)
+      {
+        EEPROM.update(cursor + i, EEPROM.read(storeIndex[next].offset + i));
+      }
+      storeIndex[next].offset = cursor;
+      storeIndex[next].type = type;
+      saveEntry(next);
+    }
+    cursor += storeIndex[next].length;
+  }
+  return cursor;
+}
+
+/*
+Evicts the least recently played entries until a free slot and length bytes are available
+Time Complexity: O(STORE_SLOTS^2)
+*/
+bool makeRoom(uint16_t length)
+{
+  while (true)
+  {
+    uint16_t used = 0;
+    int8_t freeSlots = 0;
+    int8_t oldest = -1;
+    int8_t slot = 0;
+    for (slot = 0; slot < STORE_SLOTS; slot++)
+    {
+      if (storeIndex[slot].type == STORE_FREE)
+      {
+        freeSlots++;
+        continue;
+      }
+      used += storeIndex[slot].length;
+      if (oldest < 0 || storeUsed[slot] < storeUsed[oldest]) oldest = slot;
+    }
+    if (freeSlots > 0 && EEPROM.length() - STORE_DATA_START - used >= length) return true;
+    if (oldest < 0) return false;
+    Serial.print("evict:");
+    Serial.println(storeIndex[oldest].id);
+    freeSlot(oldest);
+  }
+}
+
+/*
+Starts an upload: id, type, flags, hash32, length16. The previous entry with the id is dropped and
+room is made; the entry only becomes visible when its last byte arrived (see handleStoreEnd)
+Time Complexity: O(bytes moved by compactStore)
+*/
+void handleStoreBegin(const uint8_t* payload, uint16_t length)
+{
+  if (length < STORE_BEGIN_SIZE) return;
+  uint8_t id = payload[0];
+  uint16_t size = payload[7] | (payload[8] << 8);
+  int8_t slot = 0;
+  if (uploadSlot >= 0) storeIndex[uploadSlot].type = STORE_FREE; // An upload never finished
+  uploadSlot = -1;
+  slot = findSlot(id);
+  if (slot >= 0) freeSlot(slot);
+  bool known = payload[1] == STORE_PRESET || payload[1] == STORE_SEQUENCE;
+  if (!known || size > EEPROM.length() - STORE_DATA_START || !makeRoom(size))
+  {
+    replyStore(id, "full");
+    return;
+  }
+  uint16_t offset = compactStore();
+  for (slot = 0; storeIndex[slot].type != STORE_FREE; slot++);
+  storeIndex[slot].id = id;
+  storeIndex[slot].type = payload[1];
+  storeIndex[slot].flags = payload[2];
+  storeIndex[slot].hash = (uint32_t)payload[3] | ((uint32_t)payload[4] << 8) | ((uint32_t)payload[5] << 16)
+                          | ((uint32_t)payload[6] << 24);
+  storeIndex[slot].offset = offset;
+  storeIndex[slot].length = size;
+  uploadSlot = slot;
+  uploadReceived = 0;
+  replyStore(id, "ok");
+}
+
+/*
+Writes a chunk: id, offset16, bytes. Only the chunk that continues the upload is written, so a chunk
+sent again after a lost ack is harmless; the answer is the number of bytes received so far
+Time Complexity: O(chunk length) EEPROM writes, 3.3 ms each
+*/
+void handleStoreData(const uint8_t* payload, uint16_t length)
+{
+  if (length < STORE_DATA_HEADER) return;
+  uint8_t id = payload[0];
+  uint16_t offset = payload[1] | (payload[2] << 8);
+  uint16_t count = length - STORE_DATA_HEADER;
+  if (uploadSlot < 0 || storeIndex[uploadSlot].id != id)
+  {
+    replyStore(id, "bad");
+    return;
+  }
+  if (offset == uploadReceived && offset + count <= storeIndex[uploadSlot].length)
+  {
+    uint16_t i = 0;
+    for (i = 0; i < count; i++)
+    {
+      EEPROM.update(storeIndex[uploadSlot].offset + offset + i, payload[STORE_DATA_HEADER + i]);
+    }
+    uploadReceived += count;
+  }
+  Serial.print("store:");
+  Serial.print(id);
+  Serial.print(',');
+  Serial.println(uploadReceived);
+}
+
+// Ends an upload: the entry is written to the index if every byte arrived
+void handleStoreEnd(const uint8_t* payload, uint16_t length)
+{
+  if (length < 1) return;
+  uint8_t id = payload[0];
+  int8_t slot = uploadSlot;
+  uploadSlot = -1;
+  if (slot < 0 || storeIndex[slot].id != id || uploadReceived != storeIndex[slot].length)
+  {
+    if (slot >= 0) storeIndex[slot].type = STORE_FREE;
+    replyStore(id, "bad");
+    return;
+  }
+  saveEntry(slot);
+  storeUsed[slot] = ++storeClock;
+  replyStore(id, "done");
+}
+
+// Prints "store:<id>,<status>"
+void replyStore(uint8_t id, const char* status)
+{
+  Serial.print("store:");
+  Serial.print(id);
+  Serial.print(',');
+  Serial.println(status);
+}
+
+// Prints the stored entries as "cache:<id>/<hash in hex>,..."
+void reportStore()
+{
+  int8_t slot = 0;
+  bool first = true;
+  Serial.print("cache:");
+  for (slot = 0; slot < STORE_SLOTS; slot++)
+  {
+    if (storeIndex[slot].type == STORE_FREE || slot == uploadSlot) continue;
+    if (!first) Serial.print(',');
+    first = false;
+    Serial.print(storeIndex[slot].id);
+    Serial.print('/');
+    Serial.print(storeIndex[slot].hash, HEX);
+  }
+  Serial.println();
+}
+
+/*
+Plays a stored entry: a preset runs its commands, a sequence becomes the running effect.
+An id that is not stored is answered with "play:<id>,missing" so the host uploads it again
+Time Complexity: O(entry length) for a preset, O(1) plus the first frame for a sequence
+*/
+void playStored(uint8_t id)
+{
+  int8_t slot = findSlot(id);
+  if (slot < 0)
+  {
+    Serial.print("play:");
+    Serial.print(id);
+    Serial.println(",missing");
+    return;
+  }
+  storeUsed[slot] = ++storeClock;
+  if (storeIndex[slot].type == STORE_PRESET)
+  {
+    runPreset(slot);
+    return;
+  }
+  if (storeIndex[slot].length < SEQUENCE_HEADER) return;
+  playSlot = slot;
+  playCursor = SEQUENCE_HEADER;
+  EEPROM.get(storeIndex[slot].offset, sequenceInterval);
+  if (sequenceInterval < MIN_STEP_INTERVAL) sequenceInterval = MIN_STEP_INTERVAL;
+  startEffect(EFFECT_SEQUENCE);
+}
+
+// Runs the commands of a preset one line at a time; a preset never plays another entry
+void runPreset(int8_t slot)
+{
+  char line[LINE_BUFFER_SIZE];
+  uint8_t length = 0;
+  uint16_t i = 0;
+  for (i = 0; i <= storeIndex[slot].length; i++)
+  {
+    char value = i < storeIndex[slot].length ? EEPROM.read(storeIndex[slot].offset + i) : '\n';
+    if (value != '\n')
+    {
+      if (length < LINE_BUFFER_SIZE - 1) line[length++] = value;
+      continue;
+    }
+    line[length] = '\0';
+    length = 0;
+    if (strncmp(line, PLAY_PREFIX, strlen(PLAY_PREFIX)) != 0) dispatchCommand(String(line));
+  }
+}
+
+/*
+Reads the next frame record of the playing sequence from EEPROM into leds[], going back to the first
+one at the end of a looping sequence; false at the end of a one-shot sequence or on a broken record
+Time Complexity: O(record length)
+*/
+bool applyStoredFrame()
+{
+  if (playSlot < 0 || storeIndex[playSlot].type != STORE_SEQUENCE) return false;
+  StoreEntry& entry = storeIndex[playSlot];
+  if (playCursor + FRAME_HEADER_SIZE > entry.length)
+  {
+    if (!(entry.flags & STORE_LOOP) || playCursor == SEQUENCE_HEADER) return false;
+    playCursor = SEQUENCE_HEADER;
+  }
+  uint8_t payload[FRAME_BUFFER_SIZE];
+  uint8_t opcode = EEPROM.read(entry.offset + playCursor);
+  uint16_t length = EEPROM.read(entry.offset + playCursor + 1) | (EEPROM.read(entry.offset + playCursor + 2) << 8);
+  if (length > FRAME_BUFFER_SIZE || playCursor + FRAME_HEADER_SIZE + length > entry.length) return false;
+  uint16_t i = 0;
+  for (i = 0; i < length; i++)
+  {
+    payload[i] = EEPROM.read(entry.offset + playCursor + FRAME_HEADER_SIZE + i);
+  }
+  applyFrame(opcode, payload, length);
+  playCursor += FRAME_HEADER_SIZE + length;
+  return true;
+}
+
+/*
+Shows the next frame of the playing sequence; skipped frames are still applied, deltas build on them
+Time Complexity: O((skipped + 1) * record length + NUM_LEDS)
+*/
+void runSequence(unsigned long skipped)
+{
+  bool more = true;
+  unsigned long i = 0;
+  for (i = 0; i <= skipped && more; i++)
+  {
+    more = applyStoredFrame();
+  }
+  showLeds();
+  if (!more) commandInProgress = NOT_PROGRES; // A one-shot sequence keeps its last frame
+}
+
+// Copies count RGB triplets into leds[] from start, clipped to the strip
+void copyPixels(uint16_t start, const uint8_t* pixels, uint16_t count)
+{
+  uint16_t i = 0;
+  for (i = 0; i < count && start + i < NUM_LEDS; i++)
+  {
+    leds[start + i] = CRGB(pixels[i * 3], pixels[i * 3 + 1], pixels[i * 3 + 2]);
+  }
+}
+
+/*
+Answers a rate proposal and switches; the new rate is kept only if the sync pattern and the
+confirmation arrive intact, otherwise the UART goes back to the rate it had
+Time Complexity: O(BAUD_TIMEOUT)
+*/
+void handleBaudCommand(String command)
+{
+  long rate = command.substring(strlen(BAUD_PREFIX)).toInt();
+  if (!isSupportedBaud(rate))
+  {
+    Serial.println(BAUD_REFUSED);
+    return;
+  }
+  Serial.println(command);
+  Serial.flush(); // The answer has to leave at the old rate
+  Serial.end();
+  Serial.begin(rate);
+  if (confirmBaud())
+  {
+    lineRate = rate;
+    return;
+  }
+  Serial.end();
+  Serial.begin(lineRate);
+}
+
+// Tells if the UART can run at a rate
+bool isSupportedBaud(long rate)
+{
+  uint8_t i = 0;
+  for (i = 0; i < NUM_SUPPORTED_BAUDS; i++)
+  {
+    if (SUPPORTED_BAUDS[i] == rate) return true;
+  }
+  return false;
+}
+
+// Echoes the sync pattern and the confirmation at the new rate, false on a timeout or mismatch
+bool confirmBaud()
+{
+  bool confirmed = false;
+  Serial.setTimeout(BAUD_TIMEOUT);
+  if (Serial.readStringUntil('\n') == SYNC_LINE)
+  {
+    Serial.println(SYNC_LINE);
+    if (Serial.readStringUntil('\n') == BAUD_OK)
     {
-      handleEffectCommand(command);
+      Serial.println(BAUD_OK);
+      confirmed = true;
     }
   }
+  Serial.setTimeout(SERIAL_TIMEOUT);
+  return confirmed;
 }
 
 // Handles RGB color commands
@@ -81,26 +894,122 @@ void handleRGBCommand(String command)
 void handleEffectCommand(String command) 
 {
   lastCommand = command.charAt(0); // Store the command
+  startEffect(lastCommand - '0');  // Convert command to effect ID
+}
+
+// Makes the given effect the active one and shows its first step right away
+void startEffect(int effect)
+{
   commandInProgress = PROGRES;       // Set the active flag
-  currentEffect = lastCommand - '0'; // Convert command to effect ID
+  currentEffect = effect;
+  lastStep = millis();
+  runEffect(0);
 }
 
+// Sets the time between two effect steps in ms, from "speed:<ms>" or OP_SPEED
+void setStepInterval(long interval)
+{
+  if (interval >= MIN_STEP_INTERVAL && interval <= 0xFFFF) stepInterval = interval;
+}
 
-/* 
-Executes the current effect
+// Time between two steps of the running effect in ms: a sequence keeps the interval it was stored with
+unsigned int effectInterval()
+{
+  return currentEffect == EFFECT_SEQUENCE ? sequenceInterval : stepInterval;
+}
+
+// Sets the time between two telemetry records in ms, from "telem:<ms>"; 0 stops them
+void setTelemetryInterval(long interval)
+{
+  if (interval < 0 || interval > 0xFFFF) return;
+  telemetryInterval = (interval > 0 && interval < TELEMETRY_MIN_INTERVAL) ? TELEMETRY_MIN_INTERVAL : interval;
+  lastTelemetry = millis();
+  resetTelemetryWindow();
+}
+
+/*
+Prints a telemetry record once the interval has passed, but only while no command is arriving and
+the whole record fits in the transmit buffer, so it never delays a command or blocks the loop:
+tm:shows,window_ms,show_us,show_max_us,step_us,loop_max_us,effect,interval_ms,parse_errors,dropped_bytes,free_ram
 Time Complexity: O(1)
 */
-void runEffect() 
+void reportTelemetry()
+{
+  if (telemetryInterval == 0 || millis() - lastTelemetry < telemetryInterval) return;
+  if (Serial.available() > 0 || lineLength > 0 || frameLength > 0) return;
+  char record[TELEMETRY_RECORD_SIZE];
+  int length = snprintf(record, sizeof(record), "tm:%u,%lu,%lu,%lu,%lu,%lu,%d,%u,%lu,%lu,%d",
+                        showCount, millis() - lastTelemetry, showCount ? showTotal / showCount : 0UL, showMax,
+                        stepCount ? stepTotal / stepCount : 0UL, loopMax, commandInProgress ? currentEffect : 0,
+                        effectInterval(), parseErrors, droppedBytes, freeRam());
+  if (Serial.availableForWrite() < min(length + 2, SERIAL_TX_BUFFER_SIZE - 1)) return;
+  Serial.println(record);
+  lastTelemetry = millis();
+  resetTelemetryWindow();
+}
+
+// Starts a new telemetry window
+void resetTelemetryWindow()
+{
+  showCount = 0;
+  showTotal = 0;
+  showMax = 0;
+  stepCount = 0;
+  stepTotal = 0;
+  loopMax = 0;
+}
+
+// Counts input thrown away: a bad frame or an overlong line of the given length
+void countDropped(uint16_t length)
+{
+  parseErrors++;
+  droppedBytes += length;
+}
+
+// Bytes between the heap and the stack, -1 where it cannot be told
+int freeRam()
+{
+#ifdef __AVR__
+  extern int __heap_start, *__brkval;
+  int top;
+  return (int)&top - (__brkval == 0 ? (int)&__heap_start : (int)__brkval);
+#else
+  return -1;
+#endif
+}
+
+// FastLED.show(), timed for the telemetry
+void showLeds()
+{
+  unsigned long start = micros();
+  FastLED.show();
+  unsigned long elapsed = micros() - start;
+  showCount++;
+  showTotal += elapsed;
+  if (elapsed > showMax) showMax = elapsed;
+}
+
+
+/* 
+Executes one step of the current effect after skipping the given number of steps
+Time Complexity: O(NUM_LEDS)
+*/
+void runEffect(unsigned long skipped) 
 {
+  unsigned long start = micros();
+  unsigned long shown = showTotal;
   switch (currentEffect)
    {
-    case 1: rainbow(); break;
-    case 2: pulse(); break;
-    case 3: colorWipe(); break;
-    case 4: randomSparkle(); break;
-    case 5: colorChase(); break;
-    default: commandInProgress = NOT_PROGRES; break;
+    case 1: rainbow(skipped); break;
+    case 2: pulse(skipped); break;
+    case 3: colorWipe(skipped); break;
+    case 4: randomSparkle(skipped); break;
+    case 5: colorChase(skipped); break;
+    case EFFECT_SEQUENCE: runSequence(skipped); break;
+    default: commandInProgress = NOT_PROGRES; return;
   }
+  stepTotal += micros() - start - (showTotal - shown); // Rendering only, the show is counted apart
+  stepCount++;
 }
 
 
@@ -117,23 +1026,23 @@ void setColor(int r, int g, int b)
   {
     leds[i] = CRGB(r, g, b);
   }
-  FastLED.show(); 
+  showLeds(); 
 }
 
 /* 
 Creates a rainbow effect
 Time Complexity: O(NUM_LEDS)
 */
-void rainbow()
+void rainbow(unsigned long skipped)
 {
   int i = 0;
   static uint8_t hue = 0;
+  hue += skipped; // The hue is a byte, it wraps like the steps would
   for (i = 0; i < NUM_LEDS; i++) 
   {
     leds[i] = CHSV(hue + (i * RAINBOW_STEP), MAX_NUM_COLOR, MAX_NUM_COLOR);
   }
-  FastLED.show();
-  delay(DELAY_TIME);
+  showLeds();
   hue++;
 }
 
@@ -142,47 +1051,38 @@ void rainbow()
 Creates a pulsing effect by changing brightness
 Time Complexity: O(NUM_LEDS)
 */
-void pulse()
+void pulse(unsigned long skipped)
  {
-  static int brightness = 0;
-  static bool increasing = true;
+  static int phase = 0; // 0..255 going up, 256..509 coming back down
   int i = 0;
+  phase = (phase + skipped) % PULSE_PERIOD;
+  int brightness = phase > MAX_NUM_COLOR ? PULSE_PERIOD - phase : phase;
   for (i = 0; i < NUM_LEDS; i++)
    {
     leds[i] = CRGB(brightness, 0, 0); // Red with current brightness
   }
-  FastLED.show();
+  showLeds();
 
-  if (increasing) 
-  {
-    brightness++;
-    if (brightness == MAX_NUM_COLOR) increasing = false;
-  } 
-  else
-  {
-    brightness--;
-    if (brightness == 0) increasing = true;
-  }
-  delay(DELAY_TIME);
+  phase = (phase + 1) % PULSE_PERIOD;
 }
 
 /*
  Creates a wiping effect by cycling through colors
 Time Complexity: O(NUM_LEDS)
  */
-void colorWipe()
+void colorWipe(unsigned long skipped)
  {
   static int colorIndex = 0;
   int i = 0;
+  colorIndex = ((colorIndex / COLORWIPE_STEP + skipped) % COLORWIPE_CYCLE) * COLORWIPE_STEP;
   for (i = 0; i < NUM_LEDS; i++)
   {
     leds[i] = CHSV(colorIndex, MAX_NUM_COLOR, MAX_NUM_COLOR);
   }
-  FastLED.show();
+  showLeds();
 
   colorIndex += COLORWIPE_STEP;
   if (colorIndex >= MAX_NUM_COLOR) colorIndex = 0;
-  delay(DELAY_TIME);
 }
 
 
@@ -190,8 +1090,9 @@ void colorWipe()
 Creates a random sparkle effect
 // Time Complexity: O(NUM_LEDS)
 */
-void randomSparkle()
+void randomSparkle(unsigned long skipped)
 {
+  // Every step is a fresh draw, skipped ones never need rendering
   int i = 0;
   for (i = 0; i < NUM_LEDS; i++) 
   {
@@ -205,25 +1106,24 @@ void randomSparkle()
       leds[i] = CRGB(0, 0, 0); // Turn off LED
     }
   }
-  FastLED.show();
-  delay(DELAY_TIME);
+  showLeds();
 }
 
 /* 
 Creates a chasing light effect
 Time Complexity: O(NUM_LEDS)
 */
-void colorChase() 
+void colorChase(unsigned long skipped) 
 {
   static int position = 0;
   int i = 0;
+  position = (position + skipped) % NUM_LEDS;
   for (i = 0; i < NUM_LEDS; i++) 
   {
     leds[i] = (i == position) ? CRGB(MAX_NUM_COLOR, 0, 0) : CRGB(0, 0, 0);
   }
-  FastLED.show();
+  showLeds();
 
   position++;
   if (position >= NUM_LEDS) position = 0;
-  delay(DELAY_TIME);
 }